@@ -4,6 +4,7 @@ FastAPI 後端服務器
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
 import asyncio
@@ -51,6 +52,7 @@ class AnalysisRequest(BaseModel):
     output_format: str = Field(default="detailed", description="輸出格式")
     show_agent_process: bool = Field(default=False, description="是否顯示 Agent 過程")
     use_crewai: bool = Field(default=True, description="是否使用 CrewAI 架構")
+    use_cache: bool = Field(default=True, description="是否使用分析結果快取")
 
 # 響應模型
 class AnalysisResponse(BaseModel):
@@ -63,8 +65,10 @@ class AnalysisResponse(BaseModel):
 class SystemStatus(BaseModel):
     status: str
     initialized: bool
+    ready: bool = False  # 檢索所需的嵌入模型是否已載入
     components: Dict[str, bool]
     architecture: str  # 新增：當前使用的架構
+    embeddings: Optional[Dict[str, Any]] = None  # 嵌入模型載入與預熱耗時
     timestamp: str
 
 # 啟動事件
@@ -125,11 +129,19 @@ async def health_check():
     try:
         system_status = ai_system.get_system_status()
         architecture = "CrewAI + MCP" if ai_system.use_crewai else "Legacy Multi-Agent"
+        if not system_status["initialized"]:
+            status = "initializing"
+        elif not system_status["ready"]:
+            status = "warming_up"
+        else:
+            status = "healthy"
         return SystemStatus(
-            status="healthy" if system_status["initialized"] else "initializing",
+            status=status,
             initialized=system_status["initialized"],
+            ready=system_status["ready"],
             components=system_status["components"],
             architecture=architecture,
+            embeddings=system_status["embeddings"],
             timestamp=system_status["timestamp"]
         )
     except Exception as e:
@@ -142,6 +154,31 @@ async def health_check():
             timestamp=datetime.now().isoformat()
         )
 
+@app.get("/health/live")
+async def liveness_check():
+    """存活檢查：進程可以處理請求"""
+    return {
+        "status": "alive",
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/health/ready")
+async def readiness_check():
+    """就緒檢查：系統已初始化且嵌入模型已載入，未就緒時返回 503"""
+    global ai_system
+
+    ready = ai_system is not None and ai_system.is_ready()
+    system_status = ai_system.get_system_status() if ai_system else {}
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "initialized": system_status.get("initialized", False),
+            "embeddings": system_status.get("embeddings"),
+            "timestamp": datetime.now().isoformat()
+        }
+    )
+
 @app.post("/analyze", response_model=AnalysisResponse)
 async def analyze_chart(request: AnalysisRequest):
     """分析紫微斗數命盤"""
@@ -172,7 +209,8 @@ async def analyze_chart(request: AnalysisRequest):
             birth_data=birth_data,
             domain_type=request.domain_type,
             output_format=request.output_format,
-            show_agent_process=request.show_agent_process
+            show_agent_process=request.show_agent_process,
+            use_cache=request.use_cache
         )
 
         if result.get("success", False):
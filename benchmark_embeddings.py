@@ -0,0 +1,191 @@
+"""
+BGE-M3 嵌入後端基準測試
+比較 PyTorch、ONNX Runtime (fp32) 與 ONNX Runtime (int8) 的延遲、記憶體與輸出一致性
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+# 添加項目根目錄到路徑
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+
+SAMPLE_QUERIES = [
+    "紫微星",
+    "紫微星坐命宮的性格特質",
+    "夫妻宮 貪狼 化忌",
+    "財帛宮 武曲 天府",
+    "大限 流年 運勢",
+    "命宮 天機 太陰 左輔 右弼"
+]
+
+SAMPLE_DOCUMENT = (
+    "紫微星為北斗帝星，主尊貴。坐命之人氣質高雅，有領導才能，處事穩重，"
+    "喜掌權而不喜受制於人。若得左輔右弼夾拱，則貴氣更顯；若逢擎羊陀羅，則孤君無輔。"
+)
+
+
+def get_rss_mb() -> float:
+    """獲取當前進程常駐記憶體（MB）"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        import resource
+        # Linux 上 ru_maxrss 單位為 KB（峰值）
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def create_backend(backend: str, model_name: str, max_length: int, onnx_dir: str, threads: int):
+    """創建指定後端的嵌入模型（不啟用快取以測量真實推理）"""
+    from src.rag.bge_embeddings import create_bge_embeddings
+    
+    return create_bge_embeddings(
+        backend="torch" if backend == "torch" else "onnx",
+        model_name=model_name,
+        device="cpu",
+        max_length=max_length,
+        query_cache_size=0,
+        onnx_dir=onnx_dir,
+        onnx_quantized=backend == "onnx-int8",
+        onnx_intra_op_threads=threads
+    )
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """計算百分位數"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_single_backend(args) -> Dict[str, Any]:
+    """在當前進程內測試單一後端"""
+    rss_before = get_rss_mb()
+    start = time.perf_counter()
+    embeddings = create_backend(args.backend, args.model, args.max_length, args.onnx_dir, args.threads)
+    load_time = time.perf_counter() - start
+    
+    # 預熱
+    embeddings.embed_query(SAMPLE_QUERIES[0])
+    
+    query_latencies = []
+    for _ in range(args.repeats):
+        for query in SAMPLE_QUERIES:
+            t0 = time.perf_counter()
+            embeddings.embed_query(query)
+            query_latencies.append((time.perf_counter() - t0) * 1000)
+    
+    documents = [SAMPLE_DOCUMENT * (1 + i % 4) for i in range(args.num_documents)]
+    t0 = time.perf_counter()
+    embeddings.embed_documents(documents)
+    document_time = time.perf_counter() - t0
+    
+    result = {
+        "backend": args.backend,
+        "load_time_s": load_time,
+        "query_p50_ms": statistics.median(query_latencies),
+        "query_p99_ms": percentile(query_latencies, 99),
+        "documents_per_s": len(documents) / document_time,
+        "rss_mb": get_rss_mb(),
+        "rss_delta_mb": get_rss_mb() - rss_before
+    }
+    
+    # 與 PyTorch 輸出比較一致性
+    if args.backend != "torch" and args.parity:
+        from src.rag.onnx_embeddings import check_parity
+        reference = create_backend("torch", args.model, args.max_length, args.onnx_dir, args.threads)
+        result["parity"] = check_parity(reference, embeddings, SAMPLE_QUERIES + [SAMPLE_DOCUMENT])
+    
+    return result
+
+
+def run_all_backends(args) -> List[Dict[str, Any]]:
+    """每個後端在獨立子進程中測試，避免記憶體互相影響"""
+    results = []
+    for backend in args.backends:
+        print(f"⏱️  測試後端: {backend} ...")
+        command = [
+            sys.executable, __file__,
+            "--backend", backend,
+            "--model", args.model,
+            "--max-length", str(args.max_length),
+            "--onnx-dir", args.onnx_dir,
+            "--threads", str(args.threads),
+            "--repeats", str(args.repeats),
+            "--num-documents", str(args.num_documents),
+            "--json"
+        ]
+        if args.parity:
+            command.append("--parity")
+        
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"❌ {backend} 測試失敗:\n{completed.stderr[-2000:]}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def print_report(results: List[Dict[str, Any]]):
+    """打印比較報告"""
+    print("\n📊 嵌入後端比較")
+    print("=" * 90)
+    print(f"{'後端':<12} {'載入(s)':<10} {'查詢p50(ms)':<13} {'查詢p99(ms)':<13} {'文檔/秒':<10} {'RSS(MB)':<10} {'最小餘弦':<10}")
+    print("-" * 90)
+    for result in results:
+        parity = result.get("parity", {}).get("min_cosine")
+        parity_text = f"{parity:.5f}" if parity is not None else "-"
+        print(
+            f"{result['backend']:<12} {result['load_time_s']:<10.1f} {result['query_p50_ms']:<13.1f} "
+            f"{result['query_p99_ms']:<13.1f} {result['documents_per_s']:<10.1f} {result['rss_mb']:<10.0f} {parity_text:<10}"
+        )
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="BGE-M3 嵌入後端基準測試")
+    parser.add_argument('--backend', choices=BACKENDS, help='只測試單一後端（在當前進程內）')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=BACKENDS, help='要比較的後端')
+    parser.add_argument('--model', default="BAAI/bge-m3", help='模型名稱')
+    parser.add_argument('--max-length', type=int, default=1024, help='最大序列長度')
+    parser.add_argument('--onnx-dir', default="./models/bge-m3-onnx", help='ONNX 模型目錄')
+    parser.add_argument('--threads', type=int, default=0, help='ONNX Runtime 算子內線程數')
+    parser.add_argument('--repeats', type=int, default=5, help='查詢重複次數')
+    parser.add_argument('--num-documents', type=int, default=32, help='文檔嵌入數量')
+    parser.add_argument('--parity', action='store_true', help='與 PyTorch 輸出比較餘弦相似度')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+    parser.add_argument('--output', '-o', help='結果保存路徑（JSON）')
+    
+    args = parser.parse_args()
+    
+    if args.backend:
+        results = [run_single_backend(args)]
+    else:
+        results = run_all_backends(args)
+    
+    if args.json:
+        print(json.dumps(results[0] if args.backend else results, ensure_ascii=False))
+    else:
+        print_report(results)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 結果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
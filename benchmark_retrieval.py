@@ -0,0 +1,149 @@
+"""
+檢索品質與延遲基準測試
+以版本化的標準查詢集（src/rag/golden_queries.json）評測向量庫，報告 recall@k、MRR、nDCG 與嵌入、檢索延遲 p50/p99；
+結果以 JSON 保存，改動分塊、top_k、最低分數、混合檢索或索引後端前後各跑一次，以 --baseline 比較
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict
+
+# 添加項目根目錄到路徑
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def create_store(args):
+    """按命令列參數創建向量庫（停用查詢與結果快取以測量實際延遲）"""
+    from src.rag.vector_store import ZiweiVectorStore
+    
+    return ZiweiVectorStore(
+        persist_directory=args.db_path,
+        collection_name=args.collection,
+        embedding_model=args.model,
+        embedding_config={
+            "backend": args.embedding_backend,
+            "onnx_dir": args.onnx_dir,
+            "device": os.getenv("EMBEDDING_DEVICE", "cpu"),
+            "max_length": int(os.getenv("EMBEDDING_MAX_LENGTH", "8192")),
+            "query_cache_size": 0,
+            "openai_fallback": False
+        },
+        index_backend=args.backend,
+        numpy_index_dir=args.numpy_index_dir,
+        numpy_index_quantization=args.quantization,
+        hybrid_search=args.hybrid,
+        result_cache_size=0,
+        rerank=args.rerank,
+        reranker_config={"latency_budget_ms": 0, "cache_size": 0},
+        logger=logger
+    )
+
+
+def print_report(report: Dict[str, Any], comparison: Dict[str, Any] = None):
+    """打印評測報告"""
+    golden = report["golden_set"]
+    store = report["store"]
+    print(f"\n📊 檢索評測：{golden['name']} v{golden['version']}（{golden['queries']} 條查詢，sha256 {golden['sha256']}）")
+    print(
+        f"索引: {store['index_backend']}  壓縮掃描: {store['numpy_index_quantization'] or '-'}  "
+        f"混合檢索: {store['hybrid_search']}  重排序: {store['rerank']}"
+    )
+    print("=" * 60)
+    
+    metric_deltas = (comparison or {}).get("metrics", {})
+    latency_deltas = (comparison or {}).get("latency", {})
+    for name, value in report["metrics"].items():
+        delta = metric_deltas.get(name)
+        delta_text = f"  ({delta:+.4f})" if delta is not None else ""
+        print(f"{name:<12} {value:.4f}{delta_text}")
+    print("-" * 60)
+    for name, value in report["latency"].items():
+        if name == "samples":
+            continue
+        delta = latency_deltas.get(name)
+        delta_text = f"  ({delta:+.2f})" if delta is not None else ""
+        print(f"{name:<14} {value:.2f}{delta_text}")
+    
+    if comparison is not None and not comparison["same_golden_set"]:
+        print("\n⚠️  基準報告使用的查詢集不同，指標差值僅供參考")
+    
+    misses = [row for row in report.get("per_query", []) if row["mrr"] == 0]
+    if misses:
+        print(f"\n未檢索到相關文本塊的查詢 ({len(misses)}):")
+        for row in misses:
+            print(f"  - {row['id']}: {row['query']}")
+
+
+def main():
+    """主函數"""
+    from src.rag.retrieval_eval import DEFAULT_KS, GoldenQuerySet, compare_reports, evaluate_retrieval
+    
+    parser = argparse.ArgumentParser(description="檢索品質與延遲基準測試")
+    parser.add_argument('--golden', help='標準查詢集路徑（默認 src/rag/golden_queries.json）')
+    parser.add_argument('--db-path', default=os.getenv("VECTOR_DB_PATH", "./data/vector_db"), help='向量資料庫目錄')
+    parser.add_argument('--collection', default=os.getenv("VECTOR_DB_COLLECTION", "ziwei_knowledge"), help='集合名稱')
+    parser.add_argument('--model', default=os.getenv("EMBEDDING_MODEL", "BAAI/bge-m3"), help='嵌入模型名稱')
+    parser.add_argument('--embedding-backend', choices=['torch', 'onnx'], default=os.getenv("EMBEDDING_BACKEND", "torch"),
+                       help='嵌入推理後端')
+    parser.add_argument('--onnx-dir', default=os.getenv("EMBEDDING_ONNX_DIR", "./models/bge-m3-onnx"), help='ONNX 模型目錄')
+    parser.add_argument('--backend', choices=['chroma', 'numpy'], default=os.getenv("VECTOR_INDEX_BACKEND", "chroma"),
+                       help='檢索索引後端')
+    parser.add_argument('--numpy-index-dir', default=os.getenv("VECTOR_NUMPY_INDEX_DIR"), help='NumPy 索引目錄')
+    parser.add_argument('--quantization', choices=['float16', 'pq'], help='NumPy 索引的壓縮掃描表示')
+    parser.add_argument('--hybrid', action='store_true', help='啟用稠密 + BM25 混合檢索')
+    parser.add_argument('--rerank', action='store_true', help='啟用交叉編碼器重排序（不設延遲預算）')
+    parser.add_argument('--k', type=int, nargs='+', default=list(DEFAULT_KS), help='計算 recall@k 與 nDCG@k 的 k 值')
+    parser.add_argument('--repeats', type=int, default=3, help='每條查詢的重複次數')
+    parser.add_argument('--min-score', type=float, help='過濾低於此分數的結果（模擬 RAG_MIN_SCORE）')
+    parser.add_argument('--domain-filters', action='store_true', help='按查詢的領域下推內容分類過濾')
+    parser.add_argument('--baseline', help='與之比較的基準報告（JSON）')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+    parser.add_argument('--output', '-o', help='結果保存路徑（JSON）')
+    
+    args = parser.parse_args()
+    
+    golden_set = GoldenQuerySet.load(args.golden)
+    store = create_store(args)
+    try:
+        report = evaluate_retrieval(
+            store,
+            golden_set,
+            ks=args.k,
+            repeats=args.repeats,
+            min_score=args.min_score,
+            use_domain_filters=args.domain_filters
+        )
+    finally:
+        store.close()
+    
+    comparison = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            comparison = compare_reports(report, json.load(f))
+        report["comparison"] = comparison
+    
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        print_report(report, comparison)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 結果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+嵌入推理線程策略基準測試
+模擬同一台機器上的多個 API 工作進程同時嵌入文檔，比較各線程與 CPU 綁定策略下的總吞吐量與查詢延遲
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+# 添加項目根目錄到路徑
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from benchmark_embeddings import SAMPLE_DOCUMENT, SAMPLE_QUERIES, percentile
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 策略 → BGEM3Embeddings 的運行時參數
+POLICIES: Dict[str, Dict[str, Any]] = {
+    # torch 默認：每個進程都使用全部核心
+    "default": {"torch_threads": 0},
+    # 按工作進程數平分核心
+    "auto": {"torch_threads": "auto"},
+    # 平分核心並把每個進程綁定到各自的 CPU 區段
+    "auto-affinity": {"torch_threads": "auto", "cpu_affinity": "auto"},
+    # 每個進程單線程
+    "single-thread": {"torch_threads": 1, "torch_interop_threads": 1},
+    # 平分核心但以 no_grad 推理（比較 inference_mode 的效果）
+    "auto-no-grad": {"torch_threads": "auto", "use_inference_mode": False}
+}
+
+
+def run_worker(slot: int, policy: str, options: Dict[str, Any], barrier, results):
+    """單一模擬工作進程：套用策略、載入模型，所有進程就緒後同時開始嵌入"""
+    os.environ["EMBEDDING_SERVER_WORKERS"] = str(options["workers"])
+    os.environ["EMBEDDING_WORKER_SLOT"] = str(slot)
+    
+    from src.rag.bge_embeddings import create_bge_embeddings
+    
+    embeddings = create_bge_embeddings(
+        backend="torch",
+        model_name=options["model"],
+        device="cpu",
+        max_length=options["max_length"],
+        batch_size=options["batch_size"],
+        query_cache_size=0,
+        **POLICIES[policy]
+    )
+    embeddings.embed_query(SAMPLE_QUERIES[0])
+    documents = [SAMPLE_DOCUMENT * (1 + i % 4) for i in range(options["num_documents"])]
+    
+    barrier.wait()
+    start = time.perf_counter()
+    embeddings.embed_documents(documents)
+    document_seconds = time.perf_counter() - start
+    
+    query_latencies = []
+    for _ in range(options["repeats"]):
+        for query in SAMPLE_QUERIES:
+            t0 = time.perf_counter()
+            embeddings.embed_query(query)
+            query_latencies.append((time.perf_counter() - t0) * 1000)
+    
+    runtime = embeddings.runtime
+    results.put({
+        "slot": slot,
+        "documents": len(documents),
+        "document_seconds": document_seconds,
+        "query_latencies": query_latencies,
+        "torch_threads": runtime.get("torch_threads"),
+        "cpu_set": runtime.get("cpu_set")
+    })
+    embeddings.close()
+
+
+def run_policy(policy: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """以 spawn 啟動 workers 個進程執行同一策略，彙總吞吐量"""
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(options["workers"], timeout=600)
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker, args=(slot, policy, options, barrier, results))
+        for slot in range(options["workers"])
+    ]
+    for process in processes:
+        process.start()
+    
+    worker_results = []
+    try:
+        while len(worker_results) < len(processes):
+            try:
+                worker_results.append(results.get(timeout=5))
+            except queue.Empty:
+                failed = [process for process in processes if process.exitcode not in (None, 0)]
+                if failed:
+                    raise RuntimeError(f"{len(failed)} worker(s) failed under policy {policy}")
+    finally:
+        for process in processes:
+            process.join(timeout=0 if len(worker_results) < len(processes) else None)
+            if process.is_alive():
+                process.terminate()
+    
+    # 所有進程同時開始，總吞吐量以最慢的進程計
+    total_documents = sum(result["documents"] for result in worker_results)
+    wall_seconds = max(result["document_seconds"] for result in worker_results)
+    latencies = [latency for result in worker_results for latency in result["query_latencies"]]
+    worker_results.sort(key=lambda result: result["slot"])
+    return {
+        "policy": policy,
+        "workers": options["workers"],
+        "documents_per_s": total_documents / wall_seconds,
+        "query_p50_ms": statistics.median(latencies),
+        "query_p99_ms": percentile(latencies, 99),
+        "torch_threads": [result["torch_threads"] for result in worker_results],
+        "cpu_sets": [result["cpu_set"] for result in worker_results]
+    }
+
+
+def print_report(results: List[Dict[str, Any]]):
+    """打印比較報告"""
+    print(f"\n📊 線程策略比較（{results[0]['workers']} 個工作進程，CPU {os.cpu_count()} 核）")
+    print("=" * 80)
+    print(f"{'策略':<16} {'文檔/秒':<10} {'查詢p50(ms)':<13} {'查詢p99(ms)':<13} {'每進程線程數':<14}")
+    print("-" * 80)
+    for result in results:
+        print(
+            f"{result['policy']:<16} {result['documents_per_s']:<10.1f} {result['query_p50_ms']:<13.1f} "
+            f"{result['query_p99_ms']:<13.1f} {str(result['torch_threads']):<14}"
+        )
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="嵌入推理線程策略基準測試")
+    parser.add_argument('--policies', nargs='+', choices=list(POLICIES), default=list(POLICIES), help='要比較的策略')
+    parser.add_argument('--workers', type=int, default=2, help='模擬的 API 工作進程數')
+    parser.add_argument('--model', default="BAAI/bge-m3", help='模型名稱')
+    parser.add_argument('--max-length', type=int, default=512, help='最大序列長度')
+    parser.add_argument('--batch-size', type=int, default=16, help='文檔嵌入批次大小')
+    parser.add_argument('--num-documents', type=int, default=64, help='每個工作進程嵌入的文檔數')
+    parser.add_argument('--repeats', type=int, default=3, help='查詢重複次數')
+    parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+    parser.add_argument('--output', '-o', help='結果保存路徑（JSON）')
+    
+    args = parser.parse_args()
+    options = {
+        "workers": args.workers,
+        "model": args.model,
+        "max_length": args.max_length,
+        "batch_size": args.batch_size,
+        "num_documents": args.num_documents,
+        "repeats": args.repeats
+    }
+    
+    results = []
+    for policy in args.policies:
+        print(f"⏱️  測試策略: {policy} ...")
+        try:
+            results.append(run_policy(policy, options))
+        except RuntimeError as e:
+            print(f"❌ {e}")
+    
+    if not results:
+        return
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False))
+    else:
+        print_report(results)
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 結果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
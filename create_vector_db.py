@@ -6,8 +6,7 @@
 import os
 import logging
 from pathlib import Path
-from typing import List, Dict, Any
-import PyPDF2
+from typing import Any, Callable, Dict, List, Optional
 import chromadb
 from chromadb.config import Settings
 
@@ -15,27 +14,23 @@ from chromadb.config import Settings
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def extract_pdf_content(pdf_path: str) -> str:
-    """提取PDF內容"""
+def extract_pdf_content(pdf_path: str, workers: int = 0) -> str:
+    """提取PDF內容（逐頁串流提取，workers > 0 時以進程池並行）"""
     logger.info(f"開始提取PDF內容: {pdf_path}")
     
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            total_pages = len(pdf_reader.pages)
-            logger.info(f"PDF總頁數: {total_pages}")
-            
-            full_text = ""
-            for page_num in range(total_pages):
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
-                full_text += text + "\n"
-                
-                if (page_num + 1) % 50 == 0:
-                    logger.info(f"已處理 {page_num + 1}/{total_pages} 頁")
+        from src.rag.ingestion import iter_pdf_pages
+        
+        pages = []
+        for page_num, text in iter_pdf_pages(pdf_path, num_workers=workers, logger=logger):
+            pages.append(text)
             
-            logger.info(f"PDF內容提取完成，總字數: {len(full_text)}")
-            return full_text
+            if page_num % 50 == 0:
+                logger.info(f"已處理 {page_num} 頁")
+        
+        full_text = "\n".join(pages) + "\n"
+        logger.info(f"PDF內容提取完成，總字數: {len(full_text)}")
+        return full_text
             
     except Exception as e:
         logger.error(f"PDF提取失敗: {str(e)}")
@@ -75,10 +70,32 @@ def analyze_content_structure(text: str) -> Dict[str, Any]:
     
     return analysis
 
-def smart_text_chunking(text: str, analysis: Dict[str, Any]) -> List[Dict[str, Any]]:
-    """智能文本分塊"""
+def load_token_counter(model_name: str = "BAAI/bge-m3") -> Optional[Callable[[List[str]], List[int]]]:
+    """載入嵌入模型的分詞器作為 token 計數函數（transformers 不可用時返回 None，改按字數分塊）"""
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        return None
+    
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+    except Exception as e:
+        logger.warning(f"分詞器載入失敗，改按字數分塊: {str(e)}")
+        return None
+    
+    def count_tokens(texts: List[str]) -> List[int]:
+        return [len(ids) for ids in tokenizer(texts, padding=False)['input_ids']]
+    
+    return count_tokens
+
+def smart_text_chunking(text: str,
+                        analysis: Dict[str, Any],
+                        count_tokens: Optional[Callable[[List[str]], List[int]]] = None) -> List[Dict[str, Any]]:
+    """智能文本分塊（在句末標點處切分，章節、星曜、宮位標題另起新塊並寫入元數據）"""
     logger.info("開始智能文本分塊...")
     
+    from src.rag.text_chunker import StreamingTextChunker
+    
     # 根據內容分析決定分塊策略
     total_length = analysis['total_length']
     
@@ -92,28 +109,15 @@ def smart_text_chunking(text: str, analysis: Dict[str, Any]) -> List[Dict[str, A
         chunk_size = 1500
         overlap = 300
     
-    logger.info(f"選擇分塊策略: 塊大小={chunk_size}, 重疊={overlap}")
+    unit = "token" if count_tokens is not None else "字"
+    logger.info(f"選擇分塊策略: 塊大小={chunk_size} {unit}, 重疊={overlap} {unit}")
     
+    chunker = StreamingTextChunker(chunk_size, overlap, count_tokens=count_tokens)
     chunks = []
-    start = 0
     chunk_id = 1
     
-    while start < len(text):
-        end = start + chunk_size
-        
-        # 尋找合適的分割點
-        if end < len(text):
-            # 優先在句號處分割
-            last_period = text.rfind('。', start, end)
-            if last_period > start + chunk_size // 2:
-                end = last_period + 1
-            else:
-                # 其次在逗號處分割
-                last_comma = text.rfind('，', start, end)
-                if last_comma > start + chunk_size // 2:
-                    end = last_comma + 1
-        
-        chunk_text = text[start:end].strip()
+    for chunk in chunker.split_text(text):
+        chunk_text = chunk['content']
         
         if len(chunk_text) > 50:  # 只保留有意義的塊
             # 簡單的內容分類
@@ -122,20 +126,17 @@ def smart_text_chunking(text: str, analysis: Dict[str, Any]) -> List[Dict[str, A
             chunk_data = {
                 'content': chunk_text,
                 'metadata': {
+                    **chunk['metadata'],
                     'chunk_id': chunk_id,
-                    'start_pos': start,
-                    'end_pos': end,
                     'content_type': content_type,
                     'source': '紫微斗数集成全书.pdf'
                 }
             }
             chunks.append(chunk_data)
             chunk_id += 1
-        
-        start = end - overlap if end < len(text) else end
-        
-        if chunk_id % 100 == 0:
-            logger.info(f"已處理 {chunk_id} 個文本塊...")
+            
+            if chunk_id % 100 == 0:
+                logger.info(f"已處理 {chunk_id} 個文本塊...")
     
     logger.info(f"文本分塊完成，共 {len(chunks)} 個塊")
     return chunks
@@ -182,7 +183,9 @@ def create_vector_database(chunks: List[Dict[str, Any]], db_name: str = "test1")
             device="cpu",
             max_length=1024,
             batch_size=8,
-            use_fp16=False
+            use_fp16=False,
+            document_cache_dir="./cache/document_embeddings",
+            max_tokens_per_batch=8192
         )
         
         logger.info("BGE-M3 嵌入模型載入成功")
@@ -203,31 +206,53 @@ def create_vector_database(chunks: List[Dict[str, Any]], db_name: str = "test1")
             collection = client.create_collection(collection_name)
             logger.info(f"創建新集合: {collection_name}")
         
+        # 以來源與內容哈希生成穩定ID，重新建立時只嵌入新增或變更的文本塊
+        from src.rag.text_chunker import content_chunk_id
+        
+        chunk_ids = [content_chunk_id(chunk['content'], chunk['metadata']['source']) for chunk in chunks]
+        existing_ids = set()
+        for source in {chunk['metadata']['source'] for chunk in chunks}:
+            existing_ids.update(collection.get(where={"source": source}, include=[])['ids'])
+        
+        pending = {}
+        for chunk_id, chunk in zip(chunk_ids, chunks):
+            if chunk_id not in existing_ids and chunk_id not in pending:
+                pending[chunk_id] = chunk
+        
+        # 刪除來源中已不存在的文本塊
+        removed_ids = sorted(existing_ids - set(chunk_ids))
+        if removed_ids:
+            collection.delete(ids=removed_ids)
+        logger.info(
+            f"同步比對: 新增 {len(pending)}，未變更 {len(existing_ids & set(chunk_ids))}，刪除 {len(removed_ids)}"
+        )
+        
         # 批次處理文檔
         batch_size = 50
-        total_chunks = len(chunks)
+        pending_items = list(pending.items())
+        total_chunks = len(pending_items)
         
         for i in range(0, total_chunks, batch_size):
-            batch_chunks = chunks[i:i + batch_size]
+            batch_items = pending_items[i:i + batch_size]
             
             # 準備批次數據
-            texts = [chunk['content'] for chunk in batch_chunks]
-            metadatas = [chunk['metadata'] for chunk in batch_chunks]
-            ids = [f"chunk_{chunk['metadata']['chunk_id']}" for chunk in batch_chunks]
+            ids = [chunk_id for chunk_id, _ in batch_items]
+            texts = [chunk['content'] for _, chunk in batch_items]
+            metadatas = [chunk['metadata'] for _, chunk in batch_items]
             
             # 生成嵌入
             logger.info(f"處理批次 {i//batch_size + 1}/{(total_chunks + batch_size - 1)//batch_size}")
             embeddings_vectors = embeddings.embed_documents(texts)
             
             # 添加到向量庫
-            collection.add(
-                embeddings=embeddings_vectors,
+            collection.upsert(
+                embeddings=embeddings_vectors.tolist(),
                 documents=texts,
                 metadatas=metadatas,
                 ids=ids
             )
             
-            logger.info(f"已添加 {len(batch_chunks)} 個文檔到向量庫")
+            logger.info(f"已添加 {len(batch_items)} 個文檔到向量庫")
         
         # 檢查最終狀態
         final_count = collection.count()
@@ -237,13 +262,16 @@ def create_vector_database(chunks: List[Dict[str, Any]], db_name: str = "test1")
         logger.info(f"集合名稱: {collection_name}")
         logger.info(f"總文檔數: {final_count}")
         
+        cache_stats = embeddings.document_cache.get_stats()
+        logger.info(f"嵌入快取命中: {cache_stats['hits']}，新嵌入: {cache_stats['misses']}")
+        
         # 測試搜索
         logger.info("測試搜索功能...")
         test_query = "紫微星的特質"
         query_embedding = embeddings.embed_query(test_query)
         
         results = collection.query(
-            query_embeddings=[query_embedding],
+            query_embeddings=[query_embedding.tolist()],
             n_results=3
         )
         
@@ -274,13 +302,13 @@ def main():
             return
         
         # 1. 提取PDF內容
-        text = extract_pdf_content(pdf_path)
+        text = extract_pdf_content(pdf_path, workers=max((os.cpu_count() or 2) // 2, 1))
         
         # 2. 分析內容結構
         analysis = analyze_content_structure(text)
         
         # 3. 智能分塊
-        chunks = smart_text_chunking(text, analysis)
+        chunks = smart_text_chunking(text, analysis, count_tokens=load_token_counter())
         
         # 4. 建立向量資料庫
         success = create_vector_database(chunks, db_name)
@@ -4,134 +4,48 @@ PDF 文件導入向量資料庫工具
 """
 
 import asyncio
+import functools
 import logging
-import json
 import os
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Dict, Any
 import argparse
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    """從PDF文件提取文本"""
-    try:
-        # 嘗試使用 PyPDF2
-        try:
-            import PyPDF2
-            
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                
-                logger.info(f"PDF 總頁數: {len(pdf_reader.pages)}")
-                
-                for page_num, page in enumerate(pdf_reader.pages, 1):
-                    page_text = page.extract_text()
-                    text += f"\n--- 第 {page_num} 頁 ---\n{page_text}\n"
-                    
-                    if page_num % 10 == 0:
-                        logger.info(f"已處理 {page_num} 頁...")
-                
-                logger.info(f"PDF 文本提取完成，總字數: {len(text)}")
-                return text
-                
-        except ImportError:
-            logger.warning("PyPDF2 未安裝，嘗試使用 pdfplumber...")
-            
-            # 嘗試使用 pdfplumber
-            try:
-                import pdfplumber
-                
-                text = ""
-                with pdfplumber.open(pdf_path) as pdf:
-                    logger.info(f"PDF 總頁數: {len(pdf.pages)}")
-                    
-                    for page_num, page in enumerate(pdf.pages, 1):
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += f"\n--- 第 {page_num} 頁 ---\n{page_text}\n"
-                        
-                        if page_num % 10 == 0:
-                            logger.info(f"已處理 {page_num} 頁...")
-                
-                logger.info(f"PDF 文本提取完成，總字數: {len(text)}")
-                return text
-                
-            except ImportError:
-                logger.error("請安裝 PDF 處理庫: pip install PyPDF2 或 pip install pdfplumber")
-                return None
-                
-    except Exception as e:
-        logger.error(f"PDF 文本提取失敗: {str(e)}")
-        return None
-
-def split_text_into_chunks(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-    """將長文本分割成適合的塊"""
-    if not text:
-        return []
-    
-    chunks = []
-    start = 0
-    text_length = len(text)
+def classify_chunk(chunk: str) -> Dict[str, Any]:
+    """識別文本塊的內容類型"""
+    content_type = "general"
     
-    while start < text_length:
-        end = start + chunk_size
-        
-        # 如果不是最後一塊，嘗試在句號處分割
-        if end < text_length:
-            # 尋找最近的句號
-            last_period = text.rfind('。', start, end)
-            if last_period > start:
-                end = last_period + 1
-        
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        
-        start = end - overlap if end < text_length else end
+    # 簡單的內容分類
+    if any(star in chunk for star in ['紫微星', '天機星', '太陽星', '武曲星', '天同星', '廉貞星']):
+        content_type = "主星解析"
+    elif any(palace in chunk for palace in ['命宮', '夫妻宮', '財帛宮', '事業宮']):
+        content_type = "宮位解析"
+    elif any(concept in chunk for concept in ['格局', '組合', '會照']):
+        content_type = "格局分析"
+    elif any(fortune in chunk for fortune in ['運勢', '流年', '大限']):
+        content_type = "運勢分析"
     
-    logger.info(f"文本分割完成，共 {len(chunks)} 個塊")
-    return chunks
+    return {
+        "category": "紫微斗數",
+        "content_type": content_type
+    }
 
-def create_knowledge_from_chunks(chunks: List[str], source_file: str) -> List[Dict[str, Any]]:
-    """將文本塊轉換為知識格式"""
-    knowledge_items = []
+async def import_pdf_to_vector_db(pdf_path: str,
+                                  chunk_size: int = 1000,
+                                  overlap: int = 200,
+                                  workers: int = 0,
+                                  max_tokens_per_batch: int = 16384,
+                                  resume: bool = True,
+                                  sync: bool = False):
+    """
+    將PDF文件導入向量資料庫（串流提取、分塊、嵌入與寫入，可從檢查點續傳）
     
-    for i, chunk in enumerate(chunks, 1):
-        # 嘗試識別內容類型
-        content_type = "general"
-        category = "紫微斗數"
-        
-        # 簡單的內容分類
-        if any(star in chunk for star in ['紫微星', '天機星', '太陽星', '武曲星', '天同星', '廉貞星']):
-            content_type = "主星解析"
-        elif any(palace in chunk for palace in ['命宮', '夫妻宮', '財帛宮', '事業宮']):
-            content_type = "宮位解析"
-        elif any(concept in chunk for concept in ['格局', '組合', '會照']):
-            content_type = "格局分析"
-        elif any(fortune in chunk for fortune in ['運勢', '流年', '大限']):
-            content_type = "運勢分析"
-        
-        knowledge_item = {
-            "content": chunk,
-            "metadata": {
-                "source": source_file,
-                "chunk_id": i,
-                "category": category,
-                "content_type": content_type,
-                "total_chunks": len(chunks)
-            }
-        }
-        
-        knowledge_items.append(knowledge_item)
-    
-    return knowledge_items
-
-async def import_pdf_to_vector_db(pdf_path: str, chunk_size: int = 1000, overlap: int = 200):
-    """將PDF文件導入向量資料庫"""
+    文本塊以內容哈希為 ID，已存在的文本塊不重新嵌入；sync 時另外刪除此文件中已不存在的文本塊。
+    """
     
     print(f"🌟 PDF 導入向量資料庫工具")
     print(f"📁 PDF 文件: {pdf_path}")
@@ -143,49 +57,12 @@ async def import_pdf_to_vector_db(pdf_path: str, chunk_size: int = 1000, overlap
         return False
     
     try:
-        # 1. 提取PDF文本
-        print("📖 步驟 1: 提取PDF文本...")
-        text = extract_text_from_pdf(pdf_path)
-        
-        if not text:
-            logger.error("PDF 文本提取失敗")
-            return False
-        
-        print(f"✅ 文本提取成功，總字數: {len(text)}")
-        
-        # 2. 分割文本
-        print(f"✂️  步驟 2: 分割文本 (塊大小: {chunk_size}, 重疊: {overlap})...")
-        chunks = split_text_into_chunks(text, chunk_size, overlap)
-        
-        if not chunks:
-            logger.error("文本分割失敗")
-            return False
-        
-        print(f"✅ 文本分割成功，共 {len(chunks)} 個塊")
-        
-        # 3. 創建知識格式
-        print("📝 步驟 3: 轉換為知識格式...")
-        source_filename = Path(pdf_path).name
-        knowledge_items = create_knowledge_from_chunks(chunks, source_filename)
-        
-        print(f"✅ 知識格式轉換成功，共 {len(knowledge_items)} 條知識")
-        
-        # 4. 保存為JSON文件（可選）
-        output_json = f"data/knowledge/{Path(pdf_path).stem}_knowledge.json"
-        os.makedirs("data/knowledge", exist_ok=True)
-        
-        with open(output_json, 'w', encoding='utf-8') as f:
-            json.dump(knowledge_items, f, ensure_ascii=False, indent=2)
-        
-        print(f"✅ 知識文件已保存: {output_json}")
-        
-        # 5. 導入向量資料庫
-        print("🗄️  步驟 4: 導入向量資料庫...")
-        
         from src.rag.rag_system import ZiweiRAGSystem
+        from src.rag.ingestion import PDFIngestionPipeline
         
         # 創建RAG系統
         rag_system = ZiweiRAGSystem(logger=logger)
+        vector_store = rag_system.vector_store
         
         # 檢查向量庫狀態
         stats = rag_system.get_system_status()
@@ -194,39 +71,66 @@ async def import_pdf_to_vector_db(pdf_path: str, chunk_size: int = 1000, overlap
         
         print(f"📊 向量庫初始狀態: {initial_docs} 條文檔")
         
-        # 添加知識到向量庫
-        success = rag_system.add_knowledge(knowledge_items)
-        
-        if success:
-            # 檢查更新後的狀態
-            updated_stats = rag_system.get_system_status()
-            updated_vector_stats = updated_stats.get('vector_store', {})
-            final_docs = updated_vector_stats.get('total_documents', 0)
-            
-            added_docs = final_docs - initial_docs
-            
-            print(f"✅ 向量庫導入成功！")
-            print(f"   新增文檔: {added_docs}")
-            print(f"   總文檔數: {final_docs}")
-            print(f"   向量庫路徑: {updated_vector_stats.get('persist_directory', 'unknown')}")
-            
-            # 測試搜索
-            print("\n🔍 測試搜索功能...")
-            test_query = "紫微星"
-            search_results = rag_system.search_knowledge(test_query, top_k=3)
-            
-            print(f"搜索 '{test_query}' 找到 {len(search_results)} 條結果:")
-            for i, result in enumerate(search_results[:2], 1):
-                content_preview = result['content'][:100] + "..." if len(result['content']) > 100 else result['content']
-                print(f"  {i}. {content_preview}")
-            
+        # 使用嵌入模型的分詞器計算 token 數（不可用時按字數估算）
+        bge_embeddings = vector_store._get_bge_embeddings()
+        count_tokens = bge_embeddings._count_tokens if bge_embeddings is not None else None
+        
+        # 提取、分塊與嵌入寫入重疊執行，每批寫入後保存檢查點
+        print(f"📖 串流導入 (塊大小: {chunk_size}, 重疊: {overlap}, 提取進程: {workers})...")
+        pipeline = PDFIngestionPipeline(
+            sink=functools.partial(vector_store.add_chunks, skip_existing=True),
+            count_tokens=count_tokens,
+            chunk_size=chunk_size,
+            overlap=overlap,
+            num_workers=workers,
+            max_tokens_per_batch=max_tokens_per_batch,
+            metadata_fn=classify_chunk,
+            prune=vector_store.prune_source if sync else None,
+            flush=vector_store.flush,
+            logger=logger
+        )
+        
+        # 管線在背景線程中運行，不阻塞事件循環
+        loop = asyncio.get_running_loop()
+        ingest_stats = await loop.run_in_executor(None, pipeline.run, pdf_path, resume)
+        
+        if ingest_stats.get('skipped'):
+            print(f"✅ 此文件已完成導入，如需重新導入請使用 --no-resume")
             return True
-        else:
-            logger.error("向量庫導入失敗")
-            return False
-            
+        
+        print(f"✅ 導入完成: {ingest_stats['pages']} 頁，{ingest_stats['chunks']} 個文本塊")
+        print(f"   新嵌入寫入: {ingest_stats['chunks_written']}，未變更: {ingest_stats['chunks'] - ingest_stats['chunks_written']}")
+        if sync:
+            print(f"   刪除已移除的文本塊: {ingest_stats.get('pruned', 0)}")
+        print(f"   耗時: {ingest_stats['elapsed']:.1f} 秒")
+        print(f"   吞吐: {ingest_stats['pages_per_sec']:.1f} 頁/秒，{ingest_stats['chunks_per_sec']:.1f} 塊/秒")
+        print(f"   嵌入寫入: {ingest_stats['write_time']:.1f} 秒，寫入線程等待: {ingest_stats['writer_wait_time']:.1f} 秒")
+        
+        # 檢查更新後的狀態
+        updated_stats = rag_system.get_system_status()
+        updated_vector_stats = updated_stats.get('vector_store', {})
+        final_docs = updated_vector_stats.get('total_documents', 0)
+        
+        print(f"✅ 向量庫導入成功！")
+        print(f"   新增文檔: {final_docs - initial_docs}")
+        print(f"   總文檔數: {final_docs}")
+        print(f"   向量庫路徑: {updated_vector_stats.get('persist_directory', 'unknown')}")
+        
+        # 測試搜索
+        print("\n🔍 測試搜索功能...")
+        test_query = "紫微星"
+        search_results = rag_system.search_knowledge(test_query, top_k=3)
+        
+        print(f"搜索 '{test_query}' 找到 {len(search_results)} 條結果:")
+        for i, result in enumerate(search_results[:2], 1):
+            content_preview = result['content'][:100] + "..." if len(result['content']) > 100 else result['content']
+            print(f"  {i}. {content_preview}")
+        
+        return True
+    
     except Exception as e:
         logger.error(f"PDF 導入過程失敗: {str(e)}")
+        logger.error("已提交的批次保存在檢查點中，重新執行即可續傳")
         import traceback
         traceback.print_exc()
         return False
@@ -235,8 +139,14 @@ async def main():
     """主函數"""
     parser = argparse.ArgumentParser(description="PDF 文件導入向量資料庫工具")
     parser.add_argument('pdf_path', help='PDF 文件路徑')
-    parser.add_argument('--chunk-size', type=int, default=1000, help='文本塊大小 (默認: 1000)')
-    parser.add_argument('--overlap', type=int, default=200, help='文本塊重疊大小 (默認: 200)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='文本塊大小，以 BGE-M3 token 計 (默認: 1000)')
+    parser.add_argument('--overlap', type=int, default=200, help='文本塊重疊大小，以整句為單位，不跨越標題 (默認: 200 token)')
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 2) // 2, 1),
+                        help='PDF 提取進程數，0 表示在主進程提取 (默認: CPU 核心數的一半)')
+    parser.add_argument('--max-tokens-per-batch', type=int, default=16384,
+                        help='每批嵌入寫入的 token 上限 (默認: 16384)')
+    parser.add_argument('--no-resume', action='store_true', help='忽略檢查點，從頭導入')
+    parser.add_argument('--sync', action='store_true', help='同步模式：刪除此文件在向量庫中已不存在的文本塊')
     
     args = parser.parse_args()
     
@@ -244,7 +154,11 @@ async def main():
     success = await import_pdf_to_vector_db(
         pdf_path=args.pdf_path,
         chunk_size=args.chunk_size,
-        overlap=args.overlap
+        overlap=args.overlap,
+        workers=args.workers,
+        max_tokens_per_batch=args.max_tokens_per_batch,
+        resume=not args.no_resume,
+        sync=args.sync
     )
     
     if success:
@@ -4,8 +4,11 @@
 """
 
 import asyncio
+import copy
+import hashlib
 import logging
 import json
+import os
 import time
 from datetime import datetime
 from typing import Dict, Any, Optional
@@ -26,11 +29,37 @@ from performance_config import get_config_by_name, apply_config
 from src.agents.coordinator import MultiAgentCoordinator, CoordinationStrategy
 from src.mcp.tools.ziwei_tool import ZiweiTool
 from src.rag.rag_system import ZiweiRAGSystem
+from src.rag.domain_filters import DOMAIN_CATEGORIES, domain_filter
+from src.rag.knowledge_lookup import chart_placement_keys
 from src.output.gpt4o_formatter import GPT4oFormatter
 
 # 載入設定
 settings = get_settings()
 
+# 分析管線版本：修改 Agent 流程或輸出結構時遞增，使舊的分析結果快取失效
+PIPELINE_VERSION = "2.0.0"
+
+# 影響分析輸出的 Prompt / 格式化檔案，內容變動時分析結果快取自動失效
+PIPELINE_SOURCE_FILES = [
+    "src/prompts/system_prompts.py",
+    "src/output/gpt4o_formatter.py",
+    "src/config/crewai_config.py",
+    "src/crew/crew_manager.py"
+]
+
+
+def compute_pipeline_version() -> str:
+    """計算分析管線版本哈希（版本號 + Prompt 檔案內容）"""
+    hasher = hashlib.sha256(PIPELINE_VERSION.encode())
+    base_dir = Path(__file__).parent
+
+    for relative_path in PIPELINE_SOURCE_FILES:
+        source_file = base_dir / relative_path
+        if source_file.exists():
+            hasher.update(source_file.read_bytes())
+
+    return hasher.hexdigest()[:16]
+
 class ZiweiAISystem:
     """紫微斗數AI系統主類"""
 
@@ -56,9 +85,11 @@ class ZiweiAISystem:
         self.ziwei_tool = None
         self.rag_system = None
         self.formatter = None
+        self.rag_warmup_task = None
 
         # 共用組件
         self.cache_manager = get_cache_manager()  # 初始化快取管理器
+        self.pipeline_version = compute_pipeline_version()
 
         # 系統狀態
         self.is_initialized = False
@@ -125,6 +156,9 @@ class ZiweiAISystem:
                 # 5. 載入紫微斗數知識庫
                 await self._load_knowledge_base()
 
+                # 6. 在背景載入並預熱嵌入模型，不需要檢索的請求無須等待
+                self.rag_warmup_task = asyncio.create_task(self._warm_up_rag_system())
+
             self.initialization_time = time.time() - start_time
             self.is_initialized = True
 
@@ -145,11 +179,25 @@ class ZiweiAISystem:
                     "collection_name": "ziwei_knowledge_test1",
                     "embedding_provider": "huggingface",
                     "embedding_model": "BAAI/bge-m3",
+                    "lazy_embeddings": True,  # 模型於背景載入，不阻塞啟動
+                    "index_backend": "numpy",  # 知識庫僅數千文本塊，以內存平面索引檢索
+                    "hybrid_search": True,  # 星曜、宮位名稱以 BM25 精確命中，與稠密結果融合
+                    "rerank": self.performance_config.rag_rerank,  # 交叉編碼器重排序較寬的候選集
+                    "rerank_candidates": self.performance_config.rag_rerank_candidates,
+                    "reranker_config": {
+                        "model_name": "BAAI/bge-reranker-base",
+                        "latency_budget_ms": self.performance_config.rag_rerank_budget_ms
+                    },
                     "embedding_config": {
                         "device": "cpu",
                         "max_length": 1024,
                         "batch_size": 8,
                         "use_fp16": False,
+                        "query_cache_size": 2048,
+                        "query_cache_path": "./cache/query_embeddings_bge_m3.npz",
+                        "micro_batch_max_size": 8,  # 合併並發查詢為單一批次
+                        "micro_batch_max_wait_ms": 5.0,
+                        "torch_threads": "auto",  # 多個 API 工作進程時平分 CPU 核心
                         "openai_fallback": True,
                         "openai_model": "text-embedding-ada-002"
                     }
@@ -160,9 +208,10 @@ class ZiweiAISystem:
                     "max_tokens": 2000
                 },
                 "rag": {
-                    "top_k": 3,  # 減少檢索數量從5到3
-                    "min_score": 0.7,  # 提高最小分數，獲得更精確結果
-                    "max_context_length": 3000  # 減少上下文長度
+                    "top_k": self.performance_config.rag_top_k,
+                    "min_score": self.performance_config.rag_min_score,
+                    "max_context_length": self.performance_config.rag_max_context_length,  # 上下文 token 預算
+                    "rerank_min_score": float(os.getenv("RAG_RERANK_MIN_SCORE", "0.0"))  # 重排序分數的最低門檻
                 }
             }
 
@@ -208,17 +257,37 @@ class ZiweiAISystem:
 
             if total_docs > 0:
                 self.logger.info("✅ test1 向量資料庫已就緒，包含紫微斗數集成全書內容")
-
-                # 測試搜索功能
-                self.logger.info("🔍 測試向量資料庫搜索功能...")
-                test_results = self.rag_system.search_knowledge("紫微星", top_k=2)
-                self.logger.info(f"   搜索測試成功，找到 {len(test_results)} 條相關結果")
             else:
                 self.logger.warning("⚠️ test1 向量資料庫為空，請重新建立資料庫")
 
         except Exception as e:
             self.logger.error(f"檢查向量資料庫時發生錯誤: {str(e)}")
 
+    async def _warm_up_rag_system(self):
+        """背景載入嵌入模型、預熱並測試搜索功能"""
+        try:
+            await self.rag_system.warm_up()
+
+            readiness = self.rag_system.vector_store.get_readiness()
+            self.logger.info(
+                f"✅ 嵌入模型就緒: 載入 {readiness['load_time'] or 0:.2f} 秒，"
+                f"預熱 {(readiness['warmup_time'] or 0) * 1000:.1f} 毫秒"
+            )
+
+            # 測試搜索功能
+            self.logger.info("🔍 測試向量資料庫搜索功能...")
+            test_results = await self.rag_system.search_knowledge_async("紫微星", top_k=2)
+            self.logger.info(f"   搜索測試成功，找到 {len(test_results)} 條相關結果")
+
+        except Exception as e:
+            self.logger.error(f"嵌入模型背景載入失敗: {str(e)}")
+
+    def is_ready(self) -> bool:
+        """系統是否已就緒（已初始化，且 RAG 嵌入模型已載入）"""
+        if not self.is_initialized:
+            return False
+        return self.rag_system is None or self.rag_system.is_ready()
+
     async def _coordinate_with_process_display(self,
                                              agent_input: Dict[str, Any],
                                              domain_type: str,
@@ -278,7 +347,8 @@ class ZiweiAISystem:
                                  domain_type: str = "comprehensive",
                                  user_profile: Optional[Dict[str, Any]] = None,
                                  output_format: str = "json",
-                                 show_agent_process: bool = False) -> Dict[str, Any]:
+                                 show_agent_process: bool = False,
+                                 use_cache: bool = True) -> Dict[str, Any]:
         """
         完整的紫微斗數分析流程 (支援 CrewAI + MCP 和 Legacy 架構)
 
@@ -288,6 +358,7 @@ class ZiweiAISystem:
             user_profile: 用戶背景資料
             output_format: 輸出格式 (json, detailed, summary, etc.)
             show_agent_process: 是否顯示 Agent 處理過程
+            use_cache: 是否使用分析結果快取
 
         Returns:
             完整的分析結果
@@ -300,9 +371,20 @@ class ZiweiAISystem:
             architecture = "CrewAI + MCP" if self.use_crewai else "Legacy Multi-Agent"
             self.logger.info(f"開始分析紫微斗數命盤 ({architecture})，領域: {domain_type}")
 
+            # 檢查分析結果快取（用戶背景資料會影響分析內容，提供時不使用快取）
+            cache_key = None
+            if use_cache and self.performance_config.cache_enabled and not user_profile:
+                cache_key = self._build_analysis_cache_key(
+                    birth_data, domain_type, output_format, architecture
+                )
+                cached_result = self.cache_manager.get(cache_key)
+                if cached_result is not None:
+                    self.logger.info("使用快取的分析結果")
+                    return self._mark_cached_result(cached_result, start_time)
+
             if self.use_crewai:
                 # 使用新的 CrewAI + MCP 架構
-                return await self._analyze_with_crewai(
+                result = await self._analyze_with_crewai(
                     birth_data=birth_data,
                     domain_type=domain_type,
                     output_format=output_format,
@@ -311,7 +393,7 @@ class ZiweiAISystem:
                 )
             else:
                 # 使用舊的 Legacy 架構
-                return await self._analyze_with_legacy(
+                result = await self._analyze_with_legacy(
                     birth_data=birth_data,
                     domain_type=domain_type,
                     user_profile=user_profile,
@@ -320,6 +402,12 @@ class ZiweiAISystem:
                     start_time=start_time
                 )
 
+            # 只快取成功的分析結果
+            if cache_key is not None and isinstance(result, dict) and result.get("success", False):
+                self.cache_manager.set(cache_key, copy.deepcopy(result))
+
+            return result
+
         except Exception as e:
             processing_time = time.time() - start_time
             self.logger.error(f"分析失敗: {str(e)} (耗時 {processing_time:.2f}s)")
@@ -332,6 +420,47 @@ class ZiweiAISystem:
                 "timestamp": datetime.now().isoformat()
             }
 
+    @staticmethod
+    def _normalize_birth_data(birth_data: Dict[str, Any]) -> Dict[str, Any]:
+        """正規化出生資料，使等價的輸入得到相同的快取鍵"""
+        birth_hour = str(birth_data.get("birth_hour", "")).strip()
+        if birth_hour.endswith("時"):
+            birth_hour = birth_hour[:-1]
+
+        return {
+            "gender": str(birth_data.get("gender", "")).strip(),
+            "birth_year": str(birth_data.get("birth_year", "")).strip(),
+            "birth_month": str(birth_data.get("birth_month", "")).strip().lstrip("0"),
+            "birth_day": str(birth_data.get("birth_day", "")).strip().lstrip("0"),
+            "birth_hour": birth_hour
+        }
+
+    def _build_analysis_cache_key(self, birth_data: Dict[str, Any], domain_type: str,
+                                  output_format: str, architecture: str) -> Dict[str, Any]:
+        """構建分析結果快取鍵"""
+        return {
+            "operation": "full_analysis",
+            "birth_data": self._normalize_birth_data(birth_data),
+            "domain_type": domain_type,
+            "output_format": output_format,
+            "architecture": architecture,
+            "pipeline_version": self.pipeline_version
+        }
+
+    @staticmethod
+    def _mark_cached_result(cached_result: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        """複製快取結果並標記為快取命中"""
+        result = copy.deepcopy(cached_result)
+        total_time = time.time() - start_time
+
+        result["cache_hit"] = True
+        result["total_processing_time"] = total_time
+        if isinstance(result.get("metadata"), dict):
+            result["metadata"]["cache_hit"] = True
+            result["metadata"]["cache_lookup_time"] = total_time
+
+        return result
+
     async def _analyze_with_crewai(self, birth_data: Dict[str, Any], domain_type: str,
                                   output_format: str, show_process: bool, start_time: float) -> Dict[str, Any]:
         """使用 CrewAI + MCP 架構進行分析"""
@@ -511,18 +640,7 @@ class ZiweiAISystem:
             if cached_result is not None:
                 self.logger.info("使用快取的知識檢索結果")
                 return cached_result
-            # 構建查詢
-            query_parts = []
-            
-            # 從命盤數據提取關鍵信息
-            if 'data' in chart_data and 'palace' in chart_data['data']:
-                palaces = chart_data['data']['palace']
-                for palace_name, stars in palaces.items():
-                    if isinstance(stars, list):
-                        query_parts.extend(stars)
-                    query_parts.append(palace_name)
-            
-            # 添加領域相關查詢
+            # 構建子查詢：領域查詢一條，每個宮位（含宮內星曜）各一條
             domain_queries = {
                 'love': ['愛情', '婚姻', '感情', '夫妻宮'],
                 'wealth': ['財富', '財運', '財帛宮', '事業'],
@@ -530,15 +648,30 @@ class ZiweiAISystem:
                 'comprehensive': ['命盤', '整體', '綜合']
             }
             
-            query_parts.extend(domain_queries.get(domain_type, domain_queries['comprehensive']))
+            queries = [' '.join(domain_queries.get(domain_type, domain_queries['comprehensive']))]
+            
+            # 從命盤數據提取關鍵信息：星曜、四化落宮查預計算表，無法解析的宮位仍作為文本子查詢
+            placement_keys = []
+            if 'data' in chart_data and 'palace' in chart_data['data']:
+                palaces = chart_data['data']['palace']
+                for palace_name, stars in palaces.items():
+                    keys = chart_placement_keys({palace_name: stars})
+                    if keys:
+                        placement_keys.extend(keys)
+                    elif isinstance(stars, list) and stars:
+                        queries.append(f"{palace_name} {' '.join(stars)}")
+                    else:
+                        queries.append(palace_name)
             
-            # 執行知識檢索 - 優化檢索參數
-            query = ' '.join(query_parts[:8])  # 進一步限制查詢長度
-            knowledge_results = self.rag_system.search_knowledge(query, top_k=3, min_score=0.7)
+            # 執行知識檢索 - 查找表未命中的配置與文本子查詢一次批量嵌入與檢索，領域對應的內容分類作為過濾條件
+            # top_k 與最低分數沿用性能配置（rag_top_k / rag_min_score），重排序時最低分數按重排序分數判斷
+            filter_metadata = domain_filter(domain_type) if domain_type in DOMAIN_CATEGORIES else None
+            knowledge_results = await self.rag_system.search_placements_async(
+                placement_keys, queries, filter_metadata=filter_metadata
+            )
             
-            # 整合知識片段
-            knowledge_texts = [result['content'] for result in knowledge_results]
-            knowledge_context = '\n\n'.join(knowledge_texts)
+            # 整合知識片段：合併相鄰文本塊、去除重複片段，並限制在上下文 token 預算內
+            knowledge_context = self.rag_system.pack_context(knowledge_results)['context']
 
             # 快取結果
             self.cache_manager.set(cache_key, knowledge_context)
@@ -553,7 +686,9 @@ class ZiweiAISystem:
         """獲取系統狀態"""
         return {
             'initialized': self.is_initialized,
+            'ready': self.is_ready(),
             'initialization_time': self.initialization_time,
+            'embeddings': self.rag_system.vector_store.get_readiness() if self.rag_system else None,
             'components': {
                 'coordinator': self.coordinator is not None,
                 'ziwei_tool': self.ziwei_tool is not None,
@@ -569,6 +704,11 @@ class ZiweiAISystem:
         try:
             self.logger.info("開始清理系統資源...")
 
+            # 停止尚未完成的背景預熱
+            if self.rag_warmup_task and not self.rag_warmup_task.done():
+                self.rag_warmup_task.cancel()
+            self.rag_warmup_task = None
+
             # 清理各個組件
             if self.coordinator:
                 # 如果協調器有清理方法，調用它
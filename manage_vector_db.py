@@ -52,8 +52,8 @@ class VectorDBManager:
         except Exception as e:
             logger.error(f"獲取狀態失敗: {str(e)}")
     
-    def add_knowledge_from_file(self, file_path: str):
-        """從文件添加知識"""
+    def add_knowledge_from_file(self, file_path: str, sync: bool = False):
+        """從文件添加知識（sync 時刪除該文件中已不存在的文本塊）"""
         try:
             file_path = Path(file_path)
             
@@ -69,7 +69,11 @@ class VectorDBManager:
                     knowledge_data = json.load(f)
                 
                 if isinstance(knowledge_data, list):
-                    success = self.rag_system.add_knowledge(knowledge_data)
+                    if sync:
+                        # 同步按來源比對，未標註來源的知識項目歸屬此文件
+                        for item in knowledge_data:
+                            item.setdefault("metadata", {}).setdefault("source", file_path.name)
+                    success = self.rag_system.add_knowledge(knowledge_data, sync=sync)
                     if success:
                         logger.info(f"成功添加 {len(knowledge_data)} 條知識")
                         return True
@@ -92,7 +96,7 @@ class VectorDBManager:
                         }
                     }
                     
-                    success = self.rag_system.add_knowledge([knowledge_item])
+                    success = self.rag_system.add_knowledge([knowledge_item], sync=sync)
                     if success:
                         logger.info(f"成功添加知識文件: {file_path.name}")
                         return True
@@ -103,7 +107,7 @@ class VectorDBManager:
             logger.error(f"添加知識失敗: {str(e)}")
             return False
     
-    def add_knowledge_from_directory(self, dir_path: str):
+    def add_knowledge_from_directory(self, dir_path: str, sync: bool = False):
         """從目錄批量添加知識"""
         try:
             dir_path = Path(dir_path)
@@ -127,7 +131,7 @@ class VectorDBManager:
             
             success_count = 0
             for file_path in knowledge_files:
-                if self.add_knowledge_from_file(str(file_path)):
+                if self.add_knowledge_from_file(str(file_path), sync=sync):
                     success_count += 1
             
             logger.info(f"成功處理 {success_count}/{len(knowledge_files)} 個文件")
@@ -178,28 +182,72 @@ class VectorDBManager:
             logger.error(f"清空向量庫失敗: {str(e)}")
             return False
     
-    def export_knowledge(self, output_file: str):
-        """導出知識（如果支持的話）"""
+    def export_knowledge(self, output_dir: str, quantization: str = None):
+        """導出知識庫快照（float16 向量、ID 陣列、文本塊與元數據，可記憶體映射載入）
+        
+        指定 quantization 時向量以 float32 保存供重新打分，另存壓縮掃描表示（float16 或 PQ 編碼）
+        """
         try:
-            # 這是一個簡化的導出功能
-            # 實際實現可能需要直接訪問 ChromaDB
-            logger.warning("導出功能尚未完全實現")
-            logger.info("建議直接備份 data/vector_db 目錄")
+            vector_store = self.rag_system.vector_store
+            stats = vector_store.get_collection_stats()
+            logger.info(f"導出集合 {stats.get('collection_name', 'unknown')}，共 {stats.get('total_documents', 0)} 條")
+            
+            manifest = vector_store.export_snapshot(
+                output_dir,
+                dtype="float32" if quantization else "float16",
+                quantization=quantization
+            )
+            
+            snapshot_size = sum(f.stat().st_size for f in Path(output_dir).iterdir() if f.is_file())
+            print(f"\n=== 快照導出完成 ===")
+            print(f"輸出目錄: {output_dir}")
+            print(f"向量數量: {manifest['count']}")
+            print(f"向量維度: {manifest['dimension']}")
+            if quantization:
+                print(f"壓縮掃描: {quantization}（重新打分倍數 {manifest['rescore_factor']}）")
+            print(f"快照大小: {snapshot_size / (1024 * 1024):.1f} MB")
+            print(f"使用方式: 設定 VECTOR_INDEX_BACKEND=numpy 與 VECTOR_NUMPY_INDEX_DIR={output_dir}")
+            return True
             
         except Exception as e:
             logger.error(f"導出失敗: {str(e)}")
+            return False
+
+
+    def build_lookup_table(self, output_path: str = None, top_k: int = 5):
+        """離線建立星曜 × 宮位、四化 × 宮位與格局的預計算查找表"""
+        try:
+            vector_store = self.rag_system.vector_store
+            manifest = vector_store.build_lookup_table(top_k=top_k, path=output_path)
+            
+            print(f"\n=== 查找表建立完成 ===")
+            print(f"輸出路徑: {output_path or vector_store.lookup_table_path}")
+            print(f"鍵數量: {manifest['keys']}")
+            print(f"每鍵文本塊數: {manifest['top_k']}")
+            print(f"耗時: {manifest['build_seconds']:.1f} 秒")
+            if output_path and output_path != vector_store.lookup_table_path:
+                print(f"使用方式: 設定 VECTOR_LOOKUP_TABLE_PATH={output_path}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"建立查找表失敗: {str(e)}")
+            return False
 
 
 async def main():
     """主函數"""
     parser = argparse.ArgumentParser(description="紫微斗數向量庫管理工具")
-    parser.add_argument('action', choices=['status', 'add-file', 'add-dir', 'search', 'clear', 'export'],
+    parser.add_argument('action', choices=['status', 'add-file', 'add-dir', 'search', 'clear', 'export', 'build-lookup'],
                        help='要執行的操作')
     parser.add_argument('--file', '-f', help='文件路徑')
     parser.add_argument('--directory', '-d', help='目錄路徑')
     parser.add_argument('--query', '-q', help='搜索查詢')
-    parser.add_argument('--output', '-o', help='輸出文件路徑')
-    parser.add_argument('--top-k', '-k', type=int, default=5, help='搜索結果數量')
+    parser.add_argument('--output', '-o', help='輸出路徑（export 時為快照目錄，build-lookup 時為查找表文件）')
+    parser.add_argument('--top-k', '-k', type=int, default=5, help='搜索結果數量（build-lookup 時為每鍵保存的文本塊數）')
+    parser.add_argument('--quantization', choices=['float16', 'pq'],
+                       help='export 時另存壓縮掃描表示，檢索先掃描壓縮向量再以完整精度重新打分')
+    parser.add_argument('--sync', action='store_true',
+                       help='同步模式：只嵌入新增或變更的文本塊，並刪除來源文件中已移除的文本塊')
     
     args = parser.parse_args()
     
@@ -215,14 +263,14 @@ async def main():
         if not args.file:
             print("錯誤: 請指定文件路徑 --file")
             return
-        manager.add_knowledge_from_file(args.file)
+        manager.add_knowledge_from_file(args.file, sync=args.sync)
         manager.show_status()
     
     elif args.action == 'add-dir':
         if not args.directory:
             print("錯誤: 請指定目錄路徑 --directory")
             return
-        manager.add_knowledge_from_directory(args.directory)
+        manager.add_knowledge_from_directory(args.directory, sync=args.sync)
         manager.show_status()
     
     elif args.action == 'search':
@@ -237,9 +285,12 @@ async def main():
     
     elif args.action == 'export':
         if not args.output:
-            print("錯誤: 請指定輸出文件路徑 --output")
+            print("錯誤: 請指定快照輸出目錄 --output")
             return
-        manager.export_knowledge(args.output)
+        manager.export_knowledge(args.output, quantization=args.quantization)
+    
+    elif args.action == 'build-lookup':
+        manager.build_lookup_table(args.output, top_k=args.top_k)
 
 
 if __name__ == "__main__":
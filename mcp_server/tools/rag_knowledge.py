@@ -3,6 +3,8 @@ RAG 知識檢索 MCP 工具
 封裝現有的 RAG 系統為 MCP 工具
 """
 
+import asyncio
+import functools
 import json
 import sys
 import os
@@ -22,6 +24,7 @@ class RAGKnowledgeTool(BaseMCPTool):
             description="從紫微斗數知識庫檢索相關理論和解釋"
         )
         self.rag_system = None
+        self._warmup_task = None
     
     def get_tool_definition(self) -> Dict[str, Any]:
         """返回工具的 MCP 定義"""
@@ -71,6 +74,9 @@ class RAGKnowledgeTool(BaseMCPTool):
         try:
             from src.rag.rag_system import ZiweiRAGSystem
             self.rag_system = ZiweiRAGSystem(logger=self.logger)
+            if not self.rag_system.is_ready():
+                # 延遲載入時在背景預熱，檢索請求會等待模型就緒
+                self._warmup_task = asyncio.create_task(self.rag_system.warm_up())
             await super().initialize()
         except ImportError as e:
             self.logger.error(f"❌ 無法導入 ZiweiRAGSystem: {str(e)}")
@@ -113,6 +119,14 @@ class RAGKnowledgeTool(BaseMCPTool):
                 "error": "min_score 必須是 0.0-1.0 之間的數字"
             }
         
+        # 檢查 domain_filter
+        domain_filter = arguments.get("domain_filter", "all")
+        if domain_filter not in ("all", "stars", "palaces", "theory", "interpretation"):
+            return {
+                "valid": False,
+                "error": "domain_filter 必須是 all、stars、palaces、theory 或 interpretation"
+            }
+        
         return {"valid": True, "error": None}
     
     async def _pre_execute(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
@@ -135,32 +149,34 @@ class RAGKnowledgeTool(BaseMCPTool):
         context_type = arguments["context_type"]
         top_k = arguments["top_k"]
         min_score = arguments["min_score"]
-        domain_filter = arguments["domain_filter"]
         
         try:
+            # 領域過濾下推為 content_type 的 where 條件，在索引內縮小候選集，結果數不因過濾而減少
+            from src.rag.domain_filters import domain_filter
+            filter_metadata = domain_filter(arguments["domain_filter"])
+            
             if context_type == "search_only":
                 # 只搜索，不生成回答
-                search_results = self.rag_system.search_knowledge(
+                search_results = await self.rag_system.search_knowledge_async(
                     query=query,
                     top_k=top_k,
-                    min_score=min_score
+                    min_score=min_score,
+                    filter_metadata=filter_metadata
                 )
                 
-                # 應用領域過濾
-                filtered_results = self._apply_domain_filter(search_results, domain_filter)
-                
                 return {
                     "success": True,
-                    "search_results": filtered_results,
+                    "search_results": search_results,
                     "query": query,
-                    "total_results": len(filtered_results),
+                    "total_results": len(search_results),
                     "context_type": context_type
                 }
             
             elif context_type == "generate_only":
                 # 只生成，不搜索（使用現有上下文）
                 context_documents = arguments.get("context_documents", [])
-                result = self.rag_system.generate_answer(
+                result = await self._run_blocking(
+                    self.rag_system.generate_answer,
                     query=query,
                     context_type="manual",
                     context_documents=context_documents
@@ -175,20 +191,17 @@ class RAGKnowledgeTool(BaseMCPTool):
             
             else:
                 # auto 或 manual：搜索並生成回答
-                result = self.rag_system.generate_answer(
+                # 檢索與生成在線程池中執行，不阻塞事件循環
+                result = await self._run_blocking(
+                    self.rag_system.generate_answer,
                     query=query,
                     context_type=context_type,
                     top_k=top_k,
                     min_score=min_score,
-                    **arguments
+                    filter_metadata=filter_metadata,
+                    context_documents=arguments.get("context_documents", [])
                 )
                 
-                # 如果結果包含搜索結果，應用領域過濾
-                if "search_results" in result:
-                    result["search_results"] = self._apply_domain_filter(
-                        result["search_results"], domain_filter
-                    )
-                
                 return {
                     "success": True,
                     "rag_result": result,
@@ -204,43 +217,11 @@ class RAGKnowledgeTool(BaseMCPTool):
                 "query": query
             }
     
-    def _apply_domain_filter(self, results: List[Dict[str, Any]], domain_filter: str) -> List[Dict[str, Any]]:
-        """應用領域過濾器"""
-        if domain_filter == "all":
-            return results
-        
-        filtered_results = []
-        
-        for result in results:
-            content = result.get("content", "").lower()
-            metadata = result.get("metadata", {})
-            
-            should_include = False
-            
-            if domain_filter == "stars":
-                # 星曜相關
-                star_keywords = ["紫微", "天機", "太陽", "武曲", "天同", "廉貞", "天府", "太陰", "貪狼", "巨門", "天相", "天梁", "七殺", "破軍"]
-                should_include = any(star in content for star in star_keywords)
-            
-            elif domain_filter == "palaces":
-                # 宮位相關
-                palace_keywords = ["命宮", "兄弟宮", "夫妻宮", "子女宮", "財帛宮", "疾厄宮", "遷移宮", "奴僕宮", "官祿宮", "田宅宮", "福德宮", "父母宮"]
-                should_include = any(palace in content for palace in palace_keywords)
-            
-            elif domain_filter == "theory":
-                # 理論相關
-                theory_keywords = ["四化", "大限", "流年", "五行", "陰陽", "干支", "納音"]
-                should_include = any(theory in content for theory in theory_keywords)
-            
-            elif domain_filter == "interpretation":
-                # 解釋相關
-                interpretation_keywords = ["性格", "命運", "運勢", "感情", "事業", "財運", "健康"]
-                should_include = any(keyword in content for keyword in interpretation_keywords)
-            
-            if should_include:
-                filtered_results.append(result)
-        
-        return filtered_results
+    @staticmethod
+    async def _run_blocking(func, *args, **kwargs):
+        """在默認線程池中執行同步函數"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
     
     async def _post_execute(self, result: Dict[str, Any], arguments: Dict[str, Any]) -> Dict[str, Any]:
         """執行後處理"""
@@ -289,6 +270,8 @@ class RAGKnowledgeTool(BaseMCPTool):
     
     async def cleanup(self):
         """清理資源"""
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
         if self.rag_system and hasattr(self.rag_system, 'cleanup'):
             await self.rag_system.cleanup()
         await super().cleanup()
@@ -27,6 +27,9 @@ class PerformanceConfig:
     rag_min_score: float = 0.7  # 最小分數 (原本0.6，優化為0.7)
     rag_max_context_length: int = 3000  # 上下文長度 (原本4000，優化為3000)
     knowledge_query_limit: int = 8  # 查詢詞限制 (原本10，優化為8)
+    rag_rerank: bool = False  # 交叉編碼器重排序（需下載 bge-reranker 模型）
+    rag_rerank_candidates: int = 20  # 重排序前向量檢索的候選數
+    rag_rerank_budget_ms: float = 300.0  # 每次請求的重排序延遲預算，預估超出時跳過
     
     # 快取設定
     cache_enabled: bool = True  # 啟用快取
@@ -55,6 +58,7 @@ FAST_CONFIG = PerformanceConfig(
     anthropic_timeout=25,
     rag_top_k=2,             # 更少的檢索結果
     rag_min_score=0.8,       # 更高的分數要求（更精確但更少）
+    rag_rerank_budget_ms=100.0,  # 啟用重排序時只容許很短的延遲
     knowledge_query_limit=6,  # 更少的查詢詞
     skip_validation=True      # 跳過驗證以節省時間
 )
@@ -83,6 +87,9 @@ QUALITY_CONFIG = PerformanceConfig(
     rag_top_k=5,
     rag_min_score=0.6,
     knowledge_query_limit=10,
+    rag_rerank=True,
+    rag_rerank_candidates=30,
+    rag_rerank_budget_ms=800.0,
     skip_validation=False
 )
 
@@ -115,7 +122,10 @@ def apply_config(config: PerformanceConfig) -> Dict[str, Any]:
             'top_k': config.rag_top_k,
             'min_score': config.rag_min_score,
             'max_context_length': config.rag_max_context_length,
-            'query_limit': config.knowledge_query_limit
+            'query_limit': config.knowledge_query_limit,
+            'rerank': config.rag_rerank,
+            'rerank_candidates': config.rag_rerank_candidates,
+            'rerank_budget_ms': config.rag_rerank_budget_ms
         },
         'cache': {
             'enabled': config.cache_enabled,
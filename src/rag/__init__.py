@@ -5,7 +5,23 @@ RAG (Retrieval-Augmented Generation) 系統
 
 from .rag_system import ZiweiRAGSystem, create_rag_system, quick_setup
 from .vector_store import ZiweiVectorStore
-from .bge_embeddings import BGEM3Embeddings, HybridEmbeddings
+from .numpy_index import NumpyVectorIndex
+from .lexical_index import BM25LexicalIndex, reciprocal_rank_fusion
+from .result_cache import RetrievalResultCache
+from .reranker import CrossEncoderReranker
+from .domain_filters import DOMAIN_CATEGORIES, domain_filter
+from .score_filters import passes_min_score
+from .knowledge_lookup import KnowledgeLookupTable, chart_placement_keys
+from .context_packer import ContextPacker
+from .retrieval_eval import GoldenQuerySet, evaluate_retrieval
+from .text_chunker import StreamingTextChunker
+from .ingestion import PDFIngestionPipeline
+from .bge_embeddings import BGEM3Embeddings, HybridEmbeddings, create_bge_embeddings
+from .embedding_cache import QueryEmbeddingCache, DocumentEmbeddingCache
+from .embedding_service import MicroBatchEmbeddingService
+from .embedding_worker import EmbeddingWorkerPool
+from .torch_runtime import configure_torch_runtime
+from .model_registry import SharedModelRegistry, get_model_registry
 from .gpt4o_generator import GPT4oGenerator, RAGResponseGenerator
 
 __all__ = [
@@ -13,8 +29,31 @@ __all__ = [
     "create_rag_system",
     "quick_setup",
     "ZiweiVectorStore",
+    "NumpyVectorIndex",
+    "BM25LexicalIndex",
+    "reciprocal_rank_fusion",
+    "RetrievalResultCache",
+    "CrossEncoderReranker",
+    "DOMAIN_CATEGORIES",
+    "domain_filter",
+    "passes_min_score",
+    "KnowledgeLookupTable",
+    "chart_placement_keys",
+    "ContextPacker",
+    "GoldenQuerySet",
+    "evaluate_retrieval",
+    "StreamingTextChunker",
+    "PDFIngestionPipeline",
     "BGEM3Embeddings",
     "HybridEmbeddings",
+    "create_bge_embeddings",
+    "QueryEmbeddingCache",
+    "DocumentEmbeddingCache",
+    "MicroBatchEmbeddingService",
+    "EmbeddingWorkerPool",
+    "configure_torch_runtime",
+    "SharedModelRegistry",
+    "get_model_registry",
     "GPT4oGenerator",
     "RAGResponseGenerator"
 ]
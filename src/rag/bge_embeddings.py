@@ -4,12 +4,20 @@ BGE-M3 嵌入模型實現
 """
 
 import os
+import asyncio
 import logging
+import threading
 import torch
 from typing import List, Optional, Union
 from transformers import AutoTokenizer, AutoModel
 import numpy as np
 
+from .embedding_cache import QueryEmbeddingCache, DocumentEmbeddingCache
+from .embedding_service import MicroBatchEmbeddingService, plan_length_buckets
+from .embedding_worker import EmbeddingWorkerPool
+from .model_registry import get_model_registry
+from .torch_runtime import configure_torch_runtime
+
 
 class BGEM3Embeddings:
     """BGE-M3 嵌入模型類"""
@@ -20,6 +28,19 @@ class BGEM3Embeddings:
                  max_length: int = 8192,
                  batch_size: int = 32,
                  use_fp16: bool = False,
+                 query_cache_size: int = 1024,
+                 query_cache_path: Optional[str] = None,
+                 document_cache_dir: Optional[str] = None,
+                 micro_batch_max_size: int = 0,
+                 micro_batch_max_wait_ms: float = 5.0,
+                 max_tokens_per_batch: int = 0,
+                 num_workers: int = 0,
+                 threads_per_worker: int = 0,
+                 torch_threads: Union[int, str] = 0,
+                 torch_interop_threads: int = 0,
+                 cpu_affinity: Optional[str] = None,
+                 server_workers: int = 0,
+                 use_inference_mode: bool = True,
                  logger=None):
         """
         初始化 BGE-M3 嵌入模型
@@ -30,6 +51,19 @@ class BGEM3Embeddings:
             max_length: 最大序列長度
             batch_size: 批次大小
             use_fp16: 是否使用半精度浮點數
+            query_cache_size: 查詢嵌入 LRU 快取大小，0 表示停用
+            query_cache_path: 查詢嵌入快取持久化路徑（可選）
+            document_cache_dir: 文檔嵌入持久化快取目錄（可選），重建知識庫時只嵌入新增或變更的文本塊
+            micro_batch_max_size: 並發查詢微批次的最大請求數，0 表示停用微批次
+            micro_batch_max_wait_ms: 微批次收集請求的最長等待時間（毫秒）
+            max_tokens_per_batch: 文檔嵌入每批最大 token 數（含填充），0 表示按 batch_size 固定條數分批
+            num_workers: 推理工作進程數，0 表示在當前進程內推理
+            threads_per_worker: 每個工作進程的 torch 線程數，0 表示平分本進程的線程數
+            torch_threads: 本進程的 torch 算子內線程數，"auto" 按 API 工作進程數平分核心，0 表示沿用默認
+            torch_interop_threads: torch 算子間線程數，0 表示沿用默認
+            cpu_affinity: 本進程綁定的 CPU 集合（"auto"、"0-3" 或按工作進程編號分配的 "0-3;4-7"），None 表示不綁定
+            server_workers: 同一台機器上的 API 工作進程數，0 表示從 WEB_CONCURRENCY 等環境變數偵測
+            use_inference_mode: 以 torch.inference_mode 推理（比 no_grad 少了版本計數與視圖追蹤）
             logger: 日誌記錄器
         """
         self.model_name = model_name
@@ -37,15 +71,75 @@ class BGEM3Embeddings:
         self.max_length = max_length
         self.batch_size = batch_size
         self.use_fp16 = use_fp16
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.use_inference_mode = use_inference_mode
         self.logger = logger or logging.getLogger(__name__)
         
+        # 線程數與 CPU 親和性（進程全域，須在載入模型前設定）
+        self.runtime = configure_torch_runtime(
+            intra_op_threads=torch_threads,
+            inter_op_threads=torch_interop_threads,
+            cpu_affinity=cpu_affinity,
+            server_workers=server_workers,
+            logger=self.logger
+        )
+        
         # 檢查設備可用性
         if device == "cuda" and not torch.cuda.is_available():
             self.logger.warning("CUDA not available, falling back to CPU")
             self.device = "cpu"
         
-        # 初始化模型和分詞器
-        self.tokenizer, self.model = self._load_model()
+        # 查詢嵌入快取
+        self.query_cache = None
+        if query_cache_size > 0:
+            self.query_cache = QueryEmbeddingCache(
+                max_size=query_cache_size,
+                persist_path=query_cache_path,
+                logger=self.logger
+            )
+        
+        # 文檔嵌入快取
+        self.document_cache = None
+        if document_cache_dir:
+            self.document_cache = DocumentEmbeddingCache(
+                cache_dir=document_cache_dir,
+                model_id=f"{model_name}:{max_length}",
+                logger=self.logger
+            )
+        
+        # 初始化模型和分詞器（啟用工作進程時，父進程只保留分詞器用於長度分桶）
+        self.worker_pool = None
+        self._registry_key = None
+        if num_workers > 0:
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.model = None
+            # 推理工作進程繼承本進程的 CPU 集合，平分本進程的線程數
+            if not threads_per_worker and self.runtime.get("intra_op_threads"):
+                threads_per_worker = max(1, self.runtime["intra_op_threads"] // num_workers)
+            self.worker_pool = EmbeddingWorkerPool(
+                model_config=self._worker_model_config(),
+                num_workers=num_workers,
+                threads_per_worker=threads_per_worker,
+                logger=self.logger
+            )
+            # 分詞器與模型不支援多線程同時推理
+            self._encode_lock = threading.Lock()
+        else:
+            # 同一 (模型, 設備, 精度) 在進程內共用一份模型與推理鎖
+            self._registry_key = self._model_key()
+            (self.tokenizer, self.model), self._encode_lock = get_model_registry().acquire(
+                self._registry_key, self._load_model
+            )
+        
+        # 並發查詢微批次服務
+        self.micro_batcher = None
+        if micro_batch_max_size > 0:
+            self.micro_batcher = MicroBatchEmbeddingService(
+                encode_fn=self._encode_numpy,
+                max_batch_size=micro_batch_max_size,
+                max_wait_ms=micro_batch_max_wait_ms,
+                logger=self.logger
+            )
 
     def _load_model(self):
         """載入 BGE-M3 模型和分詞器"""
@@ -75,39 +169,84 @@ class BGEM3Embeddings:
             self.logger.error(f"Error loading BGE-M3 model: {str(e)}")
             raise
 
+    def _model_key(self) -> tuple:
+        """共享模型註冊表的鍵：(模型名稱, 設備, 精度)"""
+        dtype = "float16" if self.use_fp16 and self.device != "cpu" else "float32"
+        return (self.model_name, self.device, dtype)
+
+    def _worker_model_config(self) -> dict:
+        """工作進程內創建模型所需的參數（工作進程不啟用快取與微批次）"""
+        return {
+            "backend": "torch",
+            "model_name": self.model_name,
+            "device": self.device,
+            "max_length": self.max_length,
+            "batch_size": self.batch_size,
+            "use_fp16": self.use_fp16,
+            "use_inference_mode": self.use_inference_mode,
+            "query_cache_size": 0
+        }
+
     def _mean_pooling(self, model_output, attention_mask):
         """平均池化"""
         token_embeddings = model_output[0]  # First element of model_output contains all token embeddings
         input_mask_expanded = attention_mask.unsqueeze(-1).expand(token_embeddings.size()).float()
         return torch.sum(token_embeddings * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
 
+    def _inference_context(self):
+        """推理上下文：inference_mode 或 no_grad"""
+        return torch.inference_mode() if self.use_inference_mode else torch.no_grad()
+    
     def _encode_texts(self, texts: List[str]) -> torch.Tensor:
         """編碼文本列表"""
-        # 分詞
-        encoded_input = self.tokenizer(
-            texts,
-            padding=True,
-            truncation=True,
-            max_length=self.max_length,
-            return_tensors='pt'
-        )
-
-        # 移動到設備
-        encoded_input = {k: v.to(self.device) for k, v in encoded_input.items()}
-
-        # 前向傳播
-        with torch.no_grad():
-            model_output = self.model(**encoded_input)
-
-        # 平均池化
-        sentence_embeddings = self._mean_pooling(model_output, encoded_input['attention_mask'])
-
-        # 正規化
-        sentence_embeddings = torch.nn.functional.normalize(sentence_embeddings, p=2, dim=1)
+        with self._encode_lock:
+            # 分詞
+            encoded_input = self.tokenizer(
+                texts,
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors='pt'
+            )
+
+            # 移動到設備
+            encoded_input = {k: v.to(self.device) for k, v in encoded_input.items()}
+
+            # 前向傳播
+            with self._inference_context():
+                model_output = self.model(**encoded_input)
+
+        with self._inference_context():
+            # 平均池化
+            sentence_embeddings = self._mean_pooling(model_output, encoded_input['attention_mask'])
+
+            # 正規化
+            sentence_embeddings = torch.nn.functional.normalize(sentence_embeddings, p=2, dim=1)
 
         return sentence_embeddings
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    def _encode_numpy(self, texts: List[str]) -> np.ndarray:
+        """編碼文本列表並返回 float32 NumPy 矩陣"""
+        if self.worker_pool is not None:
+            return self.worker_pool.encode(texts)
+        return self._encode_texts(texts).cpu().numpy()
+
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        """計算每條文本截斷後的 token 數"""
+        if not texts:
+            return []
+        
+        # 分詞器不支援多線程同時使用：導入時分塊線程計數與寫入線程嵌入共用同一分詞器
+        with self._encode_lock:
+            encoded = self.tokenizer(
+                texts,
+                truncation=True,
+                max_length=self.max_length,
+                padding=False
+            )
+        return [len(ids) for ids in encoded['input_ids']]
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
         """
         對文檔列表進行嵌入
 
@@ -115,22 +254,48 @@ class BGEM3Embeddings:
             texts: 文本列表
 
         Returns:
-            嵌入向量列表
+            float32 嵌入矩陣 (len(texts), dim)
         """
         if not texts:
-            return []
+            return np.zeros((0, 0), dtype=np.float32)
 
         try:
             self.logger.debug(f"Embedding {len(texts)} documents")
 
-            # 批次處理
-            all_embeddings = []
-            for i in range(0, len(texts), self.batch_size):
-                batch_texts = texts[i:i + self.batch_size]
+            # 先從文檔快取取出已嵌入的文本塊
+            if self.document_cache is not None:
+                cached = self.document_cache.get_many(texts)
+                missing_indices = [i for i, vector in enumerate(cached) if vector is None]
+                self.logger.debug(
+                    f"Document embedding cache: {len(texts) - len(missing_indices)} hits, "
+                    f"{len(missing_indices)} to embed"
+                )
+            else:
+                cached = [None] * len(texts)
+                missing_indices = list(range(len(texts)))
+
+            missing_texts = [texts[i] for i in missing_indices]
+
+            # 按長度分桶批次處理，最後還原原始順序
+            new_matrix = None
+            for batch_indices in plan_length_buckets(
+                self._count_tokens(missing_texts), self.batch_size, self.max_tokens_per_batch
+            ):
+                batch_texts = [missing_texts[i] for i in batch_indices]
 
                 # 使用 HuggingFace 模型進行嵌入
-                batch_embeddings = self._encode_texts(batch_texts)
-                all_embeddings.extend(batch_embeddings.cpu().numpy().tolist())
+                batch_embeddings = self._encode_numpy(batch_texts)
+                if new_matrix is None:
+                    new_matrix = np.empty((len(missing_texts), batch_embeddings.shape[1]), dtype=np.float32)
+                new_matrix[batch_indices] = batch_embeddings
+
+            if new_matrix is not None:
+                if self.document_cache is not None:
+                    self.document_cache.put_many(missing_texts, new_matrix)
+                for index, vector in zip(missing_indices, new_matrix):
+                    cached[index] = vector
+
+            all_embeddings = np.stack(cached).astype(np.float32, copy=False)
 
             self.logger.debug(f"Successfully embedded {len(texts)} documents")
             return all_embeddings
@@ -139,7 +304,7 @@ class BGEM3Embeddings:
             self.logger.error(f"Error embedding documents: {str(e)}")
             raise
     
-    def embed_query(self, text: str) -> List[float]:
+    def embed_query(self, text: str) -> np.ndarray:
         """
         對查詢文本進行嵌入
 
@@ -147,33 +312,144 @@ class BGEM3Embeddings:
             text: 查詢文本
 
         Returns:
-            嵌入向量
+            float32 嵌入向量 (dim,)
         """
         try:
+            # 檢查查詢快取（返回副本，調用方修改不影響快取）
+            cache_key, cached_embedding = self._lookup_query_cache(text)
+            if cached_embedding is not None:
+                return cached_embedding.copy()
+
             self.logger.debug(f"Embedding query: {text[:100]}...")
 
-            # 使用 HuggingFace 模型進行嵌入
-            embedding = self._encode_texts([text])
+            # 使用 HuggingFace 模型進行嵌入（啟用時與其他並發查詢合併為一批）
+            if self.micro_batcher is not None:
+                embedding = self.micro_batcher.embed_query(text)
+            else:
+                embedding = self._encode_numpy([text])[0]
+
+            if cache_key is not None:
+                self.query_cache.put(cache_key, embedding)
 
-            return embedding[0].cpu().numpy().tolist()
+            return embedding
 
         except Exception as e:
             self.logger.error(f"Error embedding query: {str(e)}")
             raise
     
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """
+        批量嵌入多條查詢文本，快取未命中的查詢合併為一次前向計算
+
+        Args:
+            texts: 查詢文本列表
+
+        Returns:
+            float32 嵌入矩陣 (len(texts), dim)，與輸入順序一致
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        try:
+            lookups = [self._lookup_query_cache(text) for text in texts]
+            missing_indices = [i for i, (_, cached) in enumerate(lookups) if cached is None]
+            embeddings = [cached for _, cached in lookups]
+
+            if missing_indices:
+                self.logger.debug(f"Embedding {len(missing_indices)} queries in one batch")
+                matrix = self._encode_numpy([texts[i] for i in missing_indices])
+                for index, vector in zip(missing_indices, matrix):
+                    cache_key = lookups[index][0]
+                    if cache_key is not None:
+                        self.query_cache.put(cache_key, vector)
+                    embeddings[index] = vector
+
+            return np.stack(embeddings).astype(np.float32, copy=False)
+
+        except Exception as e:
+            self.logger.error(f"Error embedding queries: {str(e)}")
+            raise
+    
+    async def embed_query_async(self, text: str) -> np.ndarray:
+        """
+        非同步嵌入查詢文本，不阻塞事件循環
+
+        Args:
+            text: 查詢文本
+
+        Returns:
+            float32 嵌入向量 (dim,)
+        """
+        cache_key, cached_embedding = self._lookup_query_cache(text)
+        if cached_embedding is not None:
+            return cached_embedding.copy()
+
+        if self.micro_batcher is not None:
+            embedding = await self.micro_batcher.embed_query_async(text)
+            if cache_key is not None:
+                self.query_cache.put(cache_key, embedding)
+            return embedding
+
+        if self.worker_pool is not None:
+            embedding = (await self.worker_pool.encode_async([text]))[0]
+            if cache_key is not None:
+                self.query_cache.put(cache_key, embedding)
+            return embedding
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.embed_query, text)
+    
+    def _lookup_query_cache(self, text: str):
+        """查詢嵌入快取，返回 (快取鍵, 命中的向量或 None)"""
+        if self.query_cache is None:
+            return None, None
+        
+        cache_key = QueryEmbeddingCache.make_key(self.model_name, self.max_length, text)
+        return cache_key, self.query_cache.get(cache_key)
+    
+    def close(self):
+        """釋放背景資源並保存查詢快取"""
+        if self.micro_batcher is not None:
+            self.micro_batcher.close()
+            self.micro_batcher = None
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool = None
+        if self._registry_key is not None:
+            get_model_registry().release(self._registry_key)
+            self._registry_key = None
+            self.model = None
+        if self.query_cache is not None:
+            self.query_cache.save()
+    
     def get_model_info(self) -> dict:
         """獲取模型信息"""
         return {
+            "backend": "torch",
             "model_name": self.model_name,
             "device": self.device,
             "max_length": self.max_length,
             "batch_size": self.batch_size,
+            "max_tokens_per_batch": self.max_tokens_per_batch,
             "use_fp16": self.use_fp16,
-            "embedding_dimension": self.get_embedding_dimension()
+            "use_inference_mode": self.use_inference_mode,
+            "runtime": self.runtime,
+            "embedding_dimension": self.get_embedding_dimension(),
+            "query_cache": self.query_cache.get_stats() if self.query_cache else None,
+            "document_cache": self.document_cache.get_stats() if self.document_cache else None,
+            "micro_batching": self.micro_batcher.get_stats() if self.micro_batcher else None,
+            "shared_model_refcount": get_model_registry().get_refcount(self._registry_key) if self._registry_key else None,
+            "worker_pool": self.worker_pool.get_stats() if self.worker_pool else None
         }
     
+    def get_query_cache_stats(self) -> dict:
+        """獲取查詢嵌入快取統計（含命中率）"""
+        return self.query_cache.get_stats() if self.query_cache else {}
+    
     def get_embedding_dimension(self) -> int:
         """獲取嵌入向量維度"""
+        if self.worker_pool is not None:
+            return self.worker_pool.dimension
         try:
             # 從模型配置獲取維度
             return self.model.config.hidden_size
@@ -187,6 +463,40 @@ class BGEM3Embeddings:
                 return 1024
 
 
+def create_bge_embeddings(backend: str = "torch", **config) -> BGEM3Embeddings:
+    """
+    按後端創建 BGE-M3 嵌入模型
+    
+    Args:
+        backend: torch（PyTorch eager）或 onnx（ONNX Runtime，可選 int8 量化；未安裝 onnxruntime 時退回 torch）
+        **config: 嵌入模型參數；onnx 後端額外支援 onnx_dir、onnx_quantized、onnx_intra_op_threads
+        
+    Returns:
+        嵌入模型實例
+    """
+    onnx_dir = config.pop("onnx_dir", "./models/bge-m3-onnx")
+    onnx_quantized = config.pop("onnx_quantized", True)
+    onnx_intra_op_threads = config.pop("onnx_intra_op_threads", 0)
+    
+    if backend == "onnx":
+        try:
+            from .onnx_embeddings import ONNXBGEM3Embeddings
+            return ONNXBGEM3Embeddings(
+                onnx_dir=onnx_dir,
+                quantized=onnx_quantized,
+                intra_op_threads=onnx_intra_op_threads,
+                **config
+            )
+        except ImportError as e:
+            logger = config.get("logger") or logging.getLogger(__name__)
+            logger.warning(f"ONNX backend unavailable, falling back to torch: {str(e)}")
+            return BGEM3Embeddings(**config)
+    elif backend == "torch":
+        return BGEM3Embeddings(**config)
+    else:
+        raise ValueError(f"Unsupported embedding backend: {backend}")
+
+
 class HybridEmbeddings:
     """混合嵌入模型類，支持 BGE-M3 和 OpenAI 嵌入"""
     
@@ -210,7 +520,7 @@ class HybridEmbeddings:
         # 初始化 BGE-M3
         if bge_config:
             try:
-                self.bge_embeddings = BGEM3Embeddings(**bge_config, logger=logger)
+                self.bge_embeddings = create_bge_embeddings(**bge_config, logger=logger)
                 self.logger.info("BGE-M3 embeddings initialized")
             except Exception as e:
                 self.logger.error(f"Failed to initialize BGE-M3: {str(e)}")
@@ -234,7 +544,7 @@ class HybridEmbeddings:
         else:
             self.openai_embeddings = None
     
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
         """嵌入文檔列表"""
         if self.primary_provider == "huggingface" and self.bge_embeddings:
             try:
@@ -242,12 +552,12 @@ class HybridEmbeddings:
             except Exception as e:
                 self.logger.warning(f"BGE-M3 failed, falling back to OpenAI: {str(e)}")
                 if self.openai_embeddings:
-                    return self.openai_embeddings.embed_documents(texts)
+                    return np.asarray(self.openai_embeddings.embed_documents(texts), dtype=np.float32)
                 raise
         
         elif self.primary_provider == "openai" and self.openai_embeddings:
             try:
-                return self.openai_embeddings.embed_documents(texts)
+                return np.asarray(self.openai_embeddings.embed_documents(texts), dtype=np.float32)
             except Exception as e:
                 self.logger.warning(f"OpenAI failed, falling back to BGE-M3: {str(e)}")
                 if self.bge_embeddings:
@@ -257,7 +567,7 @@ class HybridEmbeddings:
         else:
             raise ValueError("No valid embedding provider available")
     
-    def embed_query(self, text: str) -> List[float]:
+    def embed_query(self, text: str) -> np.ndarray:
         """嵌入查詢文本"""
         if self.primary_provider == "huggingface" and self.bge_embeddings:
             try:
@@ -265,12 +575,12 @@ class HybridEmbeddings:
             except Exception as e:
                 self.logger.warning(f"BGE-M3 failed, falling back to OpenAI: {str(e)}")
                 if self.openai_embeddings:
-                    return self.openai_embeddings.embed_query(text)
+                    return np.asarray(self.openai_embeddings.embed_query(text), dtype=np.float32)
                 raise
         
         elif self.primary_provider == "openai" and self.openai_embeddings:
             try:
-                return self.openai_embeddings.embed_query(text)
+                return np.asarray(self.openai_embeddings.embed_query(text), dtype=np.float32)
             except Exception as e:
                 self.logger.warning(f"OpenAI failed, falling back to BGE-M3: {str(e)}")
                 if self.bge_embeddings:
@@ -280,6 +590,46 @@ class HybridEmbeddings:
         else:
             raise ValueError("No valid embedding provider available")
     
+    def embed_queries(self, texts: List[str]) -> np.ndarray:
+        """批量嵌入多條查詢文本"""
+        if self.primary_provider == "huggingface" and self.bge_embeddings:
+            try:
+                return self.bge_embeddings.embed_queries(texts)
+            except Exception as e:
+                self.logger.warning(f"BGE-M3 failed, falling back to OpenAI: {str(e)}")
+                if self.openai_embeddings:
+                    return np.asarray(self.openai_embeddings.embed_documents(texts), dtype=np.float32)
+                raise
+
+        elif self.primary_provider == "openai" and self.openai_embeddings:
+            try:
+                # OpenAI 查詢與文檔使用同一嵌入，embed_documents 本身即為批量請求
+                return np.asarray(self.openai_embeddings.embed_documents(texts), dtype=np.float32)
+            except Exception as e:
+                self.logger.warning(f"OpenAI failed, falling back to BGE-M3: {str(e)}")
+                if self.bge_embeddings:
+                    return self.bge_embeddings.embed_queries(texts)
+                raise
+
+        else:
+            raise ValueError("No valid embedding provider available")
+    
+    async def embed_query_async(self, text: str) -> np.ndarray:
+        """非同步嵌入查詢文本，推理不在事件循環線程上執行"""
+        loop = asyncio.get_running_loop()
+        
+        if self.primary_provider == "huggingface" and self.bge_embeddings:
+            try:
+                return await self.bge_embeddings.embed_query_async(text)
+            except Exception as e:
+                self.logger.warning(f"BGE-M3 failed, falling back to OpenAI: {str(e)}")
+                if self.openai_embeddings:
+                    embedding = await loop.run_in_executor(None, self.openai_embeddings.embed_query, text)
+                    return np.asarray(embedding, dtype=np.float32)
+                raise
+        
+        return await loop.run_in_executor(None, self.embed_query, text)
+    
     def get_current_provider(self) -> str:
         """獲取當前使用的提供商"""
         return self.primary_provider
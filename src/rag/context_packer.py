@@ -0,0 +1,246 @@
+"""
+上下文組裝
+合併位置重疊或相鄰的文本塊、去除重複片段、按相關度排序，並按生成模型的 token 預算打包
+"""
+
+import logging
+import math
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+from .embedding_cache import normalize_text
+
+
+_CJK = re.compile(r"[㐀-鿿豈-﫿　-〿＀-￯]")
+_SENTENCE_END = re.compile(r"[。！？；!?;\n]")
+
+# 文本比對確認重疊時，重疊片段的最短長度（過短的重疊可能只是巧合）
+_MIN_TEXT_OVERLAP = 8
+
+
+def estimate_tokens(text: str) -> int:
+    """無分詞器時估算 token 數：中日韓字元與全形標點各計 1，其他字元每 4 個計 1"""
+    cjk = len(_CJK.findall(text))
+    other = len(text) - cjk - text.count(" ")
+    return cjk + math.ceil(max(other, 0) / 4)
+
+
+def get_token_counter(model: Optional[str] = None) -> Callable[[List[str]], List[int]]:
+    """
+    取得生成模型的批量 token 計數函數
+    
+    Args:
+        model: 模型名稱（如 gpt-4o），tiktoken 可用時使用該模型的編碼
+    
+    Returns:
+        計數函數，輸入文本列表返回 token 數列表
+    """
+    if TIKTOKEN_AVAILABLE:
+        try:
+            encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("o200k_base")
+        except (KeyError, ValueError):
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda texts: [len(tokens) for tokens in encoding.encode_batch(texts, disallowed_special=())]
+    return lambda texts: [estimate_tokens(text) for text in texts]
+
+
+def _text_overlap(left: str, right: str, max_overlap: int) -> int:
+    """left 的結尾與 right 的開頭相同的最長長度（不足最短長度時返回 0）"""
+    limit = min(len(left), len(right), max_overlap)
+    for length in range(limit, _MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+class _Block:
+    """合併後的上下文片段"""
+    
+    __slots__ = ("text", "source", "start", "end", "rank", "score", "ids")
+    
+    def __init__(self, result: Dict[str, Any], rank: int):
+        metadata = result.get("metadata") or {}
+        self.text = (result.get("content") or "").strip()
+        self.source = metadata.get("source", "")
+        self.start = metadata.get("start_pos")
+        self.end = metadata.get("end_pos")
+        self.rank = rank
+        self.score = result.get("score")
+        self.ids = [result.get("id")]
+    
+    @property
+    def has_span(self) -> bool:
+        return isinstance(self.start, int) and isinstance(self.end, int)
+    
+    def absorb(self, other: "_Block", overlap: int, separator: str = ""):
+        """把位置在後的片段接到本片段結尾"""
+        self.text = self.text + separator + other.text[overlap:]
+        self.end = max(self.end, other.end)
+        self.rank = min(self.rank, other.rank)
+        if other.score is not None and (self.score is None or other.score > self.score):
+            self.score = other.score
+        self.ids.extend(other.ids)
+
+
+class ContextPacker:
+    """按 token 預算組裝檢索上下文"""
+    
+    def __init__(self,
+                 max_tokens: int = 3000,
+                 model: Optional[str] = None,
+                 count_tokens: Optional[Callable[[List[str]], List[int]]] = None,
+                 separator: str = "\n\n",
+                 min_fragment_tokens: int = 80,
+                 logger=None):
+        """
+        初始化上下文組裝器
+        
+        Args:
+            max_tokens: 上下文 token 預算
+            model: 生成模型名稱，用於選擇分詞器
+            count_tokens: 自訂批量 token 計數函數，默認依 model 選擇
+            separator: 片段之間的分隔符
+            min_fragment_tokens: 預算剩餘不少於此數時，放不下的片段在句末截斷後放入
+            logger: 日誌記錄器
+        """
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens or get_token_counter(model)
+        self.separator = separator
+        self.min_fragment_tokens = min_fragment_tokens
+        self.logger = logger or logging.getLogger(__name__)
+    
+    def pack(self, results: List[Dict[str, Any]], max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        組裝上下文
+        
+        Args:
+            results: 檢索結果（按相關度排序，含 content、metadata、score、id）
+            max_tokens: 本次的 token 預算，默認使用初始化時的設定
+        
+        Returns:
+            {'context': 上下文字符串, 'documents': 片段列表, 'tokens': token 數,
+             'merged': 合併掉的文本塊數, 'duplicates': 去除的重複片段數, 'dropped': 超出預算未放入的片段數}
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        blocks = [_Block(result, rank) for rank, result in enumerate(results) if (result.get("content") or "").strip()]
+        
+        merged_blocks = self._merge_spans(blocks)
+        unique_blocks = self._drop_duplicates(merged_blocks)
+        unique_blocks.sort(key=lambda block: block.rank)
+        
+        documents, tokens, dropped = self._fit_budget([block.text for block in unique_blocks], budget)
+        stats = {
+            "context": self.separator.join(documents),
+            "documents": documents,
+            "tokens": tokens,
+            "merged": len(blocks) - len(merged_blocks),
+            "duplicates": len(merged_blocks) - len(unique_blocks),
+            "dropped": dropped
+        }
+        self.logger.debug(
+            f"Packed {len(results)} chunks into {len(documents)} blocks, {tokens}/{budget} tokens "
+            f"(merged {stats['merged']}, duplicates {stats['duplicates']}, dropped {dropped})"
+        )
+        return stats
+    
+    def _merge_spans(self, blocks: List[_Block]) -> List[_Block]:
+        """
+        合併同一來源中位置重疊或相鄰的文本塊
+        
+        位置元數據可能已過期（內容未變的文本塊沿用舊位置），聲稱重疊的文本塊須以文本確認；
+        文本不重疊時保留為獨立片段。
+        """
+        spanned: Dict[Any, List[_Block]] = {}
+        merged: List[_Block] = []
+        for block in blocks:
+            if block.has_span:
+                spanned.setdefault(block.source, []).append(block)
+            else:
+                merged.append(block)
+        
+        for group in spanned.values():
+            group.sort(key=lambda block: (block.start, block.end))
+            current = group[0]
+            for block in group[1:]:
+                if block.start < current.end:
+                    overlap = _text_overlap(current.text, block.text, current.end - block.start + _MIN_TEXT_OVERLAP)
+                    if overlap:
+                        current.absorb(block, overlap)
+                        continue
+                    if block.text in current.text:
+                        current.absorb(block, len(block.text))
+                        continue
+                elif block.start == current.end:
+                    current.absorb(block, 0, "\n")
+                    continue
+                merged.append(current)
+                current = block
+            merged.append(current)
+        
+        return merged
+    
+    @staticmethod
+    def _drop_duplicates(blocks: List[_Block]) -> List[_Block]:
+        """去除內容相同或被其他片段完整包含的片段（保留較長者，排名取較前者）"""
+        ordered = sorted(blocks, key=lambda block: len(block.text), reverse=True)
+        kept: List[_Block] = []
+        normalized: List[str] = []
+        for block in ordered:
+            text = normalize_text(block.text)
+            container = next((i for i, other in enumerate(normalized) if text in other), None)
+            if container is None:
+                kept.append(block)
+                normalized.append(text)
+            else:
+                kept[container].rank = min(kept[container].rank, block.rank)
+        return kept
+    
+    def _fit_budget(self, texts: List[str], budget: int):
+        """按順序放入片段直到預算用完；放不下但剩餘預算足夠時在句末截斷後放入"""
+        if not texts:
+            return [], 0, 0
+        
+        separator_tokens = self.count_tokens([self.separator])[0]
+        counts = self.count_tokens(texts)
+        documents: List[str] = []
+        used = 0
+        
+        for index, (text, count) in enumerate(zip(texts, counts)):
+            cost = count + (separator_tokens if documents else 0)
+            if used + cost <= budget:
+                documents.append(text)
+                used += cost
+                continue
+            
+            dropped = len(texts) - index
+            separator_cost = separator_tokens if documents else 0
+            remaining = budget - used - separator_cost
+            if remaining >= self.min_fragment_tokens:
+                fragment = self._truncate(text, count, remaining)
+                if fragment:
+                    documents.append(fragment)
+                    used += self.count_tokens([fragment])[0] + separator_cost
+                    dropped -= 1
+            return documents, used, dropped
+        
+        return documents, used, 0
+    
+    def _truncate(self, text: str, count: int, budget: int) -> str:
+        """把文本截斷到預算內，切在最後一個句末標點"""
+        length = int(len(text) * budget / max(count, 1))
+        while length > 0:
+            cut = text[:length]
+            ends = [match.end() for match in _SENTENCE_END.finditer(cut)]
+            if ends:
+                cut = cut[:ends[-1]]
+            cut = cut.strip()
+            if cut and self.count_tokens([cut])[0] <= budget:
+                return cut
+            length = int(length * 0.9)
+        return ""
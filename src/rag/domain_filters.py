@@ -0,0 +1,59 @@
+"""
+領域過濾條件
+把分析領域映射到文本塊的 content_type 分類，作為向量檢索的 where 條件下推到索引
+"""
+
+from typing import Any, Dict, List, Optional
+
+
+# 導入時由 classify_content / classify_chunk 標註的內容分類
+STAR_ANALYSIS = "主星解析"
+PALACE_ANALYSIS = "宮位解析"
+PATTERN_ANALYSIS = "格局分析"
+FORTUNE_ANALYSIS = "運勢分析"
+BASIC_THEORY = "基礎理論"
+# 未符合以上任何分類的文本塊：classify_content 標為「一般內容」，classify_chunk 標為 general
+GENERAL_CONTENT = "一般內容"
+GENERAL_CONTENT_EN = "general"
+GENERAL_TYPES = (GENERAL_CONTENT, GENERAL_CONTENT_EN)
+
+CONTENT_TYPES = (STAR_ANALYSIS, PALACE_ANALYSIS, PATTERN_ANALYSIS, FORTUNE_ANALYSIS, BASIC_THEORY) + GENERAL_TYPES
+
+# 分析領域 → 檢索的內容分類；None 表示不過濾
+# 每個領域都包含通用分類：這些文本塊沒有可判定的分類，排除它們會使其在任何領域過濾下都無法被檢索到
+DOMAIN_CATEGORIES: Dict[str, Optional[List[str]]] = {
+    # 命盤分析領域（main.py 的 domain_type）
+    "love": [PALACE_ANALYSIS, STAR_ANALYSIS, *GENERAL_TYPES],
+    "wealth": [PALACE_ANALYSIS, STAR_ANALYSIS, PATTERN_ANALYSIS, *GENERAL_TYPES],
+    "future": [FORTUNE_ANALYSIS, PATTERN_ANALYSIS, *GENERAL_TYPES],
+    "comprehensive": None,
+    # MCP 工具的 domain_filter
+    "stars": [STAR_ANALYSIS, *GENERAL_TYPES],
+    "palaces": [PALACE_ANALYSIS, *GENERAL_TYPES],
+    "theory": [BASIC_THEORY, PATTERN_ANALYSIS, *GENERAL_TYPES],
+    "interpretation": [FORTUNE_ANALYSIS, PATTERN_ANALYSIS, *GENERAL_TYPES],
+    "all": None
+}
+
+
+def domain_filter(domain: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    生成領域的元數據過濾條件
+    
+    Args:
+        domain: 分析領域（love / wealth / future / stars / palaces 等）
+    
+    Returns:
+        ChromaDB 風格的 where 條件，不過濾時返回 None
+    """
+    if domain is None:
+        return None
+    if domain not in DOMAIN_CATEGORIES:
+        raise ValueError(f"Unknown domain: {domain}")
+    
+    categories = DOMAIN_CATEGORIES[domain]
+    if not categories:
+        return None
+    if len(categories) == 1:
+        return {"content_type": categories[0]}
+    return {"content_type": {"$in": list(categories)}}
@@ -0,0 +1,308 @@
+"""
+嵌入向量快取
+避免對重複文本重新執行 BGE-M3 前向傳播
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """正規化查詢文本（全半形統一、合併空白）"""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+
+class QueryEmbeddingCache:
+    """查詢嵌入 LRU 快取"""
+    
+    def __init__(self,
+                 max_size: int = 1024,
+                 persist_path: Optional[str] = None,
+                 logger=None):
+        """
+        初始化查詢嵌入快取
+        
+        Args:
+            max_size: 最大快取條目數
+            persist_path: 持久化檔案路徑（.npz），None 表示只保存在記憶體
+            logger: 日誌記錄器
+        """
+        self.max_size = max_size
+        self.persist_path = Path(persist_path) if persist_path else None
+        self.logger = logger or logging.getLogger(__name__)
+        
+        self._entries: "OrderedDict[Tuple[str, int, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        
+        # 命中統計
+        self.hits = 0
+        self.misses = 0
+        
+        if self.persist_path:
+            self.load()
+            atexit.register(self.save)
+    
+    @staticmethod
+    def make_key(model_name: str, max_length: int, text: str) -> Tuple[str, int, str]:
+        """生成快取鍵"""
+        return (model_name, max_length, normalize_text(text))
+    
+    def get(self, key: Tuple[str, int, str]) -> Optional[np.ndarray]:
+        """獲取快取向量"""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+    
+    def put(self, key: Tuple[str, int, str], vector: np.ndarray):
+        """設置快取向量（保存副本，調用方之後修改原向量不影響快取）"""
+        with self._lock:
+            self._entries[key] = np.array(vector, dtype=np.float32, copy=True)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._dirty = True
+    
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self._dirty = True
+    
+    def load(self):
+        """從磁盤載入快取"""
+        if not self.persist_path or not self.persist_path.exists():
+            return
+        
+        try:
+            with np.load(self.persist_path) as data:
+                keys = json.loads(str(data["keys"]))
+                vectors = data["vectors"]
+            
+            with self._lock:
+                for (model_name, max_length, text), vector in zip(keys, vectors):
+                    self._entries[(model_name, int(max_length), text)] = vector.astype(np.float32)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            
+            self.logger.info(f"Loaded {len(self._entries)} cached query embeddings from {self.persist_path}")
+        except Exception as e:
+            self.logger.warning(f"Failed to load query embedding cache: {e}")
+    
+    def save(self):
+        """保存快取到磁盤"""
+        if not self.persist_path or not self._dirty:
+            return
+        
+        try:
+            with self._lock:
+                keys = list(self._entries.keys())
+                vectors = list(self._entries.values())
+                self._dirty = False
+            
+            self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+            matrix = np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+            tmp_path = self.persist_path.with_name(self.persist_path.name + ".tmp.npz")
+            np.savez(tmp_path, keys=np.array(json.dumps(keys, ensure_ascii=False)), vectors=matrix)
+            tmp_path.replace(self.persist_path)
+            
+            self.logger.debug(f"Saved {len(keys)} query embeddings to {self.persist_path}")
+        except Exception as e:
+            self.logger.warning(f"Failed to save query embedding cache: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取快取統計"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "persist_path": str(self.persist_path) if self.persist_path else None
+        }
+
+
+class DocumentEmbeddingCache:
+    """文檔嵌入持久化快取（以內容哈希為鍵）"""
+    
+    VECTORS_FILE = "vectors.f16"
+    INDEX_FILE = "index.json"
+    
+    def __init__(self,
+                 cache_dir: str,
+                 model_id: str,
+                 logger=None):
+        """
+        初始化文檔嵌入快取
+        
+        向量以 float16 矩陣追加寫入單一檔案並以 np.memmap 讀取，
+        索引檔記錄 sha256(文本) 到矩陣行號的對應。
+        
+        Args:
+            cache_dir: 快取根目錄
+            model_id: 模型標識（模型名稱與截斷長度），不同模型使用不同子目錄
+            logger: 日誌記錄器
+        """
+        self.model_id = model_id
+        self.logger = logger or logging.getLogger(__name__)
+        
+        safe_model_id = hashlib.sha256(model_id.encode("utf-8")).hexdigest()[:16]
+        self.cache_dir = Path(cache_dir) / safe_model_id
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.cache_dir / self.VECTORS_FILE
+        self.index_path = self.cache_dir / self.INDEX_FILE
+        
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._dimension: Optional[int] = None
+        self._count = 0
+        self._matrix: Optional[np.ndarray] = None
+        
+        # 命中統計
+        self.hits = 0
+        self.misses = 0
+        
+        self._load_index()
+    
+    @staticmethod
+    def content_key(text: str) -> str:
+        """計算文本內容哈希"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    def _load_index(self):
+        """載入索引與向量矩陣"""
+        if not self.index_path.exists():
+            return
+        
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            
+            if index.get("model_id") != self.model_id:
+                self.logger.warning(f"Embedding cache at {self.cache_dir} belongs to another model, ignoring")
+                return
+            
+            self._rows = index["rows"]
+            self._dimension = index["dimension"]
+            self._count = index["count"]
+            self._open_matrix()
+            
+            self.logger.info(f"Loaded document embedding cache with {self._count} vectors")
+        except Exception as e:
+            self.logger.warning(f"Failed to load document embedding cache: {e}")
+            self._rows, self._dimension, self._count, self._matrix = {}, None, 0, None
+    
+    def _open_matrix(self):
+        """以唯讀記憶體映射開啟向量矩陣"""
+        if self._count and self._dimension:
+            self._matrix = np.memmap(
+                self.vectors_path, dtype=np.float16, mode='r',
+                shape=(self._count, self._dimension)
+            )
+        else:
+            self._matrix = None
+    
+    def _save_index(self):
+        """寫入索引檔"""
+        index = {
+            "model_id": self.model_id,
+            "dimension": self._dimension,
+            "count": self._count,
+            "rows": self._rows
+        }
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        tmp_path.replace(self.index_path)
+    
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查詢快取向量，未命中的位置為 None"""
+        results: List[Optional[np.ndarray]] = []
+        with self._lock:
+            if self._matrix is None:
+                # 寫入失敗後映射已關閉，重新開啟
+                self._open_matrix()
+            for text in texts:
+                row = self._rows.get(self.content_key(text))
+                if row is None or self._matrix is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    results.append(np.asarray(self._matrix[row], dtype=np.float32))
+        return results
+    
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """批量寫入新向量"""
+        vectors = np.asarray(vectors, dtype=np.float16)
+        if len(texts) == 0:
+            return
+        
+        with self._lock:
+            dimension = self._dimension if self._dimension is not None else int(vectors.shape[1])
+            if vectors.shape[1] != dimension:
+                raise ValueError(
+                    f"Embedding dimension mismatch: expected {dimension}, got {vectors.shape[1]}"
+                )
+            
+            # 先在本地計算新行號，向量寫入檔案後才更新索引狀態
+            new_keys: Dict[str, int] = {}
+            new_rows = []
+            for text, vector in zip(texts, vectors):
+                key = self.content_key(text)
+                if key in self._rows or key in new_keys:
+                    continue
+                new_keys[key] = self._count + len(new_rows)
+                new_rows.append(vector)
+            
+            if not new_rows:
+                return
+            
+            # 關閉舊映射後追加寫入（先截斷上次中斷寫入留下的殘餘資料）
+            self._matrix = None
+            offset = self._count * dimension * np.dtype(np.float16).itemsize
+            with open(self.vectors_path, 'r+b' if self.vectors_path.exists() else 'wb') as f:
+                f.seek(offset)
+                f.truncate()
+                f.write(np.stack(new_rows).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            
+            self._dimension = dimension
+            self._rows.update(new_keys)
+            self._count += len(new_rows)
+            
+            self._save_index()
+            self._open_matrix()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取快取統計"""
+        total = self.hits + self.misses
+        return {
+            "size": self._count,
+            "dimension": self._dimension,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "cache_dir": str(self.cache_dir)
+        }
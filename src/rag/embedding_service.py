@@ -0,0 +1,184 @@
+"""
+嵌入批次處理
+按長度分桶規劃文檔批次，並將並發的查詢嵌入請求合併為單一批次前向傳播
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def plan_length_buckets(lengths: List[int],
+                        batch_size: int,
+                        max_tokens_per_batch: int = 0) -> List[List[int]]:
+    """
+    按長度分桶規劃批次
+    
+    依 token 數排序後把長度相近的文本放在同一批，減少填充浪費。
+    設定 max_tokens_per_batch 時以「批次大小 × 批內最長長度」的 token 預算決定批次大小，
+    否則每批固定 batch_size 條。
+    
+    Args:
+        lengths: 每條文本的 token 數
+        batch_size: 固定批次大小（未設定 token 預算時使用）
+        max_tokens_per_batch: 每批最大 token 數（含填充），0 表示停用
+    
+    Returns:
+        批次列表，每個批次是原始索引列表
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches: List[List[int]] = []
+    current: List[int] = []
+    
+    for index in order:
+        if current:
+            if max_tokens_per_batch > 0:
+                # 已排序，當前文本即為批內最長
+                full = (len(current) + 1) * lengths[index] > max_tokens_per_batch
+            else:
+                full = len(current) >= batch_size
+            if full:
+                batches.append(current)
+                current = []
+        current.append(index)
+    
+    if current:
+        batches.append(current)
+    
+    return batches
+
+
+class MicroBatchEmbeddingService:
+    """查詢嵌入微批次服務"""
+    
+    def __init__(self,
+                 encode_fn: Callable[[List[str]], np.ndarray],
+                 max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0,
+                 logger=None):
+        """
+        初始化微批次服務
+        
+        Args:
+            encode_fn: 批次編碼函數，輸入文本列表，返回 (n, dim) 向量矩陣
+            max_batch_size: 每批最大請求數
+            max_wait_ms: 收到第一個請求後最多等待多少毫秒收集更多請求
+            logger: 日誌記錄器
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.logger = logger or logging.getLogger(__name__)
+        
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._closed = False
+        # 保護 _closed 與入隊：關閉信號之後不會再有請求入隊
+        self._close_lock = threading.Lock()
+        
+        # 批次統計
+        self.batch_count = 0
+        self.request_count = 0
+        self.max_observed_batch = 0
+        
+        self._worker = threading.Thread(
+            target=self._run,
+            name="embedding-micro-batcher",
+            daemon=True
+        )
+        self._worker.start()
+    
+    def submit(self, text: str) -> Future:
+        """提交查詢文本，返回向量的 Future"""
+        future: Future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("MicroBatchEmbeddingService is closed")
+            self._queue.put((text, future))
+        return future
+    
+    def embed_query(self, text: str) -> np.ndarray:
+        """同步嵌入查詢（阻塞直到所在批次完成）"""
+        return self.submit(text).result()
+    
+    async def embed_query_async(self, text: str) -> np.ndarray:
+        """非同步嵌入查詢"""
+        return await asyncio.wrap_future(self.submit(text))
+    
+    def _collect_batch(self, first_item: tuple) -> List[tuple]:
+        """收集一個批次的請求"""
+        batch = [first_item]
+        deadline = time.monotonic() + self.max_wait
+        
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # 關閉信號留給主循環處理
+                self._queue.put(None)
+                break
+            batch.append(item)
+        
+        return batch
+    
+    def _run(self):
+        """工作線程主循環"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            
+            # 標記為執行中：已取消的請求直接跳過，其餘的之後無法再被取消，設置結果不會與取消競爭
+            batch = [
+                (text, future) for text, future in self._collect_batch(item)
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            
+            # 同一批次內相同文本只編碼一次
+            unique_texts = list(dict.fromkeys(text for text, _ in batch))
+            
+            try:
+                vectors = self.encode_fn(unique_texts)
+                by_text = dict(zip(unique_texts, vectors))
+                for text, future in batch:
+                    future.set_result(by_text[text])
+            except Exception as e:
+                self.logger.error(f"Micro-batch embedding failed: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+            
+            self.batch_count += 1
+            self.request_count += len(batch)
+            self.max_observed_batch = max(self.max_observed_batch, len(batch))
+    
+    def close(self):
+        """停止工作線程"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join(timeout=5.0)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取批次統計"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batch_count,
+            "requests": self.request_count,
+            "avg_batch_size": self.request_count / self.batch_count if self.batch_count else 0.0,
+            "max_observed_batch": self.max_observed_batch
+        }
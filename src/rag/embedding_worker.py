@@ -0,0 +1,178 @@
+"""
+嵌入工作進程池
+在獨立進程中執行嵌入推理，向量經由共享記憶體傳回，避免阻塞事件循環
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .torch_runtime import available_cpus
+
+
+# 工作進程內的模型實例（每個進程各自持有一份）
+_worker_model = None
+
+
+def _default_model_factory(**config):
+    """默認模型工廠：按後端創建 BGE-M3 嵌入模型"""
+    from .bge_embeddings import create_bge_embeddings
+    return create_bge_embeddings(**config)
+
+
+def _worker_init(model_factory: Optional[Callable], model_config: Dict[str, Any], num_threads: int):
+    """工作進程初始化：限制線程數並載入模型"""
+    global _worker_model
+    
+    if num_threads > 0:
+        try:
+            import torch
+            torch.set_num_threads(num_threads)
+        except ImportError:
+            pass
+    
+    factory = model_factory or _default_model_factory
+    _worker_model = factory(**model_config)
+
+
+def _worker_dimension() -> int:
+    """返回工作進程內模型的嵌入維度"""
+    return int(_worker_model._encode_numpy(["紫微斗數"]).shape[1])
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """附加到父進程建立的共享記憶體，生命週期由父進程管理"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前附加也會註冊到資源追蹤器；spawn 子進程與父進程共用同一追蹤器，
+        # 重複註冊無副作用，由父進程 unlink 時統一取消
+        return shared_memory.SharedMemory(name=name)
+
+
+def _worker_encode(texts: List[str], shm_name: str) -> Tuple[int, int]:
+    """在工作進程中編碼文本，結果寫入共享記憶體並返回矩陣形狀"""
+    vectors = np.ascontiguousarray(_worker_model._encode_numpy(texts), dtype=np.float32)
+    
+    shm = _attach_shared_memory(shm_name)
+    try:
+        output = np.ndarray(vectors.shape, dtype=np.float32, buffer=shm.buf)
+        output[:] = vectors
+        del output
+    finally:
+        shm.close()
+    
+    return vectors.shape
+
+
+class EmbeddingWorkerPool:
+    """嵌入工作進程池"""
+    
+    def __init__(self,
+                 model_config: Dict[str, Any],
+                 num_workers: int = 1,
+                 threads_per_worker: int = 0,
+                 model_factory: Optional[Callable] = None,
+                 logger=None):
+        """
+        初始化工作進程池
+        
+        每個工作進程各自載入一份模型；父進程為每個請求配置共享記憶體輸出緩衝區，
+        工作進程直接把向量寫入其中，只回傳矩陣形狀，省去向量的序列化開銷。
+        
+        Args:
+            model_config: 傳給模型工廠的參數
+            num_workers: 工作進程數
+            threads_per_worker: 每個工作進程的 torch 線程數，0 表示平分本進程可用的 CPU 核心（工作進程繼承本進程的 CPU 綁定）
+            model_factory: 模型工廠（需可被 pickle 的模組級函數），默認為 create_bge_embeddings
+            logger: 日誌記錄器
+        """
+        self.model_config = dict(model_config)
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = threads_per_worker or max(1, len(available_cpus()) // self.num_workers)
+        self.logger = logger or logging.getLogger(__name__)
+        
+        # 使用 spawn，避免 fork 已初始化 torch 線程池的父進程
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_worker_init,
+            initargs=(model_factory, self.model_config, self.threads_per_worker)
+        )
+        
+        # 請求統計
+        self.request_count = 0
+        self.text_count = 0
+        
+        self.logger.info(
+            f"Starting embedding worker pool: {self.num_workers} workers, "
+            f"{self.threads_per_worker} threads each"
+        )
+        self.dimension = self._executor.submit(_worker_dimension).result()
+    
+    def _submit(self, texts: List[str]) -> Tuple[Future, shared_memory.SharedMemory]:
+        """配置輸出緩衝區並提交編碼任務"""
+        if self._executor is None:
+            raise RuntimeError("EmbeddingWorkerPool is closed")
+        
+        size = max(1, len(texts) * self.dimension * np.dtype(np.float32).itemsize)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            future = self._executor.submit(_worker_encode, list(texts), shm.name)
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+        
+        self.request_count += 1
+        self.text_count += len(texts)
+        return future, shm
+    
+    @staticmethod
+    def _collect(shape: Tuple[int, int], shm: shared_memory.SharedMemory) -> np.ndarray:
+        """從共享記憶體複製結果"""
+        return np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+    
+    @staticmethod
+    def _release(shm: shared_memory.SharedMemory):
+        """釋放共享記憶體"""
+        shm.close()
+        shm.unlink()
+    
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """同步編碼文本列表，返回 (n, dim) float32 矩陣"""
+        future, shm = self._submit(texts)
+        try:
+            return self._collect(future.result(), shm)
+        finally:
+            self._release(shm)
+    
+    async def encode_async(self, texts: List[str]) -> np.ndarray:
+        """非同步編碼文本列表，等待期間不佔用事件循環"""
+        future, shm = self._submit(texts)
+        try:
+            shape = await asyncio.wrap_future(future)
+            return self._collect(shape, shm)
+        finally:
+            self._release(shm)
+    
+    def close(self):
+        """關閉工作進程"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取進程池統計"""
+        return {
+            "num_workers": self.num_workers,
+            "threads_per_worker": self.threads_per_worker,
+            "dimension": self.dimension,
+            "requests": self.request_count,
+            "texts": self.text_count
+        }
@@ -10,6 +10,8 @@ import openai
 from openai import OpenAI
 import json
 
+from .score_filters import passes_min_score
+
 
 class GPT4oGenerator:
     """GPT-4o 輸出生成器類"""
@@ -256,6 +258,7 @@ class RAGResponseGenerator:
     def __init__(self, 
                  vector_store,
                  generator: GPT4oGenerator,
+                 context_packer=None,
                  logger=None):
         """
         初始化 RAG 回應生成器
@@ -263,16 +266,20 @@ class RAGResponseGenerator:
         Args:
             vector_store: 向量存儲
             generator: GPT-4o 生成器
+            context_packer: 上下文組裝器（ContextPacker），合併重疊文本塊並限制 token 數
             logger: 日誌記錄器
         """
         self.vector_store = vector_store
         self.generator = generator
+        self.context_packer = context_packer
         self.logger = logger or logging.getLogger(__name__)
     
     def generate_rag_response(self, 
                              query: str,
                              top_k: int = 5,
                              min_score: float = 0.7,
+                             filter_metadata: Optional[Dict[str, Any]] = None,
+                             rerank_min_score: float = 0.0,
                              **kwargs) -> Dict[str, Any]:
         """
         生成 RAG 回應
@@ -281,6 +288,8 @@ class RAGResponseGenerator:
             query: 用戶查詢
             top_k: 檢索文檔數量
             min_score: 最小相似度分數
+            filter_metadata: 元數據過濾條件（在索引內過濾）
+            rerank_min_score: 經交叉編碼器重排序的結果的最小重排序分數
             **kwargs: 其他參數
             
         Returns:
@@ -288,15 +297,22 @@ class RAGResponseGenerator:
         """
         try:
             # 檢索相關文檔
-            search_results = self.vector_store.search(query, top_k)
+            search_results = self.vector_store.search(query, top_k, filter_metadata)
             
-            # 過濾低分文檔
-            relevant_docs = [
-                result["content"] 
-                for result in search_results 
-                if result["score"] >= min_score
+            # 過濾低分文檔（與知識庫搜索相同：保留詞法排名靠前的結果，重排序結果以重排序分數判斷）
+            relevant_results = [
+                result for result in search_results
+                if passes_min_score(result, min_score, top_k, rerank_min_score)
             ]
             
+            # 合併重疊文本塊、去重並按 token 預算截斷
+            if self.context_packer:
+                packed = self.context_packer.pack(relevant_results)
+                relevant_docs = packed["documents"]
+            else:
+                packed = None
+                relevant_docs = [result["content"] for result in relevant_results]
+            
             # 生成回答
             response = self.generator.generate_response(
                 query=query,
@@ -309,6 +325,7 @@ class RAGResponseGenerator:
                 "total_retrieved": len(search_results),
                 "relevant_docs": len(relevant_docs),
                 "min_score": min_score,
+                "context_tokens": packed["tokens"] if packed else None,
                 "search_results": search_results
             }
             
@@ -0,0 +1,433 @@
+"""
+串流式 PDF 導入管線
+頁面在進程池中並行提取，增量分塊後按 token 預算分批嵌入並寫入向量庫；
+每批提交後保存檢查點，中斷後從最後提交的位置續傳
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .text_chunker import StreamingTextChunker, content_chunk_id
+
+
+def _open_pdf(pdf_path: str):
+    """開啟 PDF，返回 (頁數, 按頁碼提取文本的函數, 關閉函數)"""
+    try:
+        import PyPDF2 as pypdf
+    except ImportError:
+        try:
+            import pypdf
+        except ImportError:
+            pypdf = None
+    
+    if pypdf is not None:
+        file = open(pdf_path, 'rb')
+        reader = pypdf.PdfReader(file)
+        return len(reader.pages), lambda i: reader.pages[i].extract_text() or "", file.close
+    
+    try:
+        import pdfplumber
+    except ImportError:
+        raise ImportError("請安裝 PDF 處理庫: pip install PyPDF2 或 pip install pdfplumber")
+    
+    pdf = pdfplumber.open(pdf_path)
+    return len(pdf.pages), lambda i: pdf.pages[i].extract_text() or "", pdf.close
+
+
+def count_pdf_pages(pdf_path: str) -> int:
+    """返回 PDF 總頁數"""
+    total_pages, _, close = _open_pdf(pdf_path)
+    close()
+    return total_pages
+
+
+def _extract_page_range(pdf_path: str, first_page: int, last_page: int) -> List[Tuple[int, str]]:
+    """提取頁碼範圍 [first_page, last_page] 的文本（頁碼從 1 起算，在工作進程中執行）"""
+    _, extract, close = _open_pdf(pdf_path)
+    try:
+        return [(page_num, extract(page_num - 1)) for page_num in range(first_page, last_page + 1)]
+    finally:
+        close()
+
+
+def iter_pdf_pages(pdf_path: str,
+                   start_page: int = 1,
+                   num_workers: int = 0,
+                   pages_per_task: int = 8,
+                   logger=None) -> Iterator[Tuple[int, str]]:
+    """
+    按頁碼順序逐頁產生 PDF 文本
+    
+    num_workers > 0 時以進程池並行提取，進行中的任務數有上限，提取只領先消費端有限頁數。
+    
+    Args:
+        pdf_path: PDF 文件路徑
+        start_page: 起始頁碼（從 1 起算）
+        num_workers: 提取進程數，0 表示在當前進程內逐頁提取
+        pages_per_task: 每個進程任務提取的頁數
+        logger: 日誌記錄器
+    
+    Yields:
+        (頁碼, 頁面文本)
+    """
+    logger = logger or logging.getLogger(__name__)
+    total_pages = count_pdf_pages(pdf_path)
+    logger.info(f"PDF 總頁數: {total_pages}，從第 {start_page} 頁開始提取")
+    
+    ranges = [
+        (first, min(first + pages_per_task - 1, total_pages))
+        for first in range(start_page, total_pages + 1, pages_per_task)
+    ]
+    
+    if num_workers <= 0:
+        for first, last in ranges:
+            yield from _extract_page_range(pdf_path, first, last)
+        return
+    
+    # spawn 避免在已載入 torch 的進程中 fork
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as executor:
+        pending = deque()
+        remaining = iter(ranges)
+        
+        def submit_next() -> bool:
+            page_range = next(remaining, None)
+            if page_range is None:
+                return False
+            pending.append(executor.submit(_extract_page_range, pdf_path, *page_range))
+            return True
+        
+        for _ in range(num_workers * 2):
+            if not submit_next():
+                break
+        
+        while pending:
+            pages = pending.popleft().result()
+            submit_next()
+            yield from pages
+
+
+def token_budget_batches(chunks: Iterable[Dict[str, Any]],
+                         count_tokens: Callable[[List[str]], List[int]],
+                         max_tokens_per_batch: int = 16384,
+                         max_batch_size: int = 64) -> Iterator[List[Dict[str, Any]]]:
+    """
+    把文本塊流按 token 預算組成批次
+    
+    Args:
+        chunks: 文本塊流
+        count_tokens: 計算文本 token 數的函數
+        max_tokens_per_batch: 每批 token 總數上限
+        max_batch_size: 每批文本塊數上限
+    
+    Yields:
+        文本塊批次（每個文本塊附帶 token_count 元數據）
+    """
+    batch: List[Dict[str, Any]] = []
+    batch_tokens = 0
+    
+    for chunk in chunks:
+        # 分塊器已按同一分詞器計數時直接沿用
+        tokens = chunk['metadata'].get('token_count')
+        if tokens is None:
+            tokens = count_tokens([chunk['content']])[0]
+        if batch and (batch_tokens + tokens > max_tokens_per_batch or len(batch) >= max_batch_size):
+            yield batch
+            batch, batch_tokens = [], 0
+        
+        chunk['metadata']['token_count'] = tokens
+        batch.append(chunk)
+        batch_tokens += tokens
+    
+    if batch:
+        yield batch
+
+
+class IngestionCheckpoint:
+    """導入檢查點（JSON 文件）"""
+    
+    def __init__(self, path: str, fingerprint: Dict[str, Any]):
+        """
+        初始化檢查點
+        
+        Args:
+            path: 檢查點文件路徑
+            fingerprint: 來源文件與分塊參數的指紋，不一致時不續傳
+        """
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.state = {
+            'next_page': 1,
+            'next_offset': 0,
+            'headings': {},
+            'chunks_done': 0,
+            'completed': False
+        }
+    
+    def load(self, logger=None) -> bool:
+        """載入檢查點，指紋一致時返回 True"""
+        if not self.path.exists():
+            return False
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            if logger:
+                logger.warning(f"Failed to read ingestion checkpoint, starting over: {e}")
+            return False
+        
+        if data.get('fingerprint') != self.fingerprint:
+            if logger:
+                logger.info("Ingestion checkpoint belongs to a different file or settings, starting over")
+            return False
+        
+        self.state.update(data.get('state', {}))
+        return True
+    
+    def save(self):
+        """原子寫入檢查點"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': self.fingerprint, 'state': self.state}, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(self.path)
+
+
+class PDFIngestionPipeline:
+    """串流式、可續傳的 PDF 導入管線"""
+    
+    def __init__(self,
+                 sink: Callable[[List[str], List[Dict[str, Any]], List[str]], Any],
+                 count_tokens: Optional[Callable[[List[str]], List[int]]] = None,
+                 chunk_size: int = 1000,
+                 overlap: int = 200,
+                 num_workers: int = 0,
+                 pages_per_task: int = 8,
+                 max_tokens_per_batch: int = 16384,
+                 max_batch_size: int = 64,
+                 queue_size: int = 2,
+                 checkpoint_dir: str = "./data/ingestion_checkpoints",
+                 metadata_fn: Optional[Callable[[str], Dict[str, Any]]] = None,
+                 prune: Optional[Callable[[str, Set[str]], int]] = None,
+                 flush: Optional[Callable[[], None]] = None,
+                 logger=None):
+        """
+        初始化導入管線
+        
+        Args:
+            sink: 寫入一批文本塊的函數 sink(texts, metadatas, ids)，負責嵌入與 upsert，
+                可返回實際寫入的 ID 列表（跳過已存在的內容哈希 ID 時）
+            count_tokens: 計算 token 數的函數，默認按字數估算
+            chunk_size: 文本塊最大 token 數
+            overlap: 相鄰文本塊的重疊 token 數
+            num_workers: PDF 提取進程數，0 表示在當前進程內提取
+            pages_per_task: 每個提取任務的頁數
+            max_tokens_per_batch: 每批寫入的 token 總數上限
+            max_batch_size: 每批寫入的文本塊數上限
+            queue_size: 等待寫入的批次隊列長度（提取與分塊最多領先的批次數）
+            checkpoint_dir: 檢查點目錄
+            metadata_fn: 由文本塊內容生成額外元數據的函數（如內容分類）
+            prune: 同步模式，導入完成後以 prune(來源, 本次所有文本塊 ID) 刪除來源中已不存在的文本塊
+            flush: 導入結束（含中斷）時調用一次，持久化 sink 累積的索引變更
+            logger: 日誌記錄器
+        """
+        self.sink = sink
+        self.count_tokens = count_tokens or (lambda texts: [len(text) for text in texts])
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.num_workers = num_workers
+        self.pages_per_task = pages_per_task
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_batch_size = max_batch_size
+        self.queue_size = queue_size
+        self.checkpoint_dir = checkpoint_dir
+        self.metadata_fn = metadata_fn
+        self.prune = prune
+        self.flush = flush
+        self.logger = logger or logging.getLogger(__name__)
+    
+    def _fingerprint(self, pdf_path: str) -> Dict[str, Any]:
+        """來源文件與分塊參數的指紋"""
+        stat = os.stat(pdf_path)
+        return {
+            'source': Path(pdf_path).name,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'chunk_size': self.chunk_size,
+            'overlap': self.overlap
+        }
+    
+    def checkpoint_path(self, pdf_path: str) -> str:
+        """返回 PDF 對應的檢查點文件路徑"""
+        digest = hashlib.md5(str(Path(pdf_path).resolve()).encode()).hexdigest()[:8]
+        return os.path.join(self.checkpoint_dir, f"{Path(pdf_path).stem}_{digest}.json")
+    
+    def run(self, pdf_path: str, resume: bool = True) -> Dict[str, Any]:
+        """
+        執行導入
+        
+        提取與分塊在當前線程進行，嵌入與寫入在獨立線程進行，兩者經由有界隊列重疊執行。
+        
+        Args:
+            pdf_path: PDF 文件路徑
+            resume: 是否從檢查點續傳
+        
+        Returns:
+            導入統計
+        """
+        source = Path(pdf_path).name
+        checkpoint = IngestionCheckpoint(self.checkpoint_path(pdf_path), self._fingerprint(pdf_path))
+        resumed = resume and checkpoint.load(self.logger)
+        
+        if resumed and checkpoint.state['completed']:
+            self.logger.info(f"{source} 已完成導入（檢查點: {checkpoint.path}）")
+            return {'source': source, 'skipped': True, **checkpoint.state}
+        if resumed:
+            self.logger.info(
+                f"從檢查點續傳: 第 {checkpoint.state['next_page']} 頁，已提交 {checkpoint.state['chunks_done']} 個文本塊"
+            )
+        
+        stats = {
+            'source': source,
+            'resumed': resumed,
+            'pages': 0,
+            'chunks': 0,
+            'chunks_written': 0,
+            'batches': 0,
+            'write_time': 0.0,
+            'writer_wait_time': 0.0
+        }
+        batches: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        writer_error: List[BaseException] = []
+        stop = threading.Event()
+        
+        def writer():
+            """嵌入並寫入批次，每批提交後更新檢查點"""
+            while True:
+                wait_start = time.perf_counter()
+                batch = batches.get()
+                stats['writer_wait_time'] += time.perf_counter() - wait_start
+                if batch is None:
+                    return
+                if stop.is_set():
+                    continue
+                
+                try:
+                    write_start = time.perf_counter()
+                    # 內容哈希 ID：重新導入相同內容時 ID 不變
+                    ids = [content_chunk_id(chunk['content'], source) for chunk in batch]
+                    written = self.sink([chunk['content'] for chunk in batch], [chunk['metadata'] for chunk in batch], ids)
+                    stats['write_time'] += time.perf_counter() - write_start
+                    
+                    next_page, next_offset, headings = batch[-1]['resume_point']
+                    checkpoint.state.update({
+                        'next_page': next_page,
+                        'next_offset': next_offset,
+                        'headings': headings,
+                        'chunks_done': checkpoint.state['chunks_done'] + len(batch)
+                    })
+                    if self.prune is not None:
+                        checkpoint.state['seen_ids'] = sorted(set(checkpoint.state.get('seen_ids', [])) | set(ids))
+                    checkpoint.save()
+                    stats['chunks'] += len(batch)
+                    stats['chunks_written'] += len(batch) if written is None else len(written)
+                    stats['batches'] += 1
+                except BaseException as e:
+                    writer_error.append(e)
+                    stop.set()
+        
+        writer_thread = threading.Thread(target=writer, name="ingestion-writer", daemon=True)
+        writer_thread.start()
+        start_time = time.perf_counter()
+        
+        try:
+            try:
+                for batch in token_budget_batches(
+                    self._iter_chunks(pdf_path, checkpoint, stats),
+                    self.count_tokens,
+                    self.max_tokens_per_batch,
+                    self.max_batch_size
+                ):
+                    if stop.is_set():
+                        break
+                    batches.put(batch)
+            finally:
+                batches.put(None)
+                writer_thread.join()
+            
+            if writer_error:
+                self.logger.error(f"導入中斷，已提交進度保存在 {checkpoint.path}")
+                raise writer_error[0]
+            
+            if self.prune is not None:
+                stats['pruned'] = self.prune(source, set(checkpoint.state.get('seen_ids', [])))
+        finally:
+            # 所有批次寫入後只保存一次索引快照
+            if self.flush is not None:
+                self.flush()
+        
+        checkpoint.state['completed'] = True
+        checkpoint.save()
+        
+        elapsed = time.perf_counter() - start_time
+        stats.update({
+            'elapsed': elapsed,
+            'pages_per_sec': stats['pages'] / elapsed if elapsed > 0 else 0.0,
+            'chunks_per_sec': stats['chunks'] / elapsed if elapsed > 0 else 0.0,
+            'total_chunks': checkpoint.state['chunks_done'],
+            'checkpoint': str(checkpoint.path)
+        })
+        self.logger.info(
+            f"導入完成: {stats['pages']} 頁，{stats['chunks']} 個文本塊（新寫入 {stats['chunks_written']}），耗時 {elapsed:.1f} 秒 "
+            f"({stats['pages_per_sec']:.1f} 頁/秒，{stats['chunks_per_sec']:.1f} 塊/秒，"
+            f"寫入線程等待 {stats['writer_wait_time']:.1f} 秒)"
+        )
+        return stats
+    
+    def _iter_chunks(self,
+                     pdf_path: str,
+                     checkpoint: IngestionCheckpoint,
+                     stats: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """從檢查點位置開始逐頁提取並增量分塊"""
+        source = Path(pdf_path).name
+        chunker = StreamingTextChunker(
+            self.chunk_size,
+            self.overlap,
+            count_tokens=self.count_tokens,
+            start_offset=checkpoint.state['next_offset'],
+            headings=checkpoint.state.get('headings')
+        )
+        
+        def annotate(chunk: Dict[str, Any]) -> Dict[str, Any]:
+            chunk['metadata']['source'] = source
+            if self.metadata_fn is not None:
+                chunk['metadata'].update(self.metadata_fn(chunk['content']))
+            return chunk
+        
+        for page_num, text in iter_pdf_pages(
+            pdf_path,
+            start_page=checkpoint.state['next_page'],
+            num_workers=self.num_workers,
+            pages_per_task=self.pages_per_task,
+            logger=self.logger
+        ):
+            stats['pages'] += 1
+            for chunk in chunker.feed(page_num, text):
+                yield annotate(chunk)
+            
+            if stats['pages'] % 50 == 0:
+                self.logger.info(f"已提取 {stats['pages']} 頁（第 {page_num} 頁）")
+        
+        for chunk in chunker.flush():
+            yield annotate(chunk)
@@ -0,0 +1,229 @@
+"""
+星曜 × 宮位知識查找表
+離線對每個主星 × 宮位、四化 × 宮位與常見格局各檢索一次，保存排名後的文本塊 ID；
+請求時命盤配置以字典查找取得知識，只有自由文本問題才需要向量檢索
+"""
+
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+MAIN_STARS = (
+    "紫微", "天機", "太陽", "武曲", "天同", "廉貞", "天府",
+    "太陰", "貪狼", "巨門", "天相", "天梁", "七殺", "破軍"
+)
+PALACES = (
+    "命宮", "兄弟宮", "夫妻宮", "子女宮", "財帛宮", "疾厄宮",
+    "遷移宮", "奴僕宮", "官祿宮", "田宅宮", "福德宮", "父母宮"
+)
+TRANSFORMATIONS = ("化祿", "化權", "化科", "化忌")
+PATTERNS = (
+    "紫府同宮", "日月同宮", "殺破狼", "機月同梁", "府相朝垣", "君臣慶會",
+    "七殺朝斗", "石中隱玉", "明珠出海", "日月並明", "火貪格", "鈴貪格", "陽梁昌祿"
+)
+
+# 同宮即成立的格局
+_SAME_PALACE_PATTERNS = {
+    "紫府同宮": ("紫微", "天府"),
+    "日月同宮": ("太陽", "太陰")
+}
+
+_PALACE_ALIASES = {"交友宮": "奴僕宮", "事業宮": "官祿宮"}
+
+# 命盤資料可能為簡體，統一轉為繁體再比對
+_TO_TRADITIONAL = str.maketrans({
+    "机": "機", "阳": "陽", "贞": "貞", "阴": "陰", "贪": "貪", "门": "門", "杀": "殺", "军": "軍",
+    "宫": "宮", "财": "財", "迁": "遷", "仆": "僕", "禄": "祿", "权": "權", "业": "業",
+    "辅": "輔", "罗": "羅", "铃": "鈴", "庙": "廟", "运": "運", "为": "為", "贵": "貴", "钺": "鉞"
+})
+
+
+def to_traditional(text: str) -> str:
+    """把星曜、宮位、四化相關的簡體字轉為繁體（知識庫與命盤資料可能為簡體）"""
+    return text.translate(_TO_TRADITIONAL)
+
+
+def placement_key(element: str, palace: Optional[str] = None) -> str:
+    """查找表鍵：星曜或四化與宮位以 | 連接，格局單獨為鍵"""
+    return f"{element}|{palace}" if palace else element
+
+
+def placement_query(key: str) -> str:
+    """查找表鍵對應的檢索查詢文本"""
+    if "|" in key:
+        return key.replace("|", " ")
+    return f"{key} 格局"
+
+
+def all_placement_queries() -> Dict[str, str]:
+    """所有預計算的鍵與查詢文本"""
+    keys = [placement_key(star, palace) for star in MAIN_STARS for palace in PALACES]
+    keys += [placement_key(transformation, palace) for transformation in TRANSFORMATIONS for palace in PALACES]
+    keys += list(PATTERNS)
+    return {key: placement_query(key) for key in keys}
+
+
+def canonical_palace(name: str) -> Optional[str]:
+    """把命盤中的宮位名稱（如「命宮-身宮」、「命」、「事业宫」）轉為標準名稱"""
+    name = to_traditional(name)
+    for alias, palace in _PALACE_ALIASES.items():
+        if alias in name:
+            return palace
+    for palace in PALACES:
+        if palace in name or name == palace[:-1]:
+            return palace
+    return None
+
+
+def chart_placement_keys(palaces: Dict[str, Any]) -> List[str]:
+    """
+    從命盤宮位資料取出查找表鍵
+    
+    Args:
+        palaces: 宮位名稱 → 星曜列表（如 ["紫微星", "主星:天府", "四化:化忌-武曲"]）或含 stars 欄位的字典
+    
+    Returns:
+        去重後的鍵列表（星曜|宮位、四化|宮位、同宮格局）
+    """
+    keys: List[str] = []
+    for palace_name, stars in palaces.items():
+        palace = canonical_palace(palace_name)
+        if palace is None:
+            continue
+        if isinstance(stars, dict):
+            stars = stars.get("stars", [])
+        if isinstance(stars, str):
+            stars = [stars]
+        
+        text = to_traditional(" ".join(str(star) for star in stars or []))
+        found_stars = [star for star in MAIN_STARS if star in text]
+        keys += [placement_key(star, palace) for star in found_stars]
+        keys += [placement_key(transformation, palace) for transformation in TRANSFORMATIONS if transformation in text]
+        keys += [
+            pattern for pattern, members in _SAME_PALACE_PATTERNS.items()
+            if all(member in found_stars for member in members)
+        ]
+    return list(dict.fromkeys(keys))
+
+
+class KnowledgeLookupTable:
+    """預計算的配置 → 排名文本塊 ID 查找表（JSON 文件）"""
+    
+    FORMAT_VERSION = 1
+    
+    def __init__(self,
+                 entries: Optional[Dict[str, List[Tuple[str, float]]]] = None,
+                 manifest: Optional[Dict[str, Any]] = None):
+        """
+        初始化查找表
+        
+        Args:
+            entries: 鍵 → [(文本塊 ID, 分數), ...]，按分數降序
+            manifest: 建表時的集合資訊（source_mtime 用於判斷是否過期）
+        """
+        self.entries = entries or {}
+        self.manifest = manifest or {}
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+    
+    def get(self, key: str) -> Optional[List[Tuple[str, float]]]:
+        """查找鍵對應的排名文本塊，不在表中時返回 None"""
+        return self.entries.get(key)
+    
+    def is_stale(self, source_mtime: Optional[float]) -> bool:
+        """集合在建表之後被修改過時返回 True"""
+        built_mtime = self.manifest.get("source_mtime")
+        return source_mtime is not None and built_mtime is not None and source_mtime > built_mtime
+    
+    @classmethod
+    def build(cls,
+              search_each,
+              top_k: int = 10,
+              batch_size: int = 64,
+              manifest: Optional[Dict[str, Any]] = None,
+              logger=None) -> "KnowledgeLookupTable":
+        """
+        對所有配置各檢索一次建立查找表
+        
+        Args:
+            search_each: 批量檢索函數，輸入查詢列表，返回每條查詢的結果列表（如 ZiweiVectorStore.search_each）
+            top_k: 每個鍵保存的文本塊數
+            batch_size: 每批查詢數
+            manifest: 額外寫入 manifest 的集合資訊
+            logger: 日誌記錄器
+        """
+        logger = logger or logging.getLogger(__name__)
+        queries = all_placement_queries()
+        keys = list(queries)
+        entries: Dict[str, List[Tuple[str, float]]] = {}
+        
+        start = time.perf_counter()
+        for offset in range(0, len(keys), batch_size):
+            batch = keys[offset:offset + batch_size]
+            for key, results in zip(batch, search_each([queries[key] for key in batch], top_k)):
+                entries[key] = [
+                    (result["id"], round(float(result["score"]), 4))
+                    for result in results
+                    if result.get("id")
+                ]
+            logger.info(f"Lookup table: {min(offset + batch_size, len(keys))}/{len(keys)} keys")
+        
+        table = cls(entries, {
+            **(manifest or {}),
+            "format_version": cls.FORMAT_VERSION,
+            "top_k": top_k,
+            "keys": len(entries),
+            "built_at": time.time(),
+            "build_seconds": round(time.perf_counter() - start, 3)
+        })
+        logger.info(f"Built knowledge lookup table with {len(table)} keys")
+        return table
+    
+    def save(self, path: str):
+        """保存查找表（先寫臨時文件再替換）"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(
+                {"manifest": self.manifest, "entries": {key: [list(hit) for hit in hits] for key, hits in self.entries.items()}},
+                f,
+                ensure_ascii=False,
+                separators=(",", ":")
+            )
+        tmp_path.replace(path)
+    
+    @classmethod
+    def load(cls, path: str) -> "KnowledgeLookupTable":
+        """載入查找表"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        manifest = data.get("manifest", {})
+        if manifest.get("format_version") != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported lookup table format: {manifest.get('format_version')}")
+        entries = {key: [(doc_id, score) for doc_id, score in hits] for key, hits in data.get("entries", {}).items()}
+        return cls(entries, manifest)
+    
+    def resolve(self, keys: Iterable[str]) -> Tuple[Dict[str, List[Tuple[str, float]]], List[str]]:
+        """
+        批量查找
+        
+        Returns:
+            (表中有的鍵 → 排名文本塊, 表中沒有的鍵)
+        """
+        found: Dict[str, List[Tuple[str, float]]] = {}
+        missing: List[str] = []
+        for key in keys:
+            hits = self.entries.get(key)
+            if hits is None:
+                missing.append(key)
+            else:
+                found[key] = hits
+        return found, missing
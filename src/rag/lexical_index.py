@@ -0,0 +1,170 @@
+"""
+中文字元 n-gram 詞法索引
+以字元二元組建立 BM25 倒排索引，並以倒數排名融合 (RRF) 合併稠密與詞法檢索結果
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# 連續的 CJK 字元，或連續的英數字
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+")
+_CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    切分詞法索引的詞項
+    
+    CJK 連續片段切為字元二元組（單字片段保留單字），英數字按詞切分並轉小寫。
+    例如「貪狼化忌」切為 貪狼、狼化、化忌。
+    
+    Args:
+        text: 文本
+    
+    Returns:
+        詞項列表
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    terms = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        segment = match.group()
+        if _CJK_PATTERN.match(segment):
+            if len(segment) == 1:
+                terms.append(segment)
+            else:
+                terms.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            terms.append(segment)
+    return terms
+
+
+class BM25LexicalIndex:
+    """字元二元組 BM25 倒排索引（支援增量更新）"""
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        初始化索引
+        
+        Args:
+            k1: BM25 詞頻飽和參數
+            b: BM25 文檔長度正規化參數
+        """
+        self.k1 = k1
+        self.b = b
+        
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+    
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+    
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_lengths
+    
+    def add(self, ids: Sequence[str], texts: Iterable[str]):
+        """
+        添加或更新文檔
+        
+        Args:
+            ids: 文檔 ID 列表
+            texts: 文本列表
+        """
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                if doc_id in self._doc_lengths:
+                    self._remove(doc_id)
+                
+                terms = Counter(tokenize(text or ""))
+                for term, frequency in terms.items():
+                    self._postings[term][doc_id] = frequency
+                self._doc_terms[doc_id] = terms
+                length = sum(terms.values())
+                self._doc_lengths[doc_id] = length
+                self._total_length += length
+    
+    def delete(self, ids: Sequence[str]):
+        """刪除文檔"""
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._doc_lengths:
+                    self._remove(doc_id)
+    
+    def _remove(self, doc_id: str):
+        """從倒排表移除文檔（調用方需持有鎖）"""
+        for term in self._doc_terms.pop(doc_id):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+    
+    def search(self, query: str, top_k: Optional[int] = 10) -> List[Tuple[str, float]]:
+        """
+        BM25 檢索
+        
+        Args:
+            query: 查詢文本
+            top_k: 返回結果數，None 表示返回所有命中
+        
+        Returns:
+            [(文檔 ID, BM25 分數), ...]，按分數降序
+        """
+        with self._lock:
+            total_docs = len(self._doc_lengths)
+            if total_docs == 0:
+                return []
+            
+            avg_length = self._total_length / total_docs
+            scores: Dict[str, float] = defaultdict(float)
+            
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked if top_k is None else ranked[:top_k]
+    
+    def get_stats(self) -> Dict[str, int]:
+        """獲取索引統計"""
+        return {
+            "documents": len(self._doc_lengths),
+            "terms": len(self._postings)
+        }
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]],
+                           k: int = 60,
+                           weights: Optional[List[float]] = None) -> List[Tuple[str, float]]:
+    """
+    倒數排名融合
+    
+    每個排名列表中第 r 名（從 1 起算）貢獻 weight / (k + r)，與各檢索器分數的尺度無關。
+    
+    Args:
+        rankings: 多個按相關度排序的 ID 列表
+        k: 平滑常數
+        weights: 各排名列表的權重，默認均為 1
+    
+    Returns:
+        [(文檔 ID, 融合分數), ...]，按分數降序
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,112 @@
+"""
+進程內共享嵌入模型註冊表
+同一 (模型名稱, 設備, 精度) 在進程內只載入一次，以引用計數管理生命週期
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class _SharedModelEntry:
+    """註冊表條目"""
+    
+    def __init__(self, value: Any, load_time: float):
+        self.value = value
+        self.load_time = load_time
+        self.refcount = 0
+        # 共享模型的推理鎖（分詞器與模型不支援多線程同時推理）
+        self.lock = threading.Lock()
+
+
+class SharedModelRegistry:
+    """共享模型註冊表"""
+    
+    def __init__(self, logger=None):
+        """
+        初始化註冊表
+        
+        Args:
+            logger: 日誌記錄器
+        """
+        self.logger = logger or logging.getLogger(__name__)
+        self._entries: Dict[Hashable, _SharedModelEntry] = {}
+        self._lock = threading.RLock()
+        
+        # 統計
+        self.loads = 0
+        self.reuses = 0
+    
+    def acquire(self, key: Hashable, loader: Callable[[], Any]) -> Tuple[Any, threading.Lock]:
+        """
+        獲取共享模型，不存在時調用 loader 載入
+        
+        Args:
+            key: 模型鍵，通常為 (model_name, device, dtype)
+            loader: 載入函數，返回要共享的對象
+        
+        Returns:
+            (共享對象, 該對象的推理鎖)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # 載入期間持有鎖，避免多個調用方同時載入同一模型
+                start_time = time.time()
+                entry = _SharedModelEntry(loader(), time.time() - start_time)
+                self._entries[key] = entry
+                self.loads += 1
+                self.logger.info(f"Registered shared model {key} (loaded in {entry.load_time:.2f}s)")
+            else:
+                self.reuses += 1
+                self.logger.info(f"Reusing shared model {key} (refcount={entry.refcount + 1})")
+            
+            entry.refcount += 1
+            return entry.value, entry.lock
+    
+    def release(self, key: Hashable):
+        """
+        釋放一個引用，引用計數歸零時移除模型
+        
+        Args:
+            key: 模型鍵
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            
+            entry.refcount -= 1
+            if entry.refcount <= 0:
+                del self._entries[key]
+                self.logger.info(f"Released shared model {key}")
+    
+    def get_refcount(self, key: Hashable) -> int:
+        """獲取模型的引用計數"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.refcount if entry else 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取註冊表統計"""
+        with self._lock:
+            return {
+                "models": [
+                    {"key": list(key) if isinstance(key, tuple) else key,
+                     "refcount": entry.refcount,
+                     "load_time": entry.load_time}
+                    for key, entry in self._entries.items()
+                ],
+                "loads": self.loads,
+                "reuses": self.reuses
+            }
+
+
+# 全局註冊表實例（模組載入時創建，所有線程共用同一實例）
+_global_registry = SharedModelRegistry()
+
+
+def get_model_registry() -> SharedModelRegistry:
+    """獲取全局共享模型註冊表"""
+    return _global_registry
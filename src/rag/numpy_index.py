@@ -0,0 +1,605 @@
+"""
+NumPy 平面向量索引
+適用於小型知識庫：向量保存在連續矩陣中，以一次矩陣乘法加 argpartition 完成 top-k 檢索；
+可選以 float16 副本或乘積量化（PQ）碼掃描，再以全精度向量重新計分前幾名候選
+"""
+
+import json
+import logging
+import time
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class _TextBlob(Sequence):
+    """以偏移量索引的 UTF-8 文本塊，按需解碼單條文本"""
+    
+    def __init__(self, path: Path, offsets: np.ndarray, mmap: bool = True):
+        self.offsets = offsets
+        if path.stat().st_size == 0:
+            self.blob = np.zeros(0, dtype=np.uint8)
+        elif mmap:
+            self.blob = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            self.blob = np.fromfile(path, dtype=np.uint8)
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+
+QUANTIZATIONS = (None, "float16", "pq")
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Lloyd k-means，返回 (k, dim) 質心；空簇以隨機樣本重新播種"""
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    data_norms = np.einsum("ij,ij->i", data, data)
+    for _ in range(iterations):
+        distances = data_norms[:, None] - 2 * data @ centroids.T + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+        assign = distances.argmin(axis=1)
+        counts = np.bincount(assign, minlength=k)
+        for dim in range(data.shape[1]):
+            sums = np.bincount(assign, weights=data[:, dim], minlength=k)
+            centroids[counts > 0, dim] = sums[counts > 0] / counts[counts > 0]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty))]
+    return centroids
+
+
+def matches_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    判斷元數據是否符合過濾條件（ChromaDB where 語法的子集）
+    
+    支援等值、$eq、$ne、$in、$nin 與組合條件 $and、$or，多個鍵之間為「且」。
+    """
+    if not where:
+        return True
+    
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+            continue
+        
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq" and value != operand:
+                return False
+            if operator == "$ne" and value == operand:
+                return False
+            if operator == "$in" and value not in operand:
+                return False
+            if operator == "$nin" and value in operand:
+                return False
+            if operator not in ("$eq", "$ne", "$in", "$nin"):
+                raise ValueError(f"Unsupported where operator: {operator}")
+    return True
+
+
+class NumpyVectorIndex:
+    """內存平面向量索引（向量已 L2 正規化，內積即餘弦相似度）"""
+    
+    FORMAT_VERSION = 1
+    MANIFEST_FILE = "manifest.json"
+    VECTORS_FILE = "vectors.npy"
+    IDS_FILE = "ids.npy"
+    TEXTS_FILE = "texts.bin"
+    TEXT_OFFSETS_FILE = "text_offsets.npy"
+    METADATAS_FILE = "metadatas.json"
+    SCAN_VECTORS_FILE = "scan_vectors.npy"
+    PQ_CODES_FILE = "pq_codes.npy"
+    PQ_CODEBOOKS_FILE = "pq_codebooks.npy"
+    SCORE_BLOCK_ROWS = 4096
+    
+    def __init__(self,
+                 dimension: Optional[int] = None,
+                 dtype: str = "float32",
+                 quantization: Optional[str] = None,
+                 pq_subvectors: int = 64,
+                 pq_centroids: int = 256,
+                 rescore_factor: int = 4,
+                 logger=None):
+        """
+        初始化索引
+        
+        Args:
+            dimension: 向量維度，None 表示由第一批向量決定
+            dtype: 向量存儲精度（float32 或 float16）
+            quantization: 掃描用的壓縮表示：None（直接掃描存儲矩陣）、float16 或 pq（乘積量化）
+            pq_subvectors: PQ 子向量數（維度須能整除），每個向量壓縮為同樣多的位元組
+            pq_centroids: 每個子空間的質心數（最多 256）
+            rescore_factor: 壓縮掃描取 top_k × rescore_factor 條候選，以存儲矩陣重新計分
+            logger: 日誌記錄器
+        """
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unsupported quantization: {quantization}")
+        if not 1 <= pq_centroids <= 256:
+            raise ValueError("pq_centroids must be between 1 and 256")
+        
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.quantization = quantization
+        self.pq_subvectors = pq_subvectors
+        self.pq_centroids = pq_centroids
+        self.rescore_factor = rescore_factor
+        self.logger = logger or logging.getLogger(__name__)
+        
+        self._matrix = np.zeros((0, dimension or 0), dtype=self.dtype)
+        # 壓縮掃描表示（float16 矩陣或 PQ 碼），與 _matrix 同行號；PQ 碼本訓練前為 None，改為直接掃描
+        self._scan: Optional[np.ndarray] = None
+        self._codebooks: Optional[np.ndarray] = None
+        self._count = 0
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self._positions: Dict[str, int] = {}
+        self.manifest: Dict[str, Any] = {}
+        # 按元數據值分組的行號（分類子索引），寫入後重建
+        self._partitions: Dict[str, Dict[Any, np.ndarray]] = {}
+    
+    def __len__(self) -> int:
+        return self._count
+    
+    @property
+    def matrix(self) -> np.ndarray:
+        """有效向量矩陣（不含預留容量）"""
+        return self._matrix[:self._count]
+    
+    @property
+    def scan_ready(self) -> bool:
+        """是否以壓縮表示掃描（float16 副本已建立或 PQ 碼本已訓練）"""
+        return self._scan is not None
+    
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """L2 正規化"""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+    
+    def _reserve(self, extra: int):
+        """確保矩陣容量足夠，不足時按倍數擴容"""
+        needed = self._count + extra
+        scan_writeable = self._scan is None or self._scan.flags.writeable
+        if needed <= self._matrix.shape[0] and self._matrix.flags.writeable and scan_writeable:
+            return
+        
+        capacity = max(needed, self._matrix.shape[0] * 2, 64)
+        matrix = np.empty((capacity, self.dimension), dtype=self.dtype)
+        matrix[:self._count] = self._matrix[:self._count]
+        self._matrix = matrix
+        
+        if self._scan is not None:
+            scan = np.empty((capacity,) + self._scan.shape[1:], dtype=self._scan.dtype)
+            scan[:self._count] = self._scan[:self._count]
+            self._scan = scan
+    
+    def _encode_scan(self, vectors: np.ndarray) -> np.ndarray:
+        """把 float32 向量編碼為掃描表示"""
+        if self.quantization == "float16":
+            return vectors.astype(np.float16)
+        
+        sub_dim = self.dimension // self.pq_subvectors
+        codes = np.empty((len(vectors), self.pq_subvectors), dtype=np.uint8)
+        for start in range(0, len(vectors), self.SCORE_BLOCK_ROWS):
+            block = vectors[start:start + self.SCORE_BLOCK_ROWS]
+            for sub, centroids in enumerate(self._codebooks):
+                part = block[:, sub * sub_dim:(sub + 1) * sub_dim]
+                distances = -2 * part @ centroids.T + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+                codes[start:start + len(block), sub] = distances.argmin(axis=1)
+        return codes
+    
+    def train_quantizer(self, sample_size: int = 10000, iterations: int = 15, seed: int = 0):
+        """
+        建立壓縮掃描表示：float16 直接轉換；PQ 以 k-means 訓練各子空間碼本並編碼所有向量
+        
+        Args:
+            sample_size: PQ 訓練取樣的向量數
+            iterations: k-means 迭代次數
+            seed: 取樣與初始化的隨機種子
+        """
+        if self.quantization is None or self._count == 0:
+            return
+        
+        start_time = time.perf_counter()
+        if self.quantization == "pq":
+            if self.dimension % self.pq_subvectors:
+                raise ValueError(f"Dimension {self.dimension} is not divisible by pq_subvectors={self.pq_subvectors}")
+            rng = np.random.default_rng(seed)
+            rows = np.sort(rng.choice(self._count, min(sample_size, self._count), replace=False))
+            sample = np.asarray(self.matrix[rows], dtype=np.float32)
+            sub_dim = self.dimension // self.pq_subvectors
+            k = min(self.pq_centroids, len(sample))
+            self._codebooks = np.stack([
+                _kmeans(np.ascontiguousarray(sample[:, sub * sub_dim:(sub + 1) * sub_dim]), k, iterations, rng)
+                for sub in range(self.pq_subvectors)
+            ]).astype(np.float32)
+        
+        scan = None
+        for start in range(0, self._count, self.SCORE_BLOCK_ROWS):
+            block = self._encode_scan(np.asarray(self.matrix[start:start + self.SCORE_BLOCK_ROWS], dtype=np.float32))
+            if scan is None:
+                scan = np.empty((self._matrix.shape[0],) + block.shape[1:], dtype=block.dtype)
+            scan[start:start + len(block)] = block
+        self._scan = scan
+        self.logger.info(
+            f"Built {self.quantization} scan index for {self._count} vectors in {time.perf_counter() - start_time:.2f}s "
+            f"({self._scan.dtype.itemsize * int(np.prod(self._scan.shape[1:]))} bytes/vector)"
+        )
+    
+    def add(self,
+            ids: List[str],
+            embeddings,
+            documents: List[str],
+            metadatas: Optional[List[Dict[str, Any]]] = None):
+        """
+        添加向量（已存在的 ID 會被覆蓋）
+        
+        Args:
+            ids: 文檔 ID 列表
+            embeddings: 向量矩陣或列表
+            documents: 文本列表
+            metadatas: 元數據列表
+        """
+        if len(ids) == 0:
+            return
+        
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        metadatas = metadatas or [{} for _ in ids]
+        
+        if self.dimension is None:
+            self.dimension = int(vectors.shape[1])
+            self._matrix = np.zeros((0, self.dimension), dtype=self.dtype)
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(f"Embedding dimension mismatch: expected {self.dimension}, got {vectors.shape[1]}")
+        
+        if self.quantization == "float16" and self._scan is None:
+            self._scan = np.empty((self._matrix.shape[0], self.dimension), dtype=np.float16)
+        self._reserve(len(ids))
+        self._materialize()
+        self._partitions = {}
+        scan_rows = self._encode_scan(vectors) if self._scan is not None else None
+        for i, (doc_id, vector, document, metadata) in enumerate(zip(ids, vectors, documents, metadatas)):
+            position = self._positions.get(doc_id)
+            if position is None:
+                position = self._count
+                self._positions[doc_id] = position
+                self.ids.append(doc_id)
+                self.documents.append(document)
+                self.metadatas.append(metadata or {})
+                self._count += 1
+            else:
+                self.documents[position] = document
+                self.metadatas[position] = metadata or {}
+            self._matrix[position] = vector
+            if scan_rows is not None:
+                self._scan[position] = scan_rows[i]
+    
+    def delete(self, ids: List[str]):
+        """刪除向量"""
+        remove = {self._positions[doc_id] for doc_id in ids if doc_id in self._positions}
+        if not remove:
+            return
+        
+        self._materialize()
+        self._partitions = {}
+        keep = [i for i in range(self._count) if i not in remove]
+        self._matrix = np.ascontiguousarray(self._matrix[keep])
+        if self._scan is not None:
+            self._scan = np.ascontiguousarray(self._scan[keep])
+        self.ids = [self.ids[i] for i in keep]
+        self.documents = [self.documents[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self._count = len(keep)
+        self._positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+    
+    def position(self, doc_id: str) -> Optional[int]:
+        """獲取文檔 ID 所在行號"""
+        return self._positions.get(doc_id)
+    
+    def _materialize(self):
+        """把按需解碼的文本轉為列表（寫入前調用）"""
+        if not isinstance(self.documents, list):
+            self.documents = list(self.documents)
+    
+    def _partition(self, key: str) -> Dict[Any, np.ndarray]:
+        """按元數據鍵分組的行號（首次使用時以一次遍歷建立）"""
+        partition = self._partitions.get(key)
+        if partition is None:
+            groups: Dict[Any, List[int]] = {}
+            for row, metadata in enumerate(self.metadatas):
+                value = metadata.get(key)
+                if isinstance(value, (str, int, float, bool)):
+                    groups.setdefault(value, []).append(row)
+            partition = {value: np.asarray(rows, dtype=np.int64) for value, rows in groups.items()}
+            self._partitions[key] = partition
+        return partition
+    
+    def _candidate_rows(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        按過濾條件取出候選行號
+        
+        等值與 $in 條件直接合併分類子索引的行號，$and、$or 對子條件的行號取交集、聯集，
+        只對候選行計算相似度；其他運算符退回逐條比對。
+        
+        Returns:
+            升序行號陣列，無過濾條件時返回 None
+        """
+        if not where:
+            return None
+        
+        rows = None
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                all_rows = np.arange(self._count, dtype=np.int64)
+                clause_rows = [self._candidate_rows(clause) for clause in condition]
+                clause_rows = [all_rows if clause is None else clause for clause in clause_rows]
+                if key == "$and":
+                    key_rows = all_rows
+                    for clause in clause_rows:
+                        key_rows = np.intersect1d(key_rows, clause, assume_unique=True)
+                else:
+                    key_rows = np.unique(np.concatenate(clause_rows)) if clause_rows else np.zeros(0, dtype=np.int64)
+                rows = key_rows if rows is None else np.intersect1d(rows, key_rows, assume_unique=True)
+                continue
+            
+            if not isinstance(condition, dict):
+                values = [condition]
+            elif set(condition) == {"$eq"}:
+                values = [condition["$eq"]]
+            elif set(condition) == {"$in"}:
+                values = list(condition["$in"])
+            else:
+                return np.flatnonzero([matches_where(metadata, where) for metadata in self.metadatas])
+            
+            partition = self._partition(key)
+            groups = [partition[value] for value in values if value in partition]
+            key_rows = np.unique(np.concatenate(groups)) if groups else np.zeros(0, dtype=np.int64)
+            rows = key_rows if rows is None else np.intersect1d(rows, key_rows, assume_unique=True)
+        return rows
+    
+    def search(self,
+               query_embeddings,
+               top_k: int = 5,
+               where: Optional[Dict[str, Any]] = None) -> List[List[Tuple[int, float]]]:
+        """
+        批量 top-k 檢索
+        
+        Args:
+            query_embeddings: 單個查詢向量 (dim,) 或查詢矩陣 (n, dim)
+            top_k: 每個查詢返回的結果數
+            where: 元數據過濾條件（等值、$eq、$ne、$in、$nin、$and、$or），在計算相似度前縮小候選集
+        
+        Returns:
+            每個查詢的 [(行號, 餘弦相似度), ...]，按相似度降序
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        
+        rows = self._candidate_rows(where) if self._count else None
+        candidate_count = self._count if rows is None else len(rows)
+        if candidate_count == 0:
+            return [[] for _ in range(len(queries))]
+        
+        queries = self._normalize(queries)
+        k = min(top_k, candidate_count)
+        
+        if self.scan_ready:
+            # 壓縮表示掃描取候選名單，再以存儲矩陣（記憶體映射時只讀取名單中的行）重新計分
+            scan = self._scan[:self._count] if rows is None else self._scan[rows]
+            approximate = self._pq_scores(scan, queries) if self.quantization == "pq" else self._dense_scores(scan, queries)
+            shortlist = self._top_rows(approximate, min(candidate_count, k * max(self.rescore_factor, 1)))
+            
+            results = []
+            for column in range(queries.shape[0]):
+                local_rows = shortlist[:, column]
+                row_ids = np.sort(local_rows if rows is None else rows[local_rows])
+                exact = np.asarray(self._matrix[row_ids], dtype=np.float32) @ queries[column]
+                order = np.argsort(-exact)[:k]
+                results.append([(int(row_ids[i]), float(exact[i])) for i in order])
+            return results
+        
+        # (count, n) 相似度矩陣：一次矩陣乘法完成所有查詢
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        scores = self._dense_scores(matrix, queries)
+        candidates = self._top_rows(scores, k)
+        
+        results = []
+        for column in range(queries.shape[0]):
+            local_rows = candidates[:, column]
+            column_scores = scores[local_rows, column]
+            order = np.argsort(-column_scores)
+            row_ids = local_rows if rows is None else rows[local_rows]
+            results.append([(int(row_ids[i]), float(column_scores[i])) for i in order])
+        return results
+    
+    def _dense_scores(self, matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """(count, n) 內積矩陣"""
+        if matrix.dtype == np.float32:
+            return matrix @ queries.T
+        
+        # float16 沒有 BLAS 支援，分塊轉為 float32 後計算，避免一次複製整個矩陣
+        scores = np.empty((len(matrix), queries.shape[0]), dtype=np.float32)
+        for start in range(0, len(matrix), self.SCORE_BLOCK_ROWS):
+            block = matrix[start:start + self.SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ queries.T
+        return scores
+    
+    def _pq_scores(self, codes: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """以查表法（非對稱距離）計算 PQ 碼與查詢的近似內積，(count, n)"""
+        sub_dim = self.dimension // self.pq_subvectors
+        # (n, 子向量數, 質心數)：每個查詢子向量與各質心的內積
+        tables = np.einsum(
+            "nsd,skd->snk", queries.reshape(len(queries), self.pq_subvectors, sub_dim), self._codebooks
+        )
+        scores = np.zeros((len(codes), len(queries)), dtype=np.float32)
+        for start in range(0, len(codes), self.SCORE_BLOCK_ROWS):
+            block = codes[start:start + self.SCORE_BLOCK_ROWS]
+            block_scores = scores[start:start + len(block)]
+            for sub in range(self.pq_subvectors):
+                block_scores += tables[sub][:, block[:, sub]].T
+        return scores
+    
+    @staticmethod
+    def _top_rows(scores: np.ndarray, k: int) -> np.ndarray:
+        """每列分數最高的 k 個行號（未排序），(k, n)"""
+        if k < scores.shape[0]:
+            return np.argpartition(-scores, k - 1, axis=0)[:k]
+        return np.broadcast_to(np.arange(scores.shape[0])[:, None], scores.shape)
+    
+    def save(self, directory: str, manifest: Optional[Dict[str, Any]] = None):
+        """
+        保存索引快照
+        
+        快照由向量矩陣 (.npy)、ID 陣列 (.npy)、以偏移量索引的 UTF-8 文本塊與元數據組成，
+        全部可用記憶體映射載入。各檔案先寫臨時檔再替換，已映射舊檔的進程不受影響。
+        
+        Args:
+            directory: 快照目錄
+            manifest: 附加寫入 manifest.json 的資訊
+        """
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        
+        encoded = [document.encode("utf-8") for document in self.documents]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        
+        def write_array(name: str, array: np.ndarray):
+            tmp_path = path / (name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            tmp_path.replace(path / name)
+        
+        write_array(self.VECTORS_FILE, np.ascontiguousarray(self.matrix))
+        write_array(self.IDS_FILE, np.array(self.ids, dtype=str))
+        write_array(self.TEXT_OFFSETS_FILE, offsets)
+        if self.quantization == "float16" and self._scan is not None:
+            write_array(self.SCAN_VECTORS_FILE, np.ascontiguousarray(self._scan[:self._count]))
+        elif self.quantization == "pq" and self._scan is not None:
+            write_array(self.PQ_CODES_FILE, np.ascontiguousarray(self._scan[:self._count]))
+            write_array(self.PQ_CODEBOOKS_FILE, self._codebooks)
+        
+        tmp_path = path / (self.TEXTS_FILE + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(b"".join(encoded))
+        tmp_path.replace(path / self.TEXTS_FILE)
+        
+        tmp_path = path / (self.METADATAS_FILE + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(self.metadatas), f, ensure_ascii=False)
+        tmp_path.replace(path / self.METADATAS_FILE)
+        
+        # manifest 最後寫入，作為快照完整的標記
+        self.manifest = {
+            **(manifest or {}),
+            "format_version": self.FORMAT_VERSION,
+            "count": self._count,
+            "dimension": self.dimension,
+            "dtype": self.dtype.name,
+            "quantization": self.quantization if self._scan is not None else None,
+            "pq_subvectors": self.pq_subvectors if self.quantization == "pq" else None,
+            "pq_centroids": int(self._codebooks.shape[1]) if self._codebooks is not None else None,
+            "rescore_factor": self.rescore_factor,
+            "created_at": time.time()
+        }
+        tmp_path = path / (self.MANIFEST_FILE + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(path / self.MANIFEST_FILE)
+        
+        self.logger.info(f"Saved numpy vector index with {self._count} vectors to {path}")
+    
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True, logger=None) -> "NumpyVectorIndex":
+        """
+        從快照目錄載入索引
+        
+        Args:
+            directory: 快照目錄
+            mmap: 是否以記憶體映射方式唯讀載入向量與文本（多進程共用頁快取，寫入時才複製到記憶體）；
+                  有壓縮掃描表示時，全精度向量只在重新計分時按行讀取
+            logger: 日誌記錄器
+        """
+        path = Path(directory)
+        with open(path / cls.MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != cls.FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format: {manifest.get('format_version')}")
+        
+        mmap_mode = 'r' if mmap else None
+        quantization = manifest.get("quantization")
+        index = cls(
+            dimension=manifest["dimension"],
+            dtype=manifest["dtype"],
+            quantization=quantization,
+            pq_subvectors=manifest.get("pq_subvectors") or 64,
+            pq_centroids=manifest.get("pq_centroids") or 256,
+            rescore_factor=manifest.get("rescore_factor", 4),
+            logger=logger
+        )
+        index.manifest = manifest
+        index._matrix = np.load(path / cls.VECTORS_FILE, mmap_mode=mmap_mode)
+        index._count = index._matrix.shape[0]
+        if quantization == "float16":
+            index._scan = np.load(path / cls.SCAN_VECTORS_FILE, mmap_mode=mmap_mode)
+        elif quantization == "pq":
+            index._scan = np.load(path / cls.PQ_CODES_FILE, mmap_mode=mmap_mode)
+            index._codebooks = np.load(path / cls.PQ_CODEBOOKS_FILE)
+        index.ids = np.load(path / cls.IDS_FILE).tolist()
+        index.documents = _TextBlob(path / cls.TEXTS_FILE, np.load(path / cls.TEXT_OFFSETS_FILE, mmap_mode=mmap_mode), mmap)
+        with open(path / cls.METADATAS_FILE, 'r', encoding='utf-8') as f:
+            index.metadatas = json.load(f)
+        index._positions = {doc_id: i for i, doc_id in enumerate(index.ids)}
+        
+        index.logger.info(f"Loaded numpy vector index with {index._count} vectors from {path}")
+        return index
+    
+    @classmethod
+    def from_collection(cls,
+                        collection,
+                        dtype: str = "float32",
+                        batch_size: int = 1000,
+                        logger=None,
+                        **options) -> "NumpyVectorIndex":
+        """
+        從 ChromaDB 集合建立索引
+        
+        Args:
+            collection: ChromaDB 集合
+            dtype: 向量存儲精度
+            batch_size: 分批讀取大小
+            logger: 日誌記錄器
+            **options: 壓縮掃描選項（quantization、pq_subvectors、pq_centroids、rescore_factor）
+        """
+        index = cls(dtype=dtype, logger=logger, **options)
+        total = collection.count()
+        for offset in range(0, total, batch_size):
+            batch = collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=batch_size,
+                offset=offset
+            )
+            index.add(batch["ids"], batch["embeddings"], batch["documents"], batch["metadatas"])
+        index.train_quantizer()
+        
+        index.logger.info(f"Built numpy vector index from collection with {len(index)} vectors")
+        return index
@@ -0,0 +1,289 @@
+"""
+BGE-M3 ONNX Runtime 嵌入後端
+將模型匯出為 ONNX（可選 int8 動態量化），在 CPU 上以 ONNX Runtime 推理
+"""
+
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from transformers import AutoTokenizer
+
+from .bge_embeddings import BGEM3Embeddings
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model.int8.onnx"
+EXPORT_INFO_FILE = "export_info.json"
+
+
+def export_onnx_model(model_name: str = "BAAI/bge-m3",
+                      output_dir: str = "./models/bge-m3-onnx",
+                      quantize: bool = True,
+                      opset_version: int = 17,
+                      logger=None) -> Dict[str, Any]:
+    """
+    匯出 BGE-M3 為 ONNX 模型
+    
+    已匯出的檔案會被重用，只在缺少時重新匯出。
+    
+    Args:
+        model_name: Hugging Face 模型名稱
+        output_dir: 輸出目錄
+        quantize: 是否額外產生 int8 動態量化模型
+        opset_version: ONNX opset 版本
+        logger: 日誌記錄器
+    
+    Returns:
+        匯出資訊
+    """
+    import torch
+    from transformers import AutoModel
+    
+    logger = logger or logging.getLogger(__name__)
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    
+    fp32_path = output_path / ONNX_MODEL_FILE
+    int8_path = output_path / ONNX_INT8_MODEL_FILE
+    info_path = output_path / EXPORT_INFO_FILE
+    
+    if not fp32_path.exists():
+        logger.info(f"Exporting {model_name} to ONNX: {fp32_path}")
+        start_time = time.time()
+        
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+        
+        class _EncoderWrapper(torch.nn.Module):
+            """只輸出 last_hidden_state 的包裝器"""
+            
+            def __init__(self, encoder):
+                super().__init__()
+                self.encoder = encoder
+            
+            def forward(self, input_ids, attention_mask):
+                return self.encoder(input_ids=input_ids, attention_mask=attention_mask)[0]
+        
+        dummy = tokenizer(["紫微斗數"], return_tensors="pt")
+        with torch.no_grad():
+            # 模型超過 2GB 時 torch 會自動以外部資料格式保存權重
+            torch.onnx.export(
+                _EncoderWrapper(model),
+                (dummy["input_ids"], dummy["attention_mask"]),
+                str(fp32_path),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"}
+                },
+                opset_version=opset_version,
+                do_constant_folding=True
+            )
+        
+        tokenizer.save_pretrained(str(output_path))
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "model_name": model_name,
+                "hidden_size": model.config.hidden_size,
+                "opset_version": opset_version
+            }, f, ensure_ascii=False, indent=2)
+        
+        logger.info(f"ONNX export finished in {time.time() - start_time:.1f}s")
+    
+    if quantize and not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        
+        logger.info(f"Quantizing ONNX model to int8: {int8_path}")
+        quantize_dynamic(
+            str(fp32_path),
+            str(int8_path),
+            weight_type=QuantType.QInt8,
+            use_external_data_format=True
+        )
+    
+    return {
+        "output_dir": str(output_path),
+        "fp32_model": str(fp32_path),
+        "int8_model": str(int8_path) if int8_path.exists() else None
+    }
+
+
+class ONNXBGEM3Embeddings(BGEM3Embeddings):
+    """以 ONNX Runtime 推理的 BGE-M3 嵌入模型"""
+    
+    def __init__(self,
+                 model_name: str = "BAAI/bge-m3",
+                 onnx_dir: str = "./models/bge-m3-onnx",
+                 quantized: bool = True,
+                 intra_op_threads: int = 0,
+                 **kwargs):
+        """
+        初始化 ONNX 嵌入模型
+        
+        Args:
+            model_name: 模型名稱（首次使用時用於匯出）
+            onnx_dir: ONNX 模型目錄
+            quantized: 是否使用 int8 量化模型
+            intra_op_threads: ONNX Runtime 算子內線程數，0 表示由 ONNX Runtime 決定
+            **kwargs: 其餘 BGEM3Embeddings 參數
+        """
+        if ort is None:
+            raise ImportError("onnxruntime is required for the ONNX backend: pip install onnxruntime")
+        
+        self.onnx_dir = onnx_dir
+        self.quantized = quantized
+        self.intra_op_threads = intra_op_threads
+        kwargs["device"] = "cpu"
+        
+        # 啟用工作進程時先在父進程完成匯出，避免多個工作進程同時匯出
+        if kwargs.get("num_workers", 0) > 0:
+            export_onnx_model(
+                model_name=model_name,
+                output_dir=onnx_dir,
+                quantize=quantized,
+                logger=kwargs.get("logger")
+            )
+        
+        super().__init__(model_name=model_name, **kwargs)
+    
+    def _load_model(self):
+        """載入分詞器與 ONNX Runtime 推理會話"""
+        try:
+            export_info = export_onnx_model(
+                model_name=self.model_name,
+                output_dir=self.onnx_dir,
+                quantize=self.quantized,
+                logger=self.logger
+            )
+            model_path = export_info["int8_model"] if self.quantized else export_info["fp32_model"]
+            
+            self.logger.info(f"Loading ONNX BGE-M3 model: {model_path}")
+            tokenizer = AutoTokenizer.from_pretrained(self.onnx_dir)
+            
+            session_options = ort.SessionOptions()
+            session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            # 未指定時沿用 torch 運行時設定的線程數（auto 模式按工作進程數平分核心）
+            intra_op_threads = self.intra_op_threads or self.runtime.get("intra_op_threads", 0)
+            if intra_op_threads > 0:
+                session_options.intra_op_num_threads = intra_op_threads
+            
+            session = ort.InferenceSession(
+                model_path,
+                sess_options=session_options,
+                providers=["CPUExecutionProvider"]
+            )
+            
+            self.logger.info(f"ONNX BGE-M3 model loaded (int8={self.quantized})")
+            return tokenizer, session
+        
+        except Exception as e:
+            self.logger.error(f"Error loading ONNX BGE-M3 model: {str(e)}")
+            raise
+    
+    def _model_key(self) -> tuple:
+        """共享模型註冊表的鍵：(ONNX 模型目錄, 設備, 精度)"""
+        return (f"onnx:{self.onnx_dir}", "cpu", "int8" if self.quantized else "float32")
+    
+    def _worker_model_config(self) -> dict:
+        """工作進程內創建 ONNX 模型所需的參數"""
+        config = super()._worker_model_config()
+        config.update({
+            "backend": "onnx",
+            "onnx_dir": self.onnx_dir,
+            "onnx_quantized": self.quantized,
+            "onnx_intra_op_threads": self.intra_op_threads
+        })
+        return config
+    
+    def _encode_texts(self, texts: List[str]):
+        """ONNX 後端不產生 torch 張量，請使用 _encode_numpy"""
+        raise NotImplementedError("ONNXBGEM3Embeddings encodes via _encode_numpy")
+    
+    def _encode_numpy(self, texts: List[str]) -> np.ndarray:
+        """編碼文本列表並返回 float32 NumPy 矩陣"""
+        if self.worker_pool is not None:
+            return self.worker_pool.encode(texts)
+        
+        with self._encode_lock:
+            encoded_input = self.tokenizer(
+                texts,
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors='np'
+            )
+        
+        input_ids = encoded_input['input_ids'].astype(np.int64)
+        attention_mask = encoded_input['attention_mask'].astype(np.int64)
+        
+        token_embeddings = self.model.run(
+            None,
+            {"input_ids": input_ids, "attention_mask": attention_mask}
+        )[0]
+        
+        # 平均池化
+        mask = attention_mask[..., None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        embeddings = summed / np.clip(mask.sum(axis=1), 1e-9, None)
+        
+        # 正規化
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return (embeddings / np.clip(norms, 1e-12, None)).astype(np.float32)
+    
+    def get_embedding_dimension(self) -> int:
+        """獲取嵌入向量維度"""
+        info_path = Path(self.onnx_dir) / EXPORT_INFO_FILE
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                return json.load(f)["hidden_size"]
+        except Exception:
+            return 1024
+    
+    def get_model_info(self) -> dict:
+        """獲取模型信息"""
+        info = super().get_model_info()
+        info.update({
+            "backend": "onnx",
+            "onnx_dir": self.onnx_dir,
+            "quantized": self.quantized,
+            "intra_op_threads": self.intra_op_threads
+        })
+        return info
+
+
+def check_parity(reference: BGEM3Embeddings,
+                 candidate: BGEM3Embeddings,
+                 texts: List[str]) -> Dict[str, float]:
+    """
+    比較兩個嵌入後端的輸出一致性
+    
+    Args:
+        reference: 參考模型（通常為 PyTorch 後端）
+        candidate: 待驗證模型（例如 ONNX 後端）
+        texts: 測試文本
+    
+    Returns:
+        每條文本餘弦相似度的最小值與平均值
+    """
+    reference_vectors = reference._encode_numpy(texts)
+    candidate_vectors = candidate._encode_numpy(texts)
+    
+    # 兩者皆已 L2 正規化，點積即為餘弦相似度
+    cosines = np.sum(reference_vectors * candidate_vectors, axis=1)
+    return {
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "num_texts": len(texts)
+    }
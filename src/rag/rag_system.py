@@ -10,6 +10,8 @@ from dotenv import load_dotenv
 
 from .vector_store import ZiweiVectorStore
 from .gpt4o_generator import GPT4oGenerator, RAGResponseGenerator
+from .context_packer import ContextPacker
+from .score_filters import passes_min_score
 from .bge_embeddings import BGEM3Embeddings, HybridEmbeddings
 
 # 載入環境變數
@@ -34,6 +36,7 @@ class ZiweiRAGSystem:
         self.vector_store = None
         self.generator = None
         self.rag_generator = None
+        self.context_packer = None
         
         # 初始化系統
         self._initialize_system()
@@ -47,11 +50,48 @@ class ZiweiRAGSystem:
                 "collection_name": os.getenv("VECTOR_DB_COLLECTION", "ziwei_knowledge"),
                 "embedding_provider": os.getenv("EMBEDDING_PROVIDER", "huggingface"),
                 "embedding_model": os.getenv("EMBEDDING_MODEL", "BAAI/bge-m3"),
+                "lazy_embeddings": os.getenv("EMBEDDING_LAZY_LOAD", "false").lower() == "true",
+                "index_backend": os.getenv("VECTOR_INDEX_BACKEND", "chroma"),
+                "numpy_index_dir": os.getenv("VECTOR_NUMPY_INDEX_DIR"),
+                "numpy_index_dtype": os.getenv("VECTOR_NUMPY_INDEX_DTYPE", "float32"),
+                "numpy_index_quantization": os.getenv("VECTOR_NUMPY_INDEX_QUANTIZATION") or None,
+                "numpy_index_rescore_factor": int(os.getenv("VECTOR_NUMPY_INDEX_RESCORE_FACTOR", "4")),
+                "hybrid_search": os.getenv("VECTOR_HYBRID_SEARCH", "false").lower() == "true",
+                "result_cache_size": int(os.getenv("VECTOR_RESULT_CACHE_SIZE", "256")),
+                "chunk_size": int(os.getenv("RAG_CHUNK_SIZE", "1000")),
+                "chunk_overlap": int(os.getenv("RAG_CHUNK_OVERLAP", "200")),
+                "lookup_table_path": os.getenv("VECTOR_LOOKUP_TABLE_PATH"),
+                "rerank": os.getenv("RAG_ENABLE_RERANKING", "false").lower() == "true",
+                "rerank_candidates": int(os.getenv("RAG_RERANK_CANDIDATES", "20")),
+                "reranker_config": {
+                    "model_name": os.getenv("RERANKER_MODEL", "BAAI/bge-reranker-base"),
+                    "device": os.getenv("EMBEDDING_DEVICE", "cpu"),
+                    "max_length": int(os.getenv("RERANKER_MAX_LENGTH", "512")),
+                    "latency_budget_ms": float(os.getenv("RERANKER_LATENCY_BUDGET_MS", "300")),
+                    "cache_size": int(os.getenv("RERANKER_CACHE_SIZE", "1024"))
+                },
                 "embedding_config": {
+                    "backend": os.getenv("EMBEDDING_BACKEND", "torch"),
+                    "onnx_dir": os.getenv("EMBEDDING_ONNX_DIR", "./models/bge-m3-onnx"),
+                    "onnx_quantized": os.getenv("EMBEDDING_ONNX_QUANTIZED", "true").lower() == "true",
+                    "onnx_intra_op_threads": int(os.getenv("EMBEDDING_ONNX_INTRA_OP_THREADS", "0")),
                     "device": os.getenv("EMBEDDING_DEVICE", "cpu"),
                     "max_length": int(os.getenv("EMBEDDING_MAX_LENGTH", "8192")),
                     "batch_size": int(os.getenv("EMBEDDING_BATCH_SIZE", "32")),
                     "use_fp16": os.getenv("EMBEDDING_USE_FP16", "false").lower() == "true",
+                    "query_cache_size": int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "1024")),
+                    "query_cache_path": os.getenv("EMBEDDING_QUERY_CACHE_PATH"),
+                    "document_cache_dir": os.getenv("EMBEDDING_DOCUMENT_CACHE_DIR", "./cache/document_embeddings"),
+                    "micro_batch_max_size": int(os.getenv("EMBEDDING_MICRO_BATCH_MAX_SIZE", "0")),
+                    "micro_batch_max_wait_ms": float(os.getenv("EMBEDDING_MICRO_BATCH_MAX_WAIT_MS", "5")),
+                    "max_tokens_per_batch": int(os.getenv("EMBEDDING_MAX_TOKENS_PER_BATCH", "8192")),
+                    "num_workers": int(os.getenv("EMBEDDING_NUM_WORKERS", "0")),
+                    "threads_per_worker": int(os.getenv("EMBEDDING_THREADS_PER_WORKER", "0")),
+                    "torch_threads": os.getenv("EMBEDDING_TORCH_THREADS", "auto"),
+                    "torch_interop_threads": int(os.getenv("EMBEDDING_TORCH_INTEROP_THREADS", "0")),
+                    "cpu_affinity": os.getenv("EMBEDDING_CPU_AFFINITY") or None,
+                    "server_workers": int(os.getenv("EMBEDDING_SERVER_WORKERS", "0")),
+                    "use_inference_mode": os.getenv("EMBEDDING_INFERENCE_MODE", "true").lower() == "true",
                     "openai_fallback": True,
                     "openai_model": os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-ada-002")
                 }
@@ -70,7 +110,8 @@ class ZiweiRAGSystem:
             "rag": {
                 "top_k": int(os.getenv("RAG_TOP_K", "5")),
                 "min_score": float(os.getenv("RAG_MIN_SCORE", "0.7")),
-                "enable_reranking": os.getenv("RAG_ENABLE_RERANKING", "false").lower() == "true"
+                "max_context_length": int(os.getenv("RAG_MAX_CONTEXT_TOKENS", "3000")),
+                "rerank_min_score": float(os.getenv("RAG_RERANK_MIN_SCORE", "0.0"))
             }
         }
     
@@ -106,11 +147,19 @@ class ZiweiRAGSystem:
                 logger=self.logger
             )
             
+            # 初始化上下文組裝器（以生成模型的分詞器計算 token 預算）
+            self.context_packer = ContextPacker(
+                max_tokens=self.config["rag"].get("max_context_length", 3000),
+                model=self.config["generator"].get("model"),
+                logger=self.logger
+            )
+            
             # 初始化 RAG 生成器
             self.logger.info("Initializing RAG generator...")
             self.rag_generator = RAGResponseGenerator(
                 vector_store=self.vector_store,
                 generator=self.generator,
+                context_packer=self.context_packer,
                 logger=self.logger
             )
             
@@ -120,12 +169,21 @@ class ZiweiRAGSystem:
             self.logger.error(f"Error initializing RAG system: {str(e)}")
             raise
     
-    def add_knowledge(self, documents: List[Dict[str, Any]]) -> bool:
+    async def warm_up(self):
+        """在背景載入並預熱嵌入模型"""
+        await self.vector_store.load_embeddings_async()
+    
+    def is_ready(self) -> bool:
+        """檢索是否可立即使用（嵌入模型已載入）"""
+        return self.vector_store is not None and self.vector_store.is_ready
+    
+    def add_knowledge(self, documents: List[Dict[str, Any]], sync: bool = False) -> bool:
         """
-        添加知識到向量庫
+        添加知識到向量庫（內容相同的文本塊不會重複寫入）
         
         Args:
             documents: 文檔列表，每個文檔包含 content 和 metadata
+            sync: 同步模式，刪除這些文檔來源中已不存在的文本塊
             
         Returns:
             是否成功添加
@@ -143,7 +201,7 @@ class ZiweiRAGSystem:
                 doc_objects.append(doc_obj)
             
             # 添加到向量存儲
-            doc_ids = self.vector_store.add_documents(doc_objects)
+            doc_ids = self.vector_store.add_documents(doc_objects, sync=sync)
             
             self.logger.info(f"Added {len(doc_ids)} documents to knowledge base")
             return True
@@ -174,7 +232,8 @@ class ZiweiRAGSystem:
     def search_knowledge(self, 
                         query: str, 
                         top_k: int = None,
-                        min_score: float = None) -> List[Dict[str, Any]]:
+                        min_score: float = None,
+                        filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         """
         搜索知識庫
         
@@ -182,6 +241,7 @@ class ZiweiRAGSystem:
             query: 查詢字符串
             top_k: 返回結果數量
             min_score: 最小相似度分數
+            filter_metadata: 元數據過濾條件（如 domain_filter("love")），在索引內過濾
             
         Returns:
             搜索結果列表
@@ -189,16 +249,154 @@ class ZiweiRAGSystem:
         top_k = top_k or self.config["rag"]["top_k"]
         min_score = min_score or self.config["rag"]["min_score"]
         
-        results = self.vector_store.search(query, top_k)
+        results = self.vector_store.search(query, top_k, filter_metadata)
         
         # 過濾低分結果
         filtered_results = [
             result for result in results 
-            if result["score"] >= min_score
+            if self._passes_min_score(result, min_score, top_k)
         ]
         
         return filtered_results
     
+    def _passes_min_score(self, result: Dict[str, Any], min_score: float, top_k: int) -> bool:
+        """以配置的 rag.rerank_min_score 判斷檢索結果是否保留"""
+        return passes_min_score(result, min_score, top_k, self.config["rag"].get("rerank_min_score", 0.0))
+    
+    async def search_knowledge_async(self,
+                                     query: str,
+                                     top_k: int = None,
+                                     min_score: float = None,
+                                     filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        非同步搜索知識庫，供事件循環中的調用方使用
+        
+        Args:
+            query: 查詢字符串
+            top_k: 返回結果數量
+            min_score: 最小相似度分數
+            filter_metadata: 元數據過濾條件
+            
+        Returns:
+            搜索結果列表
+        """
+        top_k = top_k or self.config["rag"]["top_k"]
+        min_score = min_score or self.config["rag"]["min_score"]
+        
+        results = await self.vector_store.search_async(query, top_k, filter_metadata)
+        
+        # 過濾低分結果
+        return [
+            result for result in results
+            if self._passes_min_score(result, min_score, top_k)
+        ]
+    
+    def search_knowledge_many(self,
+                              queries: List[str],
+                              top_k: int = None,
+                              min_score: float = None,
+                              per_query_k: int = None,
+                              filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        批量搜索多條子查詢（一次批量嵌入與向量查詢），合併去重
+        
+        Args:
+            queries: 子查詢列表
+            top_k: 合併後返回結果數量
+            min_score: 最小相似度分數
+            per_query_k: 每條子查詢保證的名額
+            filter_metadata: 元數據過濾條件（套用於所有子查詢）
+            
+        Returns:
+            搜索結果列表
+        """
+        top_k = top_k or self.config["rag"]["top_k"]
+        min_score = min_score or self.config["rag"]["min_score"]
+        
+        results = self.vector_store.search_many(queries, top_k, per_query_k=per_query_k, filter_metadata=filter_metadata)
+        
+        return [
+            result for result in results
+            if self._passes_min_score(result, min_score, top_k)
+        ]
+    
+    async def search_knowledge_many_async(self,
+                                          queries: List[str],
+                                          top_k: int = None,
+                                          min_score: float = None,
+                                          per_query_k: int = None,
+                                          filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        非同步批量搜索多條子查詢
+        
+        Args:
+            queries: 子查詢列表
+            top_k: 合併後返回結果數量
+            min_score: 最小相似度分數
+            per_query_k: 每條子查詢保證的名額
+            filter_metadata: 元數據過濾條件（套用於所有子查詢）
+            
+        Returns:
+            搜索結果列表
+        """
+        top_k = top_k or self.config["rag"]["top_k"]
+        min_score = min_score or self.config["rag"]["min_score"]
+        
+        results = await self.vector_store.search_many_async(
+            queries, top_k, per_query_k=per_query_k, filter_metadata=filter_metadata
+        )
+        
+        return [
+            result for result in results
+            if self._passes_min_score(result, min_score, top_k)
+        ]
+    
+    async def search_placements_async(self,
+                                      placement_keys: List[str],
+                                      queries: List[str] = None,
+                                      top_k: int = None,
+                                      min_score: float = None,
+                                      per_query_k: int = None,
+                                      filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        非同步命盤配置檢索：星曜 × 宮位等配置查預計算表，自由文本與表中沒有的配置走向量檢索
+        
+        Args:
+            placement_keys: 查找表鍵（見 knowledge_lookup.chart_placement_keys）
+            queries: 自由文本子查詢
+            top_k: 合併後返回結果數量
+            min_score: 最小相似度分數
+            per_query_k: 每個鍵或子查詢保證的名額
+            filter_metadata: 元數據過濾條件
+            
+        Returns:
+            搜索結果列表
+        """
+        top_k = top_k or self.config["rag"]["top_k"]
+        min_score = min_score or self.config["rag"]["min_score"]
+        
+        results = await self.vector_store.search_placements_async(
+            placement_keys, queries, top_k, per_query_k=per_query_k, filter_metadata=filter_metadata
+        )
+        
+        return [
+            result for result in results
+            if self._passes_min_score(result, min_score, top_k)
+        ]
+    
+    def pack_context(self, results: List[Dict[str, Any]], max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        """
+        把檢索結果組裝為上下文（合併重疊文本塊、去重、按相關度排序並限制 token 數）
+        
+        Args:
+            results: 檢索結果，按相關度排序
+            max_tokens: token 預算，默認使用 rag.max_context_length
+            
+        Returns:
+            ContextPacker.pack 的結果（context、documents、tokens 等）
+        """
+        return self.context_packer.pack(results, max_tokens)
+    
     def generate_answer(self, 
                        query: str,
                        context_type: str = "auto",
@@ -216,17 +414,19 @@ class ZiweiRAGSystem:
         """
         try:
             if context_type == "auto":
-                # 自動檢索上下文
+                # 自動檢索上下文（filter_metadata 隨 kwargs 傳給檢索）
+                kwargs.pop("context_documents", None)
                 return self.rag_generator.generate_rag_response(
                     query=query,
-                    top_k=kwargs.get("top_k", self.config["rag"]["top_k"]),
-                    min_score=kwargs.get("min_score", self.config["rag"]["min_score"]),
+                    top_k=kwargs.pop("top_k", self.config["rag"]["top_k"]),
+                    min_score=kwargs.pop("min_score", self.config["rag"]["min_score"]),
+                    rerank_min_score=kwargs.pop("rerank_min_score", self.config["rag"].get("rerank_min_score", 0.0)),
                     **kwargs
                 )
             
             elif context_type == "manual":
                 # 手動提供上下文
-                context_docs = kwargs.get("context_documents", [])
+                context_docs = kwargs.pop("context_documents", [])
                 return self.generator.generate_response(
                     query=query,
                     context_documents=context_docs,
@@ -266,26 +466,26 @@ class ZiweiRAGSystem:
             分析結果
         """
         try:
-            # 根據命盤數據檢索相關知識
-            query_parts = []
+            # 根據命盤數據檢索相關知識，每顆主星、每個宮位各為一條子查詢
+            queries = []
             
-            # 提取主要信息構建查詢
             if "main_stars" in chart_data:
-                query_parts.extend(chart_data["main_stars"])
+                queries.extend(chart_data["main_stars"])
             
             if "palaces" in chart_data:
-                query_parts.extend([f"{palace}宮" for palace in chart_data["palaces"]])
+                queries.extend([f"{palace}宮" for palace in chart_data["palaces"]])
             
-            query = " ".join(query_parts) if query_parts else "紫微斗數 命盤分析"
+            if not queries:
+                queries = ["紫微斗數 命盤分析"]
             
-            # 檢索相關文檔
-            context_docs = self.search_knowledge(query, top_k=10, min_score=0.6)
-            context_texts = [doc["content"] for doc in context_docs]
+            # 批量檢索相關文檔
+            context_docs = self.search_knowledge_many(queries, top_k=10, min_score=0.6)
+            packed = self.pack_context(context_docs)
             
             # 生成分析
             return self.generator.generate_ziwei_analysis(
                 chart_data=chart_data,
-                context_documents=context_texts,
+                context_documents=packed["documents"],
                 analysis_type=analysis_type
             )
             
@@ -302,6 +502,7 @@ class ZiweiRAGSystem:
         try:
             status = {
                 "system": "active",
+                "ready": self.is_ready(),
                 "config": self.config,
                 "components": {
                     "vector_store": "active" if self.vector_store else "inactive",
@@ -324,6 +525,12 @@ class ZiweiRAGSystem:
             self.logger.error(f"Error getting system status: {str(e)}")
             return {"system": "error", "error": str(e)}
 
+    
+    async def cleanup(self):
+        """釋放嵌入模型的背景資源"""
+        if self.vector_store:
+            self.vector_store.close()
+
 
 # 便捷函數
 def create_rag_system(config: Dict[str, Any] = None) -> ZiweiRAGSystem:
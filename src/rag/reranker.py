@@ -0,0 +1,281 @@
+"""
+交叉編碼器重排序
+向量檢索取較寬的候選集，以小型 CPU 交叉編碼器（如 bge-reranker）一次批量打分後保留最佳結果；
+預估延遲超出請求預算時（如並發排隊過多）跳過重排序，直接返回向量檢索排名
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    RERANKER_AVAILABLE = True
+except ImportError:
+    RERANKER_AVAILABLE = False
+
+from .model_registry import get_model_registry
+from .result_cache import RetrievalResultCache
+
+
+class CrossEncoderReranker:
+    """交叉編碼器重排序器"""
+    
+    def __init__(self,
+                 model_name: str = "BAAI/bge-reranker-base",
+                 device: str = "cpu",
+                 max_length: int = 512,
+                 batch_size: int = 64,
+                 use_fp16: bool = False,
+                 latency_budget_ms: float = 300.0,
+                 cache_size: int = 1024,
+                 score_fn: Optional[Callable[[List[Tuple[str, str]]], Sequence[float]]] = None,
+                 logger=None):
+        """
+        初始化重排序器
+        
+        Args:
+            model_name: 交叉編碼器模型名稱
+            device: 運行設備
+            max_length: (查詢, 文本塊) 對的最大 token 數
+            batch_size: 每次前向傳播的最大對數，候選集不超過此數時一次打分
+            use_fp16: 是否使用半精度（僅 GPU）
+            latency_budget_ms: 每次請求的重排序延遲預算（毫秒），預估超出時跳過，0 表示不限制
+            cache_size: 重排序結果快取條目數（按查詢與候選集雜湊），0 表示停用
+            score_fn: 自訂打分函數，輸入 (查詢, 文本) 對列表返回相關度分數；默認載入交叉編碼器
+            logger: 日誌記錄器
+        """
+        self.model_name = model_name
+        self.device = device
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.use_fp16 = use_fp16
+        self.latency_budget_ms = latency_budget_ms
+        self.logger = logger or logging.getLogger(__name__)
+        
+        self._score_fn = score_fn
+        self._registry_key = None
+        self.tokenizer = None
+        self.model = None
+        self._model_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        self.load_error: Optional[str] = None
+        
+        self.cache = RetrievalResultCache(cache_size) if cache_size > 0 else None
+        
+        # 延遲估計：每對的平均耗時（指數移動平均）與正在排隊打分的對數
+        self._ms_per_pair: Optional[float] = None
+        self._pending_pairs = 0
+        self._state_lock = threading.Lock()
+        
+        # 統計
+        self.reranked = 0
+        self.skipped = 0
+    
+    @property
+    def is_loaded(self) -> bool:
+        return self._score_fn is not None or self.model is not None
+    
+    def load(self, warm_up: bool = True):
+        """
+        載入交叉編碼器（可重複調用，只載入一次）
+        
+        Args:
+            warm_up: 載入後打分一對文本作為預熱，並取得初始延遲估計
+        """
+        if self.is_loaded:
+            return
+        if not RERANKER_AVAILABLE:
+            self.load_error = "torch and transformers are required for cross-encoder reranking"
+            raise ImportError(self.load_error)
+        
+        with self._model_lock:
+            if self.model is not None:
+                return
+            dtype = "float16" if self.use_fp16 and self.device != "cpu" else "float32"
+            registry_key = ("reranker", self.model_name, self.device, dtype)
+            try:
+                (self.tokenizer, self.model), self._encode_lock = get_model_registry().acquire(
+                    registry_key, self._load_model
+                )
+            except Exception as e:
+                self.load_error = str(e)
+                raise
+            self._registry_key = registry_key
+        
+        if warm_up:
+            start_time = time.perf_counter()
+            self._score_pairs([("紫微斗數", "紫微星為帝星")])
+            self._record_latency(1, time.perf_counter() - start_time)
+    
+    def _load_model(self):
+        """載入交叉編碼器模型和分詞器"""
+        self.logger.info(f"Loading reranker model: {self.model_name}")
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+        model = model.to(self.device)
+        model.eval()
+        if self.use_fp16 and self.device != "cpu":
+            model = model.half()
+        return tokenizer, model
+    
+    def _score_pairs(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        """對 (查詢, 文本) 對打分，返回 0~1 的相關度"""
+        if self._score_fn is not None:
+            return np.asarray(self._score_fn(pairs), dtype=np.float32)
+        
+        scores = []
+        with self._encode_lock:
+            for offset in range(0, len(pairs), self.batch_size):
+                batch = pairs[offset:offset + self.batch_size]
+                encoded = self.tokenizer(
+                    [query for query, _ in batch],
+                    [text for _, text in batch],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors="pt"
+                )
+                encoded = {k: v.to(self.device) for k, v in encoded.items()}
+                with torch.inference_mode():
+                    logits = self.model(**encoded).logits.view(-1).float()
+                scores.append(torch.sigmoid(logits).cpu().numpy())
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+    
+    def _record_latency(self, pairs: int, seconds: float):
+        """更新每對平均耗時"""
+        ms_per_pair = seconds * 1000 / max(pairs, 1)
+        with self._state_lock:
+            if self._ms_per_pair is None:
+                self._ms_per_pair = ms_per_pair
+            else:
+                self._ms_per_pair = 0.8 * self._ms_per_pair + 0.2 * ms_per_pair
+    
+    def estimate_latency_ms(self, pairs: int) -> Optional[float]:
+        """預估打分 pairs 對所需時間（含前面排隊的請求），尚無測量時返回 None"""
+        with self._state_lock:
+            if self._ms_per_pair is None:
+                return None
+            return (self._pending_pairs + pairs) * self._ms_per_pair
+    
+    @staticmethod
+    def _candidate_key(result: Dict[str, Any]) -> str:
+        """候選文本的雜湊（文本塊就地更新時 ID 不變，故以內容為鍵）"""
+        return hashlib.blake2b(result["content"].encode("utf-8"), digest_size=16).hexdigest()
+    
+    @classmethod
+    def cache_key(cls, pairs: List[Tuple[str, str]]) -> Tuple:
+        """重排序快取鍵：(查詢, 候選內容雜湊) 集合的雜湊，與候選順序無關"""
+        digest = hashlib.blake2b(digest_size=16)
+        for query, candidate_key in sorted(pairs):
+            digest.update(query.encode("utf-8"))
+            digest.update(b"\x1f")
+            digest.update(candidate_key.encode("utf-8"))
+            digest.update(b"\x1e")
+        return ("rerank", digest.hexdigest())
+    
+    def score(self,
+              queries: List[str],
+              candidates: List[Dict[str, Any]],
+              budget_ms: Optional[float] = None) -> Optional[List[float]]:
+        """
+        一次批量為每個 (查詢, 候選) 對打分
+        
+        Args:
+            queries: 與 candidates 對應的查詢文本
+            candidates: 候選結果（含 content）
+            budget_ms: 本次請求的延遲預算，默認使用 latency_budget_ms
+        
+        Returns:
+            與 candidates 對應的分數；預估延遲超出預算或模型不可用而跳過時返回 None
+        """
+        if not candidates:
+            return []
+        if self.load_error is not None:
+            return None
+        
+        keyed_pairs = [(query, self._candidate_key(result)) for query, result in zip(queries, candidates)]
+        cache_key = self.cache_key(keyed_pairs) if self.cache is not None else None
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                scores = cached[0]
+                return [scores[f"{query}\x1f{key}"] for query, key in keyed_pairs]
+        
+        budget_ms = self.latency_budget_ms if budget_ms is None else budget_ms
+        estimate = self.estimate_latency_ms(len(candidates))
+        if budget_ms and estimate is not None and estimate > budget_ms:
+            self.skipped += 1
+            self.logger.info(f"Skipping rerank of {len(candidates)} candidates: estimated {estimate:.0f}ms > {budget_ms:.0f}ms")
+            return None
+        
+        with self._state_lock:
+            self._pending_pairs += len(candidates)
+        try:
+            self.load()
+            start_time = time.perf_counter()
+            scores = self._score_pairs([(query, result["content"]) for query, result in zip(queries, candidates)])
+            self._record_latency(len(candidates), time.perf_counter() - start_time)
+        except Exception as e:
+            # 重排序只是優化，模型不可用時退回向量檢索排名
+            self.skipped += 1
+            self.logger.warning(f"Rerank failed, keeping vector ranking: {str(e)}")
+            return None
+        finally:
+            with self._state_lock:
+                self._pending_pairs -= len(candidates)
+        
+        scores = [float(score) for score in scores]
+        self.reranked += 1
+        if cache_key is not None:
+            self.cache.put(cache_key, [{f"{query}\x1f{key}": score for (query, key), score in zip(keyed_pairs, scores)}])
+        return scores
+    
+    def rerank(self,
+               query: str,
+               candidates: List[Dict[str, Any]],
+               top_n: int,
+               budget_ms: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        重排序單條查詢的候選結果
+        
+        Args:
+            query: 查詢文本
+            candidates: 向量檢索的候選結果（按向量分數排序）
+            top_n: 保留結果數
+            budget_ms: 本次請求的延遲預算
+        
+        Returns:
+            按 rerank_score 降序的前 top_n 條結果；跳過重排序時返回原排名的前 top_n 條
+        """
+        scores = self.score([query] * len(candidates), candidates, budget_ms)
+        if scores is None:
+            return candidates[:top_n]
+        reranked = [{**result, "rerank_score": score} for result, score in zip(candidates, scores)]
+        reranked.sort(key=lambda result: result["rerank_score"], reverse=True)
+        return reranked[:top_n]
+    
+    def close(self):
+        """釋放共享模型引用"""
+        if self._registry_key is not None:
+            get_model_registry().release(self._registry_key)
+            self._registry_key = None
+            self.model = None
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取重排序統計"""
+        return {
+            "model_name": self.model_name,
+            "loaded": self.is_loaded,
+            "load_error": self.load_error,
+            "latency_budget_ms": self.latency_budget_ms,
+            "ms_per_pair": self._ms_per_pair,
+            "reranked": self.reranked,
+            "skipped": self.skipped,
+            "cache": self.cache.get_stats() if self.cache else None
+        }
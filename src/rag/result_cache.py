@@ -0,0 +1,92 @@
+"""
+檢索結果快取
+以 (查詢向量, top_k, 過濾條件, 集合版本) 為鍵快取向量檢索結果，集合寫入後版本遞增即自動失效
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class RetrievalResultCache:
+    """檢索結果 LRU 快取"""
+    
+    def __init__(self, max_size: int = 256):
+        """
+        初始化檢索結果快取
+        
+        Args:
+            max_size: 最大快取條目數
+        """
+        self.max_size = max_size
+        
+        self._entries: "OrderedDict[Tuple, List[Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        
+        # 命中統計
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def make_key(query_embedding: Sequence[float],
+                 top_k: int,
+                 filter_metadata: Optional[Dict[str, Any]],
+                 version: Hashable,
+                 query: Optional[str] = None) -> Tuple:
+        """
+        生成快取鍵
+        
+        Args:
+            query_embedding: 查詢向量
+            top_k: 返回結果數量
+            filter_metadata: 元數據過濾條件
+            version: 集合版本（寫入後改變）
+            query: 查詢文本，結果依賴文本時（混合檢索）才需要傳入
+        
+        Returns:
+            快取鍵
+        """
+        vector = np.ascontiguousarray(query_embedding, dtype=np.float32)
+        embedding_key = hashlib.blake2b(vector.tobytes(), digest_size=16).hexdigest()
+        filter_key = json.dumps(filter_metadata, sort_keys=True, ensure_ascii=False) if filter_metadata else None
+        return (embedding_key, top_k, filter_key, version, query)
+    
+    def get(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        """獲取快取結果（返回副本，調用方修改不影響快取）"""
+        with self._lock:
+            results = self._entries.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [dict(result) for result in results]
+    
+    def put(self, key: Tuple, results: List[Dict[str, Any]]):
+        """設置快取結果"""
+        with self._lock:
+            self._entries[key] = [dict(result) for result in results]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """清空快取"""
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取快取統計"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
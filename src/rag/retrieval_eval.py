@@ -0,0 +1,286 @@
+"""
+檢索評測
+以版本化的標準查詢集評估向量庫的檢索品質（recall@k、MRR、nDCG）與嵌入、檢索延遲；
+分塊、top_k、最低分數、混合檢索等改動前後各評測一次，比較 JSON 報告即可判斷改動的效果
+"""
+
+import hashlib
+import json
+import math
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .domain_filters import domain_filter
+from .embedding_cache import normalize_text
+from .knowledge_lookup import to_traditional
+
+
+DEFAULT_GOLDEN_SET = Path(__file__).with_name("golden_queries.json")
+DEFAULT_KS = (1, 3, 5, 10)
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """計算百分位數（最近秩），無數據時返回 0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _match_text(text: str) -> str:
+    """比對用文本：繁簡統一並正規化空白"""
+    return normalize_text(to_traditional(text or ""))
+
+
+class GoldenQuerySet:
+    """版本化的標準查詢集（JSON 文件）"""
+    
+    def __init__(self,
+                 queries: List[Dict[str, Any]],
+                 name: str = "ziwei-golden",
+                 version: int = 1,
+                 description: str = "",
+                 digest: Optional[str] = None):
+        """
+        初始化標準查詢集
+        
+        Args:
+            queries: 查詢列表，每條含 id、query、relevant（[{contains: [...]} 或 {id: ...}, grade]），可選 domain
+            name: 查詢集名稱
+            version: 查詢集版本，修改查詢或相關判定時遞增
+            description: 說明
+            digest: 文件內容雜湊，用於確認兩次評測使用同一查詢集
+        """
+        for entry in queries:
+            if not entry.get("id") or not entry.get("query") or not entry.get("relevant"):
+                raise ValueError(f"Golden query requires id, query and relevant: {entry}")
+            for spec in entry["relevant"]:
+                if not spec.get("contains") and not spec.get("id"):
+                    raise ValueError(f"Relevance spec requires contains or id: {entry['id']}")
+        self.queries = queries
+        self.name = name
+        self.version = version
+        self.description = description
+        self.digest = digest
+    
+    def __len__(self) -> int:
+        return len(self.queries)
+    
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "GoldenQuerySet":
+        """載入標準查詢集，默認為隨代碼維護的 golden_queries.json"""
+        raw = Path(path or DEFAULT_GOLDEN_SET).read_bytes()
+        data = json.loads(raw.decode("utf-8"))
+        return cls(
+            data["queries"],
+            name=data.get("name", "ziwei-golden"),
+            version=data.get("version", 1),
+            description=data.get("description", ""),
+            digest=hashlib.sha256(raw).hexdigest()[:16]
+        )
+    
+    def info(self) -> Dict[str, Any]:
+        """報告中記錄的查詢集資訊"""
+        return {"name": self.name, "version": self.version, "sha256": self.digest, "queries": len(self)}
+
+
+def judge(results: List[Dict[str, Any]], relevant: List[Dict[str, Any]]) -> List[Tuple[Optional[int], int]]:
+    """
+    判定每條檢索結果的相關性
+    
+    每個相關條目只計一次：結果符合多個未命中條目時歸入等級最高者，只符合已命中條目的結果視為不相關
+    （重複內容不增加資訊）。
+    
+    Args:
+        results: 檢索結果（按排名，含 content、id）
+        relevant: 相關判定條目
+    
+    Returns:
+        與 results 對應的 (命中的條目索引或 None, 相關等級)
+    """
+    specs = [
+        (index, spec.get("id"), [_match_text(term) for term in spec.get("contains", [])], int(spec.get("grade", 1)))
+        for index, spec in enumerate(relevant)
+    ]
+    matched = set()
+    judged: List[Tuple[Optional[int], int]] = []
+    for result in results:
+        text = _match_text(result.get("content", ""))
+        candidates = [
+            (grade, index) for index, doc_id, terms, grade in specs
+            if index not in matched and (
+                (doc_id and result.get("id") == doc_id) or (terms and all(term in text for term in terms))
+            )
+        ]
+        if candidates:
+            grade, index = max(candidates, key=lambda candidate: (candidate[0], -candidate[1]))
+            matched.add(index)
+            judged.append((index, grade))
+        else:
+            judged.append((None, 0))
+    return judged
+
+
+def recall_at_k(judged: List[Tuple[Optional[int], int]], num_relevant: int, k: int) -> float:
+    """前 k 條結果命中的相關條目比例"""
+    hits = sum(1 for index, _ in judged[:k] if index is not None)
+    return hits / num_relevant if num_relevant else 0.0
+
+
+def reciprocal_rank(judged: List[Tuple[Optional[int], int]]) -> float:
+    """第一條相關結果排名的倒數，沒有相關結果時為 0"""
+    for rank, (index, _) in enumerate(judged, 1):
+        if index is not None:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(judged: List[Tuple[Optional[int], int]], grades: List[int], k: int) -> float:
+    """前 k 條結果的 nDCG（增益 2^grade - 1，理想排序為相關條目按等級降序）"""
+    dcg = sum((2 ** grade - 1) / math.log2(rank + 2) for rank, (_, grade) in enumerate(judged[:k]))
+    ideal = sorted(grades, reverse=True)[:k]
+    idcg = sum((2 ** grade - 1) / math.log2(rank + 2) for rank, grade in enumerate(ideal))
+    return dcg / idcg if idcg else 0.0
+
+
+def describe_store(store) -> Dict[str, Any]:
+    """記錄評測時向量庫的檢索配置"""
+    reranker = getattr(store, "reranker", None)
+    return {
+        "collection_name": getattr(store, "collection_name", None),
+        "index_backend": getattr(store, "index_backend", None),
+        "numpy_index_quantization": getattr(store, "numpy_index_quantization", None),
+        "hybrid_search": getattr(store, "hybrid_search", None),
+        "rerank": reranker is not None,
+        "reranker_model": getattr(reranker, "model_name", None),
+        "embedding_model": getattr(store, "embedding_model", None),
+        "chunk_size": getattr(store, "chunk_size", None),
+        "chunk_overlap": getattr(store, "chunk_overlap", None)
+    }
+
+
+def _clear_result_caches(store):
+    """清空結果快取與重排序快取，使每次檢索都實際執行"""
+    if getattr(store, "result_cache", None) is not None:
+        store.result_cache.clear()
+    reranker = getattr(store, "reranker", None)
+    if reranker is not None and reranker.cache is not None:
+        reranker.cache.clear()
+
+
+def evaluate_retrieval(store,
+                       golden_set: Optional[GoldenQuerySet] = None,
+                       ks: Sequence[int] = DEFAULT_KS,
+                       repeats: int = 3,
+                       min_score: Optional[float] = None,
+                       use_domain_filters: bool = False,
+                       clear_caches: bool = True,
+                       include_per_query: bool = True) -> Dict[str, Any]:
+    """
+    以標準查詢集評測向量庫
+    
+    每條查詢先嵌入再以查詢向量檢索，分別計時；品質指標以最後一次的檢索結果計算。
+    嵌入延遲包含嵌入模型的查詢快取，測量實際推理時應停用查詢快取。
+    
+    Args:
+        store: 向量庫（ZiweiVectorStore 或提供 embeddings.embed_query 與 search_by_vector 的對象）
+        golden_set: 標準查詢集，默認載入 golden_queries.json
+        ks: 計算 recall@k 與 nDCG@k 的 k 值，檢索 max(ks) 條
+        repeats: 每條查詢的重複次數（延遲取所有重複的分位數）
+        min_score: 過濾低於此分數的結果（與 RAG 系統的 min_score 一致），None 表示不過濾
+        use_domain_filters: 按查詢的 domain 下推內容分類過濾
+        clear_caches: 每次檢索前清空結果快取與重排序快取
+        include_per_query: 報告中包含每條查詢的排名與指標
+    
+    Returns:
+        JSON 可序列化的評測報告
+    """
+    golden_set = golden_set or GoldenQuerySet.load()
+    ks = sorted(set(ks))
+    top_k = ks[-1]
+    embed_ms: List[float] = []
+    search_ms: List[float] = []
+    rows: List[Dict[str, Any]] = []
+    
+    for entry in golden_set.queries:
+        where = domain_filter(entry.get("domain")) if use_domain_filters else None
+        results: List[Dict[str, Any]] = []
+        for _ in range(max(repeats, 1)):
+            start = time.perf_counter()
+            embedding = np.asarray(store.embeddings.embed_query(entry["query"]), dtype=np.float32)
+            embed_ms.append((time.perf_counter() - start) * 1000)
+            
+            if clear_caches:
+                _clear_result_caches(store)
+            start = time.perf_counter()
+            results = store.search_by_vector(entry["query"], embedding, top_k, where)
+            search_ms.append((time.perf_counter() - start) * 1000)
+        
+        if min_score is not None:
+            results = [result for result in results if result.get("rerank_score", result["score"]) >= min_score]
+        judged = judge(results, entry["relevant"])
+        grades = [int(spec.get("grade", 1)) for spec in entry["relevant"]]
+        
+        row = {"id": entry["id"], "query": entry["query"], "mrr": reciprocal_rank(judged)}
+        for k in ks:
+            row[f"recall@{k}"] = recall_at_k(judged, len(grades), k)
+            row[f"ndcg@{k}"] = ndcg_at_k(judged, grades, k)
+        row["retrieved"] = [
+            {"id": result.get("id"), "score": round(float(result["score"]), 4), "relevant": index is not None}
+            for result, (index, _) in zip(results, judged)
+        ]
+        rows.append(row)
+    
+    metric_names = ["mrr"] + [f"{name}@{k}" for name in ("recall", "ndcg") for k in ks]
+    metrics = {name: round(statistics.fmean(row[name] for row in rows), 4) if rows else 0.0 for name in metric_names}
+    
+    report = {
+        "golden_set": golden_set.info(),
+        "store": describe_store(store),
+        "settings": {
+            "ks": ks,
+            "repeats": repeats,
+            "min_score": min_score,
+            "use_domain_filters": use_domain_filters,
+            "clear_caches": clear_caches
+        },
+        "metrics": metrics,
+        "latency": {
+            "embed_p50_ms": round(percentile(embed_ms, 50), 3),
+            "embed_p99_ms": round(percentile(embed_ms, 99), 3),
+            "search_p50_ms": round(percentile(search_ms, 50), 3),
+            "search_p99_ms": round(percentile(search_ms, 99), 3),
+            "samples": len(search_ms)
+        },
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+    if include_per_query:
+        report["per_query"] = rows
+    return report
+
+
+def compare_reports(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    比較兩份評測報告
+    
+    Returns:
+        {'same_golden_set': 是否同一查詢集, 'metrics': 指標差值, 'latency': 延遲差值}（current - baseline）
+    """
+    def deltas(section: str) -> Dict[str, float]:
+        previous = baseline.get(section, {})
+        return {
+            name: round(value - previous[name], 4)
+            for name, value in current.get(section, {}).items()
+            if name in previous and isinstance(value, (int, float))
+        }
+    
+    return {
+        "same_golden_set": current.get("golden_set", {}).get("sha256") == baseline.get("golden_set", {}).get("sha256"),
+        "metrics": deltas("metrics"),
+        "latency": deltas("latency")
+    }
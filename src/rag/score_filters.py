@@ -0,0 +1,30 @@
+"""
+檢索結果分數過濾
+向量檢索、混合檢索與重排序結果共用的最低分數判斷
+"""
+
+from typing import Any, Dict
+
+
+def passes_min_score(result: Dict[str, Any],
+                     min_score: float,
+                     top_k: int,
+                     rerank_min_score: float = 0.0) -> bool:
+    """
+    判斷檢索結果是否保留
+    
+    稠密分數達標，或混合檢索中詞法排名靠前（精確命中星曜、宮位名稱）的結果保留；
+    經交叉編碼器重排序的結果改以重排序分數與 rerank_min_score 比較。
+    
+    Args:
+        result: 檢索結果（含 score，可能含 lexical_rank、rerank_score）
+        min_score: 最小稠密相似度分數
+        top_k: 檢索結果數量，詞法排名在此之內的結果保留
+        rerank_min_score: 最小重排序分數
+    """
+    if "rerank_score" in result:
+        return result["rerank_score"] >= rerank_min_score
+    if result["score"] >= min_score:
+        return True
+    lexical_rank = result.get("lexical_rank")
+    return lexical_rank is not None and lexical_rank <= top_k
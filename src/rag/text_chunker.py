@@ -0,0 +1,369 @@
+"""
+中文串流文本分塊
+按頁增量輸入文本，以線性掃描在句末標點處切句，遇到章、節、星曜或宮位標題時另起新塊，
+並把所屬標題寫入元數據；塊大小以嵌入模型的 token 數計算
+"""
+
+import hashlib
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .embedding_cache import normalize_text
+
+
+# 句末標點（含緊隨其後的引號、括號）
+_SENTENCE_END = re.compile(r"[。！？；!?;]+[」』”’）)]*")
+# 句內次級標點，超長句子在此處再切分
+_CLAUSE_END = re.compile(r"[，、：,:]")
+# 標題行不含的標點
+_HEADING_PUNCTUATION = re.compile(r"[，。！？；：、,!?;:]")
+
+_NUMERAL = r"[一二三四五六七八九十百千零〇两兩0-9]+"
+_CHAPTER_HEADING = re.compile(rf"^(第{_NUMERAL}[章卷篇部]|#{{1,2}}\s)")
+_SECTION_HEADING = re.compile(rf"^(第{_NUMERAL}[节節]|[一二三四五六七八九十]+[、．.]|#{{3,6}}\s)")
+
+# 星曜、宮位標題關鍵詞（繁簡並列）
+_TOPIC_TERMS = (
+    "紫微", "天機", "天机", "太陽", "太阳", "武曲", "天同", "廉貞", "廉贞", "天府", "太陰", "太阴",
+    "貪狼", "贪狼", "巨門", "巨门", "天相", "天梁", "七殺", "七杀", "破軍", "破军",
+    "命宮", "命宫", "兄弟宮", "兄弟宫", "夫妻宮", "夫妻宫", "子女宮", "子女宫", "財帛宮", "财帛宫",
+    "疾厄宮", "疾厄宫", "遷移宮", "迁移宫", "奴僕宮", "奴仆宫", "交友宮", "交友宫", "官祿宮", "官禄宫",
+    "事業宮", "事业宫", "田宅宮", "田宅宫", "福德宮", "福德宫", "父母宮", "父母宫"
+)
+
+_HEADING_MAX_CHARS = 30
+_TOPIC_MAX_CHARS = 12
+
+# 標題層級：上層標題出現時清除下層
+HEADING_LEVELS = ("chapter", "section", "topic")
+
+
+def content_chunk_id(content: str, source: str = "") -> str:
+    """
+    以內容哈希生成穩定的文本塊 ID
+    
+    同一來源中內容相同的文本塊總是得到相同 ID，重複導入時可直接比對而不重新嵌入。
+    
+    Args:
+        content: 文本塊內容
+        source: 來源文件名稱
+    
+    Returns:
+        文本塊 ID
+    """
+    digest = hashlib.sha1(f"{source}\x00{normalize_text(content)}".encode("utf-8")).hexdigest()
+    return f"doc_{digest[:16]}"
+
+
+def detect_heading(line: str) -> Optional[str]:
+    """
+    判斷一行文本是否為標題
+    
+    Args:
+        line: 去除首尾空白的行文本
+    
+    Returns:
+        標題層級 chapter / section / topic，不是標題時返回 None
+    """
+    if not line or len(line) > _HEADING_MAX_CHARS or _HEADING_PUNCTUATION.search(line):
+        return None
+    if _CHAPTER_HEADING.match(line):
+        return "chapter"
+    if _SECTION_HEADING.match(line):
+        return "section"
+    if len(line) <= _TOPIC_MAX_CHARS and any(term in line for term in _TOPIC_TERMS):
+        return "topic"
+    return None
+
+
+class _Segment:
+    """句子或標題在全文中的範圍"""
+    
+    __slots__ = ("start", "end", "tokens", "heading")
+    
+    def __init__(self, start: int, end: int, heading: Optional[str] = None):
+        self.start = start
+        self.end = end
+        self.tokens = 0
+        self.heading = heading
+
+
+class StreamingTextChunker:
+    """
+    中文串流分塊器
+    
+    - 句子邊界以一次線性掃描找出，PDF 換行不視為句末，跨頁的句子會接續到下一頁
+    - 章、節標題與獨立成行的星曜、宮位名稱另起新塊，標題寫入後續文本塊的元數據
+    - 塊大小與重疊以 count_tokens 計算（傳入嵌入模型分詞器時即為實際 token 數），
+      重疊以整句為單位，不跨越標題
+    """
+    
+    def __init__(self,
+                 chunk_size: int = 1000,
+                 overlap: int = 200,
+                 count_tokens: Optional[Callable[[List[str]], List[int]]] = None,
+                 start_offset: int = 0,
+                 headings: Optional[Dict[str, str]] = None):
+        """
+        初始化分塊器
+        
+        Args:
+            chunk_size: 文本塊最大 token 數（未提供 count_tokens 時為字數）
+            overlap: 相鄰文本塊的重疊 token 數
+            count_tokens: 批量計算 token 數的函數（如 BGEM3Embeddings._count_tokens），默認按字數
+            start_offset: 第一頁在全文中的位置（從檢查點續傳時使用，保持 start_pos/end_pos 一致）
+            headings: 續傳時沿用的標題上下文
+        """
+        if overlap >= chunk_size:
+            raise ValueError("overlap must be smaller than chunk_size")
+        
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.count_tokens = count_tokens or (lambda texts: [len(text) for text in texts])
+        # 分詞器對每次調用附加的特殊 token（如 [CLS]、[SEP]），逐句計數時扣除，整塊計一次
+        self._special_tokens = self.count_tokens([""])[0]
+        
+        # 緩衝區只保留尚未輸出的文本；_offset 為緩衝區開頭在全文中的位置
+        self._buffer = ""
+        self._offset = start_offset
+        self._fragment_start = start_offset
+        # 已掃描到的位置（總在行首）與尚未結束的句子是否含有文字
+        self._scanned = start_offset
+        self._fragment_open = False
+        # 每頁的 (起始位置, 頁碼, 該頁開頭的標題上下文)
+        self._page_starts: List[Tuple[int, Optional[int], Dict[str, str]]] = []
+        
+        # 組裝中的文本塊；前 _overlap_count 段是上一塊帶過來的重疊
+        self._current: List[_Segment] = []
+        self._current_tokens = 0
+        self._overlap_count = 0
+        # 正在組裝的段落起點，裁剪緩衝區時不可越過
+        self._pending_start: Optional[int] = None
+        self.headings: Dict[str, str] = dict(headings or {})
+    
+    @property
+    def _end(self) -> int:
+        """緩衝區結尾在全文中的位置"""
+        return self._offset + len(self._buffer)
+    
+    def split_text(self, text: str) -> List[Dict[str, Any]]:
+        """一次切分整段文本（不帶頁碼）"""
+        return list(self.feed(None, text)) + list(self.flush())
+    
+    def feed(self, page_num: Optional[int], text: str) -> Iterator[Dict[str, Any]]:
+        """
+        輸入一頁文本，輸出已確定邊界的文本塊
+        
+        Args:
+            page_num: 頁碼，None 表示不記錄頁碼
+            text: 頁面文本
+        
+        Yields:
+            文本塊 {'content': ..., 'metadata': {...}, 'resume_point': ...}
+        """
+        if not text:
+            return
+        
+        self._page_starts.append((self._end, page_num, dict(self.headings)))
+        self._buffer += text + "\n"
+        yield from self._assemble(self._scan())
+    
+    def flush(self) -> Iterator[Dict[str, Any]]:
+        """輸出緩衝區中剩餘的文本"""
+        segments = []
+        self._close_fragment(self._end, segments)
+        self._count(segments)
+        yield from self._assemble(segments)
+        
+        chunk = self._emit(carry_overlap=False)
+        if chunk is not None:
+            yield chunk
+        self._offset = self._fragment_start = self._scanned = self._end
+        self._fragment_open = False
+        self._buffer = ""
+    
+    def _text(self, start: int, end: int) -> str:
+        """取出全文範圍 [start, end) 的文本"""
+        return self._buffer[start - self._offset:end - self._offset]
+    
+    def _close_fragment(self, end: int, segments: List[_Segment]):
+        """把尚未結束的句子片段作為一段輸出"""
+        if end > self._fragment_start and self._text(self._fragment_start, end).strip():
+            segments.append(_Segment(self._fragment_start, end))
+        self._fragment_start = end
+    
+    def _scan(self) -> List[_Segment]:
+        """逐行掃描新加入的文本，切出完整句子與標題；未結束的句子留待下一頁"""
+        segments: List[_Segment] = []
+        buffer = self._buffer
+        
+        line_start = self._scanned - self._offset
+        while True:
+            line_end = buffer.find("\n", line_start)
+            if line_end == -1:
+                break
+            
+            line = buffer[line_start:line_end].strip()
+            global_start = self._offset + line_start
+            global_end = self._offset + line_end + 1
+            
+            # 標題必須獨立成行，且前面沒有未結束的句子
+            level = None if self._fragment_open else detect_heading(line)
+            
+            if level is not None:
+                self._close_fragment(global_start, segments)
+                segments.append(_Segment(global_start, global_end, heading=level))
+                self._fragment_start = global_end
+                self._fragment_open = False
+            elif not line:
+                # 空行為段落邊界
+                self._close_fragment(global_end, segments)
+                self._fragment_open = False
+            else:
+                for match in _SENTENCE_END.finditer(buffer, line_start, line_end):
+                    self._close_fragment(self._offset + match.end(), segments)
+                tail_start = max(line_start, self._fragment_start - self._offset)
+                self._fragment_open = tail_start == line_start or bool(buffer[tail_start:line_end].strip())
+            
+            line_start = line_end + 1
+        
+        self._scanned = self._offset + line_start
+        self._count(segments)
+        return segments
+    
+    def _count(self, segments: List[_Segment]):
+        """批量計算各段的 token 數（不含分詞器附加的特殊 token）"""
+        if not segments:
+            return
+        counts = self.count_tokens([self._text(segment.start, segment.end) for segment in segments])
+        for segment, count in zip(segments, counts):
+            segment.tokens = max(count - self._special_tokens, 0)
+    
+    def _fit(self, segment: _Segment) -> List[_Segment]:
+        """超過塊大小的段落先在逗號處切分，仍過長時按比例切成等長片段"""
+        limit = self.chunk_size - self._special_tokens
+        if segment.tokens <= limit:
+            return [segment]
+        
+        text = self._text(segment.start, segment.end)
+        cuts = [segment.start + match.end() for match in _CLAUSE_END.finditer(text)]
+        pieces = []
+        start = segment.start
+        for cut in cuts + [segment.end]:
+            if cut > start:
+                pieces.append(_Segment(start, cut))
+                start = cut
+        self._count(pieces)
+        
+        fitted = []
+        for piece in pieces:
+            if piece.tokens <= limit:
+                fitted.append(piece)
+                continue
+            # 以字數估算切分長度，留一成餘量
+            step = max(int((piece.end - piece.start) * limit / piece.tokens * 0.9), 1)
+            windows = [
+                _Segment(position, min(position + step, piece.end))
+                for position in range(piece.start, piece.end, step)
+            ]
+            self._count(windows)
+            fitted.extend(windows)
+        return fitted
+    
+    def _assemble(self, segments: List[_Segment]) -> Iterator[Dict[str, Any]]:
+        """把句子與標題組裝成文本塊"""
+        limit = self.chunk_size - self._special_tokens
+        
+        for segment in segments:
+            self._pending_start = segment.start
+            if segment.heading is not None:
+                # 標題另起新塊，不帶重疊
+                chunk = self._emit(carry_overlap=False)
+                if chunk is not None:
+                    yield chunk
+                self._set_heading(segment.heading, self._text(segment.start, segment.end).strip())
+                self._current = [segment]
+                self._current_tokens = segment.tokens
+                continue
+            
+            for piece in self._fit(segment):
+                if self._current_tokens + piece.tokens > limit and len(self._current) > self._overlap_count:
+                    chunk = self._emit(carry_overlap=True)
+                    if chunk is not None:
+                        yield chunk
+                self._current.append(piece)
+                self._current_tokens += piece.tokens
+        self._pending_start = None
+    
+    def _set_heading(self, level: str, text: str):
+        """更新標題上下文，清除下層標題"""
+        for lower in HEADING_LEVELS[HEADING_LEVELS.index(level):]:
+            self.headings.pop(lower, None)
+        self.headings[level] = text.lstrip("#").strip()
+    
+    def _emit(self, carry_overlap: bool) -> Optional[Dict[str, Any]]:
+        """輸出組裝中的文本塊，並保留結尾若干整句作為下一塊的重疊"""
+        current = self._current
+        has_new_content = len(current) > self._overlap_count
+        
+        chunk = None
+        if has_new_content:
+            start_pos, end_pos = current[0].start, current[-1].end
+            content = self._text(start_pos, end_pos).strip()
+            if content:
+                page_start = self._page_at(start_pos)[1]
+                page_end_offset, page_end, page_headings = self._page_at(end_pos - 1)
+                metadata = {
+                    'start_pos': start_pos,
+                    'end_pos': end_pos,
+                    'token_count': self._current_tokens + self._special_tokens,
+                    **self.headings
+                }
+                if page_start is not None:
+                    metadata['page_start'] = page_start
+                    metadata['page_end'] = page_end
+                chunk = {
+                    'content': content,
+                    'metadata': metadata,
+                    # 續傳點：此塊最後一頁的頁碼、起始位置與該頁開頭的標題上下文，此塊提交後從該頁重新分塊即不遺漏文本
+                    'resume_point': (page_end, page_end_offset, page_headings)
+                }
+        
+        # 保留結尾的整句作為重疊（至少留下一段新內容不重疊）
+        kept: List[_Segment] = []
+        kept_tokens = 0
+        if carry_overlap and has_new_content:
+            for segment in reversed(current[1:]):
+                if kept_tokens + segment.tokens > self.overlap:
+                    break
+                kept.insert(0, segment)
+                kept_tokens += segment.tokens
+        self._current = kept
+        self._current_tokens = kept_tokens
+        self._overlap_count = len(kept)
+        
+        self._trim()
+        return chunk
+    
+    def _trim(self):
+        """丟棄緩衝區中不再需要的文本與頁面起點"""
+        keep_from = min(
+            [segment.start for segment in self._current[:1]]
+            + [start for start in (self._pending_start,) if start is not None]
+            + [self._fragment_start]
+        )
+        if keep_from > self._offset:
+            self._buffer = self._buffer[keep_from - self._offset:]
+            self._offset = keep_from
+        
+        while len(self._page_starts) > 1 and self._page_starts[1][0] <= self._offset:
+            self._page_starts.pop(0)
+    
+    def _page_at(self, position: int) -> Tuple[int, Optional[int], Dict[str, str]]:
+        """返回全文位置所在頁的 (起始位置, 頁碼, 該頁開頭的標題上下文)"""
+        found = self._page_starts[0] if self._page_starts else (self._offset, None, {})
+        for page_start in self._page_starts:
+            if page_start[0] > position:
+                break
+            found = page_start
+        return found[0], found[1], dict(found[2])
@@ -0,0 +1,246 @@
+"""
+嵌入推理的 torch 運行時設定
+同一台機器上的多個 API 工作進程各自推理時，torch 默認讓每個進程都使用全部核心，線程互相搶佔；
+auto 模式按偵測到的工作進程數平分核心，並可把每個進程綁定到各自的 CPU 集合
+"""
+
+import logging
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Union
+
+try:
+    import torch
+    TORCH_AVAILABLE = True
+except ImportError:
+    TORCH_AVAILABLE = False
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# 依序檢查的工作進程數環境變數（EMBEDDING_SERVER_WORKERS 為顯式設定，WEB_CONCURRENCY 為 uvicorn / gunicorn 慣例）
+WORKER_COUNT_ENV = ("EMBEDDING_SERVER_WORKERS", "WEB_CONCURRENCY", "UVICORN_WORKERS", "GUNICORN_WORKERS")
+# 顯式指定本進程的工作進程編號（未設定時以文件鎖自動取得）
+WORKER_SLOT_ENV = "EMBEDDING_WORKER_SLOT"
+SLOT_LOCK_DIR_ENV = "EMBEDDING_WORKER_SLOT_DIR"
+
+# 進程內已套用的設定（線程數與親和性是進程全域的，只套用一次）
+_applied: Optional[Dict[str, Any]] = None
+# 持有的編號文件鎖，進程結束時由作業系統釋放
+_slot_handles: List[Any] = []
+
+
+def available_cpus() -> List[int]:
+    """本進程可使用的 CPU 編號（考慮容器或 taskset 的限制）"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def detect_server_workers() -> int:
+    """從環境變數偵測同一台機器上的 API 工作進程數，未設定時返回 1"""
+    for name in WORKER_COUNT_ENV:
+        value = os.getenv(name, "").strip()
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+    return 1
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """解析 CPU 列表（如 "0-3,8,10-11"）"""
+    cpus: List[int] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+def claim_worker_slot(num_slots: int, lock_dir: Optional[str] = None) -> Optional[int]:
+    """
+    取得本進程的工作進程編號
+    
+    優先使用 EMBEDDING_WORKER_SLOT；否則在 0..num_slots-1 中以文件鎖取得第一個未被其他進程佔用的編號，
+    進程結束時鎖自動釋放，重啟的工作進程可取回同一編號。
+    
+    Args:
+        num_slots: 編號數（工作進程數）
+        lock_dir: 鎖文件目錄，默認為系統臨時目錄下的 ziwei_embedding_slots
+    
+    Returns:
+        編號；所有編號都被佔用時返回 None
+    """
+    value = os.getenv(WORKER_SLOT_ENV, "").strip()
+    if value.isdigit():
+        return int(value) % max(num_slots, 1)
+    if fcntl is None:
+        # 無文件鎖（Windows）時以進程 ID 分配，可能重複
+        return os.getpid() % max(num_slots, 1)
+    
+    lock_dir = lock_dir or os.getenv(SLOT_LOCK_DIR_ENV) or os.path.join(tempfile.gettempdir(), "ziwei_embedding_slots")
+    os.makedirs(lock_dir, exist_ok=True)
+    for slot in range(num_slots):
+        handle = open(os.path.join(lock_dir, f"slot-{slot}.lock"), "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        _slot_handles.append(handle)
+        return slot
+    return None
+
+
+def plan_runtime(intra_op_threads: Union[int, str] = 0,
+                 inter_op_threads: int = 0,
+                 cpu_affinity: Optional[str] = None,
+                 server_workers: int = 0,
+                 worker_slot: Optional[int] = None,
+                 lock_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    計算本進程的線程數與 CPU 集合（不套用）
+    
+    Args:
+        intra_op_threads: 算子內線程數；"auto" 按工作進程數平分核心（綁定 CPU 集合時等於集合大小），0 表示沿用 torch 默認
+        inter_op_threads: 算子間線程數，0 表示沿用 torch 默認
+        cpu_affinity: None 不綁定；"auto" 把可用核心按工作進程數分成連續區段，本進程綁定自己編號的區段；
+                      CPU 列表（如 "0-3"）所有進程共用；以 ; 分隔的多個列表（如 "0-3;4-7"）按編號各取一個
+        server_workers: 工作進程數，0 表示從環境變數偵測
+        worker_slot: 本進程的編號，None 時自動取得（僅在需要按編號分配 CPU 集合時）
+        lock_dir: 自動取得編號時的鎖文件目錄
+    
+    Returns:
+        {'intra_op_threads', 'inter_op_threads', 'cpu_set', 'server_workers', 'worker_slot'}
+    """
+    cpus = available_cpus()
+    workers = server_workers or detect_server_workers()
+    
+    cpu_sets: List[List[int]] = []
+    if cpu_affinity == "auto":
+        if workers > 1:
+            size = max(1, len(cpus) // workers)
+            starts = [(slot * size) % len(cpus) for slot in range(workers)]
+            cpu_sets = [cpus[start:start + size] for start in starts]
+    elif cpu_affinity:
+        cpu_sets = [parse_cpu_list(part) for part in cpu_affinity.split(";") if part.strip()]
+    
+    cpu_set = None
+    if len(cpu_sets) == 1:
+        cpu_set = cpu_sets[0]
+    elif cpu_sets:
+        if worker_slot is None:
+            worker_slot = claim_worker_slot(len(cpu_sets), lock_dir)
+        if worker_slot is not None:
+            cpu_set = cpu_sets[worker_slot % len(cpu_sets)]
+    
+    if intra_op_threads == "auto":
+        # 單一工作進程且未綁定時沿用 torch 默認（物理核心數）
+        threads = len(cpu_set) if cpu_set else (max(1, len(cpus) // workers) if workers > 1 else 0)
+    else:
+        threads = int(intra_op_threads or 0)
+    
+    return {
+        "intra_op_threads": threads,
+        "inter_op_threads": int(inter_op_threads or 0),
+        "cpu_set": cpu_set,
+        "server_workers": workers,
+        "worker_slot": worker_slot
+    }
+
+
+def _set_process_affinity(cpu_set: List[int]):
+    """把進程內所有現有線程綁定到 CPU 集合（之後建立的線程繼承建立者的設定）"""
+    try:
+        thread_ids = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        thread_ids = [0]
+    for tid in thread_ids:
+        try:
+            os.sched_setaffinity(tid, cpu_set)
+        except ProcessLookupError:
+            # 線程已結束
+            continue
+
+
+def configure_torch_runtime(intra_op_threads: Union[int, str] = 0,
+                            inter_op_threads: int = 0,
+                            cpu_affinity: Optional[str] = None,
+                            server_workers: int = 0,
+                            worker_slot: Optional[int] = None,
+                            logger=None) -> Dict[str, Any]:
+    """
+    套用本進程的 torch 線程數與 CPU 親和性
+    
+    設定是進程全域的，只在第一次有設定的調用時套用，之後的調用返回已套用的設定；全部為默認值時不做任何更改。
+    算子間線程數只能在 torch 執行並行工作之前設定，應在載入模型前調用。
+    
+    Args:
+        intra_op_threads: 算子內線程數（"auto" 或整數，0 表示沿用默認）
+        inter_op_threads: 算子間線程數（0 表示沿用默認）
+        cpu_affinity: CPU 集合設定（見 plan_runtime）
+        server_workers: 工作進程數，0 表示從環境變數偵測
+        worker_slot: 本進程的編號，None 時自動取得
+        logger: 日誌記錄器
+    
+    Returns:
+        已套用的設定（含 torch 實際的線程數）
+    """
+    global _applied
+    logger = logger or logging.getLogger(__name__)
+    if isinstance(intra_op_threads, str) and intra_op_threads != "auto":
+        intra_op_threads = int(intra_op_threads or 0)
+    
+    requested = bool(intra_op_threads) or bool(inter_op_threads) or bool(cpu_affinity)
+    if _applied is not None:
+        if requested and _applied.get("requested") != [intra_op_threads, inter_op_threads, cpu_affinity]:
+            logger.warning("Torch runtime already configured in this process, keeping the first settings")
+        return _applied
+    if not requested:
+        return current_runtime()
+    
+    plan = plan_runtime(intra_op_threads, inter_op_threads, cpu_affinity, server_workers, worker_slot)
+    
+    if plan["cpu_set"]:
+        if hasattr(os, "sched_setaffinity"):
+            try:
+                _set_process_affinity(plan["cpu_set"])
+            except OSError as e:
+                logger.warning(f"Failed to set CPU affinity {plan['cpu_set']}: {str(e)}")
+                plan["cpu_set"] = None
+        else:
+            logger.warning("CPU affinity is not supported on this platform")
+            plan["cpu_set"] = None
+    
+    if TORCH_AVAILABLE:
+        if plan["intra_op_threads"] > 0:
+            torch.set_num_threads(plan["intra_op_threads"])
+        if plan["inter_op_threads"] > 0:
+            try:
+                torch.set_num_interop_threads(plan["inter_op_threads"])
+            except RuntimeError as e:
+                # torch 已執行過並行工作
+                logger.warning(f"Failed to set inter-op threads: {str(e)}")
+    
+    _applied = {**plan, **current_runtime(), "requested": [intra_op_threads, inter_op_threads, cpu_affinity]}
+    logger.info(
+        f"Torch runtime: {_applied['torch_threads']} intra-op / {_applied['torch_interop_threads']} inter-op threads, "
+        f"worker {plan['worker_slot']} of {plan['server_workers']}, CPUs {plan['cpu_set'] or 'all'}"
+    )
+    return _applied
+
+
+def current_runtime() -> Dict[str, Any]:
+    """本進程目前的 torch 線程數與可用 CPU"""
+    return {
+        "torch_threads": torch.get_num_threads() if TORCH_AVAILABLE else None,
+        "torch_interop_threads": torch.get_num_interop_threads() if TORCH_AVAILABLE else None,
+        "available_cpus": len(available_cpus())
+    }
@@ -5,18 +5,26 @@ RAG向量資料庫實現
 
 import os
 import json
+import asyncio
 import logging
+import threading
+import time
 from typing import List, Dict, Any, Optional
 import chromadb
 from chromadb.config import Settings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 try:
     from langchain_openai import OpenAIEmbeddings
 except ImportError:
     from langchain_community.embeddings import OpenAIEmbeddings
 from langchain.schema import Document
-import hashlib
-from .bge_embeddings import BGEM3Embeddings, HybridEmbeddings
+import numpy as np
+from .bge_embeddings import BGEM3Embeddings, HybridEmbeddings, create_bge_embeddings
+from .numpy_index import NumpyVectorIndex, matches_where
+from .lexical_index import BM25LexicalIndex, reciprocal_rank_fusion
+from .result_cache import RetrievalResultCache
+from .text_chunker import StreamingTextChunker, content_chunk_id
+from .knowledge_lookup import KnowledgeLookupTable, chart_placement_keys, placement_query
+from .reranker import CrossEncoderReranker
 
 class ZiweiVectorStore:
     """紫微斗數向量資料庫"""
@@ -27,36 +35,178 @@ class ZiweiVectorStore:
                  embedding_provider: str = "huggingface",
                  embedding_model: str = "BAAI/bge-m3",
                  embedding_config: Dict[str, Any] = None,
+                 lazy_embeddings: bool = False,
+                 index_backend: str = "chroma",
+                 numpy_index_dir: Optional[str] = None,
+                 numpy_index_dtype: str = "float32",
+                 numpy_index_quantization: Optional[str] = None,
+                 numpy_index_rescore_factor: int = 4,
+                 hybrid_search: bool = False,
+                 rrf_k: int = 60,
+                 result_cache_size: int = 256,
+                 chunk_size: int = 1000,
+                 chunk_overlap: int = 200,
+                 lookup_table_path: Optional[str] = None,
+                 rerank: bool = False,
+                 rerank_candidates: int = 20,
+                 reranker_config: Optional[Dict[str, Any]] = None,
                  logger=None):
 
         self.persist_directory = persist_directory
         self.collection_name = collection_name
         self.embedding_provider = embedding_provider
+        self.embedding_model = embedding_model
+        self.embedding_config = embedding_config or {}
         self.logger = logger or logging.getLogger(__name__)
 
-        # 初始化ChromaDB
-        self.client = chromadb.PersistentClient(
-            path=persist_directory,
-            settings=Settings(anonymized_telemetry=False)
-        )
+        # ChromaDB 客戶端與集合在首次使用時才開啟（NumPy 快照可用時啟動無須載入 HNSW 索引）
+        self._client = None
+        self._collection = None
+        self._collection_lock = threading.Lock()
 
-        # 初始化嵌入模型
-        self.embeddings = self._initialize_embeddings(
-            embedding_provider,
-            embedding_model,
-            embedding_config or {}
-        )
+        # 嵌入模型載入狀態（lazy_embeddings 時延遲到首次使用或 load_embeddings() 才載入）
+        self._embeddings = None
+        self._embeddings_lock = threading.Lock()
+        self.embedding_load_time = None
+        self.embedding_warmup_time = None
+        self.embedding_load_error = None
+
+        if not lazy_embeddings:
+            self.load_embeddings(warm_up=False)
+        
+        # 文本分塊參數（BGE-M3 可用時以其分詞器計算 token 數，否則按字數）
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        
+        # 可選的 NumPy 平面索引（以 ChromaDB 集合為資料來源的內存鏡像）
+        self.index_backend = index_backend
+        self.numpy_index_dir = numpy_index_dir or os.path.join(persist_directory, "numpy_index", collection_name)
+        self.numpy_index_dtype = numpy_index_dtype
+        # 可選的壓縮掃描（float16 副本或 PQ 碼），前 top_k × rescore_factor 條候選以全精度向量重新計分
+        self.numpy_index_quantization = numpy_index_quantization or None
+        self.numpy_index_rescore_factor = numpy_index_rescore_factor
+        if index_backend not in ("numpy", "chroma"):
+            raise ValueError(f"Unsupported index backend: {index_backend}")
+        # 索引在首次檢索或 load_embeddings(warm_up=True) 時才載入，建構時不開啟 ChromaDB
+        self._numpy_index = None
+        self._numpy_index_pending = index_backend == "numpy"
+        self._numpy_index_lock = threading.Lock()
+        # 寫入只標記索引已變更，批量寫入結束或關閉時由 flush() 保存一次快照
+        self._numpy_index_dirty = False
         
-        # 初始化文本分割器
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", "。", "！", "？", "；", " ", ""]
+        # 稠密 + 字元二元組 BM25 混合檢索（詞法索引首次檢索時建立，之後隨寫入增量更新）
+        self.hybrid_search = hybrid_search
+        self.rrf_k = rrf_k
+        self.lexical_index = None
+        self._lexical_lock = threading.Lock()
+        
+        # 檢索結果快取，鍵包含集合版本；add/delete/update 遞增版本使舊結果失效
+        self.result_cache = RetrievalResultCache(result_cache_size) if result_cache_size > 0 else None
+        self._generation = 0
+        
+        # 預計算的星曜 × 宮位查找表（由 build_lookup_table() 離線建立）
+        self.lookup_table_path = lookup_table_path or os.path.join(
+            persist_directory, "lookup_tables", f"{collection_name}.json"
         )
+        self.lookup_table = self._load_lookup_table()
+        
+        # 可選的交叉編碼器重排序：向量檢索取 rerank_candidates 條候選，重排序後保留 top_k 條
+        self.rerank_candidates = rerank_candidates
+        self.reranker = CrossEncoderReranker(**(reranker_config or {}), logger=self.logger) if rerank else None
+        
+        # 未使用 NumPy 索引時，檢索依賴 ChromaDB，啟動時即開啟集合
+        if index_backend == "chroma":
+            self._open_collection()
+
+    @property
+    def embeddings(self):
+        """嵌入模型（尚未載入時同步載入）"""
+        if self._embeddings is None:
+            self.load_embeddings(warm_up=False)
+        return self._embeddings
+
+    @property
+    def numpy_index(self) -> Optional[NumpyVectorIndex]:
+        """NumPy 索引（尚未載入時同步載入）；載入失敗或使用 ChromaDB 後端時為 None"""
+        return self._ensure_numpy_index()
+
+    @numpy_index.setter
+    def numpy_index(self, index: Optional[NumpyVectorIndex]):
+        self._numpy_index = index
+        self._numpy_index_pending = False
+
+    def _ensure_numpy_index(self) -> Optional[NumpyVectorIndex]:
+        """載入 NumPy 索引（可重複調用，只載入一次）"""
+        if self._numpy_index_pending:
+            with self._numpy_index_lock:
+                if self._numpy_index_pending:
+                    self._numpy_index = self._load_numpy_index()
+                    self._numpy_index_pending = False
+        return self._numpy_index
+
+    @property
+    def is_ready(self) -> bool:
+        """嵌入模型與 NumPy 索引是否已載入"""
+        return self._embeddings is not None and not self._numpy_index_pending
+
+    def load_embeddings(self, warm_up: bool = True):
+        """
+        載入嵌入模型（可重複調用，只載入一次）
+
+        Args:
+            warm_up: 載入後是否執行一次查詢嵌入作為預熱，並載入 NumPy 索引
+        """
+        if warm_up:
+            self._ensure_numpy_index()
         
-        # 獲取或創建集合
-        self.collection = self._get_or_create_collection()
+        with self._embeddings_lock:
+            if self._embeddings is not None:
+                return
+
+            start_time = time.time()
+            embeddings = self._initialize_embeddings(
+                self.embedding_provider,
+                self.embedding_model,
+                self.embedding_config
+            )
+            self.embedding_load_time = time.time() - start_time
+            self.logger.info(f"Embedding model loaded in {self.embedding_load_time:.2f}s")
+
+            if warm_up:
+                try:
+                    start_time = time.time()
+                    embeddings.embed_query("紫微斗數")
+                    self.embedding_warmup_time = time.time() - start_time
+                    self.logger.info(f"Embedding warm-up finished in {self.embedding_warmup_time * 1000:.1f}ms")
+                except Exception as e:
+                    self.embedding_load_error = str(e)
+                    self.logger.warning(f"Embedding warm-up failed: {str(e)}")
+
+                # 重排序模型一併載入，預熱同時取得延遲估計
+                if self.reranker is not None:
+                    try:
+                        self.reranker.load()
+                    except Exception as e:
+                        self.logger.warning(f"Reranker load failed, searches keep vector ranking: {str(e)}")
+
+            self._embeddings = embeddings
+
+    async def load_embeddings_async(self, warm_up: bool = True):
+        """在線程池中載入並預熱嵌入模型，不阻塞事件循環"""
+        if self.is_ready:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.load_embeddings, warm_up)
+
+    def get_readiness(self) -> Dict[str, Any]:
+        """獲取嵌入模型與 NumPy 索引的就緒狀態與載入耗時"""
+        return {
+            "ready": self.is_ready,
+            "loading": self._embeddings_lock.locked() or self._numpy_index_lock.locked(),
+            "load_time": self.embedding_load_time,
+            "warmup_time": self.embedding_warmup_time,
+            "error": self.embedding_load_error
+        }
 
     def _initialize_embeddings(self, provider: str, model: str, config: Dict[str, Any]):
         """初始化嵌入模型"""
@@ -64,11 +214,28 @@ class ZiweiVectorStore:
             if provider == "huggingface":
                 # 使用 BGE-M3
                 bge_config = {
+                    "backend": config.get("backend", "torch"),
+                    "onnx_dir": config.get("onnx_dir", "./models/bge-m3-onnx"),
+                    "onnx_quantized": config.get("onnx_quantized", True),
+                    "onnx_intra_op_threads": config.get("onnx_intra_op_threads", 0),
                     "model_name": model,
                     "device": config.get("device", "cpu"),
                     "max_length": config.get("max_length", 8192),
                     "batch_size": config.get("batch_size", 32),
-                    "use_fp16": config.get("use_fp16", False)
+                    "use_fp16": config.get("use_fp16", False),
+                    "query_cache_size": config.get("query_cache_size", 1024),
+                    "query_cache_path": config.get("query_cache_path"),
+                    "document_cache_dir": config.get("document_cache_dir"),
+                    "micro_batch_max_size": config.get("micro_batch_max_size", 0),
+                    "micro_batch_max_wait_ms": config.get("micro_batch_max_wait_ms", 5.0),
+                    "max_tokens_per_batch": config.get("max_tokens_per_batch", 0),
+                    "num_workers": config.get("num_workers", 0),
+                    "threads_per_worker": config.get("threads_per_worker", 0),
+                    "torch_threads": config.get("torch_threads", 0),
+                    "torch_interop_threads": config.get("torch_interop_threads", 0),
+                    "cpu_affinity": config.get("cpu_affinity"),
+                    "server_workers": config.get("server_workers", 0),
+                    "use_inference_mode": config.get("use_inference_mode", True)
                 }
 
                 # 如果有 OpenAI 配置，創建混合嵌入
@@ -83,7 +250,7 @@ class ZiweiVectorStore:
                         logger=self.logger
                     )
                 else:
-                    return BGEM3Embeddings(**bge_config)
+                    return create_bge_embeddings(**bge_config)
 
             elif provider == "openai":
                 # 使用 OpenAI
@@ -98,13 +265,48 @@ class ZiweiVectorStore:
             self.logger.info("Falling back to OpenAI embeddings")
             return OpenAIEmbeddings(model="text-embedding-ada-002")
 
+    def _get_bge_embeddings(self) -> Optional[BGEM3Embeddings]:
+        """獲取底層的 BGE-M3 嵌入模型（若已載入）"""
+        if isinstance(self._embeddings, BGEM3Embeddings):
+            return self._embeddings
+        return getattr(self._embeddings, "bge_embeddings", None)
+
+    def _create_chunker(self) -> StreamingTextChunker:
+        """建立中文分塊器（每份文檔一個，分塊器帶有標題上下文狀態）"""
+        bge_embeddings = self._get_bge_embeddings()
+        count_tokens = bge_embeddings._count_tokens if bge_embeddings is not None else None
+        return StreamingTextChunker(self.chunk_size, self.chunk_overlap, count_tokens=count_tokens)
+
+    @property
+    def client(self):
+        """ChromaDB 客戶端（首次使用時開啟）"""
+        self._open_collection()
+        return self._client
+
+    @property
+    def collection(self):
+        """ChromaDB 集合（首次使用時開啟）"""
+        return self._open_collection()
+
+    def _open_collection(self):
+        """開啟 ChromaDB 客戶端並獲取集合（只執行一次）"""
+        if self._collection is None:
+            with self._collection_lock:
+                if self._collection is None:
+                    self._client = chromadb.PersistentClient(
+                        path=self.persist_directory,
+                        settings=Settings(anonymized_telemetry=False)
+                    )
+                    self._collection = self._get_or_create_collection()
+        return self._collection
+
     def _get_or_create_collection(self):
         """獲取或創建向量集合"""
         try:
-            collection = self.client.get_collection(name=self.collection_name)
+            collection = self._client.get_collection(name=self.collection_name)
             self.logger.info(f"Loaded existing collection: {self.collection_name}")
         except:
-            collection = self.client.create_collection(
+            collection = self._client.create_collection(
                 name=self.collection_name,
                 metadata={"description": "紫微斗數知識庫"}
             )
@@ -112,12 +314,144 @@ class ZiweiVectorStore:
         
         return collection
     
-    def add_documents(self, documents: List[Document]) -> List[str]:
+    def _source_mtime(self) -> Optional[float]:
+        """ChromaDB 資料檔的修改時間，用於判斷快照是否過期"""
+        sqlite_path = os.path.join(self.persist_directory, "chroma.sqlite3")
+        return os.path.getmtime(sqlite_path) if os.path.exists(sqlite_path) else None
+    
+    def _snapshot_manifest(self) -> Dict[str, Any]:
+        """寫入快照 manifest 的來源資訊"""
+        return {
+            "collection_name": self.collection_name,
+            "distance_space": (self.collection.metadata or {}).get("hnsw:space", "l2"),
+            "collection_count": self.collection.count(),
+            "source_mtime": self._source_mtime()
+        }
+    
+    def _load_numpy_index(self) -> Optional[NumpyVectorIndex]:
+        """
+        載入 NumPy 索引快照
+        
+        快照存在且 ChromaDB 資料檔未在快照之後被修改時直接記憶體映射載入，不開啟 ChromaDB；
+        否則從集合重建並保存快照。
+        """
+        try:
+            manifest_path = os.path.join(self.numpy_index_dir, NumpyVectorIndex.MANIFEST_FILE)
+            if os.path.exists(manifest_path):
+                index = NumpyVectorIndex.load(self.numpy_index_dir, mmap=True, logger=self.logger)
+                index.rescore_factor = self.numpy_index_rescore_factor
+                source_mtime = self._source_mtime()
+                snapshot_mtime = index.manifest.get("source_mtime")
+                if index.manifest.get("quantization") != self.numpy_index_quantization:
+                    self.logger.info("Numpy index snapshot uses a different quantization, rebuilding")
+                elif source_mtime is None or (snapshot_mtime is not None and source_mtime <= snapshot_mtime):
+                    return index
+                else:
+                    self.logger.info("Numpy index snapshot is older than the ChromaDB collection, rebuilding")
+            
+            index = NumpyVectorIndex.from_collection(
+                self.collection,
+                dtype=self.numpy_index_dtype,
+                logger=self.logger,
+                quantization=self.numpy_index_quantization,
+                rescore_factor=self.numpy_index_rescore_factor
+            )
+            index.save(self.numpy_index_dir, manifest=self._snapshot_manifest())
+            return index
+        
+        except Exception as e:
+            self.logger.error(f"Failed to load numpy index, falling back to ChromaDB: {str(e)}")
+            self.index_backend = "chroma"
+            return None
+    
+    def _load_lookup_table(self) -> Optional[KnowledgeLookupTable]:
+        """載入查找表；集合在建表之後被修改過時不使用，需重新建表"""
+        if not os.path.exists(self.lookup_table_path):
+            return None
+        
+        try:
+            table = KnowledgeLookupTable.load(self.lookup_table_path)
+        except Exception as e:
+            self.logger.warning(f"Failed to load knowledge lookup table: {str(e)}")
+            return None
+        
+        if table.is_stale(self._source_mtime()):
+            self.logger.warning("Knowledge lookup table is older than the ChromaDB collection, ignoring it until rebuilt")
+            return None
+        
+        self.logger.info(f"Loaded knowledge lookup table with {len(table)} keys")
+        return table
+    
+    def build_lookup_table(self, top_k: int = 10, path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        離線建立星曜 × 宮位、四化 × 宮位與格局的查找表並保存
+        
+        Args:
+            top_k: 每個鍵保存的文本塊數
+            path: 輸出路徑，默認為 lookup_table_path
+            
+        Returns:
+            查找表 manifest
+        """
+        table = KnowledgeLookupTable.build(
+            self.search_each, top_k=top_k, manifest=self._snapshot_manifest(), logger=self.logger
+        )
+        table.save(path or self.lookup_table_path)
+        if path is None or path == self.lookup_table_path:
+            self.lookup_table = table
+        return table.manifest
+    
+    def export_snapshot(self,
+                        output_dir: str,
+                        dtype: str = "float16",
+                        quantization: Optional[str] = None) -> Dict[str, Any]:
+        """
+        導出集合的向量與元數據為可記憶體映射的快照
+        
+        導出的目錄可直接作為 numpy_index_dir 使用，多個工作進程載入同一快照時共用頁快取。
+        
+        Args:
+            output_dir: 輸出目錄
+            dtype: 向量存儲精度，默認 float16
+            quantization: 壓縮掃描表示（float16 或 pq），None 表示直接掃描存儲向量
+            
+        Returns:
+            快照 manifest
+        """
+        index = NumpyVectorIndex.from_collection(
+            self.collection,
+            dtype=dtype,
+            logger=self.logger,
+            quantization=quantization,
+            rescore_factor=self.numpy_index_rescore_factor
+        )
+        index.save(output_dir, manifest=self._snapshot_manifest())
+        
+        self.logger.info(f"Exported snapshot of {len(index)} vectors to {output_dir}")
+        return index.manifest
+    
+    def _persist_numpy_index(self):
+        """保存 NumPy 索引"""
+        try:
+            self.numpy_index.save(self.numpy_index_dir, manifest=self._snapshot_manifest())
+        except Exception as e:
+            self.logger.warning(f"Failed to save numpy index: {str(e)}")
+    
+    def flush(self):
+        """保存寫入後尚未持久化的 NumPy 索引快照"""
+        if self._numpy_index_dirty and self.numpy_index is not None:
+            self._numpy_index_dirty = False
+            self._persist_numpy_index()
+    
+    def add_documents(self, documents: List[Document], sync: bool = False) -> List[str]:
         """
         添加文檔到向量資料庫
         
+        文本塊 ID 由來源與內容哈希生成，重複添加相同內容不會產生重複條目，也不會重新嵌入。
+        
         Args:
             documents: 文檔列表
+            sync: 同步模式，另外刪除這些文檔來源中已不存在的文本塊
             
         Returns:
             添加的文檔ID列表
@@ -128,48 +462,176 @@ class ZiweiVectorStore:
         # 分割文檔
         split_docs = []
         for doc in documents:
-            chunks = self.text_splitter.split_text(doc.page_content)
+            chunks = self._create_chunker().split_text(doc.page_content)
             for i, chunk in enumerate(chunks):
                 split_doc = Document(
-                    page_content=chunk,
+                    page_content=chunk['content'],
                     metadata={
                         **doc.metadata,
+                        **chunk['metadata'],
                         "chunk_index": i,
                         "total_chunks": len(chunks)
                     }
                 )
                 split_docs.append(split_doc)
         
-        # 生成嵌入向量
+        # 以來源與內容哈希生成穩定ID
         texts = [doc.page_content for doc in split_docs]
-        embeddings = self.embeddings.embed_documents(texts)
-        
-        # 生成文檔ID
-        doc_ids = []
-        metadatas = []
-        
-        for i, doc in enumerate(split_docs):
-            # 使用內容哈希作為ID的一部分
-            content_hash = hashlib.md5(doc.page_content.encode()).hexdigest()[:8]
-            doc_id = f"doc_{i}_{content_hash}"
-            doc_ids.append(doc_id)
-            
-            # 準備元數據
-            metadata = doc.metadata.copy()
-            metadata["doc_id"] = doc_id
-            metadatas.append(metadata)
-        
-        # 添加到ChromaDB
-        self.collection.add(
-            embeddings=embeddings,
-            documents=texts,
-            metadatas=metadatas,
-            ids=doc_ids
-        )
+        metadatas = [doc.metadata for doc in split_docs]
+        doc_ids = [content_chunk_id(doc.page_content, doc.metadata.get("source", "")) for doc in split_docs]
+        
+        if sync:
+            stats = self.sync_chunks(texts, metadatas, doc_ids)
+            self.logger.info(f"Synced {len(split_docs)} document chunks: {stats}")
+        else:
+            written = self.add_chunks(texts, metadatas, doc_ids, skip_existing=True)
+            self.logger.info(
+                f"Added {len(written)} document chunks to vector store "
+                f"({len(split_docs) - len(written)} unchanged)"
+            )
+        self.flush()
+        return list(dict.fromkeys(doc_ids))
+    
+    def add_chunks(self,
+                   texts: List[str],
+                   metadatas: List[Dict[str, Any]],
+                   doc_ids: List[str],
+                   embeddings: Optional[np.ndarray] = None,
+                   skip_existing: bool = False) -> List[str]:
+        """
+        寫入已分塊的文本（不再分割），同 ID 已存在時覆蓋
+        
+        Args:
+            texts: 文本塊列表
+            metadatas: 元數據列表
+            doc_ids: 文檔ID列表（重複的 ID 只寫入第一條）
+            embeddings: 預先計算的嵌入矩陣 (len(texts), dim)，None 時在此生成
+            skip_existing: 跳過集合中已存在的 ID（內容哈希 ID 相同即內容相同，無須重新嵌入）
+            
+        Returns:
+            實際寫入的文檔ID列表
+        """
+        existing = self.existing_ids(doc_ids) if skip_existing else set()
+        
+        keep = []
+        seen = set()
+        for i, doc_id in enumerate(doc_ids):
+            if doc_id not in seen and doc_id not in existing:
+                keep.append(i)
+            seen.add(doc_id)
+        if not keep:
+            return []
+        
+        if len(keep) < len(doc_ids):
+            texts = [texts[i] for i in keep]
+            metadatas = [metadatas[i] for i in keep]
+            doc_ids = [doc_ids[i] for i in keep]
+            if embeddings is not None:
+                embeddings = np.asarray(embeddings, dtype=np.float32)[keep]
+        
+        # 生成嵌入向量
+        if embeddings is None:
+            embeddings = self.embeddings.embed_documents(texts)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        
+        # 準備元數據
+        metadatas = [{**metadata, "doc_id": doc_id} for metadata, doc_id in zip(metadatas, doc_ids)]
+        
+        # 寫入ChromaDB（ChromaDB 0.4 只接受 Python 列表）
+        try:
+            self.collection.upsert(
+                embeddings=embeddings.tolist(),
+                documents=texts,
+                metadatas=metadatas,
+                ids=doc_ids
+            )
+            
+            if self.numpy_index is not None:
+                self.numpy_index.add(doc_ids, embeddings, texts, metadatas)
+                self._numpy_index_dirty = True
+            if self.lexical_index is not None:
+                self.lexical_index.add(doc_ids, texts)
+        finally:
+            self._bump_generation()
         
-        self.logger.info(f"Added {len(split_docs)} document chunks to vector store")
         return doc_ids
     
+    def existing_ids(self, doc_ids: List[str]) -> set:
+        """返回集合中已存在的文檔ID"""
+        if not doc_ids:
+            return set()
+        return set(self.collection.get(ids=list(dict.fromkeys(doc_ids)), include=[])["ids"])
+    
+    def source_ids(self, source: str, batch_size: int = 1000) -> set:
+        """返回來自指定來源文件的所有文檔ID"""
+        ids = set()
+        offset = 0
+        while True:
+            batch = self.collection.get(where={"source": source}, include=[], limit=batch_size, offset=offset)
+            ids.update(batch["ids"])
+            if len(batch["ids"]) < batch_size:
+                return ids
+            offset += batch_size
+    
+    def prune_source(self, source: str, keep_ids) -> int:
+        """
+        刪除指定來源中不在 keep_ids 內的文本塊
+        
+        Args:
+            source: 來源文件名稱
+            keep_ids: 本次導入產生的文檔ID
+            
+        Returns:
+            刪除的文本塊數量
+        """
+        removed = sorted(self.source_ids(source) - set(keep_ids))
+        if removed:
+            self.delete_documents(removed)
+            self.logger.info(f"Pruned {len(removed)} stale chunks from source {source}")
+        return len(removed)
+    
+    def sync_chunks(self,
+                    texts: List[str],
+                    metadatas: List[Dict[str, Any]],
+                    doc_ids: List[str]) -> Dict[str, int]:
+        """
+        按來源同步文本塊：只嵌入並寫入新增的文本塊，刪除來源中已不存在的文本塊
+        
+        Args:
+            texts: 文本塊列表（每個元數據須含 source）
+            metadatas: 元數據列表
+            doc_ids: 內容哈希文檔ID列表
+            
+        Returns:
+            同步統計 {"added", "deleted", "unchanged"}
+        """
+        by_source: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            by_source.setdefault(metadata.get("source", ""), []).append(i)
+        
+        stats = {"added": 0, "deleted": 0, "unchanged": 0}
+        for source, indices in by_source.items():
+            source_doc_ids = [doc_ids[i] for i in indices]
+            existing = self.source_ids(source) if source else self.existing_ids(source_doc_ids)
+            
+            new_indices = [i for i in indices if doc_ids[i] not in existing]
+            written = self.add_chunks(
+                [texts[i] for i in new_indices],
+                [metadatas[i] for i in new_indices],
+                [doc_ids[i] for i in new_indices]
+            )
+            stats["added"] += len(written)
+            stats["unchanged"] += len(set(source_doc_ids) & existing)
+            
+            # 沒有來源資訊的文本塊無法判斷是否已被移除，只做新增
+            if source:
+                removed = sorted(existing - set(source_doc_ids))
+                if removed:
+                    self.delete_documents(removed)
+                stats["deleted"] += len(removed)
+        
+        return stats
+    
     def search(self, 
                query: str, 
                top_k: int = 5,
@@ -190,23 +652,64 @@ class ZiweiVectorStore:
             query_embedding = self.embeddings.embed_query(query)
             
             # 執行搜索
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k,
-                where=filter_metadata
-            )
+            formatted_results = self._retrieve_reranked(query, query_embedding, top_k, filter_metadata)
             
-            # 格式化結果
-            formatted_results = []
-            if results['documents'] and results['documents'][0]:
-                for i in range(len(results['documents'][0])):
-                    result = {
-                        "content": results['documents'][0][i],
-                        "metadata": results['metadatas'][0][i] if results['metadatas'] else {},
-                        "score": 1 - results['distances'][0][i] if results['distances'] else 0,  # 轉換為相似度分數
-                        "id": results['ids'][0][i] if results['ids'] else None
-                    }
-                    formatted_results.append(result)
+            self.logger.info(f"Search query: '{query}' returned {len(formatted_results)} results")
+            return formatted_results
+            
+        except Exception as e:
+            self.logger.error(f"Error during search: {str(e)}")
+            return []
+    
+    def search_by_vector(self,
+                         query: str,
+                         query_embedding: np.ndarray,
+                         top_k: int = 5,
+                         filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        以預先計算的查詢向量搜索（評測時分別測量嵌入與檢索耗時）
+        
+        Args:
+            query: 查詢字符串（混合檢索與重排序使用）
+            query_embedding: 查詢向量
+            top_k: 返回結果數量
+            filter_metadata: 元數據過濾條件
+            
+        Returns:
+            搜索結果列表，檢索失敗時拋出異常
+        """
+        return self._retrieve_reranked(query, np.asarray(query_embedding, dtype=np.float32), top_k, filter_metadata)
+    
+    async def search_async(self,
+                           query: str,
+                           top_k: int = 5,
+                           filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        非同步搜索相關文檔，嵌入推理與向量查詢都不在事件循環線程上執行
+        
+        Args:
+            query: 查詢字符串
+            top_k: 返回結果數量
+            filter_metadata: 元數據過濾條件
+            
+        Returns:
+            搜索結果列表
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            # 模型仍在背景載入時等待就緒
+            await self.load_embeddings_async()
+            
+            # 生成查詢嵌入
+            if hasattr(self.embeddings, "embed_query_async"):
+                query_embedding = await self.embeddings.embed_query_async(query)
+            else:
+                query_embedding = await loop.run_in_executor(None, self.embeddings.embed_query, query)
+            
+            # 執行搜索
+            formatted_results = await loop.run_in_executor(
+                None, self._retrieve_reranked, query, query_embedding, top_k, filter_metadata
+            )
             
             self.logger.info(f"Search query: '{query}' returned {len(formatted_results)} results")
             return formatted_results
@@ -215,6 +718,585 @@ class ZiweiVectorStore:
             self.logger.error(f"Error during search: {str(e)}")
             return []
     
+    def search_many(self,
+                    queries: List[str],
+                    top_k: int = 5,
+                    per_query_k: Optional[int] = None,
+                    filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        批量檢索多條子查詢（如逐宮位、逐星曜查詢），合併去重後返回
+        
+        所有子查詢一次批量嵌入、一次批量向量查詢，成本與單條查詢相近。
+        
+        Args:
+            queries: 子查詢列表
+            top_k: 合併後返回的結果總數
+            per_query_k: 每條子查詢保證的名額，默認平分 top_k（至少 1）
+            filter_metadata: 元數據過濾條件
+            
+        Returns:
+            搜索結果列表，每條結果的 query 欄位記錄選中它的子查詢
+        """
+        queries = self._normalize_queries(queries)
+        if not queries:
+            return []
+        
+        try:
+            query_embeddings = self._embed_queries(queries)
+            per_query_results = self._retrieve_many(
+                queries, query_embeddings, self._candidate_k(top_k, len(queries)), filter_metadata
+            )
+            per_query_results = self._rerank_each(queries, per_query_results, top_k)
+            merged = self._merge_query_results(queries, per_query_results, top_k, per_query_k)
+            
+            self.logger.info(f"Batched search of {len(queries)} queries returned {len(merged)} results")
+            return merged
+            
+        except Exception as e:
+            self.logger.error(f"Error during batched search: {str(e)}")
+            return []
+    
+    async def search_many_async(self,
+                                queries: List[str],
+                                top_k: int = 5,
+                                per_query_k: Optional[int] = None,
+                                filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        非同步批量檢索多條子查詢，嵌入推理與向量查詢都不在事件循環線程上執行
+        
+        Args:
+            queries: 子查詢列表
+            top_k: 合併後返回的結果總數
+            per_query_k: 每條子查詢保證的名額
+            filter_metadata: 元數據過濾條件
+            
+        Returns:
+            搜索結果列表
+        """
+        await self.load_embeddings_async()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.search_many, queries, top_k, per_query_k, filter_metadata
+        )
+    
+    def search_each(self,
+                    queries: List[str],
+                    top_k: int = 5,
+                    filter_metadata: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        批量檢索多條查詢，分別返回每條查詢的結果（不合併）
+        
+        Args:
+            queries: 查詢列表
+            top_k: 每條查詢返回的結果數
+            filter_metadata: 元數據過濾條件
+            
+        Returns:
+            與 queries 對應的結果列表
+        """
+        if not queries:
+            return []
+        query_embeddings = self._embed_queries(list(queries))
+        return self._retrieve_many(list(queries), query_embeddings, top_k, filter_metadata)
+    
+    def get_chunks(self, doc_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """按 ID 取出文本塊（不存在的 ID 略過）"""
+        doc_ids = list(dict.fromkeys(doc_ids))
+        if not doc_ids:
+            return {}
+        
+        chunks = {}
+        if self.numpy_index is not None:
+            for doc_id in doc_ids:
+                row = self.numpy_index.position(doc_id)
+                if row is not None:
+                    chunks[doc_id] = {
+                        "content": self.numpy_index.documents[row],
+                        "metadata": self.numpy_index.metadatas[row],
+                        "id": doc_id
+                    }
+            return chunks
+        
+        batch = self.collection.get(ids=doc_ids, include=["documents", "metadatas"])
+        for doc_id, document, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+            chunks[doc_id] = {"content": document, "metadata": metadata or {}, "id": doc_id}
+        return chunks
+    
+    def search_placements(self,
+                          placement_keys: List[str],
+                          queries: Optional[List[str]] = None,
+                          top_k: int = 5,
+                          per_query_k: Optional[int] = None,
+                          filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        命盤配置檢索：配置鍵先查預計算表，表中沒有的鍵與自由文本查詢再批量向量檢索，合併去重
+        
+        Args:
+            placement_keys: 查找表鍵（見 knowledge_lookup.chart_placement_keys）
+            queries: 自由文本子查詢
+            top_k: 合併後返回的結果總數
+            per_query_k: 每個鍵或子查詢保證的名額
+            filter_metadata: 元數據過濾條件（查找表以未過濾的檢索建立，過濾後不足名額的鍵改為向量檢索）
+            
+        Returns:
+            搜索結果列表，query 欄位記錄選中它的配置或子查詢
+        """
+        try:
+            labels: List[str] = []
+            per_query_results: List[List[Dict[str, Any]]] = []
+            live_queries = list(queries or [])
+            
+            if self.lookup_table is not None:
+                placement_keys = list(dict.fromkeys(placement_keys))
+                found, missing = self.lookup_table.resolve(placement_keys)
+                quota = per_query_k or max(1, -(-top_k // max(len(placement_keys) + len(live_queries), 1)))
+                chunks = self.get_chunks([doc_id for hits in found.values() for doc_id, _ in hits])
+                for key, hits in found.items():
+                    key_results = [
+                        {**chunks[doc_id], "score": score}
+                        for doc_id, score in hits
+                        if doc_id in chunks and matches_where(chunks[doc_id]["metadata"], filter_metadata)
+                    ]
+                    if filter_metadata and len(key_results) < quota:
+                        # 過濾後名額不足：在索引內帶過濾條件檢索，確保名額仍能填滿
+                        missing.append(key)
+                        continue
+                    labels.append(placement_query(key))
+                    per_query_results.append(key_results)
+                live_queries += [placement_query(key) for key in missing]
+            else:
+                live_queries += [placement_query(key) for key in placement_keys]
+            
+            live_queries = [query for query in self._normalize_queries(live_queries) if query not in labels]
+            if live_queries:
+                query_embeddings = self._embed_queries(live_queries)
+                candidate_k = self._candidate_k(top_k, len(labels) + len(live_queries))
+                labels += live_queries
+                per_query_results += self._retrieve_many(live_queries, query_embeddings, candidate_k, filter_metadata)
+            
+            per_query_results = self._rerank_each(labels, per_query_results, top_k)
+            merged = self._merge_query_results(labels, per_query_results, top_k, per_query_k)
+            self.logger.info(
+                f"Placement search: {len(labels) - len(live_queries)} table lookups, "
+                f"{len(live_queries)} live queries, {len(merged)} results"
+            )
+            return merged
+            
+        except Exception as e:
+            self.logger.error(f"Error during placement search: {str(e)}")
+            return []
+    
+    async def search_placements_async(self,
+                                      placement_keys: List[str],
+                                      queries: Optional[List[str]] = None,
+                                      top_k: int = 5,
+                                      per_query_k: Optional[int] = None,
+                                      filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """非同步命盤配置檢索（參數同 search_placements）"""
+        if queries or self.lookup_table is None:
+            await self.load_embeddings_async()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.search_placements, placement_keys, queries, top_k, per_query_k, filter_metadata
+        )
+    
+    @staticmethod
+    def _normalize_queries(queries: List[str]) -> List[str]:
+        """去除空白與重複的子查詢，保留原始順序"""
+        seen = set()
+        normalized = []
+        for query in queries:
+            query = (query or "").strip()
+            if query and query not in seen:
+                seen.add(query)
+                normalized.append(query)
+        return normalized
+    
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """一次批量嵌入多條查詢，返回 float32 矩陣"""
+        if hasattr(self.embeddings, "embed_queries"):
+            return np.asarray(self.embeddings.embed_queries(queries), dtype=np.float32)
+        # OpenAI 等提供商的查詢與文檔嵌入相同，embed_documents 為批量請求
+        return np.asarray(self.embeddings.embed_documents(queries), dtype=np.float32)
+    
+    def _retrieve_many(self,
+                       queries: List[str],
+                       query_embeddings: np.ndarray,
+                       top_k: int,
+                       filter_metadata: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """一次批量向量查詢，按配置對每條子查詢做混合融合；命中結果快取的子查詢不再查詢"""
+        cache_keys = [None] * len(queries)
+        results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+        if self.result_cache is not None:
+            for i, (query, embedding) in enumerate(zip(queries, query_embeddings)):
+                cache_keys[i] = self._result_cache_key(query, embedding, top_k, filter_metadata)
+                results[i] = self.result_cache.get(cache_keys[i])
+        
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if not missing:
+            return results
+        
+        missing_embeddings = np.asarray(query_embeddings, dtype=np.float32)[missing]
+        if not self.hybrid_search:
+            fetched = self._query_collection_many(missing_embeddings, top_k, filter_metadata)
+        else:
+            candidates = max(top_k * 4, 20)
+            dense_results = self._query_collection_many(missing_embeddings, candidates, filter_metadata)
+            fetched = [
+                self._fuse_hybrid(queries[i], query_embeddings[i], dense, top_k, filter_metadata)
+                for i, dense in zip(missing, dense_results)
+            ]
+        
+        for i, query_results in zip(missing, fetched):
+            results[i] = query_results
+            if cache_keys[i] is not None:
+                self.result_cache.put(cache_keys[i], query_results)
+        return results
+    
+    @staticmethod
+    def _merge_query_results(queries: List[str],
+                             per_query_results: List[List[Dict[str, Any]]],
+                             top_k: int,
+                             per_query_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        合併各子查詢的結果
+        
+        先按名額輪流從每條子查詢取排名最前且未被選中的結果，避免單一子查詢佔滿結果；
+        名額用完後剩餘位置按分數從所有候選中補齊。同一文檔只保留一次。
+        
+        Args:
+            queries: 子查詢列表
+            per_query_results: 每條子查詢的結果（按相關度排序）
+            top_k: 返回結果總數
+            per_query_k: 每條子查詢的名額
+            
+        Returns:
+            按分數降序的合併結果
+        """
+        if per_query_k is None:
+            per_query_k = max(1, -(-top_k // max(len(queries), 1)))
+        
+        selected: Dict[str, Dict[str, Any]] = {}
+        
+        def take(result: Dict[str, Any], query: str) -> bool:
+            key = result.get("id") or result["content"]
+            if key in selected:
+                return False
+            selected[key] = {**result, "query": query}
+            return True
+        
+        # 第一輪：每條子查詢按名額取結果
+        for rank in range(max((len(results) for results in per_query_results), default=0)):
+            for query, results in zip(queries, per_query_results):
+                if len(selected) >= top_k:
+                    break
+                taken = sum(1 for result in selected.values() if result["query"] == query)
+                if rank < len(results) and taken < per_query_k:
+                    take(results[rank], query)
+        
+        # 第二輪：按分數補齊剩餘位置（重排序過的結果按重排序分數）
+        leftovers = sorted(
+            ((result, query) for query, results in zip(queries, per_query_results) for result in results),
+            key=lambda item: item[0].get("rerank_score", item[0]["score"]),
+            reverse=True
+        )
+        for result, query in leftovers:
+            if len(selected) >= top_k:
+                break
+            take(result, query)
+        
+        return sorted(selected.values(), key=lambda result: result.get("rerank_score", result["score"]), reverse=True)
+    
+    def _bump_generation(self):
+        """集合內容變更後遞增版本，使檢索結果快取失效"""
+        self._generation += 1
+        if self.result_cache is not None:
+            self.result_cache.clear()
+    
+    def _collection_version(self) -> tuple:
+        """
+        檢索結果快取使用的集合版本
+        
+        包含本進程的寫入版本；直接查詢 ChromaDB 時另含資料檔修改時間，
+        以覆蓋其他進程（如導入腳本）重新寫入的情況。
+        """
+        return (self._generation, self._source_mtime() if self.numpy_index is None else None)
+    
+    def _result_cache_key(self,
+                          query: str,
+                          query_embedding: np.ndarray,
+                          top_k: int,
+                          filter_metadata: Optional[Dict[str, Any]] = None) -> tuple:
+        """生成檢索結果快取鍵（混合檢索的結果依賴查詢文本）"""
+        return RetrievalResultCache.make_key(
+            query_embedding,
+            top_k,
+            filter_metadata,
+            self._collection_version(),
+            query=query if self.hybrid_search else None
+        )
+    
+    def _retrieve(self,
+                  query: str,
+                  query_embedding: np.ndarray,
+                  top_k: int,
+                  filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """按配置執行稠密或混合檢索，命中結果快取時直接返回"""
+        if self.result_cache is None:
+            return self._retrieve_uncached(query, query_embedding, top_k, filter_metadata)
+        
+        # 版本在查詢前讀取，查詢期間發生的寫入不會以新版本快取舊結果
+        cache_key = self._result_cache_key(query, query_embedding, top_k, filter_metadata)
+        results = self.result_cache.get(cache_key)
+        if results is None:
+            results = self._retrieve_uncached(query, query_embedding, top_k, filter_metadata)
+            self.result_cache.put(cache_key, results)
+        return results
+    
+    def _candidate_k(self, top_k: int, num_queries: int = 1) -> int:
+        """每條查詢向量檢索的候選數：啟用重排序時各查詢合計至少 rerank_candidates 條"""
+        if self.reranker is None:
+            return top_k
+        return max(top_k, -(-self.rerank_candidates // max(num_queries, 1)))
+    
+    def _retrieve_reranked(self,
+                           query: str,
+                           query_embedding: np.ndarray,
+                           top_k: int,
+                           filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """檢索較寬的候選集並以交叉編碼器重排序（未啟用時即 _retrieve）"""
+        if self.reranker is None:
+            return self._retrieve(query, query_embedding, top_k, filter_metadata)
+        candidates = self._retrieve(query, query_embedding, self._candidate_k(top_k), filter_metadata)
+        return self.reranker.rerank(query, candidates, top_k)
+    
+    def _rerank_each(self,
+                     queries: List[str],
+                     per_query_results: List[List[Dict[str, Any]]],
+                     top_k: int) -> List[List[Dict[str, Any]]]:
+        """
+        把各子查詢的候選一次批量重排序，每條子查詢的結果按重排序分數排列並保留 top_k 條
+        
+        未啟用重排序或因延遲預算跳過時，保留各子查詢原排名的前 top_k 條。
+        """
+        if self.reranker is None:
+            return per_query_results
+        
+        pair_queries = [query for query, results in zip(queries, per_query_results) for _ in results]
+        candidates = [result for results in per_query_results for result in results]
+        scores = self.reranker.score(pair_queries, candidates)
+        if scores is None:
+            return [results[:top_k] for results in per_query_results]
+        
+        reranked = []
+        offset = 0
+        for results in per_query_results:
+            scored = [
+                {**result, "rerank_score": score}
+                for result, score in zip(results, scores[offset:offset + len(results)])
+            ]
+            offset += len(results)
+            scored.sort(key=lambda result: result["rerank_score"], reverse=True)
+            reranked.append(scored[:top_k])
+        return reranked
+    
+    def _retrieve_uncached(self,
+                           query: str,
+                           query_embedding: np.ndarray,
+                           top_k: int,
+                           filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """按配置執行稠密或混合檢索"""
+        if not self.hybrid_search:
+            return self._query_collection(query_embedding, top_k, filter_metadata)
+        
+        # 兩路各取較多候選再融合
+        candidates = max(top_k * 4, 20)
+        dense_results = self._query_collection(query_embedding, candidates, filter_metadata)
+        return self._fuse_hybrid(query, query_embedding, dense_results, top_k, filter_metadata)
+    
+    def _ensure_lexical_index(self) -> BM25LexicalIndex:
+        """建立詞法索引（只執行一次）"""
+        if self.lexical_index is None:
+            with self._lexical_lock:
+                if self.lexical_index is None:
+                    index = BM25LexicalIndex()
+                    if self.numpy_index is not None:
+                        index.add(self.numpy_index.ids, self.numpy_index.documents)
+                    else:
+                        total = self.collection.count()
+                        for offset in range(0, total, 1000):
+                            batch = self.collection.get(include=["documents"], limit=1000, offset=offset)
+                            index.add(batch["ids"], batch["documents"])
+                    self.lexical_index = index
+                    self.logger.info(f"Built lexical index: {index.get_stats()}")
+        return self.lexical_index
+    
+    def _fuse_hybrid(self,
+                     query: str,
+                     query_embedding: np.ndarray,
+                     dense_results: List[Dict[str, Any]],
+                     top_k: int,
+                     filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """以倒數排名融合合併稠密與詞法結果，結果保留稠密相似度分數"""
+        candidates = max(top_k * 4, 20)
+        if filter_metadata:
+            # 詞法索引不含元數據：融合前按排名逐頁剔除不符合過濾條件的命中，直到湊滿候選數
+            ranked = self._ensure_lexical_index().search(query, top_k=None)
+            lexical_hits = []
+            for start in range(0, len(ranked), candidates):
+                page = ranked[start:start + candidates]
+                allowed = self._filter_ids([doc_id for doc_id, _ in page], filter_metadata)
+                lexical_hits.extend(hit for hit in page if hit[0] in allowed)
+                if len(lexical_hits) >= candidates:
+                    break
+            lexical_hits = lexical_hits[:candidates]
+        else:
+            lexical_hits = self._ensure_lexical_index().search(query, candidates)
+        
+        dense_by_id = {result["id"]: result for result in dense_results}
+        fused = reciprocal_rank_fusion(
+            [list(dense_by_id), [doc_id for doc_id, _ in lexical_hits]],
+            k=self.rrf_k
+        )
+        
+        # 只出現在詞法結果中的文檔需補齊內容與稠密分數
+        missing = [doc_id for doc_id, _ in fused[:top_k * 2] if doc_id not in dense_by_id]
+        extra = self._fetch_results(missing, query_embedding)
+        
+        lexical_ranks = {doc_id: rank for rank, (doc_id, _) in enumerate(lexical_hits, start=1)}
+        results = []
+        for doc_id, fusion_score in fused:
+            result = dense_by_id.get(doc_id) or extra.get(doc_id)
+            if result is None:
+                continue
+            results.append({
+                **result,
+                "rrf_score": fusion_score,
+                "lexical_rank": lexical_ranks.get(doc_id)
+            })
+            if len(results) >= top_k:
+                break
+        
+        return results
+    
+    def _filter_ids(self, doc_ids: List[str], filter_metadata: Dict[str, Any]) -> set:
+        """返回元數據符合過濾條件的文檔ID"""
+        if not doc_ids:
+            return set()
+        
+        if self.numpy_index is not None:
+            allowed = set()
+            for doc_id in doc_ids:
+                row = self.numpy_index.position(doc_id)
+                if row is not None and matches_where(self.numpy_index.metadatas[row], filter_metadata):
+                    allowed.add(doc_id)
+            return allowed
+        
+        return set(self.collection.get(ids=doc_ids, where=filter_metadata, include=[])["ids"])
+    
+    @staticmethod
+    def _cosine_to_score(cosine: float, space: str) -> float:
+        """把餘弦相似度換算為與 ChromaDB 一致的 1 - 距離分數"""
+        # 單位向量的平方 L2 距離為 2 - 2cos，cosine/ip 距離為 1 - cos
+        return 2 * cosine - 1 if space == "l2" else cosine
+    
+    def _fetch_results(self, doc_ids: List[str], query_embedding: np.ndarray) -> Dict[str, Dict[str, Any]]:
+        """按 ID 取出文檔並計算與查詢的稠密分數"""
+        if not doc_ids:
+            return {}
+        
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector = query_vector / max(float(np.linalg.norm(query_vector)), 1e-12)
+        fetched = {}
+        
+        if self.numpy_index is not None:
+            space = self.numpy_index.manifest.get("distance_space", "l2")
+            for doc_id in doc_ids:
+                row = self.numpy_index.position(doc_id)
+                if row is None:
+                    continue
+                cosine = float(np.asarray(self.numpy_index.matrix[row], dtype=np.float32) @ query_vector)
+                fetched[doc_id] = {
+                    "content": self.numpy_index.documents[row],
+                    "metadata": self.numpy_index.metadatas[row],
+                    "score": self._cosine_to_score(cosine, space),
+                    "id": doc_id
+                }
+            return fetched
+        
+        space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+        batch = self.collection.get(ids=doc_ids, include=["documents", "metadatas", "embeddings"])
+        for doc_id, document, metadata, embedding in zip(
+            batch["ids"], batch["documents"], batch["metadatas"], batch["embeddings"]
+        ):
+            vector = np.asarray(embedding, dtype=np.float32)
+            cosine = float(vector @ query_vector) / max(float(np.linalg.norm(vector)), 1e-12)
+            fetched[doc_id] = {
+                "content": document,
+                "metadata": metadata or {},
+                "score": self._cosine_to_score(cosine, space),
+                "id": doc_id
+            }
+        return fetched
+    
+    def _query_collection(self,
+                          query_embedding: np.ndarray,
+                          top_k: int,
+                          filter_metadata: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """以查詢向量檢索集合並格式化結果"""
+        return self._query_collection_many([query_embedding], top_k, filter_metadata)[0]
+    
+    def _query_collection_many(self,
+                               query_embeddings: np.ndarray,
+                               top_k: int,
+                               filter_metadata: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """以多條查詢向量一次檢索集合，返回每條查詢的格式化結果"""
+        if self.numpy_index is not None:
+            return self._query_numpy(query_embeddings, top_k, filter_metadata)
+        
+        results = self.collection.query(
+            query_embeddings=np.asarray(query_embeddings, dtype=np.float32).tolist(),
+            n_results=top_k,
+            where=filter_metadata
+        )
+        
+        # 格式化結果
+        all_results = []
+        for q in range(len(query_embeddings)):
+            formatted_results = []
+            if results['documents'] and results['documents'][q]:
+                for i in range(len(results['documents'][q])):
+                    result = {
+                        "content": results['documents'][q][i],
+                        "metadata": results['metadatas'][q][i] if results['metadatas'] else {},
+                        "score": 1 - results['distances'][q][i] if results['distances'] else 0,  # 轉換為相似度分數
+                        "id": results['ids'][q][i] if results['ids'] else None
+                    }
+                    formatted_results.append(result)
+            all_results.append(formatted_results)
+        
+        return all_results
+    
+    def _query_numpy(self,
+                     query_embeddings: np.ndarray,
+                     top_k: int,
+                     filter_metadata: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """以 NumPy 索引批量檢索，分數與 ChromaDB 路徑一致"""
+        space = self.numpy_index.manifest.get("distance_space", "l2")
+        
+        formatted = []
+        for hits in self.numpy_index.search(query_embeddings, top_k, where=filter_metadata):
+            results = []
+            for row, cosine in hits:
+                results.append({
+                    "content": self.numpy_index.documents[row],
+                    "metadata": self.numpy_index.metadatas[row],
+                    "score": self._cosine_to_score(cosine, space),
+                    "id": self.numpy_index.ids[row]
+                })
+            formatted.append(results)
+        return formatted
+    
     def search_by_keywords(self, 
                           keywords: List[str], 
                           top_k: int = 5) -> List[Dict[str, Any]]:
@@ -235,12 +1317,27 @@ class ZiweiVectorStore:
     def get_collection_stats(self) -> Dict[str, Any]:
         """獲取集合統計信息"""
         try:
-            count = self.collection.count()
-            return {
+            # 使用 NumPy 索引時不為統計開啟 ChromaDB
+            count = len(self.numpy_index) if self.numpy_index is not None else self.collection.count()
+            stats = {
                 "total_documents": count,
                 "collection_name": self.collection_name,
-                "persist_directory": self.persist_directory
+                "persist_directory": self.persist_directory,
+                "index_backend": self.index_backend,
+                "hybrid_search": self.hybrid_search,
+                "lexical_index": self.lexical_index.get_stats() if self.lexical_index else None,
+                "result_cache": self.result_cache.get_stats() if self.result_cache else None,
+                "collection_generation": self._generation,
+                "lookup_table_keys": len(self.lookup_table) if self.lookup_table is not None else None,
+                "reranker": self.reranker.get_stats() if self.reranker else None,
+                "embeddings": self.get_readiness()
             }
+            
+            bge_embeddings = self._get_bge_embeddings()
+            if bge_embeddings is not None:
+                stats["query_cache"] = bge_embeddings.get_query_cache_stats()
+            
+            return stats
         except Exception as e:
             self.logger.error(f"Error getting collection stats: {str(e)}")
             return {}
@@ -257,11 +1354,18 @@ class ZiweiVectorStore:
         """
         try:
             self.collection.delete(ids=doc_ids)
+            if self.numpy_index is not None:
+                self.numpy_index.delete(doc_ids)
+                self._numpy_index_dirty = True
+            if self.lexical_index is not None:
+                self.lexical_index.delete(doc_ids)
             self.logger.info(f"Deleted {len(doc_ids)} documents")
             return True
         except Exception as e:
             self.logger.error(f"Error deleting documents: {str(e)}")
             return False
+        finally:
+            self._bump_generation()
     
     def update_document(self, doc_id: str, document: Document) -> bool:
         """
@@ -275,22 +1379,38 @@ class ZiweiVectorStore:
             是否成功更新
         """
         try:
-            # 生成新的嵌入
-            embedding = self.embeddings.embed_documents([document.page_content])[0]
+            # 生成新的嵌入（OpenAI 等提供商返回 Python 列表）
+            embedding = np.asarray(self.embeddings.embed_documents([document.page_content]), dtype=np.float32)[0]
             
             # 更新文檔
             self.collection.update(
                 ids=[doc_id],
-                embeddings=[embedding],
+                embeddings=[embedding.tolist()],
                 documents=[document.page_content],
                 metadatas=[document.metadata]
             )
+            if self.numpy_index is not None:
+                self.numpy_index.add([doc_id], [embedding], [document.page_content], [document.metadata])
+                self._numpy_index_dirty = True
+            if self.lexical_index is not None:
+                self.lexical_index.add([doc_id], [document.page_content])
             
             self.logger.info(f"Updated document: {doc_id}")
             return True
         except Exception as e:
             self.logger.error(f"Error updating document: {str(e)}")
             return False
+        finally:
+            self._bump_generation()
+    
+    def close(self):
+        """保存未持久化的索引變更，釋放嵌入模型的背景資源（工作進程、微批次線程）與重排序模型"""
+        self.flush()
+        bge_embeddings = self._get_bge_embeddings()
+        if bge_embeddings is not None:
+            bge_embeddings.close()
+        if self.reranker is not None:
+            self.reranker.close()
 
 class ZiweiRAGSystem:
     """紫微斗數RAG系統"""
@@ -365,9 +1485,11 @@ class ZiweiRAGSystem:
         return filtered_results
     
     def search_by_ziwei_elements(self, 
-                                main_stars: List[str], 
+                                main_stars: List[str] = None, 
                                 palaces: List[str] = None,
-                                top_k: int = 5) -> List[str]:
+                                top_k: int = 5,
+                                min_score: float = 0.7,
+                                placements: Optional[Dict[str, Any]] = None) -> List[str]:
         """
         根據紫微斗數元素搜索
         
@@ -375,21 +1497,22 @@ class ZiweiRAGSystem:
             main_stars: 主星列表
             palaces: 宮位列表
             top_k: 返回結果數量
+            min_score: 最小相似度分數
+            placements: 命盤配置，宮位 → 該宮星曜列表（如 {"命宮": ["紫微", "天府"]}）
             
         Returns:
             相關知識片段列表
         """
-        # 構建查詢
-        query_parts = []
-        
-        if main_stars:
-            query_parts.extend(main_stars)
-        
-        if palaces:
-            query_parts.extend(palaces)
+        # 每顆主星、每個宮位各為一條子查詢，避免拼接後稀釋嵌入語義；
+        # 主星與宮位列表不含哪顆星在哪個宮，只有給出 placements 時才查預計算的星曜 × 宮位表
+        queries = list(main_stars or []) + list(palaces or [])
+        placement_keys = chart_placement_keys(placements) if placements else []
+        if placement_keys:
+            results = self.vector_store.search_placements(placement_keys, queries=queries, top_k=top_k)
+        else:
+            results = self.vector_store.search_many(queries, top_k)
         
-        query = " ".join(query_parts)
-        return self.search_knowledge(query, top_k)
+        return [result["content"] for result in results if result["score"] >= min_score]
     
     def get_system_status(self) -> Dict[str, Any]:
         """獲取系統狀態"""
@@ -4,30 +4,222 @@
 
 import hashlib
 import json
+import os
+import pickle
+import struct
+import tempfile
 import time
-from typing import Dict, Any, Optional
+import zlib
+from typing import Dict, Any, Optional, Tuple
 from pathlib import Path
 import logging
 
+# 可選的序列化與壓縮庫
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+class JSONSerializer:
+    """JSON 序列化器（緊湊格式）"""
+    
+    name = "json"
+    code = 1
+    
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    
+    def loads(self, payload: bytes) -> Any:
+        return json.loads(payload.decode('utf-8'))
+
+
+class PickleSerializer:
+    """Pickle 序列化器（protocol 5）"""
+    
+    name = "pickle"
+    code = 2
+    
+    def dumps(self, value: Any) -> bytes:
+        return pickle.dumps(value, protocol=5)
+    
+    def loads(self, payload: bytes) -> Any:
+        return pickle.loads(payload)
+
+
+class MsgpackSerializer:
+    """MessagePack 序列化器"""
+    
+    name = "msgpack"
+    code = 3
+    
+    def dumps(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+    
+    def loads(self, payload: bytes) -> Any:
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+class NoCompressor:
+    """不壓縮"""
+    
+    name = "none"
+    code = 0
+    
+    def compress(self, payload: bytes) -> bytes:
+        return payload
+    
+    def decompress(self, payload: bytes) -> bytes:
+        return payload
+
+
+class ZlibCompressor:
+    """zlib 壓縮（標準庫，作為最後備用）"""
+    
+    name = "zlib"
+    code = 1
+    
+    def compress(self, payload: bytes) -> bytes:
+        return zlib.compress(payload, 6)
+    
+    def decompress(self, payload: bytes) -> bytes:
+        return zlib.decompress(payload)
+
+
+class ZstdCompressor:
+    """Zstandard 壓縮"""
+    
+    name = "zstd"
+    code = 2
+    
+    def __init__(self, level: int = 3):
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+    
+    def compress(self, payload: bytes) -> bytes:
+        return self._compressor.compress(payload)
+    
+    def decompress(self, payload: bytes) -> bytes:
+        return self._decompressor.decompress(payload)
+
+
+class LZ4Compressor:
+    """LZ4 壓縮"""
+    
+    name = "lz4"
+    code = 3
+    
+    def compress(self, payload: bytes) -> bytes:
+        return lz4_frame.compress(payload)
+    
+    def decompress(self, payload: bytes) -> bytes:
+        return lz4_frame.decompress(payload)
+
+
+def _available_serializers() -> Dict[str, Any]:
+    """可用的序列化器"""
+    serializers = {"json": JSONSerializer, "pickle": PickleSerializer}
+    if msgpack is not None:
+        serializers["msgpack"] = MsgpackSerializer
+    return serializers
+
+
+def _available_compressors() -> Dict[str, Any]:
+    """可用的壓縮器"""
+    compressors = {"none": NoCompressor, "zlib": ZlibCompressor}
+    if zstandard is not None:
+        compressors["zstd"] = ZstdCompressor
+    if lz4_frame is not None:
+        compressors["lz4"] = LZ4Compressor
+    return compressors
+
+
 class CacheManager:
     """智能快取管理器"""
     
-    def __init__(self, cache_dir: str = "cache", ttl: int = 3600):
+    # 二進位快取檔案格式: 魔數 | 序列化器代碼 | 壓縮器代碼 | 時間戳 | 資料
+    FILE_MAGIC = b"ZWC1"
+    HEADER = struct.Struct("<4sBBd")
+    FILE_SUFFIX = ".cache"
+    LEGACY_SUFFIX = ".json"
+    
+    def __init__(self,
+                 cache_dir: str = "cache",
+                 ttl: int = 3600,
+                 serializer: str = "auto",
+                 compression: str = "auto",
+                 compression_threshold: int = 1024):
         """
         初始化快取管理器
         
         Args:
             cache_dir: 快取目錄
             ttl: 快取存活時間（秒）
+            serializer: 序列化器 (auto, msgpack, pickle, json)
+            compression: 壓縮方式 (auto, zstd, lz4, zlib, none)
+            compression_threshold: 超過此位元組數才壓縮
         """
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
         self.ttl = ttl
         self.logger = logging.getLogger(__name__)
         
+        # 序列化與壓縮
+        self.serializer = self._resolve_serializer(serializer)
+        self.compressor = self._resolve_compressor(compression)
+        self.compression_threshold = compression_threshold
+        self._fallback_serializer = PickleSerializer()
+        self._serializers_by_code = {
+            cls.code: cls() for cls in _available_serializers().values()
+        }
+        self._compressors_by_code = {
+            cls.code: cls() for cls in _available_compressors().values()
+        }
+        
         # 記憶體快取
         self.memory_cache = {}
         self.cache_timestamps = {}
+        
+        # 序列化統計
+        self.metrics = {
+            'disk_writes': 0,
+            'disk_reads': 0,
+            'legacy_reads': 0,
+            'raw_bytes': 0,
+            'stored_bytes': 0,
+            'encode_time': 0.0,
+            'decode_time': 0.0
+        }
+    
+    def _resolve_serializer(self, name: str):
+        """解析序列化器名稱"""
+        available = _available_serializers()
+        if name == "auto":
+            name = "msgpack" if "msgpack" in available else "pickle"
+        if name not in available:
+            self.logger.warning(f"Serializer '{name}' not available, using pickle")
+            name = "pickle"
+        return available[name]()
+    
+    def _resolve_compressor(self, name: str):
+        """解析壓縮器名稱"""
+        available = _available_compressors()
+        if name == "auto":
+            name = next(n for n in ("zstd", "lz4", "zlib") if n in available)
+        if name not in available:
+            self.logger.warning(f"Compression '{name}' not available, using zlib")
+            name = "zlib"
+        return available[name]()
     
     def _generate_cache_key(self, data: Dict[str, Any]) -> str:
         """生成快取鍵"""
@@ -39,6 +231,56 @@ class CacheManager:
         """檢查快取是否有效"""
         return time.time() - timestamp < self.ttl
     
+    def _encode(self, value: Any, timestamp: float) -> bytes:
+        """序列化並（視大小）壓縮快取值"""
+        start = time.perf_counter()
+        
+        serializer = self.serializer
+        try:
+            payload = serializer.dumps(value)
+        except (TypeError, ValueError):
+            # 值含有該格式無法表示的類型時改用 pickle
+            serializer = self._fallback_serializer
+            payload = serializer.dumps(value)
+        
+        compressor = self._compressors_by_code[NoCompressor.code]
+        if len(payload) >= self.compression_threshold:
+            compressed = self.compressor.compress(payload)
+            if len(compressed) < len(payload):
+                compressor = self.compressor
+                payload_out = compressed
+            else:
+                payload_out = payload
+        else:
+            payload_out = payload
+        
+        header = self.HEADER.pack(self.FILE_MAGIC, serializer.code, compressor.code, timestamp)
+        blob = header + payload_out
+        
+        self.metrics['encode_time'] += time.perf_counter() - start
+        self.metrics['raw_bytes'] += len(payload)
+        self.metrics['stored_bytes'] += len(blob)
+        return blob
+    
+    def _read_header(self, blob: bytes) -> Tuple[int, int, float]:
+        """解析快取檔案標頭"""
+        magic, serializer_code, compressor_code, timestamp = self.HEADER.unpack_from(blob)
+        if magic != self.FILE_MAGIC:
+            raise ValueError("Invalid cache file header")
+        return serializer_code, compressor_code, timestamp
+    
+    def _decode(self, blob: bytes) -> Any:
+        """解壓並反序列化快取值"""
+        start = time.perf_counter()
+        
+        serializer_code, compressor_code, _ = self._read_header(blob)
+        payload = blob[self.HEADER.size:]
+        payload = self._compressors_by_code[compressor_code].decompress(payload)
+        value = self._serializers_by_code[serializer_code].loads(payload)
+        
+        self.metrics['decode_time'] += time.perf_counter() - start
+        return value
+    
     def get_from_memory(self, key: str) -> Optional[Any]:
         """從記憶體快取獲取數據"""
         if key in self.memory_cache:
@@ -60,37 +302,71 @@ class CacheManager:
     
     def get_from_disk(self, key: str) -> Optional[Any]:
         """從磁盤快取獲取數據"""
-        cache_file = self.cache_dir / f"{key}.json"
+        cache_file = self.cache_dir / f"{key}{self.FILE_SUFFIX}"
+        
+        if cache_file.exists():
+            try:
+                blob = cache_file.read_bytes()
+                _, _, timestamp = self._read_header(blob)
+                if self._is_cache_valid(timestamp):
+                    value = self._decode(blob)
+                    self.metrics['disk_reads'] += 1
+                    self.logger.debug(f"Disk cache hit: {key}")
+                    return value
+                else:
+                    # 刪除過期快取
+                    cache_file.unlink()
+            except Exception as e:
+                self.logger.warning(f"Failed to read cache {key}: {e}")
+        
+        return self._get_from_legacy_disk(key)
+    
+    def _get_from_legacy_disk(self, key: str) -> Optional[Any]:
+        """讀取舊版 JSON 格式的快取"""
+        cache_file = self.cache_dir / f"{key}{self.LEGACY_SUFFIX}"
         
         if cache_file.exists():
             try:
+                start = time.perf_counter()
                 with open(cache_file, 'r', encoding='utf-8') as f:
                     cache_data = json.load(f)
+                self.metrics['decode_time'] += time.perf_counter() - start
                 
                 timestamp = cache_data.get('timestamp', 0)
                 if self._is_cache_valid(timestamp):
-                    self.logger.debug(f"Disk cache hit: {key}")
+                    self.metrics['legacy_reads'] += 1
+                    self.logger.debug(f"Legacy disk cache hit: {key}")
                     return cache_data.get('data')
                 else:
                     # 刪除過期快取
                     cache_file.unlink()
             except Exception as e:
-                self.logger.warning(f"Failed to read cache {key}: {e}")
+                self.logger.warning(f"Failed to read legacy cache {key}: {e}")
         
         return None
     
     def set_to_disk(self, key: str, value: Any):
         """設置磁盤快取"""
-        cache_file = self.cache_dir / f"{key}.json"
+        cache_file = self.cache_dir / f"{key}{self.FILE_SUFFIX}"
         
         try:
-            cache_data = {
-                'data': value,
-                'timestamp': time.time()
-            }
+            blob = self._encode(value, time.time())
             
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+            # 先寫入臨時檔再替換，避免讀到寫到一半的檔案；每次寫入使用唯一的臨時檔，同鍵的並發寫入互不交錯
+            tmp = tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=f"{key}.", suffix=".tmp", delete=False)
+            try:
+                with tmp:
+                    tmp.write(blob)
+                os.replace(tmp.name, cache_file)
+            except Exception:
+                Path(tmp.name).unlink(missing_ok=True)
+                raise
+            self.metrics['disk_writes'] += 1
+            
+            # 新格式寫入後移除同鍵的舊版 JSON
+            legacy_file = self.cache_dir / f"{key}{self.LEGACY_SUFFIX}"
+            if legacy_file.exists():
+                legacy_file.unlink()
             
             self.logger.debug(f"Disk cache set: {key}")
         except Exception as e:
@@ -124,6 +400,22 @@ class CacheManager:
         # 設置磁盤快取
         self.set_to_disk(key, value)
     
+    def _iter_cache_files(self):
+        """列出所有快取檔案（新格式與舊版 JSON）"""
+        yield from self.cache_dir.glob(f"*{self.FILE_SUFFIX}")
+        yield from self.cache_dir.glob(f"*{self.LEGACY_SUFFIX}")
+    
+    def _read_file_timestamp(self, cache_file: Path) -> float:
+        """讀取快取檔案的時間戳"""
+        if cache_file.suffix == self.FILE_SUFFIX:
+            with open(cache_file, 'rb') as f:
+                header = f.read(self.HEADER.size)
+            return self._read_header(header)[2]
+        
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache_data = json.load(f)
+        return cache_data.get('timestamp', 0)
+    
     def clear_expired(self):
         """清理過期快取"""
         # 清理記憶體快取
@@ -137,12 +429,9 @@ class CacheManager:
             del self.cache_timestamps[key]
         
         # 清理磁盤快取
-        for cache_file in self.cache_dir.glob("*.json"):
+        for cache_file in list(self._iter_cache_files()):
             try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    cache_data = json.load(f)
-                
-                timestamp = cache_data.get('timestamp', 0)
+                timestamp = self._read_file_timestamp(cache_file)
                 if not self._is_cache_valid(timestamp):
                     cache_file.unlink()
             except Exception:
@@ -158,7 +447,7 @@ class CacheManager:
         self.cache_timestamps.clear()
         
         # 清理磁盤快取
-        for cache_file in self.cache_dir.glob("*.json"):
+        for cache_file in list(self._iter_cache_files()):
             cache_file.unlink()
         
         self.logger.info("All cache cleared")
@@ -166,13 +455,29 @@ class CacheManager:
     def get_stats(self) -> Dict[str, Any]:
         """獲取快取統計"""
         memory_count = len(self.memory_cache)
-        disk_count = len(list(self.cache_dir.glob("*.json")))
+        disk_count = len(list(self.cache_dir.glob(f"*{self.FILE_SUFFIX}")))
+        legacy_count = len(list(self.cache_dir.glob(f"*{self.LEGACY_SUFFIX}")))
+        
+        metrics = self.metrics
+        stored_bytes = metrics['stored_bytes']
         
         return {
             'memory_cache_count': memory_count,
-            'disk_cache_count': disk_count,
+            'disk_cache_count': disk_count + legacy_count,
+            'legacy_cache_count': legacy_count,
             'cache_dir': str(self.cache_dir),
-            'ttl': self.ttl
+            'ttl': self.ttl,
+            'serializer': self.serializer.name,
+            'compression': self.compressor.name,
+            'compression_threshold': self.compression_threshold,
+            'compression_ratio': metrics['raw_bytes'] / stored_bytes if stored_bytes else 1.0,
+            'bytes_written': stored_bytes,
+            'disk_writes': metrics['disk_writes'],
+            'disk_reads': metrics['disk_reads'],
+            'legacy_reads': metrics['legacy_reads'],
+            'avg_encode_ms': metrics['encode_time'] * 1000 / metrics['disk_writes'] if metrics['disk_writes'] else 0.0,
+            'avg_decode_ms': metrics['decode_time'] * 1000 / (metrics['disk_reads'] + metrics['legacy_reads'])
+            if (metrics['disk_reads'] + metrics['legacy_reads']) else 0.0
         }
 
 
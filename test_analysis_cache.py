@@ -0,0 +1,142 @@
+"""
+測試完整分析結果快取
+"""
+
+import asyncio
+import logging
+import shutil
+import tempfile
+
+import main
+from main import ZiweiAISystem
+from src.utils.cache_manager import CacheManager
+
+
+BIRTH_DATA = {
+    "gender": "男",
+    "birth_year": 1990,
+    "birth_month": 5,
+    "birth_day": 15,
+    "birth_hour": "午"
+}
+
+
+def _make_system(results=None):
+    """建立不連接外部服務的系統，分析流程以計數的替身取代"""
+    system = ZiweiAISystem(logger=logging.getLogger("test_analysis_cache"))
+    system.cache_manager = CacheManager(cache_dir=tempfile.mkdtemp(prefix="ziwei_analysis_cache_"))
+    system.is_initialized = True
+    system.analysis_calls = 0
+    
+    async def fake_analyze(birth_data, domain_type, output_format, show_process, start_time):
+        system.analysis_calls += 1
+        if results:
+            return results.pop(0)
+        return {
+            "success": True,
+            "result": f"{domain_type} 分析 #{system.analysis_calls}",
+            "metadata": {"domain_type": domain_type}
+        }
+    
+    system._analyze_with_crewai = fake_analyze
+    return system
+
+
+def _cleanup(system):
+    shutil.rmtree(system.cache_manager.cache_dir, ignore_errors=True)
+
+
+def test_hit_on_normalized_birth_data():
+    """測試等價的出生資料命中同一快取，不同資料不命中"""
+    print("=== 測試快取命中與未命中 ===")
+    
+    system = _make_system()
+    try:
+        first = asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "love"))
+        assert first["success"] and not first.get("cache_hit")
+        
+        # 字串與補零的日期、帶「時」的時辰正規化後相同
+        equivalent = {**BIRTH_DATA, "birth_month": "05", "birth_day": " 15", "birth_hour": "午時"}
+        second = asyncio.run(system.analyze_ziwei_chart(equivalent, "love"))
+        assert second["cache_hit"] is True
+        assert second["metadata"]["cache_hit"] is True
+        assert second["result"] == first["result"]
+        assert system.analysis_calls == 1
+        
+        # 其他日期或領域不命中
+        asyncio.run(system.analyze_ziwei_chart({**BIRTH_DATA, "birth_day": 16}, "love"))
+        asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "wealth"))
+        assert system.analysis_calls == 3
+    finally:
+        _cleanup(system)
+
+
+def test_pipeline_version_invalidates():
+    """測試管線版本變更後舊的快取失效"""
+    print("=== 測試管線版本失效 ===")
+    
+    system = _make_system()
+    original_version = main.PIPELINE_VERSION
+    try:
+        asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "love"))
+        assert asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "love"))["cache_hit"]
+        
+        main.PIPELINE_VERSION = original_version + "-next"
+        system.pipeline_version = main.compute_pipeline_version()
+        
+        result = asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "love"))
+        assert not result.get("cache_hit")
+        assert system.analysis_calls == 2
+    finally:
+        main.PIPELINE_VERSION = original_version
+        _cleanup(system)
+
+
+def test_cache_bypass():
+    """測試 use_cache=False 與用戶背景資料不使用快取"""
+    print("=== 測試略過快取 ===")
+    
+    system = _make_system()
+    try:
+        asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "love"))
+        
+        result = asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "love", use_cache=False))
+        assert not result.get("cache_hit")
+        assert system.analysis_calls == 2
+        
+        # 用戶背景資料會影響分析內容：既不讀取也不寫入快取
+        profile = {"occupation": "工程師"}
+        result = asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "wealth", user_profile=profile))
+        assert not result.get("cache_hit")
+        result = asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "wealth", user_profile=profile))
+        assert not result.get("cache_hit")
+        assert system.analysis_calls == 4
+        assert system.cache_manager.get(
+            system._build_analysis_cache_key(BIRTH_DATA, "wealth", "json", "CrewAI + MCP")
+        ) is None
+    finally:
+        _cleanup(system)
+
+
+def test_failed_analysis_not_cached():
+    """測試失敗的分析結果不寫入快取"""
+    print("=== 測試失敗結果不快取 ===")
+    
+    system = _make_system(results=[{"success": False, "error": "LLM timeout"}])
+    try:
+        failed = asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "love"))
+        assert failed["success"] is False
+        
+        retried = asyncio.run(system.analyze_ziwei_chart(BIRTH_DATA, "love"))
+        assert retried["success"] and not retried.get("cache_hit")
+        assert system.analysis_calls == 2
+    finally:
+        _cleanup(system)
+
+
+if __name__ == "__main__":
+    test_hit_on_normalized_birth_data()
+    test_pipeline_version_invalidates()
+    test_cache_bypass()
+    test_failed_analysis_not_cached()
+    print("✅ 分析結果快取測試完成")
@@ -77,7 +77,7 @@ async def test_bge_embedding_with_openai_fallback():
             print(f"✅ 文檔嵌入成功")
             print(f"   處理時間: {embed_time:.2f} 秒")
             print(f"   嵌入數量: {len(doc_embeddings)}")
-            print(f"   嵌入維度: {len(doc_embeddings[0]) if doc_embeddings else 0}")
+            print(f"   嵌入維度: {len(doc_embeddings[0]) if len(doc_embeddings) else 0}")
             
         except Exception as e:
             print(f"⚠️  BGE-M3 嵌入失敗，嘗試使用 OpenAI 備用: {str(e)}")
@@ -99,7 +99,7 @@ async def test_bge_embedding_with_openai_fallback():
             return False
         
         # 計算相似度
-        if doc_embeddings and query_embedding:
+        if len(doc_embeddings) and len(query_embedding):
             print("📊 計算相似度...")
             
             similarities = []
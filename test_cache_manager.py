@@ -0,0 +1,120 @@
+"""
+測試快取管理器的序列化與壓縮
+"""
+
+import json
+import shutil
+import tempfile
+import threading
+import time
+
+from src.utils.cache_manager import CacheManager
+
+
+def _make_cache(**kwargs) -> CacheManager:
+    """在臨時目錄建立快取管理器"""
+    cache_dir = tempfile.mkdtemp(prefix="ziwei_cache_")
+    return CacheManager(cache_dir=cache_dir, **kwargs)
+
+
+def test_binary_round_trip():
+    """測試二進位格式的讀寫"""
+    print("=== 測試二進位快取讀寫 ===")
+    
+    cache = _make_cache()
+    try:
+        key = {'operation': 'knowledge_retrieval', 'domain_type': 'love'}
+        value = "紫微星坐命，主尊貴。" * 500
+        
+        cache.set(key, value)
+        cache.memory_cache.clear()
+        
+        assert cache.get(key) == value
+        
+        stats = cache.get_stats()
+        print(f"序列化器: {stats['serializer']}, 壓縮: {stats['compression']}")
+        print(f"壓縮比: {stats['compression_ratio']:.2f}")
+        assert stats['compression_ratio'] > 1.0
+        assert stats['disk_reads'] == 1
+    finally:
+        shutil.rmtree(cache.cache_dir, ignore_errors=True)
+
+
+def test_small_values_not_compressed():
+    """測試小於閾值的值不壓縮"""
+    print("=== 測試壓縮閾值 ===")
+    
+    cache = _make_cache(compression_threshold=4096)
+    try:
+        cache.set({'k': 1}, {'answer': '命宮'})
+        cache.memory_cache.clear()
+        
+        assert cache.get({'k': 1}) == {'answer': '命宮'}
+        assert cache.get_stats()['compression_ratio'] < 1.0
+    finally:
+        shutil.rmtree(cache.cache_dir, ignore_errors=True)
+
+
+def test_legacy_json_read():
+    """測試讀取舊版 JSON 快取"""
+    print("=== 測試舊版 JSON 快取相容 ===")
+    
+    cache = _make_cache()
+    try:
+        key = {'operation': 'knowledge_retrieval'}
+        legacy_file = cache.cache_dir / f"{cache._generate_cache_key(key)}.json"
+        with open(legacy_file, 'w', encoding='utf-8') as f:
+            json.dump({'data': '舊版內容', 'timestamp': time.time()}, f, ensure_ascii=False, indent=2)
+        
+        assert cache.get(key) == '舊版內容'
+        assert cache.get_stats()['legacy_reads'] == 1
+        
+        # 重新寫入後舊檔案應被取代
+        cache.set(key, '新版內容')
+        assert not legacy_file.exists()
+    finally:
+        shutil.rmtree(cache.cache_dir, ignore_errors=True)
+
+
+def test_clear_expired():
+    """測試過期快取清理"""
+    print("=== 測試過期清理 ===")
+    
+    cache = _make_cache(ttl=0)
+    try:
+        cache.set({'k': 'expired'}, 'value')
+        cache.clear_expired()
+        assert cache.get_stats()['disk_cache_count'] == 0
+    finally:
+        shutil.rmtree(cache.cache_dir, ignore_errors=True)
+
+
+def test_concurrent_writes_same_key():
+    """測試同鍵並發寫入各自使用臨時檔，最終檔案完整且不殘留臨時檔"""
+    print("=== 測試同鍵並發寫入 ===")
+    
+    cache = _make_cache()
+    try:
+        key = {'operation': 'full_analysis', 'domain_type': 'love'}
+        values = [f"第{i}次分析。" * 2000 for i in range(8)]
+        threads = [threading.Thread(target=cache.set, args=(key, value)) for value in values]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        cache.memory_cache.clear()
+        assert cache.get(key) in values
+        assert cache.metrics['disk_writes'] == len(values)
+        assert not list(cache.cache_dir.glob("*.tmp"))
+    finally:
+        shutil.rmtree(cache.cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_binary_round_trip()
+    test_small_values_not_compressed()
+    test_legacy_json_read()
+    test_clear_expired()
+    test_concurrent_writes_same_key()
+    print("✅ 快取管理器測試完成")
@@ -0,0 +1,86 @@
+"""
+測試檢索上下文組裝（重疊合併、去重、token 預算）
+"""
+
+from src.rag.context_packer import ContextPacker, estimate_tokens
+
+
+def _result(text, start, end, score, source="book.pdf", doc_id=None):
+    return {
+        "id": doc_id or f"{source}:{start}",
+        "content": text,
+        "score": score,
+        "metadata": {"source": source, "start_pos": start, "end_pos": end}
+    }
+
+
+def test_merge_overlapping_chunks():
+    """測試位置重疊且文本吻合的文本塊合併為一段，按最高相關度排序"""
+    print("=== 測試重疊合併 ===")
+    
+    full_text = "紫微星為帝星，主尊貴。坐命宮者氣度恢宏，喜得左輔右弼相助。若逢擎羊陀羅則多波折。天府星為財庫，主保守穩重。"
+    first = full_text[:30]
+    second = full_text[20:]
+    other = "太陽星主光明，男命主父。"
+    
+    results = [
+        _result(second, 20, len(full_text), 0.9),
+        _result(other, 0, len(other), 0.85, source="other.pdf"),
+        _result(first, 0, 30, 0.8)
+    ]
+    packed = ContextPacker(max_tokens=1000).pack(results)
+    print(f"片段: {packed['documents']}")
+    
+    assert packed["merged"] == 1
+    assert packed["documents"] == [full_text, other]
+
+
+def test_stale_positions_not_merged():
+    """測試位置元數據過期（聲稱重疊但文本不吻合）時不合併"""
+    first = "紫微星為帝星，主尊貴，坐命宮者氣度恢宏。"
+    second = "天機星為智慧之星，主機變，喜動不喜靜。"
+    
+    results = [_result(first, 0, 40, 0.9), _result(second, 20, 60, 0.8)]
+    packed = ContextPacker(max_tokens=1000).pack(results)
+    
+    assert packed["merged"] == 0
+    assert packed["documents"] == [first, second]
+
+
+def test_duplicates_removed():
+    """測試相同或被包含的片段只保留一次"""
+    text = "武曲星為財星，主剛毅果決。化忌時財務多波折。"
+    results = [
+        _result(text[:13], 0, 13, 0.95, source="a.pdf"),
+        _result(text, 0, len(text), 0.7, source="b.pdf"),
+        _result(" " + text + " ", 0, len(text), 0.6, source="c.pdf")
+    ]
+    packed = ContextPacker(max_tokens=1000).pack(results)
+    
+    assert packed["duplicates"] == 2
+    assert packed["documents"] == [text]
+
+
+def test_token_budget():
+    """測試上下文不超過 token 預算，超出部分在句末截斷或捨棄"""
+    print("=== 測試 token 預算 ===")
+    
+    sentence = "廉貞星為囚星，主桀驁不馴，化祿時轉為才華洋溢。"
+    chunks = [_result(f"第{i}段：" + sentence * 8, 0, 0, 0.9 - i * 0.1, source=f"{i}.pdf") for i in range(5)]
+    packer = ContextPacker(max_tokens=500, min_fragment_tokens=20)
+    packed = packer.pack(chunks)
+    print(f"token: {packed['tokens']}, 片段: {len(packed['documents'])}, 捨棄: {packed['dropped']}")
+    
+    assert packed["tokens"] <= 500
+    assert estimate_tokens(packed["context"]) <= 500
+    assert packed["documents"][-1].endswith("。")
+    assert len(packed["documents"]) + packed["dropped"] == 5
+    assert packer.pack(chunks, max_tokens=5)["documents"] == []
+
+
+if __name__ == "__main__":
+    test_merge_overlapping_chunks()
+    test_stale_positions_not_merged()
+    test_duplicates_removed()
+    test_token_budget()
+    print("✅ 上下文組裝測試完成")
@@ -0,0 +1,60 @@
+"""
+測試領域過濾條件
+"""
+
+from import_pdf_to_vector_db import classify_chunk
+from src.rag.domain_filters import DOMAIN_CATEGORIES, GENERAL_TYPES, domain_filter
+from src.rag.numpy_index import matches_where
+
+
+def test_domain_filter_clauses():
+    """測試領域映射為 content_type 條件"""
+    print("=== 測試領域過濾條件 ===")
+    
+    assert domain_filter(None) is None
+    assert domain_filter("comprehensive") is None
+    assert domain_filter("all") is None
+    assert domain_filter("future") == {"content_type": {"$in": ["運勢分析", "格局分析", "一般內容", "general"]}}
+    
+    try:
+        domain_filter("unknown")
+        raise AssertionError("expected ValueError")
+    except ValueError:
+        pass
+
+
+def test_general_chunks_match_every_domain():
+    """測試未分類的文本塊在任何領域過濾下都可被檢索"""
+    print("=== 測試通用分類 ===")
+    
+    # 導入工具對沒有可判定分類的文本塊寫入的標籤
+    label = classify_chunk("凡論命者，先看其人之根基。")["content_type"]
+    assert label in GENERAL_TYPES
+    
+    for domain, categories in DOMAIN_CATEGORIES.items():
+        where = domain_filter(domain)
+        for general_type in GENERAL_TYPES:
+            assert matches_where({"content_type": general_type}, where), (domain, general_type)
+        if categories:
+            # 其他領域的專屬分類仍被排除
+            excluded = {"主星解析", "宮位解析", "格局分析", "運勢分析", "基礎理論"} - set(categories)
+            for content_type in excluded:
+                assert not matches_where({"content_type": content_type}, where), (domain, content_type)
+
+
+def test_create_vector_db_general_label():
+    """測試 create_vector_db 的通用分類標籤包含在過濾條件中"""
+    print("=== 測試 create_vector_db 分類標籤 ===")
+    
+    from create_vector_db import classify_content
+    
+    label = classify_content("凡論命者，先看其人之根基。")
+    assert label in GENERAL_TYPES
+    assert matches_where({"content_type": label}, domain_filter("love"))
+
+
+if __name__ == "__main__":
+    test_domain_filter_clauses()
+    test_general_chunks_match_every_domain()
+    test_create_vector_db_general_label()
+    print("✅ 領域過濾條件測試完成")
@@ -0,0 +1,151 @@
+"""
+測試嵌入向量快取
+"""
+
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from src.rag.embedding_cache import QueryEmbeddingCache, DocumentEmbeddingCache
+
+
+def test_query_cache_lru():
+    """測試查詢快取的 LRU 淘汰與命中率"""
+    print("=== 測試查詢嵌入 LRU 快取 ===")
+    
+    cache = QueryEmbeddingCache(max_size=2)
+    key_a = QueryEmbeddingCache.make_key("BAAI/bge-m3", 1024, "紫微星")
+    key_b = QueryEmbeddingCache.make_key("BAAI/bge-m3", 1024, "天機星")
+    key_c = QueryEmbeddingCache.make_key("BAAI/bge-m3", 1024, "太陽星")
+    
+    cache.put(key_a, np.ones(4))
+    cache.put(key_b, np.zeros(4))
+    assert cache.get(key_a) is not None  # a 變為最近使用
+    cache.put(key_c, np.ones(4))          # 淘汰 b
+    
+    assert cache.get(key_b) is None
+    assert cache.get(key_c) is not None
+    
+    stats = cache.get_stats()
+    print(f"命中率: {stats['hit_rate']:.2f}")
+    assert stats['size'] == 2
+    assert stats['hits'] == 2 and stats['misses'] == 1
+
+
+def test_query_cache_key_normalization():
+    """測試查詢文本正規化"""
+    print("=== 測試查詢鍵正規化 ===")
+    
+    key_1 = QueryEmbeddingCache.make_key("BAAI/bge-m3", 1024, "  紫微星   命宮 ")
+    key_2 = QueryEmbeddingCache.make_key("BAAI/bge-m3", 1024, "紫微星 命宮")
+    key_3 = QueryEmbeddingCache.make_key("BAAI/bge-m3", 512, "紫微星 命宮")
+    
+    assert key_1 == key_2
+    assert key_1 != key_3
+
+
+def test_query_cache_persistence():
+    """測試查詢快取持久化"""
+    print("=== 測試查詢快取持久化 ===")
+    
+    cache_dir = tempfile.mkdtemp(prefix="ziwei_query_cache_")
+    try:
+        persist_path = str(Path(cache_dir) / "queries.npz")
+        key = QueryEmbeddingCache.make_key("BAAI/bge-m3", 1024, "紫微星")
+        
+        cache = QueryEmbeddingCache(max_size=8, persist_path=persist_path)
+        cache.put(key, np.arange(4, dtype=np.float32))
+        cache.save()
+        
+        reloaded = QueryEmbeddingCache(max_size=8, persist_path=persist_path)
+        assert np.allclose(reloaded.get(key), np.arange(4))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def test_query_cache_stores_copy():
+    """測試快取保存副本，修改返回的向量不影響快取"""
+    print("=== 測試查詢快取副本 ===")
+    
+    cache = QueryEmbeddingCache(max_size=8)
+    key = QueryEmbeddingCache.make_key("BAAI/bge-m3", 1024, "紫微星")
+    
+    batch = np.ones((2, 4), dtype=np.float32)
+    vector = batch[0]
+    cache.put(key, vector)
+    
+    # 未命中時調用方拿到的是原向量，原地正規化不應改變快取
+    vector /= np.linalg.norm(vector)
+    assert np.allclose(cache.get(key), np.ones(4))
+
+
+def test_document_cache_incremental():
+    """測試文檔嵌入快取只需嵌入新文本"""
+    print("=== 測試文檔嵌入快取 ===")
+    
+    cache_dir = tempfile.mkdtemp(prefix="ziwei_doc_cache_")
+    try:
+        cache = DocumentEmbeddingCache(cache_dir, model_id="BAAI/bge-m3:1024")
+        texts = ["紫微星為帝星", "天機星主智慧"]
+        cache.put_many(texts, np.eye(2, 4, dtype=np.float32))
+        
+        # 重新開啟（模擬重建知識庫）
+        reopened = DocumentEmbeddingCache(cache_dir, model_id="BAAI/bge-m3:1024")
+        results = reopened.get_many(["天機星主智慧", "太陽星主貴"])
+        
+        assert np.allclose(results[0], [0, 1, 0, 0])
+        assert results[1] is None
+        
+        reopened.put_many(["太陽星主貴"], np.ones((1, 4), dtype=np.float32))
+        assert reopened.get_stats()['size'] == 3
+        assert np.allclose(reopened.get_many(["太陽星主貴"])[0], 1.0)
+        
+        # 不同模型不共用快取
+        other_model = DocumentEmbeddingCache(cache_dir, model_id="BAAI/bge-m3:512")
+        assert other_model.get_many(["紫微星為帝星"])[0] is None
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def test_document_cache_failed_write():
+    """測試向量寫入失敗時索引不指向不存在的行"""
+    print("=== 測試文檔快取寫入失敗 ===")
+    
+    cache_dir = tempfile.mkdtemp(prefix="ziwei_doc_cache_")
+    try:
+        cache = DocumentEmbeddingCache(cache_dir, model_id="BAAI/bge-m3:1024")
+        cache.put_many(["紫微星為帝星"], np.ones((1, 4), dtype=np.float32))
+        
+        # 以目錄佔據向量檔路徑，使下一次寫入失敗
+        vectors_path = cache.vectors_path
+        vectors_path.rename(vectors_path.with_suffix(".bak"))
+        vectors_path.mkdir()
+        try:
+            cache.put_many(["天機星主智慧"], np.zeros((1, 4), dtype=np.float32))
+            raise AssertionError("expected OSError")
+        except OSError:
+            pass
+        vectors_path.rmdir()
+        vectors_path.with_suffix(".bak").rename(vectors_path)
+        
+        assert cache.get_stats()['size'] == 1
+        assert cache.get_many(["天機星主智慧"])[0] is None
+        assert np.allclose(cache.get_many(["紫微星為帝星"])[0], 1.0)
+        
+        reopened = DocumentEmbeddingCache(cache_dir, model_id="BAAI/bge-m3:1024")
+        assert reopened.get_stats()['size'] == 1
+        assert reopened.get_many(["天機星主智慧"])[0] is None
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_query_cache_lru()
+    test_query_cache_key_normalization()
+    test_query_cache_persistence()
+    test_query_cache_stores_copy()
+    test_document_cache_incremental()
+    test_document_cache_failed_write()
+    print("✅ 嵌入快取測試完成")
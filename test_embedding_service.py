@@ -0,0 +1,192 @@
+"""
+測試嵌入微批次服務
+"""
+
+import asyncio
+import threading
+
+import numpy as np
+
+from src.rag.embedding_service import MicroBatchEmbeddingService, plan_length_buckets
+
+
+def _fake_encoder(calls):
+    """模擬批次編碼函數，記錄每次調用的批次大小"""
+    def encode(texts):
+        calls.append(len(texts))
+        return np.array([[float(len(text)), 1.0] for text in texts], dtype=np.float32)
+    return encode
+
+
+def test_concurrent_requests_share_batch():
+    """測試並發請求被合併為同一批次"""
+    print("=== 測試並發請求合併 ===")
+    
+    calls = []
+    service = MicroBatchEmbeddingService(_fake_encoder(calls), max_batch_size=8, max_wait_ms=50)
+    try:
+        texts = ["紫微", "天機星", "太陽星君", "武曲"]
+        results = {}
+        
+        def worker(text):
+            results[text] = service.embed_query(text)
+        
+        threads = [threading.Thread(target=worker, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        for text in texts:
+            assert results[text][0] == len(text)
+        
+        print(f"批次調用: {calls}")
+        assert len(calls) < len(texts)
+        assert service.get_stats()['requests'] == len(texts)
+    finally:
+        service.close()
+
+
+def test_async_requests_and_duplicates():
+    """測試非同步請求與重複文本去重"""
+    print("=== 測試非同步請求 ===")
+    
+    calls = []
+    service = MicroBatchEmbeddingService(_fake_encoder(calls), max_batch_size=8, max_wait_ms=50)
+    try:
+        async def run():
+            return await asyncio.gather(*[
+                service.embed_query_async(text) for text in ["命宮", "命宮", "夫妻宮"]
+            ])
+        
+        vectors = asyncio.run(run())
+        assert vectors[0][0] == 2 and vectors[2][0] == 3
+        assert sum(calls) == 2
+    finally:
+        service.close()
+
+
+def test_encoder_errors_propagate():
+    """測試編碼錯誤傳遞給所有等待者"""
+    print("=== 測試錯誤傳遞 ===")
+    
+    def failing_encoder(texts):
+        raise RuntimeError("model not ready")
+    
+    service = MicroBatchEmbeddingService(failing_encoder, max_batch_size=4, max_wait_ms=1)
+    try:
+        future = service.submit("紫微")
+        try:
+            future.result(timeout=5)
+            raise AssertionError("expected RuntimeError")
+        except RuntimeError as e:
+            assert "model not ready" in str(e)
+    finally:
+        service.close()
+
+
+def test_cancel_during_batch():
+    """測試批次執行中取消請求不會中斷工作線程"""
+    print("=== 測試取消請求 ===")
+    
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    
+    def blocking_encoder(texts):
+        calls.append(list(texts))
+        started.set()
+        release.wait(timeout=5)
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+    
+    service = MicroBatchEmbeddingService(blocking_encoder, max_batch_size=4, max_wait_ms=1)
+    try:
+        running = service.submit("紫微")
+        assert started.wait(timeout=5)
+        queued = service.submit("天機星")
+        
+        # 執行中的請求無法取消，排隊中的可以
+        assert running.cancel() is False
+        assert queued.cancel() is True
+        release.set()
+        
+        assert running.result(timeout=5)[0] == 2
+        assert service.embed_query("太陽星君")[0] == 4
+        assert ["天機星"] not in calls
+    finally:
+        release.set()
+        service.close()
+
+
+def test_submit_racing_close():
+    """測試與 close 並發的請求要麼被拒絕，要麼得到結果，不會永久等待"""
+    print("=== 測試關閉時並發提交 ===")
+    
+    def encoder(texts):
+        return np.array([[float(len(text))] for text in texts], dtype=np.float32)
+    
+    for _ in range(20):
+        service = MicroBatchEmbeddingService(encoder, max_batch_size=4, max_wait_ms=1)
+        futures = []
+        rejected = []
+        barrier = threading.Barrier(5)
+        
+        def submitter():
+            barrier.wait()
+            for _ in range(50):
+                try:
+                    futures.append(service.submit("紫微"))
+                except RuntimeError:
+                    rejected.append(True)
+        
+        threads = [threading.Thread(target=submitter) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        service.close()
+        for thread in threads:
+            thread.join()
+        
+        for future in futures:
+            assert future.result(timeout=5)[0] == 2
+        assert len(futures) + len(rejected) == 200
+    
+    try:
+        service.submit("紫微")
+        raise AssertionError("expected RuntimeError")
+    except RuntimeError:
+        pass
+
+
+def test_length_buckets_fixed_size():
+    """測試固定批次大小的長度分桶"""
+    print("=== 測試長度分桶 ===")
+    
+    lengths = [500, 20, 480, 25, 30, 510]
+    batches = plan_length_buckets(lengths, batch_size=3)
+    
+    assert batches == [[1, 3, 4], [2, 0, 5]]
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+
+
+def test_length_buckets_token_budget():
+    """測試 token 預算批次大小"""
+    print("=== 測試 token 預算分批 ===")
+    
+    lengths = [100] * 10 + [1000] * 3
+    batches = plan_length_buckets(lengths, batch_size=32, max_tokens_per_batch=2000)
+    
+    for batch in batches:
+        assert len(batch) * max(lengths[i] for i in batch) <= 2000
+    assert [len(batch) for batch in batches] == [10, 2, 1]
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_share_batch()
+    test_async_requests_and_duplicates()
+    test_encoder_errors_propagate()
+    test_cancel_during_batch()
+    test_submit_racing_close()
+    test_length_buckets_fixed_size()
+    test_length_buckets_token_budget()
+    print("✅ 微批次服務測試完成")
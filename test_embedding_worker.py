@@ -0,0 +1,64 @@
+"""
+測試嵌入工作進程池
+"""
+
+import asyncio
+
+import numpy as np
+
+from src.rag.embedding_worker import EmbeddingWorkerPool
+
+
+class _FakeModel:
+    """模擬嵌入模型：向量為 (文本長度, 1, 2, 3)"""
+    
+    def _encode_numpy(self, texts):
+        return np.array([[float(len(text)), 1.0, 2.0, 3.0] for text in texts], dtype=np.float32)
+
+
+def _fake_factory(**config):
+    """模擬模型工廠（需為模組級函數以便工作進程載入）"""
+    return _FakeModel()
+
+
+def test_encode_via_shared_memory():
+    """測試同步編碼結果經共享記憶體傳回"""
+    print("=== 測試工作進程編碼 ===")
+    
+    pool = EmbeddingWorkerPool({}, num_workers=2, model_factory=_fake_factory)
+    try:
+        assert pool.dimension == 4
+        
+        vectors = pool.encode(["紫微", "天機星", "太陽星君"])
+        assert vectors.shape == (3, 4)
+        assert vectors.dtype == np.float32
+        assert vectors[:, 0].tolist() == [2.0, 3.0, 4.0]
+        
+        stats = pool.get_stats()
+        print(f"進程池統計: {stats}")
+        assert stats["requests"] == 1
+        assert stats["texts"] == 3
+    finally:
+        pool.close()
+
+
+def test_encode_async_concurrent():
+    """測試並發非同步編碼"""
+    print("=== 測試非同步編碼 ===")
+    
+    pool = EmbeddingWorkerPool({}, num_workers=2, model_factory=_fake_factory)
+    try:
+        async def run():
+            texts = ["命宮", "夫妻宮", "財帛宮主星"]
+            return await asyncio.gather(*(pool.encode_async([text]) for text in texts))
+        
+        results = asyncio.run(run())
+        assert [float(vectors[0, 0]) for vectors in results] == [2.0, 3.0, 5.0]
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    test_encode_via_shared_memory()
+    test_encode_async_concurrent()
+    print("✅ 嵌入工作進程池測試完成")
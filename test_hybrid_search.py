@@ -0,0 +1,74 @@
+"""
+測試混合檢索的元數據過濾
+"""
+
+import logging
+import threading
+
+import numpy as np
+
+from src.rag.numpy_index import NumpyVectorIndex
+from src.rag.vector_store import ZiweiVectorStore
+
+
+STAR_FILTER = {"content_type": "主星解析"}
+
+
+def _make_store() -> ZiweiVectorStore:
+    """建立以 NumPy 索引檢索、不開啟 ChromaDB 的混合檢索向量庫"""
+    ids, embeddings, documents, metadatas = [], [], [], []
+    
+    # 詞法上最匹配查詢、但不符合過濾條件的文本塊
+    for i in range(30):
+        ids.append(f"fortune-{i}")
+        embeddings.append([0.0, 1.0, 0.0, i / 100])
+        documents.append(f"夫妻宮見貪狼化忌，感情多波折。第{i}則")
+        metadatas.append({"content_type": "運勢分析"})
+    
+    stars = [
+        ("star-ziwei", [1.0, 0.0, 0.0, 0.0], "紫微星坐命宮，主尊貴，性格穩重。"),
+        ("star-tanlang", [0.0, 0.0, 1.0, 0.0], "紫微斗數中貪狼化忌之說，見於古籍，論述頗多，此處從略不再贅述。"),
+        ("star-tianji", [0.5, 0.0, 0.5, 0.0], "天機星主智慧，善謀略。")
+    ]
+    for doc_id, embedding, document in stars:
+        ids.append(doc_id)
+        embeddings.append(embedding)
+        documents.append(document)
+        metadatas.append(dict(STAR_FILTER))
+    
+    index = NumpyVectorIndex()
+    index.add(ids, np.asarray(embeddings, dtype=np.float32), documents, metadatas)
+    
+    store = ZiweiVectorStore.__new__(ZiweiVectorStore)
+    store.logger = logging.getLogger("test_hybrid_search")
+    store.numpy_index = index
+    store.hybrid_search = True
+    store.rrf_k = 60
+    store.lexical_index = None
+    store._lexical_lock = threading.Lock()
+    return store
+
+
+def test_filtered_hybrid_search():
+    """測試過濾條件同樣作用於詞法結果，不符合條件的詞法命中不佔用融合名次"""
+    print("=== 測試混合檢索過濾 ===")
+    
+    store = _make_store()
+    query_embedding = np.array([1.0, 0.0, 0.0, 0.0], dtype=np.float32)
+    
+    results = store._retrieve_uncached("貪狼化忌 夫妻宮", query_embedding, 3, STAR_FILTER)
+    
+    assert [result["metadata"]["content_type"] for result in results] == ["主星解析"] * 3
+    by_id = {result["id"]: result for result in results}
+    # 唯一符合條件的詞法命中排在詞法結果第一位，而非被運勢分析的命中擠出
+    assert by_id["star-tanlang"]["lexical_rank"] == 1
+    assert by_id["star-ziwei"]["lexical_rank"] is None
+    
+    # 不過濾時詞法結果仍以運勢分析為主
+    unfiltered = store._retrieve_uncached("貪狼化忌 夫妻宮", query_embedding, 3)
+    assert any(result["id"].startswith("fortune-") for result in unfiltered)
+
+
+if __name__ == "__main__":
+    test_filtered_hybrid_search()
+    print("✅ 混合檢索測試完成")
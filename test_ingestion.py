@@ -0,0 +1,222 @@
+"""
+測試串流導入管線的分塊、分批與檢查點
+"""
+
+import shutil
+import tempfile
+
+from src.rag import ingestion
+from src.rag.ingestion import IngestionCheckpoint, PDFIngestionPipeline, token_budget_batches
+from src.rag.text_chunker import StreamingTextChunker, content_chunk_id
+
+
+PAGES = [
+    (1, "紫微星為帝座，主尊貴。" * 40),
+    (2, "天機星主智慧，善謀略。" * 25),
+    (3, "太陽星主光明，性格開朗。" * 30)
+]
+
+
+def _chunk_all(chunker, pages):
+    chunks = []
+    for page_num, text in pages:
+        chunks.extend(chunker.feed(page_num, text))
+    chunks.extend(chunker.flush())
+    return chunks
+
+
+def test_streaming_chunker_covers_text():
+    """測試增量分塊覆蓋全文且位置、頁碼正確"""
+    print("=== 測試串流分塊 ===")
+    
+    full_text = "".join(text + "\n" for _, text in PAGES)
+    chunks = _chunk_all(StreamingTextChunker(chunk_size=300, overlap=50), PAGES)
+    print(f"文本塊數: {len(chunks)}")
+    
+    assert all(len(chunk['content']) <= 300 for chunk in chunks)
+    assert chunks[0]['metadata']['start_pos'] == 0
+    assert chunks[-1]['metadata']['end_pos'] == len(full_text.rstrip())
+    
+    for chunk, following in zip(chunks, chunks[1:]):
+        meta = chunk['metadata']
+        assert chunk['content'] == full_text[meta['start_pos']:meta['end_pos']].strip()
+        # 相鄰文本塊相互重疊，不遺漏文本
+        assert following['metadata']['start_pos'] < meta['end_pos']
+    
+    assert chunks[0]['metadata']['page_start'] == 1
+    assert chunks[-1]['metadata']['page_end'] == 3
+
+
+def test_resume_point_restarts_consistently():
+    """測試從續傳點重新分塊時位置與全文一致"""
+    print("=== 測試續傳點 ===")
+    
+    full_text = "".join(text + "\n" for _, text in PAGES)
+    chunks = _chunk_all(StreamingTextChunker(chunk_size=300, overlap=50), PAGES)
+    
+    committed = chunks[len(chunks) // 2]
+    page, offset, headings = committed['resume_point']
+    resumed = _chunk_all(
+        StreamingTextChunker(chunk_size=300, overlap=50, start_offset=offset, headings=headings),
+        [item for item in PAGES if item[0] >= page]
+    )
+    
+    # 續傳後的文本塊從該頁開始，覆蓋到全文結尾
+    assert resumed[0]['metadata']['start_pos'] == offset <= committed['metadata']['end_pos']
+    assert resumed[-1]['metadata']['end_pos'] == len(full_text.rstrip())
+    for chunk in resumed:
+        meta = chunk['metadata']
+        assert chunk['content'] == full_text[meta['start_pos']:meta['end_pos']].strip()
+
+
+def test_headings_start_new_chunks():
+    """測試標題另起新塊、不帶重疊，並寫入元數據"""
+    print("=== 測試標題分塊 ===")
+    
+    text = (
+        "第一章 星曜總論\n" + "紫微為帝座，主尊貴。" * 5 + "\n"
+        "命宮\n" + "命宮主一生格局。" * 5 + "\n"
+        "第二章 宮位\n" + "財帛宮主錢財。" * 5 + "\n"
+    )
+    chunks = StreamingTextChunker(chunk_size=200, overlap=30).split_text(text)
+    
+    assert [chunk['content'].split("\n")[0] for chunk in chunks] == ["第一章 星曜總論", "命宮", "第二章 宮位"]
+    assert chunks[1]['metadata']['chapter'] == "第一章 星曜總論"
+    assert chunks[1]['metadata']['topic'] == "命宮"
+    # 上層標題出現時清除下層標題
+    assert chunks[2]['metadata']['chapter'] == "第二章 宮位"
+    assert 'topic' not in chunks[2]['metadata']
+    # 不跨越標題重疊
+    for chunk, following in zip(chunks, chunks[1:]):
+        assert following['metadata']['start_pos'] >= chunk['metadata']['end_pos']
+
+
+def test_sentences_and_token_counts():
+    """測試在句末切分，token 數按分詞函數計算（扣除重複的特殊 token）"""
+    print("=== 測試句子邊界與 token 數 ===")
+    
+    # 模擬分詞器：每字一個 token，另加 [CLS]、[SEP]
+    count_tokens = lambda texts: [len(text) + 2 for text in texts]
+    text = "".join(f"天機星第{i}句主智慧善謀略。" for i in range(40))
+    chunks = StreamingTextChunker(chunk_size=100, overlap=20, count_tokens=count_tokens).split_text(text)
+    
+    for chunk in chunks:
+        assert chunk['content'].endswith("。")
+        assert chunk['metadata']['token_count'] == count_tokens([chunk['content']])[0] <= 100
+
+
+def test_content_chunk_id_is_stable():
+    """測試內容哈希 ID 穩定且區分來源"""
+    print("=== 測試內容哈希 ID ===")
+    
+    chunk_id = content_chunk_id("紫微星為帝座，主尊貴。", "book.pdf")
+    
+    # 重新導入相同內容（僅空白或全半形不同）得到相同 ID
+    assert chunk_id == content_chunk_id("紫微星為帝座，主尊貴。 ", "book.pdf")
+    assert chunk_id == content_chunk_id("紫微星為帝座,主尊貴。", "book.pdf")
+    assert chunk_id != content_chunk_id("紫微星為帝座，主尊貴。", "other.pdf")
+    assert chunk_id != content_chunk_id("天機星主智慧。", "book.pdf")
+    
+    # 重新分塊同一文本時 ID 集合不變，只有變更的部分需要重新嵌入
+    chunks = _chunk_all(StreamingTextChunker(chunk_size=300, overlap=50), PAGES)
+    again = _chunk_all(StreamingTextChunker(chunk_size=300, overlap=50), PAGES)
+    assert [content_chunk_id(c['content'], "book.pdf") for c in chunks] == \
+        [content_chunk_id(c['content'], "book.pdf") for c in again]
+
+
+def test_token_budget_batches():
+    """測試按 token 預算分批"""
+    print("=== 測試 token 預算分批 ===")
+    
+    chunks = [{'content': "星" * length, 'metadata': {}} for length in [100, 200, 300, 50, 400]]
+    batches = list(token_budget_batches(
+        chunks, lambda texts: [len(text) for text in texts], max_tokens_per_batch=500, max_batch_size=10
+    ))
+    
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert all(sum(chunk['metadata']['token_count'] for chunk in batch) <= 500 for batch in batches)
+
+
+def test_checkpoint_fingerprint():
+    """測試檢查點保存、載入與指紋校驗"""
+    print("=== 測試檢查點 ===")
+    
+    directory = tempfile.mkdtemp(prefix="ziwei_checkpoint_")
+    try:
+        path = f"{directory}/book.json"
+        fingerprint = {'source': 'book.pdf', 'size': 1024, 'chunk_size': 1000}
+        
+        checkpoint = IngestionCheckpoint(path, fingerprint)
+        checkpoint.state.update({'next_page': 12, 'next_offset': 5400, 'chunks_done': 37})
+        checkpoint.save()
+        
+        loaded = IngestionCheckpoint(path, fingerprint)
+        assert loaded.load()
+        assert loaded.state['next_page'] == 12
+        assert loaded.state['chunks_done'] == 37
+        
+        # 文件或分塊參數改變時不續傳
+        changed = IngestionCheckpoint(path, {**fingerprint, 'chunk_size': 800})
+        assert not changed.load()
+        assert changed.state['next_page'] == 1
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _run_pipeline(sink, flush):
+    """以替身頁面執行導入管線，返回統計或拋出寫入錯誤"""
+    directory = tempfile.mkdtemp(prefix="ziwei_pipeline_")
+    original_iter_pdf_pages = ingestion.iter_pdf_pages
+    ingestion.iter_pdf_pages = lambda pdf_path, start_page=1, **kwargs: iter(PAGES[start_page - 1:])
+    try:
+        pdf_path = f"{directory}/book.pdf"
+        with open(pdf_path, 'wb') as f:
+            f.write(b"%PDF-1.4")
+        pipeline = PDFIngestionPipeline(
+            sink=sink,
+            flush=flush,
+            chunk_size=120,
+            overlap=20,
+            max_tokens_per_batch=250,
+            checkpoint_dir=f"{directory}/checkpoints"
+        )
+        return pipeline.run(pdf_path, resume=False)
+    finally:
+        ingestion.iter_pdf_pages = original_iter_pdf_pages
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_pipeline_flushes_once():
+    """測試導入管線在所有批次寫入後只持久化一次索引，中斷時也會持久化已寫入的批次"""
+    print("=== 測試導入結束時持久化 ===")
+    
+    writes = []
+    flushes = []
+    stats = _run_pipeline(lambda texts, metadatas, ids: writes.append(ids), lambda: flushes.append(len(writes)))
+    assert stats['batches'] == len(writes) > 1
+    assert flushes == [len(writes)]
+    
+    def failing_sink(texts, metadatas, ids):
+        if writes:
+            raise IOError("disk full")
+        writes.append(ids)
+    
+    writes, flushes = [], []
+    try:
+        _run_pipeline(failing_sink, lambda: flushes.append(len(writes)))
+        raise AssertionError("expected IOError")
+    except IOError:
+        pass
+    assert flushes == [1]
+
+
+if __name__ == "__main__":
+    test_streaming_chunker_covers_text()
+    test_resume_point_restarts_consistently()
+    test_headings_start_new_chunks()
+    test_sentences_and_token_counts()
+    test_content_chunk_id_is_stable()
+    test_token_budget_batches()
+    test_checkpoint_fingerprint()
+    test_pipeline_flushes_once()
+    print("✅ 串流導入測試完成")
@@ -0,0 +1,101 @@
+"""
+測試導入管線與嵌入模型共用分詞器
+"""
+
+import logging
+import shutil
+import tempfile
+import threading
+import time
+
+import torch
+
+from src.rag import ingestion
+from src.rag.bge_embeddings import BGEM3Embeddings
+from src.rag.ingestion import PDFIngestionPipeline
+
+
+PAGES = [(page_num, f"第{page_num}頁：紫微星為帝座，天機星主智慧，太陽星主光明。" * 12) for page_num in range(1, 41)]
+
+
+class BorrowCheckingTokenizer:
+    """與 HuggingFace 快速分詞器相同，被多個線程同時使用時拋出 Already borrowed"""
+    
+    def __init__(self):
+        self._busy = threading.Lock()
+        self.calls = 0
+    
+    def __call__(self, texts, truncation=True, max_length=512, padding=False, return_tensors=None):
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("Already borrowed")
+        try:
+            self.calls += 1
+            time.sleep(0.001)
+            lengths = [min(len(text), max_length) for text in texts]
+            if return_tensors != 'pt':
+                return {'input_ids': [[1] * length for length in lengths]}
+            width = max(lengths)
+            mask = torch.tensor([[1] * length + [0] * (width - length) for length in lengths])
+            return {'input_ids': mask.clone(), 'attention_mask': mask}
+        finally:
+            self._busy.release()
+
+
+def _make_embeddings() -> BGEM3Embeddings:
+    """建立使用檢查並發分詞器與替身模型的 BGE-M3 嵌入"""
+    embeddings = BGEM3Embeddings.__new__(BGEM3Embeddings)
+    embeddings.logger = logging.getLogger("test_ingestion_tokenizer")
+    embeddings.tokenizer = BorrowCheckingTokenizer()
+    embeddings.model = lambda input_ids, attention_mask: (attention_mask.unsqueeze(-1).float().expand(-1, -1, 4),)
+    embeddings._encode_lock = threading.Lock()
+    embeddings.device = "cpu"
+    embeddings.max_length = 512
+    embeddings.batch_size = 8
+    embeddings.max_tokens_per_batch = 0
+    embeddings.use_inference_mode = True
+    embeddings.document_cache = None
+    embeddings.worker_pool = None
+    return embeddings
+
+
+def test_pipeline_with_model_token_counter():
+    """測試分塊線程以模型分詞器計數時，與寫入線程的嵌入不會同時使用分詞器"""
+    print("=== 測試導入共用分詞器 ===")
+    
+    embeddings = _make_embeddings()
+    written = []
+    
+    def sink(texts, metadatas, ids):
+        vectors = embeddings.embed_documents(texts)
+        assert vectors.shape == (len(texts), 4)
+        written.extend(ids)
+    
+    directory = tempfile.mkdtemp(prefix="ziwei_pipeline_tokenizer_")
+    original_iter_pdf_pages = ingestion.iter_pdf_pages
+    ingestion.iter_pdf_pages = lambda pdf_path, start_page=1, **kwargs: iter(PAGES[start_page - 1:])
+    try:
+        pdf_path = f"{directory}/book.pdf"
+        with open(pdf_path, 'wb') as f:
+            f.write(b"%PDF-1.4")
+        pipeline = PDFIngestionPipeline(
+            sink=sink,
+            count_tokens=embeddings._count_tokens,
+            chunk_size=120,
+            overlap=20,
+            max_tokens_per_batch=400,
+            queue_size=4,
+            checkpoint_dir=f"{directory}/checkpoints"
+        )
+        stats = pipeline.run(pdf_path, resume=False)
+    finally:
+        ingestion.iter_pdf_pages = original_iter_pdf_pages
+        shutil.rmtree(directory, ignore_errors=True)
+    
+    assert stats['pages'] == len(PAGES)
+    assert stats['chunks'] == len(written) > 0
+    assert embeddings.tokenizer.calls > stats['batches']
+
+
+if __name__ == "__main__":
+    test_pipeline_with_model_token_counter()
+    print("✅ 導入分詞器測試完成")
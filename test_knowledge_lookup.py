@@ -0,0 +1,84 @@
+"""
+測試星曜 × 宮位預計算查找表
+"""
+
+import os
+import shutil
+import tempfile
+
+from src.rag.knowledge_lookup import (
+    MAIN_STARS, PALACES, PATTERNS, TRANSFORMATIONS,
+    KnowledgeLookupTable, all_placement_queries, canonical_palace, chart_placement_keys
+)
+
+
+def test_chart_placement_keys():
+    """測試從命盤資料解析配置鍵（繁簡、帶前綴的星曜、四化與同宮格局）"""
+    print("=== 測試命盤配置鍵 ===")
+    
+    palaces = {
+        "命宮-身宮": ["主星:紫微", "主星:天府", "輔星:左輔"],
+        "夫妻宫": ["太阳星", "巨门星"],
+        "財帛宮": {"stars": ["主星:武曲", "四化:化忌-武曲"]},
+        "未知": ["紫微星"]
+    }
+    keys = chart_placement_keys(palaces)
+    print(f"配置鍵: {keys}")
+    
+    assert keys == [
+        "紫微|命宮", "天府|命宮", "紫府同宮",
+        "太陽|夫妻宮", "巨門|夫妻宮",
+        "武曲|財帛宮", "化忌|財帛宮"
+    ]
+    assert canonical_palace("事業宮") == "官祿宮"
+    assert canonical_palace("命") == "命宮"
+
+
+def test_all_placement_queries():
+    """測試預計算的鍵覆蓋所有組合"""
+    queries = all_placement_queries()
+    
+    assert len(queries) == len(MAIN_STARS) * len(PALACES) + len(TRANSFORMATIONS) * len(PALACES) + len(PATTERNS)
+    assert queries["紫微|命宮"] == "紫微 命宮"
+    assert queries["殺破狼"] == "殺破狼 格局"
+
+
+def test_build_save_and_load():
+    """測試建表、保存、載入與過期判斷"""
+    print("=== 測試查找表建立 ===")
+    
+    calls = []
+    
+    def search_each(queries, top_k):
+        calls.append(len(queries))
+        return [
+            [{"id": f"doc_{query}_{rank}", "score": 0.9 - rank * 0.1, "content": ""} for rank in range(top_k)]
+            for query in queries
+        ]
+    
+    table = KnowledgeLookupTable.build(search_each, top_k=3, batch_size=100, manifest={"source_mtime": 100.0})
+    assert len(table) == len(all_placement_queries())
+    assert sum(calls) == len(table) and max(calls) <= 100
+    assert table.get("化忌|夫妻宮") == [("doc_化忌 夫妻宮_0", 0.9), ("doc_化忌 夫妻宮_1", 0.8), ("doc_化忌 夫妻宮_2", 0.7)]
+    
+    directory = tempfile.mkdtemp(prefix="ziwei_lookup_")
+    try:
+        path = os.path.join(directory, "table.json")
+        table.save(path)
+        loaded = KnowledgeLookupTable.load(path)
+        
+        assert loaded.entries == table.entries
+        found, missing = loaded.resolve(["紫微|命宮", "紫微 命宮 怎麼看"])
+        assert list(found) == ["紫微|命宮"] and missing == ["紫微 命宮 怎麼看"]
+        
+        assert not loaded.is_stale(100.0)
+        assert loaded.is_stale(200.0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_chart_placement_keys()
+    test_all_placement_queries()
+    test_build_save_and_load()
+    print("✅ 查找表測試完成")
@@ -0,0 +1,72 @@
+"""
+測試中文字元二元組 BM25 詞法索引與倒數排名融合
+"""
+
+from src.rag.lexical_index import BM25LexicalIndex, reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize_bigrams():
+    """測試 CJK 二元組與英數字切分"""
+    print("=== 測試詞項切分 ===")
+    
+    assert tokenize("貪狼化忌") == ["貪狼", "狼化", "化忌"]
+    assert tokenize("命，BGE-M3") == ["命", "bge", "m3"]
+
+
+def test_exact_term_ranking():
+    """測試精確詞項命中排在前面"""
+    print("=== 測試 BM25 排序 ===")
+    
+    index = BM25LexicalIndex()
+    index.add(
+        ["d1", "d2", "d3"],
+        [
+            "紫微星坐命宮，主尊貴，性格穩重。",
+            "夫妻宮見貪狼化忌，感情多波折。",
+            "財帛宮武曲天府，理財有道。"
+        ]
+    )
+    
+    hits = index.search("貪狼化忌 夫妻宮", top_k=3)
+    print(f"檢索結果: {hits}")
+    assert hits[0][0] == "d2"
+    assert all(doc_id != "d3" for doc_id, _ in hits)
+
+
+def test_incremental_update_and_delete():
+    """測試增量更新與刪除"""
+    print("=== 測試增量更新 ===")
+    
+    index = BM25LexicalIndex()
+    index.add(["d1"], ["天機星主智慧"])
+    assert index.search("天機")[0][0] == "d1"
+    
+    # 同一 ID 重新添加時覆蓋舊內容
+    index.add(["d1"], ["太陽星主光明"])
+    assert index.search("天機") == []
+    assert index.search("太陽")[0][0] == "d1"
+    
+    index.add(["d2"], ["太陽化祿"])
+    index.delete(["d1"])
+    assert [doc_id for doc_id, _ in index.search("太陽")] == ["d2"]
+    assert len(index) == 1
+
+
+def test_reciprocal_rank_fusion():
+    """測試倒數排名融合"""
+    print("=== 測試倒數排名融合 ===")
+    
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a", "d"]], k=60)
+    ranking = [doc_id for doc_id, _ in fused]
+    
+    # a 兩路皆靠前，c 兩路皆出現，b/d 只出現一次
+    assert ranking[:2] == ["a", "c"]
+    assert set(ranking) == {"a", "b", "c", "d"}
+
+
+if __name__ == "__main__":
+    test_tokenize_bigrams()
+    test_exact_term_ranking()
+    test_incremental_update_and_delete()
+    test_reciprocal_rank_fusion()
+    print("✅ 詞法索引測試完成")
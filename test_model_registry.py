@@ -0,0 +1,93 @@
+"""
+測試共享嵌入模型註冊表
+"""
+
+import threading
+
+from src.rag.model_registry import SharedModelRegistry
+
+
+def test_same_key_loads_once():
+    """測試同一鍵只載入一次並共用推理鎖"""
+    print("=== 測試模型共享 ===")
+    
+    registry = SharedModelRegistry()
+    loads = []
+    
+    def loader():
+        loads.append(1)
+        return object()
+    
+    key = ("BAAI/bge-m3", "cpu", "float32")
+    first, first_lock = registry.acquire(key, loader)
+    second, second_lock = registry.acquire(key, loader)
+    
+    assert first is second
+    assert first_lock is second_lock
+    assert len(loads) == 1
+    assert registry.get_refcount(key) == 2
+    
+    # 不同精度視為不同模型
+    other, _ = registry.acquire(("BAAI/bge-m3", "cuda", "float16"), loader)
+    assert other is not first
+    assert len(loads) == 2
+    
+    stats = registry.get_stats()
+    print(f"註冊表統計: {stats}")
+    assert stats["loads"] == 2
+    assert stats["reuses"] == 1
+
+
+def test_release_drops_model_at_zero():
+    """測試引用計數歸零後移除模型"""
+    print("=== 測試引用計數 ===")
+    
+    registry = SharedModelRegistry()
+    key = ("BAAI/bge-m3", "cpu", "float32")
+    
+    first, _ = registry.acquire(key, object)
+    registry.acquire(key, object)
+    
+    registry.release(key)
+    assert registry.get_refcount(key) == 1
+    
+    registry.release(key)
+    assert registry.get_refcount(key) == 0
+    
+    # 再次獲取時重新載入
+    reloaded, _ = registry.acquire(key, object)
+    assert reloaded is not first
+
+
+def test_concurrent_acquire():
+    """測試多線程同時獲取只載入一次"""
+    print("=== 測試並發獲取 ===")
+    
+    registry = SharedModelRegistry()
+    loads = []
+    results = []
+    
+    def loader():
+        loads.append(1)
+        return object()
+    
+    def worker():
+        value, _ = registry.acquire("model", loader)
+        results.append(value)
+    
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(loads) == 1
+    assert len(set(map(id, results))) == 1
+    assert registry.get_refcount("model") == 8
+
+
+if __name__ == "__main__":
+    test_same_key_loads_once()
+    test_release_drops_model_at_zero()
+    test_concurrent_acquire()
+    print("✅ 共享模型註冊表測試完成")
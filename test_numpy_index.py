@@ -0,0 +1,228 @@
+"""
+測試 NumPy 平面向量索引
+"""
+
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from src.rag.numpy_index import NumpyVectorIndex, matches_where
+
+
+def _random_index(count: int = 2000, dimension: int = 64, seed: int = 0):
+    """建立隨機向量索引"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dimension)).astype(np.float32)
+    index = NumpyVectorIndex()
+    index.add(
+        [f"doc_{i}" for i in range(count)],
+        vectors,
+        [f"文本 {i}" for i in range(count)],
+        [{"content_type": "star" if i % 2 else "palace"} for i in range(count)]
+    )
+    return index, vectors
+
+
+def test_top_k_matches_brute_force():
+    """測試 top-k 結果與暴力排序一致"""
+    print("=== 測試 top-k 檢索 ===")
+    
+    index, vectors = _random_index()
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[:3] + 0.1
+    
+    results = index.search(queries, top_k=5)
+    assert len(results) == 3
+    
+    for query, hits in zip(queries, results):
+        expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:5]
+        assert [row for row, _ in hits] == expected.tolist()
+    
+    start = time.perf_counter()
+    index.search(queries[0], top_k=5)
+    print(f"單查詢延遲: {(time.perf_counter() - start) * 1000:.3f} ms")
+
+
+def test_filter_and_delete():
+    """測試元數據過濾與刪除"""
+    print("=== 測試過濾與刪除 ===")
+    
+    index, vectors = _random_index(count=100)
+    
+    hits = index.search(vectors[0], top_k=10, where={"content_type": "star"})[0]
+    assert all(index.metadatas[row]["content_type"] == "star" for row, _ in hits)
+    
+    index.delete(["doc_0", "doc_1"])
+    assert len(index) == 98
+    assert "doc_0" not in index.ids
+    
+    # 覆蓋已存在的 ID 不會新增條目
+    index.add(["doc_2"], vectors[2:3], ["新文本"], [{"content_type": "palace"}])
+    assert len(index) == 98
+    assert index.documents[index.ids.index("doc_2")] == "新文本"
+
+
+def test_category_prefilter():
+    """測試 $in 過濾在分類子索引內檢索，結果數填滿且與全量過濾一致"""
+    print("=== 測試分類預過濾 ===")
+    
+    index, vectors = _random_index(count=300)
+    for i, metadata in enumerate(index.metadatas):
+        metadata["content_type"] = ["主星解析", "宮位解析", "運勢分析"][i % 3]
+    index._partitions = {}
+    
+    where = {"content_type": {"$in": ["主星解析", "運勢分析"]}}
+    hits = index.search(vectors[:2], top_k=20, where=where)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    
+    for query, query_hits in zip(vectors[:2], hits):
+        assert len(query_hits) == 20
+        allowed = np.array([i % 3 != 1 for i in range(300)])
+        scores = np.where(allowed, normalized @ (query / np.linalg.norm(query)), -np.inf)
+        assert [row for row, _ in query_hits] == np.argsort(-scores)[:20].tolist()
+    
+    # 寫入後子索引重建
+    index.add(["doc_new"], vectors[:1], ["新文本"], [{"content_type": "宮位解析"}])
+    rows = [row for row, _ in index.search(vectors[0], top_k=200, where={"content_type": "宮位解析"})[0]]
+    assert index.position("doc_new") in rows
+    assert index.search(vectors[0], top_k=5, where={"content_type": "不存在"}) == [[]]
+
+
+def test_compound_filters():
+    """測試 $and、$or 組合條件與逐條比對的結果一致"""
+    print("=== 測試組合過濾條件 ===")
+    
+    index, vectors = _random_index(count=300)
+    for i, metadata in enumerate(index.metadatas):
+        metadata["content_type"] = ["主星解析", "宮位解析", "運勢分析"][i % 3]
+        metadata["source"] = f"book_{i % 4}.pdf"
+    index._partitions = {}
+    
+    filters = [
+        {"$or": [{"content_type": "主星解析"}, {"source": "book_1.pdf"}]},
+        {"$and": [{"content_type": {"$in": ["主星解析", "運勢分析"]}}, {"source": {"$ne": "book_0.pdf"}}]},
+        {"$and": [{"content_type": "宮位解析"}, {"$or": [{"source": "book_1.pdf"}, {"source": "book_2.pdf"}]}]},
+        {"content_type": "主星解析", "$or": [{"source": "book_0.pdf"}, {"source": "book_3.pdf"}]}
+    ]
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = vectors[5] / np.linalg.norm(vectors[5])
+    
+    for where in filters:
+        allowed = np.array([matches_where(metadata, where) for metadata in index.metadatas])
+        assert 0 < allowed.sum() < 300, where
+        hits = index.search(vectors[5], top_k=10, where=where)[0]
+        scores = np.where(allowed, normalized @ query, -np.inf)
+        assert [row for row, _ in hits] == np.argsort(-scores)[:10].tolist(), where
+    
+    assert matches_where({"content_type": "主星解析"}, {"$or": [{"content_type": "主星解析"}, {"source": "x"}]})
+    assert not matches_where({"content_type": "主星解析"}, {"$and": [{"content_type": "主星解析"}, {"source": "x"}]})
+
+
+def test_save_and_mmap_load():
+    """測試保存與記憶體映射載入"""
+    print("=== 測試保存與載入 ===")
+    
+    index, vectors = _random_index(count=200)
+    directory = tempfile.mkdtemp(prefix="ziwei_numpy_index_")
+    try:
+        index.save(directory)
+        loaded = NumpyVectorIndex.load(directory, mmap=True)
+        
+        assert isinstance(loaded.matrix, np.memmap)
+        assert loaded.ids == index.ids
+        assert loaded.search(vectors[5], top_k=3) == index.search(vectors[5], top_k=3)
+        
+        assert loaded.documents[7] == "文本 7"
+        
+        # 唯讀映射上追加時複製到記憶體
+        loaded.add(["doc_new"], vectors[:1], ["追加"], [{}])
+        assert len(loaded) == 201
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+
+def test_float16_snapshot():
+    """測試 float16 快照的檔案結構與檢索結果"""
+    print("=== 測試 float16 快照 ===")
+    
+    index, vectors = _random_index(count=300)
+    snapshot = NumpyVectorIndex(dtype="float16")
+    snapshot.add(index.ids, vectors, index.documents, index.metadatas)
+    
+    directory = tempfile.mkdtemp(prefix="ziwei_snapshot_")
+    try:
+        snapshot.save(directory, manifest={"collection_name": "test"})
+        
+        assert np.load(f"{directory}/vectors.npy", mmap_mode='r').dtype == np.float16
+        assert np.load(f"{directory}/ids.npy")[3] == "doc_3"
+        offsets = np.load(f"{directory}/text_offsets.npy")
+        with open(f"{directory}/texts.bin", 'rb') as f:
+            blob = f.read()
+        assert blob[offsets[12]:offsets[13]].decode("utf-8") == "文本 12"
+        
+        loaded = NumpyVectorIndex.load(directory)
+        assert loaded.manifest["collection_name"] == "test"
+        assert loaded.manifest["count"] == 300
+        
+        # float16 精度下 top-1 與 float32 一致
+        for query in vectors[:5]:
+            assert loaded.search(query, top_k=1)[0][0][0] == index.search(query, top_k=1)[0][0][0]
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_compressed_scan_rescoring():
+    """測試 float16 與 PQ 壓縮掃描：候選經全精度重新計分，分數與暴力計算一致"""
+    print("=== 測試壓縮掃描與重新計分 ===")
+    
+    _, vectors = _random_index(count=2000)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    rng = np.random.default_rng(1)
+    queries = vectors[:20] + 0.3 * rng.standard_normal((20, 64)).astype(np.float32)
+    
+    for quantization in ("float16", "pq"):
+        index = NumpyVectorIndex(quantization=quantization, pq_subvectors=16, pq_centroids=64, rescore_factor=8)
+        index.add([f"doc_{i}" for i in range(2000)], vectors, [f"文本 {i}" for i in range(2000)])
+        index.train_quantizer()
+        assert index.scan_ready
+        
+        start = time.perf_counter()
+        results = index.search(queries, top_k=5)
+        print(f"{quantization}: {(time.perf_counter() - start) * 1000:.2f} ms / 20 查詢")
+        
+        overlap = 0
+        for row, (query, hits) in enumerate(zip(queries, results)):
+            exact = normalized @ (query / np.linalg.norm(query))
+            assert hits[0][0] == row
+            overlap += len({hit for hit, _ in hits} & set(np.argsort(-exact)[:5].tolist()))
+            for hit, score in hits:
+                assert abs(score - exact[hit]) < 1e-4
+        assert overlap >= 20 * 5 * 0.9
+    
+    # PQ 碼每向量 16 位元組，快照保存碼本與碼，載入後結果一致；訓練後追加的向量以既有碼本編碼
+    assert index._scan.dtype == np.uint8 and index._scan.shape[1] == 16
+    directory = tempfile.mkdtemp(prefix="ziwei_pq_index_")
+    try:
+        index.save(directory)
+        loaded = NumpyVectorIndex.load(directory, mmap=True)
+        assert loaded.manifest["quantization"] == "pq"
+        assert loaded.search(queries[:3], top_k=5) == index.search(queries[:3], top_k=5)
+        
+        loaded.add(["doc_new"], queries[:1], ["追加"])
+        assert loaded.search(queries[0], top_k=1)[0][0][0] == loaded.position("doc_new")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_top_k_matches_brute_force()
+    test_filter_and_delete()
+    test_category_prefilter()
+    test_compound_filters()
+    test_save_and_mmap_load()
+    test_float16_snapshot()
+    test_compressed_scan_rescoring()
+    print("✅ NumPy 向量索引測試完成")
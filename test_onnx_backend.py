@@ -0,0 +1,87 @@
+"""
+測試 ONNX / int8 嵌入後端選擇
+"""
+
+import logging
+
+import numpy as np
+
+from src.rag import onnx_embeddings
+from src.rag.bge_embeddings import BGEM3Embeddings, create_bge_embeddings
+from src.rag.onnx_embeddings import ONNXBGEM3Embeddings
+
+
+MODEL_CONFIG = {
+    "model_name": "BAAI/bge-m3",
+    "device": "cpu",
+    "max_length": 512,
+    "query_cache_size": 0
+}
+
+TEXTS = ["紫微星坐命宮，主尊貴", "天機星化忌在夫妻宮", "武曲星主財"]
+
+
+def _assert_same_outputs(reference: BGEM3Embeddings, candidate: BGEM3Embeddings):
+    """比較兩個後端的輸出形狀與型別"""
+    reference_documents = reference.embed_documents(TEXTS)
+    candidate_documents = candidate.embed_documents(TEXTS)
+    assert candidate_documents.shape == reference_documents.shape == (len(TEXTS), reference.get_embedding_dimension())
+    assert candidate_documents.dtype == reference_documents.dtype == np.float32
+    
+    reference_query = reference.embed_query(TEXTS[0])
+    candidate_query = candidate.embed_query(TEXTS[0])
+    assert candidate_query.shape == reference_query.shape
+    assert candidate_query.dtype == reference_query.dtype == np.float32
+
+
+def test_onnx_falls_back_to_torch():
+    """測試未安裝 onnxruntime 時 onnx 後端退回 torch"""
+    print("=== 測試 ONNX 後端退回 ===")
+    
+    original_ort = onnx_embeddings.ort
+    onnx_embeddings.ort = None
+    try:
+        embeddings = create_bge_embeddings(
+            backend="onnx",
+            onnx_dir="./models/bge-m3-onnx",
+            logger=logging.getLogger("test_onnx_backend"),
+            **MODEL_CONFIG
+        )
+    finally:
+        onnx_embeddings.ort = original_ort
+    
+    reference = create_bge_embeddings(backend="torch", **MODEL_CONFIG)
+    try:
+        assert type(embeddings) is BGEM3Embeddings
+        _assert_same_outputs(reference, embeddings)
+    finally:
+        embeddings.close()
+        reference.close()
+
+
+def test_onnx_matches_torch_outputs():
+    """測試 ONNX int8 後端與 torch 後端的輸出形狀、型別一致"""
+    print("=== 測試 ONNX 後端輸出 ===")
+    
+    if onnx_embeddings.ort is None:
+        print("未安裝 onnxruntime，跳過")
+        return
+    
+    reference = create_bge_embeddings(backend="torch", **MODEL_CONFIG)
+    candidate = create_bge_embeddings(backend="onnx", onnx_quantized=True, **MODEL_CONFIG)
+    try:
+        assert isinstance(candidate, ONNXBGEM3Embeddings)
+        _assert_same_outputs(reference, candidate)
+        
+        parity = onnx_embeddings.check_parity(reference, candidate, TEXTS)
+        print(f"餘弦相似度: {parity}")
+        assert parity["min_cosine"] > 0.95
+    finally:
+        candidate.close()
+        reference.close()
+
+
+if __name__ == "__main__":
+    test_onnx_falls_back_to_torch()
+    test_onnx_matches_torch_outputs()
+    print("✅ ONNX 後端測試完成")
@@ -0,0 +1,101 @@
+"""
+測試交叉編碼器重排序（排序、快取、延遲預算）
+"""
+
+import threading
+import time
+
+from src.rag.reranker import CrossEncoderReranker
+
+
+def _candidates(texts):
+    return [{"id": f"doc{i}", "content": text, "score": 0.9 - i * 0.05} for i, text in enumerate(texts)]
+
+
+class CountingScorer:
+    """以查詢字元在文本中的出現次數打分，記錄調用次數"""
+    
+    def __init__(self, delay: float = 0.0):
+        self.calls = 0
+        self.pairs = 0
+        self.delay = delay
+    
+    def __call__(self, pairs):
+        self.calls += 1
+        self.pairs += len(pairs)
+        time.sleep(self.delay * len(pairs))
+        return [sum(text.count(char) for char in query) / 10 for query, text in pairs]
+
+
+def test_rerank_order_and_cache():
+    """測試按交叉編碼器分數重排、一次批量打分，以及候選集相同（順序不同）時命中快取"""
+    print("=== 測試重排序與快取 ===")
+    
+    scorer = CountingScorer()
+    reranker = CrossEncoderReranker(score_fn=scorer, latency_budget_ms=0)
+    candidates = _candidates(["天府星與紫微同宮", "太陽星主光明", "紫微星坐命宮，紫微為帝星"])
+    
+    results = reranker.rerank("紫微", candidates, top_n=2)
+    print(f"結果: {[result['id'] for result in results]}")
+    
+    assert [result["id"] for result in results] == ["doc2", "doc0"]
+    assert results[0]["rerank_score"] > results[1]["rerank_score"]
+    assert results[0]["score"] == candidates[2]["score"]
+    assert scorer.calls == 1 and scorer.pairs == 3
+    
+    again = reranker.rerank("紫微", list(reversed(candidates)), top_n=2)
+    assert [result["id"] for result in again] == [result["id"] for result in results]
+    assert scorer.calls == 1
+    
+    reranker.rerank("太陽", candidates, top_n=2)
+    assert scorer.calls == 2
+    assert reranker.get_stats()["cache"]["hits"] == 1
+
+
+def test_multi_query_scores():
+    """測試不同子查詢的 (查詢, 候選) 對在同一批次打分"""
+    scorer = CountingScorer()
+    reranker = CrossEncoderReranker(score_fn=scorer, cache_size=0)
+    candidates = _candidates(["紫微星", "太陽星"])
+    
+    scores = reranker.score(["紫微", "太陽"], candidates)
+    assert [round(score, 3) for score in scores] == [0.2, 0.2]
+    assert reranker.score(["太陽", "紫微"], candidates) == [0.0, 0.0]
+    assert scorer.calls == 2
+
+
+def test_latency_budget_skips_under_load():
+    """測試預估延遲（含排隊中的請求）超出預算時跳過重排序，保留向量排名"""
+    print("=== 測試延遲預算 ===")
+    
+    scorer = CountingScorer(delay=0.005)
+    reranker = CrossEncoderReranker(score_fn=scorer, latency_budget_ms=60, cache_size=0)
+    reranker.load()
+    candidates = _candidates([f"第{i}段 紫微" for i in range(8)])
+    
+    # 首次打分後取得每對耗時（約 5ms），8 對約 40ms 在預算內
+    reranker.rerank("紫微", candidates, top_n=3)
+    estimate = reranker.estimate_latency_ms(len(candidates))
+    print(f"預估延遲: {estimate:.1f}ms")
+    assert estimate < 60
+    
+    # 另一請求正在打分時，排隊的對數計入預估，超出預算即跳過
+    busy = threading.Thread(target=reranker.rerank, args=("星", candidates, 3))
+    busy.start()
+    time.sleep(0.01)
+    skipped = reranker.rerank("紫微", candidates, top_n=3)
+    busy.join()
+    
+    assert [result["id"] for result in skipped] == ["doc0", "doc1", "doc2"]
+    assert "rerank_score" not in skipped[0]
+    assert reranker.skipped == 1
+    
+    # 單次請求的預算可覆蓋默認值
+    assert "rerank_score" not in reranker.rerank("紫微", candidates, top_n=3, budget_ms=1)[0]
+
+
+if __name__ == "__main__":
+    test_rerank_order_and_cache()
+    test_multi_query_scores()
+    test_latency_budget_skips_under_load()
+    print("✅ 重排序測試完成")
@@ -0,0 +1,63 @@
+"""
+測試檢索結果快取
+"""
+
+from src.rag.result_cache import RetrievalResultCache
+
+
+def test_key_includes_version_and_filter():
+    """測試快取鍵隨集合版本、過濾條件與 top_k 變化"""
+    print("=== 測試快取鍵 ===")
+    
+    embedding = [0.1, 0.2, 0.3]
+    key = RetrievalResultCache.make_key(embedding, 5, {"content_type": "star"}, (0, None))
+    
+    assert key == RetrievalResultCache.make_key(list(embedding), 5, {"content_type": "star"}, (0, None))
+    assert key != RetrievalResultCache.make_key(embedding, 5, {"content_type": "star"}, (1, None))
+    assert key != RetrievalResultCache.make_key(embedding, 5, {"content_type": "palace"}, (0, None))
+    assert key != RetrievalResultCache.make_key(embedding, 3, {"content_type": "star"}, (0, None))
+    assert key != RetrievalResultCache.make_key([0.1, 0.2, 0.31], 5, {"content_type": "star"}, (0, None))
+
+
+def test_hit_returns_copy():
+    """測試命中時返回副本，修改結果不影響快取"""
+    print("=== 測試快取命中 ===")
+    
+    cache = RetrievalResultCache(max_size=8)
+    key = RetrievalResultCache.make_key([1.0, 0.0], 5, None, (0, None))
+    
+    assert cache.get(key) is None
+    cache.put(key, [{"id": "doc_1", "content": "紫微星", "score": 0.9}])
+    
+    first = cache.get(key)
+    first[0]["score"] = 0.0
+    assert cache.get(key)[0]["score"] == 0.9
+    
+    stats = cache.get_stats()
+    print(f"快取統計: {stats}")
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+
+
+def test_lru_eviction():
+    """測試超過容量時淘汰最久未使用的條目"""
+    print("=== 測試 LRU 淘汰 ===")
+    
+    cache = RetrievalResultCache(max_size=2)
+    keys = [RetrievalResultCache.make_key([float(i)], 5, None, (0, None)) for i in range(3)]
+    
+    cache.put(keys[0], [])
+    cache.put(keys[1], [])
+    cache.get(keys[0])
+    cache.put(keys[2], [])
+    
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == []
+    assert cache.get(keys[2]) == []
+
+
+if __name__ == "__main__":
+    test_key_includes_version_and_filter()
+    test_hit_returns_copy()
+    test_lru_eviction()
+    print("✅ 檢索結果快取測試完成")
@@ -0,0 +1,108 @@
+"""
+測試檢索評測指標與標準查詢集
+"""
+
+import math
+
+import numpy as np
+
+from src.rag.retrieval_eval import (
+    GoldenQuerySet, compare_reports, evaluate_retrieval, judge, ndcg_at_k, recall_at_k, reciprocal_rank
+)
+
+
+class _KeywordStore:
+    """以關鍵字重疊數排序的內存向量庫（測試評測流程用）"""
+    
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.result_cache = None
+        self.embeddings = self
+        self.searches = []
+    
+    def embed_query(self, text):
+        return np.zeros(4, dtype=np.float32)
+    
+    def search_by_vector(self, query, query_embedding, top_k, filter_metadata=None):
+        self.searches.append(filter_metadata)
+        scored = [
+            {"id": doc_id, "content": text, "metadata": {}, "score": sum(char in text for char in query) / len(query)}
+            for doc_id, text in self.chunks.items()
+        ]
+        scored.sort(key=lambda result: result["score"], reverse=True)
+        return scored[:top_k]
+
+
+def test_metrics():
+    """測試 recall@k、MRR、nDCG 的計算與相關條目只計一次"""
+    print("=== 測試評測指標 ===")
+    
+    relevant = [{"contains": ["紫微", "命宮"], "grade": 2}, {"contains": ["天府"], "grade": 1}]
+    results = [
+        {"id": "a", "content": "太陽星主光明"},
+        {"id": "b", "content": "紫微星坐命宫，气度恢宏"},
+        {"id": "c", "content": "紫微在命宮者尊貴"},
+        {"id": "d", "content": "天府星為財庫"}
+    ]
+    judged = judge(results, relevant)
+    print(f"判定: {judged}")
+    
+    # 簡體文本繁簡統一後命中；第二條同樣命中「紫微 命宮」的結果不重複計分
+    assert judged == [(None, 0), (0, 2), (None, 0), (1, 1)]
+    assert recall_at_k(judged, 2, 2) == 0.5
+    assert recall_at_k(judged, 2, 4) == 1.0
+    assert reciprocal_rank(judged) == 0.5
+    
+    dcg = 3 / math.log2(3) + 1 / math.log2(5)
+    idcg = 3 / math.log2(2) + 1 / math.log2(3)
+    assert abs(ndcg_at_k(judged, [2, 1], 4) - dcg / idcg) < 1e-9
+    assert ndcg_at_k([(0, 2), (1, 1)], [2, 1], 2) == 1.0
+
+
+def test_golden_set_loads():
+    """測試隨代碼維護的標準查詢集格式正確"""
+    golden_set = GoldenQuerySet.load()
+    info = golden_set.info()
+    print(f"標準查詢集: {info}")
+    
+    assert len(golden_set) >= 20
+    assert info["version"] >= 1 and info["sha256"]
+    assert len({entry["id"] for entry in golden_set.queries}) == len(golden_set)
+
+
+def test_evaluate_retrieval():
+    """測試評測報告的指標、延遲、領域過濾與基準比較"""
+    print("=== 測試評測流程 ===")
+    
+    chunks = {
+        "ziwei": "紫微星坐命宮，為帝星",
+        "tanlang": "貪狼星在夫妻宮主桃花",
+        "noise": "無關的內容"
+    }
+    golden_set = GoldenQuerySet([
+        {"id": "q1", "query": "紫微命宮", "domain": "stars", "relevant": [{"contains": ["紫微", "命宮"]}]},
+        {"id": "q2", "query": "貪狼夫妻", "domain": "love", "relevant": [{"id": "tanlang", "grade": 2}]},
+        {"id": "q3", "query": "天梁", "relevant": [{"contains": ["天梁"]}]}
+    ])
+    store = _KeywordStore(chunks)
+    report = evaluate_retrieval(store, golden_set, ks=(1, 3), repeats=2, use_domain_filters=True)
+    print(f"指標: {report['metrics']}")
+    
+    assert report["metrics"]["recall@1"] == round(2 / 3, 4)
+    assert report["metrics"]["mrr"] == round(2 / 3, 4)
+    assert report["latency"]["samples"] == 6
+    assert report["per_query"][2]["retrieved"][0]["relevant"] is False
+    assert store.searches[0] == {"content_type": {"$in": ["主星解析", "一般內容", "general"]}}
+    assert store.searches[-1] is None
+    
+    baseline = {**report, "metrics": {**report["metrics"], "mrr": 0.5}}
+    comparison = compare_reports(report, baseline)
+    assert comparison["same_golden_set"]
+    assert comparison["metrics"]["mrr"] == round(2 / 3 - 0.5, 4)
+
+
+if __name__ == "__main__":
+    test_metrics()
+    test_golden_set_loads()
+    test_evaluate_retrieval()
+    print("✅ 檢索評測測試完成")
@@ -0,0 +1,61 @@
+"""
+測試檢索結果分數過濾
+"""
+
+from src.rag.gpt4o_generator import RAGResponseGenerator
+from src.rag.score_filters import passes_min_score
+
+
+RESULTS = [
+    {"id": "dense", "content": "紫微星坐命宮", "metadata": {}, "score": 0.82},
+    {"id": "lexical", "content": "貪狼化忌", "metadata": {}, "score": 0.41, "lexical_rank": 1},
+    {"id": "low", "content": "天機星", "metadata": {}, "score": 0.30, "lexical_rank": 9},
+    {"id": "reranked", "content": "太陽星", "metadata": {}, "score": 0.20, "rerank_score": 0.65},
+    {"id": "rerank-low", "content": "武曲星", "metadata": {}, "score": 0.90, "rerank_score": 0.10}
+]
+
+
+class FakeVectorStore:
+    """返回固定檢索結果的向量庫替身"""
+    
+    def search(self, query, top_k=5, filter_metadata=None):
+        return [dict(result) for result in RESULTS]
+
+
+class FakeGenerator:
+    """記錄上下文文檔的生成器替身"""
+    
+    model = "fake"
+    
+    def generate_response(self, query, context_documents, **kwargs):
+        self.context_documents = context_documents
+        return {"success": True, "answer": "回答"}
+
+
+def test_passes_min_score():
+    """測試稠密分數、詞法排名與重排序分數的保留規則"""
+    print("=== 測試分數過濾 ===")
+    
+    kept = [result["id"] for result in RESULTS if passes_min_score(result, 0.7, 5, rerank_min_score=0.5)]
+    assert kept == ["dense", "lexical", "reranked"]
+    
+    # 未設定重排序門檻時保留所有重排序結果
+    kept = [result["id"] for result in RESULTS if passes_min_score(result, 0.7, 5)]
+    assert kept == ["dense", "lexical", "reranked", "rerank-low"]
+
+
+def test_rag_response_uses_shared_filter():
+    """測試生成 RAG 回應時與知識庫搜索使用相同的過濾規則"""
+    print("=== 測試 RAG 回應過濾 ===")
+    
+    generator = FakeGenerator()
+    rag_generator = RAGResponseGenerator(FakeVectorStore(), generator)
+    
+    rag_generator.generate_rag_response("貪狼化忌", top_k=5, min_score=0.7, rerank_min_score=0.5)
+    assert generator.context_documents == ["紫微星坐命宮", "貪狼化忌", "太陽星"]
+
+
+if __name__ == "__main__":
+    test_passes_min_score()
+    test_rag_response_uses_shared_filter()
+    print("✅ 分數過濾測試完成")
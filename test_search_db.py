@@ -26,7 +26,7 @@ def test_search(query: str, top_k: int = 3):
         
         # 搜索
         results = collection.query(
-            query_embeddings=[query_embedding],
+            query_embeddings=[query_embedding.tolist()],
             n_results=top_k
         )
         
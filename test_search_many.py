@@ -0,0 +1,147 @@
+"""
+測試批量多查詢檢索的合併與名額分配
+"""
+
+import logging
+
+import numpy as np
+
+from src.rag.knowledge_lookup import KnowledgeLookupTable
+from src.rag.vector_store import ZiweiRAGSystem, ZiweiVectorStore
+
+
+def _result(doc_id: str, score: float):
+    return {"id": doc_id, "content": f"內容 {doc_id}", "metadata": {}, "score": score}
+
+
+def test_per_query_quota():
+    """測試每條子查詢至少分得名額，不被高分子查詢佔滿"""
+    print("=== 測試子查詢名額 ===")
+    
+    queries = ["命宮 紫微", "夫妻宮 貪狼", "財帛宮 武曲"]
+    per_query_results = [
+        [_result("a1", 0.95), _result("a2", 0.94), _result("a3", 0.93)],
+        [_result("b1", 0.75), _result("b2", 0.74)],
+        [_result("c1", 0.72)]
+    ]
+    
+    merged = ZiweiVectorStore._merge_query_results(queries, per_query_results, top_k=3)
+    print(f"合併結果: {[(r['id'], r['query']) for r in merged]}")
+    
+    assert [r["id"] for r in merged] == ["a1", "b1", "c1"]
+    assert {r["query"] for r in merged} == set(queries)
+
+
+def test_dedupe_and_fill_by_score():
+    """測試重複文檔只保留一次，剩餘位置按分數補齊"""
+    print("=== 測試去重與補齊 ===")
+    
+    queries = ["紫微", "天府"]
+    per_query_results = [
+        [_result("shared", 0.9), _result("x", 0.85), _result("y", 0.6)],
+        [_result("shared", 0.88), _result("z", 0.7)]
+    ]
+    
+    merged = ZiweiVectorStore._merge_query_results(queries, per_query_results, top_k=4, per_query_k=1)
+    ids = [r["id"] for r in merged]
+    
+    assert ids.count("shared") == 1
+    assert ids == ["shared", "x", "z", "y"]
+    # 第二條子查詢的第一名已被選中，名額順延給下一名
+    assert next(r for r in merged if r["id"] == "z")["query"] == "天府"
+
+
+def test_normalize_queries():
+    """測試空白與重複子查詢被移除"""
+    assert ZiweiVectorStore._normalize_queries(["命宮", " ", "命宮", "遷移宮 "]) == ["命宮", "遷移宮"]
+
+
+def _placement_store(entries, chunks):
+    """建立只含查找表的向量庫，向量檢索以記錄查詢與過濾條件的替身取代"""
+    store = ZiweiVectorStore.__new__(ZiweiVectorStore)
+    store.logger = logging.getLogger("test_search_many")
+    store.reranker = None
+    store.lookup_table = KnowledgeLookupTable(entries=entries)
+    store.live_calls = []
+    
+    store.get_chunks = lambda doc_ids: {
+        doc_id: {"id": doc_id, "content": f"內容 {doc_id}", "metadata": chunks[doc_id]}
+        for doc_id in doc_ids if doc_id in chunks
+    }
+    store._embed_queries = lambda queries: np.zeros((len(queries), 4), dtype=np.float32)
+    
+    def retrieve_many(queries, query_embeddings, top_k, filter_metadata=None):
+        store.live_calls.append((list(queries), filter_metadata))
+        return [
+            [{"id": f"live-{query}-{rank}", "content": f"{query} {rank}", "metadata": {}, "score": 0.8 - rank * 0.01}
+             for rank in range(top_k)]
+            for query in queries
+        ]
+    
+    store._retrieve_many = retrieve_many
+    return store
+
+
+def test_placement_filter_falls_back_to_live_search():
+    """測試過濾後查找表名額不足的鍵改為帶過濾條件的向量檢索"""
+    print("=== 測試查找表過濾退回 ===")
+    
+    chunks = {
+        "star-1": {"content_type": "主星解析"},
+        "star-2": {"content_type": "主星解析"},
+        "fortune-1": {"content_type": "運勢分析"},
+        "fortune-2": {"content_type": "運勢分析"}
+    }
+    store = _placement_store(
+        {"紫微|命宮": [("star-1", 0.9), ("star-2", 0.85)], "太陰|田宅宮": [("fortune-1", 0.9), ("fortune-2", 0.8)]},
+        chunks
+    )
+    future_filter = {"content_type": {"$in": ["運勢分析", "格局分析"]}}
+    
+    results = store.search_placements(["紫微|命宮", "太陰|田宅宮"], top_k=4, filter_metadata=future_filter)
+    
+    # 紫微|命宮 的表中結果全被過濾，改為在索引內過濾檢索；太陰|田宅宮 仍由表提供
+    assert store.live_calls == [(["紫微 命宮"], future_filter)]
+    assert {result["query"] for result in results} == {"紫微 命宮", "太陰 田宅宮"}
+    assert sum(1 for result in results if result["query"] == "紫微 命宮") == 2
+    assert not any(result["id"].startswith("star-") for result in results)
+    
+    # 不過濾時查找表即可填滿名額，不做向量檢索
+    store.live_calls.clear()
+    results = store.search_placements(["紫微|命宮", "太陰|田宅宮"], top_k=4)
+    assert store.live_calls == []
+    assert len(results) == 4
+
+
+def test_ziwei_elements_without_placements():
+    """測試只給出主星與宮位列表時不虛構星曜 × 宮位組合"""
+    print("=== 測試主星與宮位檢索 ===")
+    
+    calls = []
+    
+    class RecordingStore:
+        def search_many(self, queries, top_k=5):
+            calls.append(("many", list(queries)))
+            return []
+        
+        def search_placements(self, placement_keys, queries=None, top_k=5):
+            calls.append(("placements", list(placement_keys), list(queries or [])))
+            return []
+    
+    rag_system = ZiweiRAGSystem(RecordingStore())
+    
+    rag_system.search_by_ziwei_elements(["紫微", "七殺"], ["命宮", "夫妻宮"])
+    assert calls[-1] == ("many", ["紫微", "七殺", "命宮", "夫妻宮"])
+    
+    # 給出宮位 → 星曜配置時只查命盤實際存在的組合
+    rag_system.search_by_ziwei_elements(placements={"命宮": ["紫微"], "夫妻宮": ["七殺"]})
+    assert calls[-1] == ("placements", ["紫微|命宮", "七殺|夫妻宮"], [])
+
+
+if __name__ == "__main__":
+    test_per_query_quota()
+    test_dedupe_and_fill_by_score()
+    test_normalize_queries()
+    test_placement_filter_falls_back_to_live_search()
+    test_ziwei_elements_without_placements()
+    print("✅ 批量檢索測試完成")
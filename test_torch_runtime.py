@@ -0,0 +1,69 @@
+"""
+測試嵌入推理的線程與 CPU 綁定策略
+"""
+
+import os
+import tempfile
+
+from src.rag.torch_runtime import available_cpus, claim_worker_slot, parse_cpu_list, plan_runtime
+
+
+def test_parse_cpu_list():
+    """測試 CPU 列表解析"""
+    assert parse_cpu_list("0-3,8, 10-11") == [0, 1, 2, 3, 8, 10, 11]
+    assert parse_cpu_list("2,2,1") == [1, 2]
+
+
+def test_auto_divides_cores():
+    """測試 auto 模式按工作進程數平分核心，並為各編號分配不重疊的 CPU 區段"""
+    print("=== 測試 auto 策略 ===")
+    
+    cpus = available_cpus()
+    plan = plan_runtime("auto", server_workers=2, worker_slot=0)
+    print(f"可用 CPU: {len(cpus)}, 計劃: {plan}")
+    assert plan["intra_op_threads"] == max(1, len(cpus) // 2)
+    assert plan["cpu_set"] is None
+    
+    # 單一工作進程不綁定時沿用 torch 默認
+    assert plan_runtime("auto", server_workers=1)["intra_op_threads"] == 0
+    assert plan_runtime(3, 2, server_workers=4)["intra_op_threads"] == 3
+    
+    if len(cpus) >= 2:
+        first = plan_runtime("auto", cpu_affinity="auto", server_workers=2, worker_slot=0)
+        second = plan_runtime("auto", cpu_affinity="auto", server_workers=2, worker_slot=1)
+        assert not set(first["cpu_set"]) & set(second["cpu_set"])
+        assert first["intra_op_threads"] == len(first["cpu_set"]) == len(cpus) // 2
+    
+    explicit = plan_runtime("auto", cpu_affinity="0-1;2-3", server_workers=2, worker_slot=1)
+    assert explicit["cpu_set"] == [2, 3]
+    assert explicit["intra_op_threads"] == 2
+
+
+def test_worker_env_detection():
+    """測試從 WEB_CONCURRENCY 偵測工作進程數"""
+    previous = os.environ.pop("EMBEDDING_SERVER_WORKERS", None)
+    os.environ["WEB_CONCURRENCY"] = "4"
+    try:
+        assert plan_runtime("auto")["server_workers"] == 4
+    finally:
+        del os.environ["WEB_CONCURRENCY"]
+        if previous is not None:
+            os.environ["EMBEDDING_SERVER_WORKERS"] = previous
+
+
+def test_claim_worker_slot():
+    """測試以文件鎖取得互不重複的工作進程編號"""
+    os.environ.pop("EMBEDDING_WORKER_SLOT", None)
+    with tempfile.TemporaryDirectory() as lock_dir:
+        slots = [claim_worker_slot(2, lock_dir) for _ in range(3)]
+        print(f"取得的編號: {slots}")
+        if os.name == "posix":
+            assert slots == [0, 1, None]
+
+
+if __name__ == "__main__":
+    test_parse_cpu_list()
+    test_auto_divides_cores()
+    test_worker_env_detection()
+    test_claim_worker_slot()
+    print("✅ 線程策略測試完成")
@@ -0,0 +1,134 @@
+"""
+測試向量庫文檔更新
+"""
+
+import logging
+import shutil
+import tempfile
+
+import numpy as np
+from langchain.schema import Document
+
+from src.rag.numpy_index import NumpyVectorIndex
+from src.rag.vector_store import ZiweiVectorStore
+
+
+class ListEmbeddings:
+    """與 OpenAIEmbeddings 相同，返回 Python 列表的嵌入模型"""
+    
+    def embed_documents(self, texts):
+        return [[float(len(text)), 1.0, 0.0] for text in texts]
+    
+    def embed_query(self, text):
+        return [float(len(text)), 1.0, 0.0]
+
+
+class RecordingCollection:
+    """記錄 update 參數的 ChromaDB 集合替身"""
+    
+    def __init__(self):
+        self.updates = []
+    
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+
+
+def _make_store() -> ZiweiVectorStore:
+    """建立使用列表嵌入模型、不開啟 ChromaDB 的向量庫"""
+    store = ZiweiVectorStore.__new__(ZiweiVectorStore)
+    store.logger = logging.getLogger("test_vector_store_update")
+    store._embeddings = ListEmbeddings()
+    store._collection = RecordingCollection()
+    store.numpy_index = NumpyVectorIndex()
+    store.numpy_index_dir = None
+    store.lexical_index = None
+    store.result_cache = None
+    store._generation = 0
+    store._numpy_index_dirty = False
+    store.persist_calls = 0
+    
+    def persist():
+        store.persist_calls += 1
+    
+    store._persist_numpy_index = persist
+    return store
+
+
+def test_update_with_list_embeddings():
+    """測試返回列表的嵌入模型也能更新文檔"""
+    print("=== 測試列表嵌入更新文檔 ===")
+    
+    store = _make_store()
+    document = Document(page_content="紫微星坐命", metadata={"content_type": "主星解析"})
+    
+    assert store.update_document("doc-1", document) is True
+    
+    update = store._collection.updates[0]
+    assert update["ids"] == ["doc-1"]
+    assert update["embeddings"] == [[5.0, 1.0, 0.0]]
+    assert isinstance(update["embeddings"][0], list)
+    
+    row = store.numpy_index.position("doc-1")
+    assert row is not None
+    assert store.numpy_index.documents[row] == "紫微星坐命"
+    assert store._generation == 1
+
+
+def test_index_saved_once_on_flush():
+    """測試寫入只標記索引已變更，flush 時保存一次快照"""
+    print("=== 測試索引延遲保存 ===")
+    
+    store = _make_store()
+    for i in range(3):
+        document = Document(page_content=f"天機星第{i}條", metadata={"content_type": "主星解析"})
+        assert store.update_document(f"doc-{i}", document) is True
+    store._collection.delete = lambda ids: None
+    assert store.delete_documents(["doc-0"]) is True
+    assert store.persist_calls == 0
+    
+    store.flush()
+    assert store.persist_calls == 1
+    
+    # 沒有新的變更時不重複保存
+    store.flush()
+    assert store.persist_calls == 1
+
+
+def test_numpy_index_loads_lazily():
+    """測試建構時不載入 NumPy 索引，預熱時載入後才就緒"""
+    print("=== 測試 NumPy 索引延遲載入 ===")
+    
+    loads = []
+    original_load = ZiweiVectorStore._load_numpy_index
+    ZiweiVectorStore._load_numpy_index = lambda self: loads.append(True) or NumpyVectorIndex()
+    directory = tempfile.mkdtemp(prefix="ziwei_lazy_index_")
+    try:
+        store = ZiweiVectorStore(
+            persist_directory=directory,
+            lazy_embeddings=True,
+            index_backend="numpy",
+            logger=logging.getLogger("test_vector_store_update")
+        )
+        assert loads == []
+        assert store._collection is None
+        
+        store._embeddings = ListEmbeddings()
+        assert store.is_ready is False
+        
+        store.load_embeddings(warm_up=True)
+        assert loads == [True]
+        assert store.is_ready is True
+        
+        # 已載入後不重複載入
+        assert store.numpy_index is not None
+        assert loads == [True]
+    finally:
+        ZiweiVectorStore._load_numpy_index = original_load
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    test_update_with_list_embeddings()
+    test_index_saved_once_on_flush()
+    test_numpy_index_loads_lazily()
+    print("✅ 向量庫更新測試完成")